@@ -0,0 +1,82 @@
+import random
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tables.models import Venta, Pago
+from .totales import totales_esperados
+
+CACHE_PRUEBAS = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+METODOS = ['EFECTIVO_USD', 'EFECTIVO_BS', 'PUNTO', 'PAGO_MOVIL', 'CASHEA', 'ZELLE']
+
+
+def totales_por_venta(fecha, tasa_general):
+    """ El cálculo original del cuadre, venta por venta (referencia para comparar) """
+    t = dict.fromkeys([
+        'total_ventas', 'total_propinas', 'ventas_cashea', 'cashea_financiado_usd', 'cashea_recibido_usd',
+        'dolares_usd', 'punto_bs', 'efectivo_bs', 'pago_movil_bs',
+    ], Decimal('0.0'))
+    for v in Venta.objects.filter(fecha__date=fecha, anulada=False):
+        pagos = v.pagos.all()
+        tiene_cashea = any(p.metodo == 'CASHEA' for p in pagos)
+        t['total_propinas'] += Decimal(str(v.propina or 0))
+        tasa_uso = Decimal(str(v.tasa_aplicada)) if v.tasa_aplicada and Decimal(str(v.tasa_aplicada)) > 0 else tasa_general
+        pagado_cashea = Decimal('0.0')
+        for p in pagos:
+            monto = Decimal(str(p.monto))
+            if p.metodo == 'PUNTO':
+                t['punto_bs'] += monto * tasa_uso
+            elif p.metodo == 'EFECTIVO_BS':
+                t['efectivo_bs'] += monto * tasa_uso
+            elif p.metodo == 'PAGO_MOVIL':
+                t['pago_movil_bs'] += monto * tasa_uso
+            elif p.metodo == 'EFECTIVO_USD':
+                t['dolares_usd'] += monto
+            elif p.metodo == 'CASHEA':
+                t['cashea_recibido_usd'] += monto
+                pagado_cashea += monto
+        t['total_ventas'] += Decimal(str(v.total))
+        if tiene_cashea:
+            t['ventas_cashea'] += Decimal(str(v.total))
+            financiado = Decimal(str(v.total)) - max(Decimal('0.0'), pagado_cashea - Decimal(str(v.propina or 0)))
+            if financiado > 0:
+                t['cashea_financiado_usd'] += financiado
+    return {campo: valor.quantize(Decimal('0.0001')) for campo, valor in t.items()}
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class TotalesEsperadosTest(TestCase):
+    """ Dos consultas sin importar cuántas ventas tenga el día, y las mismas cifras que el cálculo venta por venta """
+
+    TASA_GENERAL = Decimal('36.50')
+    DIAS = {date(2026, 3, 2): 0, date(2026, 3, 3): 4, date(2026, 3, 4): 120}
+
+    @classmethod
+    def setUpTestData(cls):
+        azar = random.Random(19)
+        n = 0
+        for dia, cuantas in cls.DIAS.items():
+            for _ in range(cuantas):
+                n += 1
+                venta = Venta.objects.create(
+                    codigo_factura=f"{n:06d}", total=Decimal(azar.randint(300, 9000)) / 100, metodo_pago='MIXTO', mesa_numero=1,
+                    propina=Decimal(azar.choice([0, 0, 100, 250])) / 100, monto_recibido=Decimal('0'),
+                    tasa_aplicada=azar.choice([None, Decimal('0'), Decimal('36.1234'), Decimal('40.50')]),
+                    anulada=azar.random() < 0.1,
+                )
+                momento = timezone.make_aware(datetime.combine(dia, time(azar.randint(0, 23), azar.randint(0, 59))))
+                Venta.objects.filter(pk=venta.pk).update(fecha=momento)
+                Pago.objects.bulk_create([
+                    Pago(venta=venta, metodo=azar.choice(METODOS), monto=Decimal(azar.randint(100, 6000)) / 100)
+                    for _ in range(azar.randint(0, 3))
+                ])
+
+    def test_dos_consultas_y_mismas_cifras(self):
+        for dia, cuantas in self.DIAS.items():
+            with self.subTest(dia=dia, ventas=cuantas):
+                with self.assertNumQueries(2):
+                    totales = totales_esperados(dia, self.TASA_GENERAL)
+                self.assertEqual(totales, totales_por_venta(dia, self.TASA_GENERAL))
+                if cuantas:
+                    self.assertGreater(totales['total_ventas'], 0)
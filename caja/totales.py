@@ -0,0 +1,71 @@
+from decimal import Decimal
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from core.fechas import filtro_dias
+from tables.models import Venta, Pago
+
+# ==========================================
+#  TOTALES ESPERADOS DEL CUADRE
+# ==========================================
+# Se suman en la BD con Sum(Case(When(...))): una consulta sobre los pagos y
+# otra sobre las ventas del día, sin recorrer venta por venta en Python.
+# El cuadre lee directo de las ventas (no de los resúmenes diarios) para que
+# el cierre de caja siempre coincida con lo facturado.
+
+CERO = Value(Decimal('0'), output_field=DecimalField())
+
+
+def _decimal(expresion):
+    return Coalesce(Sum(expresion, output_field=DecimalField()), CERO)
+
+
+def totales_esperados(fecha, tasa_general):
+    """
+    Totales de las ventas válidas del día para el cuadre de caja:
+    total_ventas, total_propinas, ventas_cashea, cashea_financiado_usd, cashea_recibido_usd,
+    dolares_usd, punto_bs, efectivo_bs y pago_movil_bs (todos Decimal).
+    Los pagos en Bs se convierten con la tasa de su venta; si no tiene, con tasa_general.
+    """
+    pagos = Pago.objects.filter(**filtro_dias('venta__fecha', fecha), venta__anulada=False)
+    tasa_venta = Case(
+        When(venta__tasa_aplicada__gt=0, then=F('venta__tasa_aplicada')),
+        default=Value(Decimal(str(tasa_general or 0))),
+        output_field=DecimalField(),
+    )
+
+    def en_bs(metodo):
+        return _decimal(Case(When(metodo=metodo, then=F('monto') * tasa_venta), default=CERO))
+
+    def en_usd(metodo):
+        return _decimal(Case(When(metodo=metodo, then=F('monto')), default=CERO))
+
+    totales = pagos.aggregate(
+        punto_bs=en_bs('PUNTO'),
+        efectivo_bs=en_bs('EFECTIVO_BS'),
+        pago_movil_bs=en_bs('PAGO_MOVIL'),
+        dolares_usd=en_usd('EFECTIVO_USD'),
+        cashea_recibido_usd=en_usd('CASHEA'),
+    )
+
+    # Cashea financia el total menos lo que se pagó de inicial (sin contar la propina)
+    pagos_cashea = Pago.objects.filter(venta=OuterRef('pk'), metodo='CASHEA')
+    pagado_cashea = Subquery(
+        pagos_cashea.values('venta').annotate(suma=Sum('monto')).values('suma'),
+        output_field=DecimalField(),
+    )
+    inicial_cashea = Greatest(CERO, Coalesce(pagado_cashea, CERO) - F('propina'), output_field=DecimalField())
+    ventas = Venta.objects.filter(**filtro_dias('fecha', fecha), anulada=False).annotate(
+        tiene_cashea=Exists(pagos_cashea),
+        inicial_cashea=inicial_cashea,
+    )
+    totales.update(ventas.aggregate(
+        total_ventas=_decimal('total'),
+        total_propinas=_decimal('propina'),
+        ventas_cashea=_decimal(Case(When(tiene_cashea=True, then=F('total')), default=CERO)),
+        cashea_financiado_usd=_decimal(Case(
+            When(tiene_cashea=True, then=Greatest(CERO, F('total') - F('inicial_cashea'), output_field=DecimalField())),
+            default=CERO,
+        )),
+    ))
+    # SQLite suma los decimales como REAL: se redondea para quitar el ruido de punto flotante
+    return {campo: Decimal(valor).quantize(Decimal('0.0001')) for campo, valor in totales.items()}
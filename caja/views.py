@@ -7,8 +7,8 @@ from django.contrib import messages
 from decimal import Decimal
 
 from .models import CuadreCaja
-from tables.models import Venta, Pago, TasaBCV
-from core.models import Configuracion
+from tables.tasas import obtener_tasas
+from .totales import totales_esperados
 
 @staff_member_required
 def cuadre_caja_list(request):
@@ -25,77 +25,22 @@ def cuadre_caja_nuevo(request):
     fecha_obj = parse_date(fecha_str) if fecha_str else hoy
 
     # 1. Tasas de Cambio
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_bcv_real = tasa_obj.precio if tasa_obj and tasa_obj.precio > 0 else Decimal('1.0')
-    
-    config = Configuracion.objects.first()
-    
-    # Determinar Tasa General
-    tasa_general = Decimal('1.0')
-    if config:
-        if config.usar_scraping_bcv:
-            tasa_general = tasa_bcv_real
-        else:
-            tasa_general = config.tasa_dolar
-    else:
-        tasa_general = tasa_bcv_real
-    tasa_cashea = Decimal('0.0')
-    if config:
-        if config.usar_tasa_bcv_para_cashea:
-            tasa_cashea = tasa_bcv_real
-        elif config.tasa_cashea > 0:
-            tasa_cashea = config.tasa_cashea
-        else:
-            tasa_cashea = tasa_general
-    else:
-        tasa_cashea = tasa_general
-
-    # 2. Obtener ventas y separar Cashea de General y automatizar totales por método de pago y propinas
-    ventas_validas = Venta.objects.filter(fecha__date=fecha_obj, anulada=False)
-    
-    ventas_sistema_cashea = Decimal('0.0')
-    ventas_sistema_general = Decimal('0.0')
-    total_propinas_sistema = Decimal('0.0')
-
-    auto_punto_venta_bs = Decimal('0.0')
-    auto_efectivo_bs = Decimal('0.0')
-    auto_pago_movil_bs = Decimal('0.0')
-    auto_dolares_usd = Decimal('0.0')
-    auto_cashea_recibido_usd = Decimal('0.0')
-    auto_cashea_financiado_usd = Decimal('0.0')
-
-    for v in ventas_validas:
-        pagos = v.pagos.all()
-        tiene_cashea = any(p.metodo == 'CASHEA' or 'cashea' in str(p.metodo).lower() for p in pagos)
-        total_propinas_sistema += Decimal(str(v.propina or 0))
-        
-        # Tasa a utilizar para convertir los montos en USD de los pagos en BS a Bolívares
-        tasa_uso = Decimal(str(v.tasa_aplicada)) if v.tasa_aplicada and Decimal(str(v.tasa_aplicada)) > 0 else tasa_general
-        
-        total_pagado_cashea_en_venta = Decimal('0.0')
-
-        for p in pagos:
-            monto_pago = Decimal(str(p.monto))
-            if p.metodo == 'PUNTO':
-                auto_punto_venta_bs += monto_pago * tasa_uso
-            elif p.metodo == 'EFECTIVO_BS':
-                auto_efectivo_bs += monto_pago * tasa_uso
-            elif p.metodo == 'PAGO_MOVIL':
-                auto_pago_movil_bs += monto_pago * tasa_uso
-            elif p.metodo == 'EFECTIVO_USD':
-                auto_dolares_usd += monto_pago
-            elif p.metodo == 'CASHEA' or 'cashea' in str(p.metodo).lower():
-                auto_cashea_recibido_usd += monto_pago
-                total_pagado_cashea_en_venta += monto_pago
-
-        if tiene_cashea:
-            ventas_sistema_cashea += Decimal(str(v.total))
-            pago_inicial_cashea = max(Decimal('0.0'), total_pagado_cashea_en_venta - Decimal(str(v.propina or 0)))
-            monto_fin = Decimal(str(v.total)) - pago_inicial_cashea
-            if monto_fin > 0:
-                auto_cashea_financiado_usd += monto_fin
-        else:
-            ventas_sistema_general += Decimal(str(v.total))
+    tasas = obtener_tasas(request)
+    tasa_general = tasas.general
+    tasa_cashea = tasas.cashea
+
+    # 2. Lo que el sistema espera en caja: dos consultas sin importar cuántas ventas hubo
+    esperado = totales_esperados(fecha_obj, tasa_general)
+    ventas_sistema_cashea = esperado['ventas_cashea']
+    ventas_sistema_general = esperado['total_ventas'] - esperado['ventas_cashea']
+    total_propinas_sistema = esperado['total_propinas']
+
+    auto_punto_venta_bs = esperado['punto_bs']
+    auto_efectivo_bs = esperado['efectivo_bs']
+    auto_pago_movil_bs = esperado['pago_movil_bs']
+    auto_dolares_usd = esperado['dolares_usd']
+    auto_cashea_recibido_usd = esperado['cashea_recibido_usd']
+    auto_cashea_financiado_usd = esperado['cashea_financiado_usd']
 
     total_ventas_sistema = ventas_sistema_cashea + ventas_sistema_general
 
@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import Impresora
 
 # Register your models here.
+
+@admin.register(Impresora)
+class ImpresoraAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'tipo', 'direccion')
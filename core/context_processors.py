@@ -4,5 +4,5 @@ from .models import Configuracion
 def configuracion_global(request):
     # Esto hace que la variable {{ config }} esté disponible en TODOS los HTML
     return {
-        'config': Configuracion.get_solo()
+        'config': Configuracion.get_cached()
     }
\ No newline at end of file
@@ -0,0 +1,47 @@
+import logging
+import random
+import time
+from functools import wraps
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+#  REINTENTOS CUANDO SQLITE ESTÁ OCUPADA
+# ==========================================
+# SQLite admite un solo escritor a la vez. El busy_timeout ya hace esperar a
+# cada conexión, pero en horas pico puede vencerse: en ese caso la operación
+# completa se repite, con una espera al azar para que no choquen otra vez.
+
+
+def es_bd_bloqueada(error):
+    return isinstance(error, OperationalError) and 'locked' in str(error).lower()
+
+
+def ejecutar_con_reintento(funcion, *args, **kwargs):
+    """
+    Llama a funcion(*args, **kwargs) y la repite si la BD respondió "database is locked".
+    La función debe abrir su propia transacción: dentro de un atomic() externo
+    no se reintenta (la transacción de afuera ya quedó inválida).
+    """
+    intentos = getattr(settings, 'BD_REINTENTOS', 3)
+    espera_base = getattr(settings, 'BD_ESPERA_REINTENTO', 0.1)
+    for intento in range(intentos + 1):
+        try:
+            return funcion(*args, **kwargs)
+        except OperationalError as e:
+            if not es_bd_bloqueada(e) or intento == intentos or connection.in_atomic_block:
+                raise
+            # Espera creciente con jitter: 0-0.1s, 0-0.2s, 0-0.4s...
+            espera = random.uniform(0, espera_base * (2 ** intento))
+            logger.warning("BD ocupada, reintento %s/%s en %.2fs", intento + 1, intentos, espera)
+            time.sleep(espera)
+
+
+def reintentar_si_bd_bloqueada(vista):
+    """ Decorador para las vistas que escriben mucho (grabar mesa, facturar) """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        return ejecutar_con_reintento(vista, request, *args, **kwargs)
+    return envoltura
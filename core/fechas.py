@@ -0,0 +1,38 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def _a_fecha(valor):
+    if isinstance(valor, str):
+        valor = parse_date(valor.strip()) if valor.strip() else None
+    return valor or timezone.localtime().date()
+
+
+def dias(inicio, fin=None):
+    """
+    (inicio, fin) como date. Acepta date o 'YYYY-MM-DD'; si no se puede leer, usa hoy.
+    Sin fin, es un solo día.
+    """
+    inicio = _a_fecha(inicio)
+    fin = _a_fecha(fin) if fin is not None else inicio
+    return inicio, fin
+
+
+def rango_dias(inicio, fin=None):
+    """ (desde, hasta) en hora local para los días inicio..fin (ambos incluidos) """
+    inicio, fin = dias(inicio, fin)
+    zona = timezone.get_current_timezone()
+    desde = timezone.make_aware(datetime.combine(inicio, time.min), zona)
+    hasta = timezone.make_aware(datetime.combine(fin + timedelta(days=1), time.min), zona)
+    return desde, hasta
+
+
+def filtro_dias(campo, inicio, fin=None):
+    """
+    Filtro por días que sí usa el índice de la fecha, en lugar de campo__date
+    (que en SQLite convierte cada fila antes de comparar).
+    Uso: Venta.objects.filter(**filtro_dias('fecha', '2024-01-01', '2024-01-31'))
+    """
+    desde, hasta = rango_dias(inicio, fin)
+    return {f'{campo}__gte': desde, f'{campo}__lt': hasta}
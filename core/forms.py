@@ -1,5 +1,5 @@
 from django import forms
-from .models import Configuracion
+from .models import Configuracion, Impresora
 from tables.models import CostoAdicional
 
 # 1. FORMULARIO DE IDENTIDAD
@@ -16,6 +16,17 @@ class ConfigIdentidadForm(forms.ModelForm):
 
 # 3. FORMULARIO VISUAL Y TÉCNICO (AQUÍ AGREGUÉ LA CONFIGURACIÓN DE IMPRESIÓN)
 class ConfigVisualForm(forms.ModelForm):
+    # La conexión no es de la Configuración sino de la impresora elegida (modelo Impresora)
+    tipo_impresora = forms.ChoiceField(
+        choices=Impresora.TIPOS, label='Tipo de Conexión', widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    direccion_impresora = forms.CharField(
+        required=False, max_length=200, label='Dirección (IP o Carpeta)',
+        help_text=Impresora._meta.get_field('direccion').help_text,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej: 192.168.1.50:9100'}),
+    )
+    field_order = ['logo', 'mensaje_ticket', 'impresora_ticket', 'tipo_impresora', 'direccion_impresora']
+
     class Meta:
         model = Configuracion
         # Agregamos: impresora_ticket, ancho_papel, auto_imprimir, usar_logo_impresora, abrir_caja_registradora
@@ -38,6 +49,22 @@ class ConfigVisualForm(forms.ModelForm):
             'abrir_caja_registradora': '¿Abrir Gaveta de Dinero?'
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        impresora = Impresora.objects.filter(nombre=self.instance.impresora_ticket).first() if self.instance.impresora_ticket else None
+        if impresora:
+            self.fields['tipo_impresora'].initial = impresora.tipo
+            self.fields['direccion_impresora'].initial = impresora.direccion
+
+    def save(self, commit=True):
+        config = super().save(commit)
+        if commit and config.impresora_ticket:
+            Impresora.objects.update_or_create(
+                nombre=config.impresora_ticket,
+                defaults={'tipo': self.cleaned_data['tipo_impresora'], 'direccion': self.cleaned_data['direccion_impresora']},
+            )
+        return config
+
 class CostoAdicionalForm(forms.ModelForm):
     class Meta:
         model = CostoAdicional
@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from core.models import Configuracion
+from inventory.models import Insumo
+from tables import views
+from tables.models import Producto, Categoria, Table, Orden, DetalleOrden
+
+
+class Command(BaseCommand):
+    help = ('Mide cuántas facturas por segundo aguanta la caja con N hilos facturando a la vez (facturar_mesa). '
+            'Trabaja sobre una copia de la base de datos: la original no se toca.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, nargs='+', default=[8, 16, 32], help='Hilos a probar (8 16 32 por defecto)')
+        parser.add_argument('--mesas-por-hilo', type=int, default=3, help='Mesas que factura cada hilo (3 por defecto)')
+        parser.add_argument('--lineas', type=int, default=8, help='Líneas de cada orden (8 por defecto)')
+        parser.add_argument('--sin-ajustes', action='store_true',
+                            help='Usa las opciones de SQLite por defecto (sin WAL, sin IMMEDIATE, timeout de 5 s) y sin reintentos, para comparar')
+
+    def handle(self, *args, **options):
+        ajustes = connections.settings['default']
+        if ajustes['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("La medición es para la base de datos SQLite.")
+        original = dict(ajustes)
+        carpeta = tempfile.mkdtemp(prefix='medir_concurrencia_')
+        try:
+            for hilos in options['hilos']:
+                copia = os.path.join(carpeta, f'copia_{hilos}.sqlite3')
+                if os.path.exists(original['NAME']):
+                    self._copiar(original['NAME'], copia)
+                connection.close()
+                ajustes['NAME'] = copia
+                if options['sin_ajustes']:
+                    ajustes['OPTIONS'] = {'init_command': 'PRAGMA journal_mode=DELETE;'}
+                # La copia queda con el esquema del código actual
+                call_command('migrate', verbosity=0, interactive=False)
+                self._medir(hilos, options['mesas_por_hilo'], options['lineas'], options['sin_ajustes'])
+                connection.close()
+                ajustes.clear()
+                ajustes.update(original)
+        finally:
+            connection.close()
+            ajustes.clear()
+            ajustes.update(original)
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    def _copiar(self, origen, destino):
+        """ Copia consistente aunque la caja esté escribiendo (API de respaldo de SQLite) """
+        with sqlite3.connect(origen) as fuente, sqlite3.connect(destino) as copia:
+            fuente.backup(copia)
+
+    def _preparar(self, mesas, lineas):
+        """ Usuario, producto y mesas con su orden ya grabada (en la copia) """
+        Configuracion.objects.filter(id=1).update(auto_imprimir=False)
+        Configuracion.invalidar_cache()
+        Insumo.objects.update(stock_actual=Decimal('1000000'))
+        usuario = User.objects.create_superuser('medicion-concurrencia', password=None)
+        producto = Producto.objects.filter(precio__gt=0).first() or Producto.objects.create(
+            nombre='Producto de medición', precio=Decimal('5.00'), categoria=Categoria.objects.create(nombre='Medición')
+        )
+        ids = []
+        for i in range(mesas):
+            # mesa_numero de la venta es numérico
+            mesa = Table.objects.create(number=str(90000 + i))
+            orden = Orden.objects.create(mesa=mesa, mesero=usuario, impreso=True)
+            DetalleOrden.objects.bulk_create([
+                DetalleOrden(orden=orden, producto=producto, cantidad=1, precio_unitario=producto.precio, impreso=True)
+                for _ in range(lineas)
+            ])
+            ids.append((mesa.id, producto.precio * lineas))
+        return usuario, ids
+
+    def _medir(self, hilos, mesas_por_hilo, lineas, sin_ajustes):
+        usuario, mesas = self._preparar(hilos * mesas_por_hilo, lineas)
+        connection.close()
+        correctas = []
+        errores = []
+        barrera = threading.Barrier(hilos + 1)
+
+        def cajero(asignadas):
+            cliente = Client()
+            cliente.force_login(usuario)
+            barrera.wait()
+            try:
+                for mesa_id, total in asignadas:
+                    respuesta = cliente.post(
+                        reverse('facturar_mesa', args=[mesa_id]),
+                        json.dumps({'lista_pagos': [{'metodo': 'EFECTIVO_USD', 'monto': float(total)}], 'monto_recibido_total': float(total)}),
+                        content_type='application/json',
+                    )
+                    if respuesta.status_code == 200 and respuesta.json().get('status') == 'ok':
+                        correctas.append(mesa_id)
+                    else:
+                        errores.append(respuesta.content[:100].decode('utf-8', errors='replace'))
+            finally:
+                connection.close()
+
+        reintentos = {'BD_REINTENTOS': 0} if sin_ajustes else {}
+        with override_settings(ALLOWED_HOSTS=['*'], **reintentos), \
+                mock.patch.object(views, 'prerenderizar_factura', lambda venta_id: None):
+            trabajadores = [threading.Thread(target=cajero, args=(mesas[i::hilos],)) for i in range(hilos)]
+            for hilo in trabajadores:
+                hilo.start()
+            barrera.wait()
+            inicio = time.perf_counter()
+            for hilo in trabajadores:
+                hilo.join()
+            segundos = time.perf_counter() - inicio
+
+        self.stdout.write(
+            f"{hilos:>3} hilos: {len(correctas)}/{len(mesas)} facturas en {segundos:.2f} s "
+            f"= {len(correctas) / segundos:.1f} facturas/s, {len(errores)} error(es)"
+        )
+        for error in sorted(set(errores))[:5]:
+            self.stdout.write(self.style.WARNING(f"    {error}"))
@@ -0,0 +1,62 @@
+import datetime
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import override_settings
+from core import pdf
+
+
+class Command(BaseCommand):
+    help = ('Mide cuánto tarda generar N PDF de la alerta de stock uno tras otro en el mismo proceso '
+            '(como antes) y a través del pool de procesos de core/pdf.py. No toca la base de datos.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documentos', type=int, default=50, help='PDF a generar (50 por defecto)')
+        parser.add_argument('--filas', type=int, default=40, help='Insumos en cada PDF (40 por defecto)')
+        parser.add_argument('--procesos', type=int, nargs='+', default=[2], help='Tamaños del pool a probar (2 por defecto)')
+
+    def handle(self, *args, **options):
+        html = self._html(options['filas'])
+        documentos = options['documentos']
+
+        inicio = time.perf_counter()
+        for _ in range(documentos):
+            pdf._html_a_pdf(html)
+        secuencial = time.perf_counter() - inicio
+        self.stdout.write(f"En el mismo proceso: {documentos} PDF en {secuencial:.2f} s")
+
+        for procesos in options['procesos']:
+            with override_settings(PDF_MAX_WORKERS=procesos):
+                self._cerrar_pool()
+                # El primer PDF arranca los procesos: no se cuenta
+                pdf.renderizar_pdf(html)
+                inicio = time.perf_counter()
+                futuros = [pdf._enviar(html) for _ in range(documentos)]
+                for futuro in futuros:
+                    futuro.result()
+                segundos = time.perf_counter() - inicio
+                self._cerrar_pool()
+            self.stdout.write(
+                f"Pool de {procesos} proceso(s): {documentos} PDF en {segundos:.2f} s "
+                f"({secuencial / segundos:.2f}x)"
+            )
+
+    def _html(self, filas):
+        """ La alerta de stock con insumos inventados """
+        insumos = [
+            {
+                'nombre': f'Insumo de medición {i}', 'unidad': 'Gramos (GR)', 'stock_actual': Decimal(i * 7),
+                'stock_minimo': Decimal(500), 'deficit': Decimal(500 - i * 7),
+            }
+            for i in range(filas)
+        ]
+        return render_to_string('reports/pdf_alerta.html', {
+            'insumos': insumos, 'fecha': datetime.datetime.now().strftime("%d/%m/%Y %H:%M"),
+        })
+
+    def _cerrar_pool(self):
+        with pdf._pool_lock:
+            if pdf._pool is not None:
+                pdf._pool.shutdown()
+            pdf._pool = None
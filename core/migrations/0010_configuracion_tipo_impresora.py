@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_configuracion_tasa_cashea_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuracion',
+            name='direccion_impresora',
+            field=models.CharField(blank=True, default='', help_text='Red: IP o IP:puerto (Ej: 192.168.1.50:9100). Carpeta: ruta donde guardar los tickets. Windows: no hace falta.', max_length=200, verbose_name='Dirección de la Impresora'),
+        ),
+        migrations.AddField(
+            model_name='configuracion',
+            name='tipo_impresora',
+            field=models.CharField(choices=[('WINDOWS', 'Impresora de Windows (Spooler)'), ('RED', 'Impresora de Red (TCP 9100)'), ('ARCHIVO', 'Guardar en Carpeta (Pruebas)'), ('MEMORIA', 'En Memoria (Pruebas)')], default='WINDOWS', max_length=10, verbose_name='Tipo de Conexión de la Impresora'),
+        ),
+    ]
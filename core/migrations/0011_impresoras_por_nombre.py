@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+def pasar_conexion_a_impresora(apps, schema_editor):
+    """ La conexión que estaba en la Configuración queda como la de la impresora de tickets """
+    Configuracion = apps.get_model('core', 'Configuracion')
+    Impresora = apps.get_model('core', 'Impresora')
+    config = Configuracion.objects.filter(id=1).first()
+    if config and config.impresora_ticket and config.tipo_impresora != 'WINDOWS':
+        Impresora.objects.update_or_create(
+            nombre=config.impresora_ticket,
+            defaults={'tipo': config.tipo_impresora, 'direccion': config.direccion_impresora},
+        )
+
+
+def devolver_conexion_a_configuracion(apps, schema_editor):
+    Configuracion = apps.get_model('core', 'Configuracion')
+    Impresora = apps.get_model('core', 'Impresora')
+    config = Configuracion.objects.filter(id=1).first()
+    impresora = Impresora.objects.filter(nombre=config.impresora_ticket).first() if config else None
+    if impresora:
+        Configuracion.objects.filter(id=1).update(tipo_impresora=impresora.tipo, direccion_impresora=impresora.direccion)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_configuracion_tipo_impresora'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Impresora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True, verbose_name='Nombre de la Impresora')),
+                ('tipo', models.CharField(choices=[('WINDOWS', 'Impresora de Windows (Spooler)'), ('RED', 'Impresora de Red (TCP 9100)'), ('ARCHIVO', 'Guardar en Carpeta (Pruebas)'), ('MEMORIA', 'En Memoria (Pruebas)')], default='WINDOWS', max_length=10, verbose_name='Tipo de Conexión')),
+                ('direccion', models.CharField(blank=True, default='', help_text='Red: IP o IP:puerto (Ej: 192.168.1.50:9100). Carpeta: ruta donde guardar los tickets. Windows: no hace falta.', max_length=200, verbose_name='Dirección')),
+            ],
+            options={
+                'verbose_name': 'Impresora',
+                'verbose_name_plural': 'Impresoras',
+            },
+        ),
+        migrations.RunPython(pasar_conexion_a_impresora, devolver_conexion_a_configuracion),
+        migrations.RemoveField(
+            model_name='configuracion',
+            name='direccion_impresora',
+        ),
+        migrations.RemoveField(
+            model_name='configuracion',
+            name='tipo_impresora',
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_impresoras_por_nombre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuracion',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -1,4 +1,10 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+CONFIGURACION_CACHE_KEY = 'core:configuracion'
 
 class Configuracion(models.Model):
     # --- 1. IDENTIDAD DEL NEGOCIO (Para el Ticket) ---
@@ -34,6 +40,7 @@ class Configuracion(models.Model):
     )
 
     # --- 4. CONFIGURACIÓN DE IMPRESIÓN (NUEVO) ---
+    # La conexión de cada impresora (Windows, red, carpeta) se guarda en Impresora, por nombre
     impresora_ticket = models.CharField(max_length=100, blank=True, default="", verbose_name="Nombre Impresora (Referencia)", help_text="Nombre de la impresora predeterminada en el sistema operativo")
     ancho_papel = models.IntegerField(default=80, verbose_name="Ancho Papel (mm)", help_text="Estándar: 80mm o 58mm")
     auto_imprimir = models.BooleanField(default=True, verbose_name="¿Impresión Automática?", help_text="Si se marca, el sistema intentará imprimir sin preguntar al cerrar la venta.")
@@ -45,6 +52,9 @@ class Configuracion(models.Model):
     caja_mediana = models.ForeignKey('inventory.Insumo', related_name='config_caja_med', on_delete=models.SET_NULL, null=True, blank=True, limit_choices_to={'es_insumo_compuesto': False}, verbose_name="Empaque Mediano")
     caja_familiar = models.ForeignKey('inventory.Insumo', related_name='config_caja_fam', on_delete=models.SET_NULL, null=True, blank=True, limit_choices_to={'es_insumo_compuesto': False}, verbose_name="Empaque Familiar")
     
+    # Cambia cada vez que se guarda: los documentos guardados (PDF de facturas) lo usan como versión
+    actualizado = models.DateTimeField(auto_now=True, null=True)
+
     def __str__(self):
         return "Configuración General"
 
@@ -59,10 +69,65 @@ class Configuracion(models.Model):
         obj, created = cls.objects.get_or_create(id=1)
         return obj
 
+    # --- VERSIÓN EN CACHÉ (solo lectura) ---
+    # Para plantillas, tickets y cálculos que solo LEEN la configuración.
+    # Trae de una vez los empaques con su unidad. Se invalida al guardar.
+    @classmethod
+    def get_cached(cls, ttl=None):
+        obj = cache.get(CONFIGURACION_CACHE_KEY)
+        if obj is None:
+            cls.get_solo()
+            obj = cls.objects.select_related(
+                'caja_individual__unidad', 'caja_mediana__unidad', 'caja_familiar__unidad'
+            ).get(id=1)
+            if ttl is None:
+                ttl = getattr(settings, 'CONFIGURACION_CACHE_TTL', 300)
+            cache.set(CONFIGURACION_CACHE_KEY, obj, ttl)
+        return obj
+
+    @staticmethod
+    def invalidar_cache():
+        cache.delete(CONFIGURACION_CACHE_KEY)
+
     # Evitar crear más de un registro
     def save(self, *args, **kwargs):
         self.pk = 1
         super(Configuracion, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        pass # No permitir borrar la configuración
\ No newline at end of file
+        pass # No permitir borrar la configuración
+
+# Al guardar la configuración, todos los procesos vuelven a leerla de la BD
+@receiver(post_save, sender=Configuracion, dispatch_uid="invalidar_cache_configuracion")
+def invalidar_cache_configuracion(sender, instance, **kwargs):
+    Configuracion.invalidar_cache()
+
+# Si cambia un insumo de empaque (nombre, unidad), la copia en caché queda vieja
+@receiver([post_save, post_delete], sender='inventory.Insumo', dispatch_uid="invalidar_cache_config_empaques")
+def invalidar_cache_por_empaque(sender, instance, **kwargs):
+    config = cache.get(CONFIGURACION_CACHE_KEY)
+    if config and instance.pk in (config.caja_individual_id, config.caja_mediana_id, config.caja_familiar_id):
+        Configuracion.invalidar_cache()
+
+
+# --- CONEXIÓN DE CADA IMPRESORA ---
+# Una fila por nombre de impresora (el mismo nombre con el que se encolan los
+# tickets). Si una impresora no tiene fila, se usa el spooler de Windows.
+class Impresora(models.Model):
+    TIPOS = [
+        ('WINDOWS', 'Impresora de Windows (Spooler)'),
+        ('RED', 'Impresora de Red (TCP 9100)'),
+        ('ARCHIVO', 'Guardar en Carpeta (Pruebas)'),
+        ('MEMORIA', 'En Memoria (Pruebas)'),
+    ]
+
+    nombre = models.CharField(max_length=100, unique=True, verbose_name="Nombre de la Impresora")
+    tipo = models.CharField(max_length=10, choices=TIPOS, default='WINDOWS', verbose_name="Tipo de Conexión")
+    direccion = models.CharField(max_length=200, blank=True, default="", verbose_name="Dirección", help_text="Red: IP o IP:puerto (Ej: 192.168.1.50:9100). Carpeta: ruta donde guardar los tickets. Windows: no hace falta.")
+
+    def __str__(self):
+        return f"{self.nombre} ({self.get_tipo_display()})"
+
+    class Meta:
+        verbose_name = "Impresora"
+        verbose_name_plural = "Impresoras"
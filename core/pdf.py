@@ -0,0 +1,134 @@
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+#  SERVICIO DE GENERACIÓN DE PDF
+# ==========================================
+# xhtml2pdf es lento y ocupa el GIL: los PDF se generan en procesos aparte.
+# El estado de cada trabajo queda en la caché compartida y el archivo en
+# disco, así cualquier proceso del servidor puede responder la consulta
+# o la descarga.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _carpeta():
+    return _config('PDF_TRABAJOS_DIR', os.path.join(settings.BASE_DIR, 'pdf_trabajos'))
+
+
+def _clave(trabajo_id):
+    return f'core:pdf:{trabajo_id}'
+
+
+def _html_a_pdf(html):
+    """ Se ejecuta en el proceso trabajador: no toca Django ni la BD """
+    from io import BytesIO
+    from xhtml2pdf import pisa
+
+    destino = BytesIO()
+    pisa_status = pisa.CreatePDF(html, dest=destino)
+    if pisa_status.err:
+        raise RuntimeError('Error al generar PDF')
+    return destino.getvalue()
+
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' igual que en Windows: el hijo no hereda hilos ni conexiones abiertas
+            _pool = ProcessPoolExecutor(max_workers=_config('PDF_MAX_WORKERS', 2), mp_context=get_context('spawn'))
+        return _pool
+
+
+def _enviar(html):
+    global _pool
+    try:
+        return _obtener_pool().submit(_html_a_pdf, html)
+    except BrokenProcessPool:
+        # Un proceso murió (memoria, antivirus...): se arma un pool nuevo y se reintenta
+        with _pool_lock:
+            _pool = None
+        return _obtener_pool().submit(_html_a_pdf, html)
+
+
+def renderizar_pdf(html):
+    """ Bytes del PDF, generado en el pool. Bloquea hasta que termine; lanza RuntimeError si falla. """
+    return _enviar(html).result()
+
+
+def _limpiar_viejos():
+    limite = time.time() - _config('PDF_TRABAJOS_TTL', 3600)
+    for ruta in glob.glob(os.path.join(_carpeta(), '*.pdf')):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+def encolar_pdf(html, nombre_archivo):
+    """ Manda el HTML a generar y devuelve el id del trabajo sin esperar """
+    trabajo_id = uuid.uuid4().hex
+    ttl = _config('PDF_TRABAJOS_TTL', 3600)
+    cache.set(_clave(trabajo_id), {'estado': 'PENDIENTE', 'nombre': nombre_archivo, 'error': ''}, ttl)
+
+    def terminado(futuro):
+        try:
+            datos = futuro.result()
+            os.makedirs(_carpeta(), exist_ok=True)
+            with open(os.path.join(_carpeta(), f'{trabajo_id}.pdf'), 'wb') as archivo:
+                archivo.write(datos)
+            estado = {'estado': 'LISTO', 'nombre': nombre_archivo, 'error': ''}
+        except Exception as e:
+            logger.exception("Error generando PDF (%s)", nombre_archivo)
+            estado = {'estado': 'ERROR', 'nombre': nombre_archivo, 'error': str(e)}
+        cache.set(_clave(trabajo_id), estado, ttl)
+
+    _limpiar_viejos()
+    _enviar(html).add_done_callback(terminado)
+    return trabajo_id
+
+
+def estado_pdf(trabajo_id):
+    """ {'estado': PENDIENTE|LISTO|ERROR, 'nombre', 'error'} o None si no existe (o ya venció) """
+    return cache.get(_clave(trabajo_id))
+
+
+def ruta_pdf(trabajo_id):
+    return os.path.join(_carpeta(), f'{trabajo_id}.pdf')
+
+
+def respuesta_pdf_en_cola(request, html, nombre_archivo):
+    """
+    Encola el PDF y responde de una vez: JSON (202) si la petición es AJAX,
+    o una página de espera que consulta el estado y abre el PDF al terminar.
+    """
+    trabajo_id = encolar_pdf(html, nombre_archivo)
+    datos = {
+        'trabajo_id': trabajo_id,
+        'estado_url': reverse('pdf_estado', args=[trabajo_id]),
+        'descarga_url': reverse('pdf_descarga', args=[trabajo_id]),
+    }
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse(dict(datos, status='ok'), status=202)
+    return render(request, 'core/pdf_espera.html', dict(datos, nombre=nombre_archivo))
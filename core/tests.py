@@ -0,0 +1,54 @@
+from decimal import Decimal
+from django.test import TestCase, override_settings
+
+from inventory.models import Insumo, UnidadMedida
+from .models import Configuracion
+
+# Las pruebas no tocan la caché en disco de la instalación
+CACHE_PRUEBAS = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class ConfiguracionCacheTest(TestCase):
+    """ get_cached() lee la BD una vez y se entera de cada cambio """
+
+    @classmethod
+    def setUpTestData(cls):
+        unidades = UnidadMedida.objects.create(nombre='Unidades', codigo='UND', factor=1)
+        cls.caja = Insumo.objects.create(nombre='Caja familiar', unidad=unidades, merma_porcentaje=Decimal('0'))
+        config = Configuracion.get_solo()
+        config.caja_familiar = cls.caja
+        config.save()
+
+    def setUp(self):
+        Configuracion.invalidar_cache()
+
+    def test_segunda_lectura_sin_consultas(self):
+        primera = Configuracion.get_cached()
+        with self.assertNumQueries(0):
+            segunda = Configuracion.get_cached()
+            # El empaque viene con su unidad desde la primera lectura
+            self.assertEqual(segunda.caja_familiar.unidad.codigo, 'UND')
+        self.assertEqual(segunda.pk, primera.pk)
+
+    def test_guardar_invalida(self):
+        self.assertEqual(Configuracion.get_cached().mensaje_ticket, Configuracion.get_solo().mensaje_ticket)
+        config = Configuracion.get_solo()
+        config.mensaje_ticket = 'Vuelva pronto'
+        config.tasa_dolar = Decimal('41.25')
+        config.save()
+        cacheada = Configuracion.get_cached()
+        self.assertEqual((cacheada.mensaje_ticket, cacheada.tasa_dolar), ('Vuelva pronto', Decimal('41.25')))
+
+    def test_cambiar_un_empaque_invalida(self):
+        self.assertEqual(Configuracion.get_cached().caja_familiar.nombre, 'Caja familiar')
+        self.caja.nombre = 'Caja familiar 40cm'
+        self.caja.save()
+        self.assertEqual(Configuracion.get_cached().caja_familiar.nombre, 'Caja familiar 40cm')
+
+        # Un insumo que no es empaque no borra la caché
+        otro = Insumo.objects.create(nombre='Harina', unidad=self.caja.unidad, merma_porcentaje=Decimal('0'))
+        Configuracion.get_cached()
+        otro.save()
+        with self.assertNumQueries(0):
+            Configuracion.get_cached()
@@ -12,4 +12,8 @@ urlpatterns = [
     path('configuracion/procesos/', views.conf_procesos, name='conf_procesos'),
     path('configuracion/costo-editar/<int:pk>/', views.costo_indirecto_edit, name='costo_indirecto_edit'),
 
+    # PDF generados en segundo plano
+    path('pdf/<str:trabajo_id>/estado/', views.pdf_estado, name='pdf_estado'),
+    path('pdf/<str:trabajo_id>/', views.pdf_descarga, name='pdf_descarga'),
+
 ]
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from decimal import Decimal
 from .models import Configuracion
 # Importamos los formularios que arreglamos antes
@@ -8,6 +9,8 @@ from tables.models import TasaBCV, CostoAdicional
 from reports.models import AuditoriaConfiguracion
 from django.db.models import ProtectedError
 from django.core.paginator import Paginator
+from django.http import JsonResponse, FileResponse, Http404
+from .pdf import estado_pdf, ruta_pdf
 
 # 1. MENÚ PRINCIPAL
 def configuracion_menu(request):
@@ -161,4 +164,24 @@ def costo_indirecto_edit(request, pk):
     
     return render(request, 'core/configuracion_form.html', {
         'form': form, 'titulo': f'Editar Costo: {costo.nombre}', 'icono': 'fas fa-edit'
-    })
\ No newline at end of file
+    })
+
+# --- PDF GENERADOS EN SEGUNDO PLANO ---
+@login_required
+def pdf_estado(request, trabajo_id):
+    estado = estado_pdf(trabajo_id)
+    if estado is None:
+        return JsonResponse({'status': 'error', 'message': 'Trabajo no encontrado'}, status=404)
+    return JsonResponse({'status': 'ok', 'estado': estado['estado'], 'error': estado['error']})
+
+@login_required
+def pdf_descarga(request, trabajo_id):
+    estado = estado_pdf(trabajo_id)
+    if estado is None or estado['estado'] != 'LISTO':
+        raise Http404("El PDF no existe o todavía no está listo")
+    try:
+        archivo = open(ruta_pdf(trabajo_id), 'rb')
+    except OSError:
+        raise Http404("El PDF ya no está disponible")
+    # Inline: se abre en el navegador igual que antes
+    return FileResponse(archivo, content_type='application/pdf', filename=estado['nombre'])
@@ -11,7 +11,7 @@ class InsumoAdmin(admin.ModelAdmin):
 
 class MovimientoAdmin(admin.ModelAdmin):
     list_display = ('fecha', 'tipo', 'insumo', 'cantidad', 'costo_unitario_movimiento', 'usuario')
-    list_filter = ('tipo', 'fecha')
+    list_filter = ('tipo', 'origen_tipo', 'fecha')
     ordering = ('-fecha',)
 
 admin.site.register(UnidadMedida)
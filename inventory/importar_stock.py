@@ -0,0 +1,297 @@
+import codecs
+import csv
+import io
+import unicodedata
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+
+from .models import Insumo, MovimientoInventario, UnidadMedida
+from .utils_stock import registrar_movimientos, cerrar_lote
+
+# ==========================================
+#  CARGA DE INVENTARIO DESDE ARCHIVO (CSV / EXCEL)
+# ==========================================
+# Una factura de proveedor (ENTRADA: lo que llegó) o una hoja de conteo físico
+# (AJUSTE: lo que hay en el estante) se leen fila por fila, sin cargar el
+# archivo entero en memoria. Cada fila se busca en un índice de insumos armado
+# una sola vez (por código = id del insumo, o por nombre sin importar
+# mayúsculas ni acentos) y las cantidades se suman por insumo: lo que queda en
+# memoria crece con los insumos, no con las líneas del archivo.
+#
+# Primero se muestra la vista previa (stock actual -> stock nuevo) y al
+# confirmar se guardan los movimientos con registrar_movimientos(): un
+# bulk_create y un UPDATE del stock por bloque, no una señal por fila.
+#
+# El archivo necesita una fila de títulos con al menos la cantidad y el insumo
+# o el código. La unidad es opcional (KG, LT...); sin ella la cantidad va en la
+# unidad base del insumo, igual que en el formulario.
+
+COLUMNAS = {
+    'codigo': ('codigo', 'cod', 'id', 'code', 'sku'),
+    'insumo': ('insumo', 'nombre', 'descripcion', 'articulo', 'producto', 'item'),
+    'cantidad': ('cantidad', 'cant', 'conteo', 'contado', 'existencia', 'stock'),
+    'unidad': ('unidad', 'und', 'um', 'medida'),
+}
+MAX_ERRORES_EN_PANTALLA = 200
+TAMANO_MUESTRA = 64 * 1024
+LINEAS_BUSCAR_TITULOS = 20
+
+
+class ArchivoInvalido(ValueError):
+    """ El archivo no se puede leer o no trae las columnas necesarias """
+
+
+def normalizar(texto):
+    """ 'Harina  PAN ' -> 'harina pan'; sin acentos para que 'azucar' encuentre 'Azúcar' """
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def leer_numero(valor):
+    """ 45 / 45.5 (celda de Excel), '45,50', '1.234,5' o '45.50' -> Decimal; vacío -> None """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor))
+    texto = str(valor).strip().replace(' ', '')
+    if not texto:
+        return None
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"'{valor}' no es un número")
+
+
+# --- LECTURA (fila por fila) ---
+
+def _filas_csv(archivo):
+    muestra = archivo.read(TAMANO_MUESTRA)
+    archivo.seek(0)
+    try:
+        # La muestra puede cortar una letra de varios bytes (ñ, á...) a la mitad:
+        # el decodificador incremental deja esos bytes pendientes en vez de fallar
+        codecs.getincrementaldecoder('utf-8')().decode(muestra, final=len(muestra) < TAMANO_MUESTRA)
+        codificacion = 'utf-8-sig'
+    except UnicodeDecodeError:
+        # Excel en Windows guarda los CSV en ANSI
+        codificacion = 'cp1252'
+    texto = io.TextIOWrapper(archivo, encoding=codificacion, errors='replace', newline='')
+    try:
+        delimitador = csv.Sniffer().sniff(muestra.decode(codificacion, errors='replace'), delimiters=';,\t').delimiter
+    except csv.Error:
+        delimitador = ';'
+    try:
+        yield from csv.reader(texto, delimiter=delimitador)
+    finally:
+        texto.detach()
+
+
+def _filas_xlsx(archivo):
+    from openpyxl import load_workbook
+
+    # read_only: las filas se leen del zip a medida que se piden
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from libro.worksheets[0].iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def leer_filas(archivo, nombre):
+    """ Filas del archivo (listas de celdas) según la extensión: .xlsx o CSV """
+    if nombre.lower().endswith(('.xlsx', '.xlsm')):
+        from reports.exportar import xlsx_disponible
+        if not xlsx_disponible():
+            raise ArchivoInvalido("Para leer archivos de Excel hace falta la librería openpyxl (pip install openpyxl). Guarde el archivo como CSV.")
+        return _filas_xlsx(archivo)
+    if nombre.lower().endswith('.xls'):
+        raise ArchivoInvalido("El formato .xls (Excel 97) no está soportado: guárdelo como .xlsx o CSV.")
+    return _filas_csv(archivo)
+
+
+def _ubicar_columnas(titulos):
+    """ {'codigo': i, 'insumo': i, 'cantidad': i, 'unidad': i} con las columnas que se reconozcan """
+    posiciones = {}
+    for i, titulo in enumerate(titulos):
+        titulo = normalizar(titulo)
+        for clave, nombres in COLUMNAS.items():
+            if clave not in posiciones and titulo in nombres:
+                posiciones[clave] = i
+    return posiciones
+
+
+# --- ÍNDICE DE INSUMOS (una consulta) ---
+
+class IndiceInsumos:
+    def __init__(self):
+        self.datos = {}
+        self.por_nombre = {}
+        self.repetidos = set()
+        self.recetas_ids = set()
+        self.recetas_nombres = set()
+        for pk, nombre, compuesto, factor in Insumo.objects.values_list('pk', 'nombre', 'es_insumo_compuesto', 'unidad__factor'):
+            clave = normalizar(nombre)
+            if compuesto:
+                self.recetas_ids.add(pk)
+                self.recetas_nombres.add(clave)
+                continue
+            self.datos[pk] = factor or Decimal('1')
+            if clave in self.por_nombre:
+                self.repetidos.add(clave)
+            self.por_nombre[clave] = pk
+
+        self.unidades = {}
+        for codigo, nombre, factor in UnidadMedida.objects.values_list('codigo', 'nombre', 'factor'):
+            self.unidades.setdefault(normalizar(codigo), factor)
+            self.unidades.setdefault(normalizar(nombre), factor)
+
+    def buscar(self, codigo, nombre):
+        """ insumo_id de la fila. ValueError con el motivo si no se encuentra """
+        if codigo not in (None, ''):
+            try:
+                pk = int(leer_numero(codigo))
+            except (ValueError, TypeError):
+                raise ValueError(f"Código '{codigo}' inválido")
+            if pk in self.datos:
+                return pk
+            if pk in self.recetas_ids:
+                raise ValueError("Es una receta: su stock se carga con Producción")
+            if not nombre:
+                raise ValueError(f"No existe un insumo con código {pk}")
+
+        clave = normalizar(nombre)
+        if not clave:
+            raise ValueError("Falta el insumo")
+        if clave in self.repetidos:
+            raise ValueError("Hay varios insumos con ese nombre: use el código")
+        if clave in self.por_nombre:
+            return self.por_nombre[clave]
+        if clave in self.recetas_nombres:
+            raise ValueError("Es una receta: su stock se carga con Producción")
+        raise ValueError("No existe un insumo con ese nombre")
+
+    def factor(self, insumo_id, unidad):
+        """ Cuánto vale 1 de la unidad del archivo en la unidad base del insumo (1 KG = 1000 GR) """
+        if unidad in (None, ''):
+            return Decimal('1')
+        factor = self.unidades.get(normalizar(unidad))
+        if factor is None:
+            raise ValueError(f"Unidad '{unidad}' desconocida")
+        return factor / self.datos[insumo_id]
+
+
+def analizar_archivo(archivo, nombre, tipo):
+    """
+    Lee el archivo y suma las cantidades (en unidad base) por insumo.
+    Devuelve {'cantidades': {insumo_id: Decimal}, 'lineas', 'errores' (las
+    primeras MAX_ERRORES_EN_PANTALLA como (línea, texto, motivo)), 'total_errores'}.
+    Lanza ArchivoInvalido si no se puede leer o no tiene los títulos.
+    """
+    indice = IndiceInsumos()
+    filas = leer_filas(archivo, nombre)
+
+    # Los títulos pueden no estar en la primera fila (logo, nombre del proveedor...)
+    columnas = {}
+    numero = 0
+    try:
+        for numero, fila in enumerate(filas, start=1):
+            columnas = _ubicar_columnas(fila)
+            if 'cantidad' in columnas and ('insumo' in columnas or 'codigo' in columnas):
+                break
+            if numero >= LINEAS_BUSCAR_TITULOS:
+                break
+        if 'cantidad' not in columnas or not ('insumo' in columnas or 'codigo' in columnas):
+            raise ArchivoInvalido("No se encontró la fila de títulos: hacen falta las columnas 'Cantidad' y 'Insumo' (o 'Código').")
+
+        def celda(fila, clave):
+            i = columnas.get(clave)
+            return fila[i] if i is not None and i < len(fila) else None
+
+        cantidades = {}
+        errores = []
+        total_errores = 0
+        lineas = 0
+        for numero, fila in enumerate(filas, start=numero + 1):
+            if not any(v not in (None, '') and str(v).strip() for v in fila):
+                continue
+            lineas += 1
+            codigo, texto = celda(fila, 'codigo'), celda(fila, 'insumo')
+            try:
+                insumo_id = indice.buscar(codigo, texto)
+                cantidad = leer_numero(celda(fila, 'cantidad'))
+                if cantidad is None:
+                    raise ValueError("Falta la cantidad")
+                if cantidad < 0:
+                    raise ValueError("La cantidad no puede ser negativa")
+                cantidad *= indice.factor(insumo_id, celda(fila, 'unidad'))
+            except ValueError as e:
+                total_errores += 1
+                if len(errores) < MAX_ERRORES_EN_PANTALLA:
+                    errores.append((numero, str(texto or codigo or ''), str(e)))
+                continue
+            cantidades[insumo_id] = cantidades.get(insumo_id, Decimal('0')) + cantidad
+    except ArchivoInvalido:
+        raise
+    except Exception as e:
+        # CSV mal formado, Excel dañado (openpyxl/zipfile lanzan sus propias excepciones)...
+        donde = f" (línea {numero + 1})" if numero else ""
+        raise ArchivoInvalido(f"No se pudo leer el archivo{donde}: {e}")
+
+    if tipo == 'ENTRADA':
+        # En una compra, una línea en 0 no cambia nada
+        cantidades = {pk: cantidad for pk, cantidad in cantidades.items() if cantidad > 0}
+    return {'cantidades': cantidades, 'lineas': lineas, 'errores': errores, 'total_errores': total_errores}
+
+
+# --- VISTA PREVIA Y APLICACIÓN ---
+
+def _cantidad_movimiento(valor):
+    return Decimal(valor).quantize(Decimal('0.001'))
+
+
+def vista_previa(cantidades, tipo):
+    """ Filas (insumo, stock actual, cantidad, stock nuevo, diferencia) ordenadas por categoría y nombre """
+    filas = []
+    for insumo in Insumo.objects.filter(pk__in=list(cantidades)).select_related('categoria', 'unidad').order_by('categoria__nombre', 'nombre'):
+        cantidad = _cantidad_movimiento(cantidades[insumo.pk])
+        stock_nuevo = insumo.stock_actual + cantidad if tipo == 'ENTRADA' else cantidad
+        filas.append({
+            'insumo': insumo,
+            'stock_actual': insumo.stock_actual,
+            'cantidad': cantidad,
+            'stock_nuevo': stock_nuevo,
+            'diferencia': stock_nuevo - insumo.stock_actual,
+        })
+    return filas
+
+
+def aplicar_carga(cantidades, tipo, usuario, nota):
+    """
+    Guarda la carga: ENTRADA suma la cantidad; AJUSTE deja el stock en lo
+    contado (el movimiento es la diferencia contra el stock de este momento).
+    Devuelve los movimientos creados, todos con el mismo lote (origen CARGA).
+    """
+    with transaction.atomic():
+        movimientos = []
+        insumos = Insumo.objects.select_for_update().filter(pk__in=list(cantidades)).only('pk', 'stock_actual', 'costo_unitario')
+        for insumo in insumos:
+            cantidad = _cantidad_movimiento(cantidades[insumo.pk])
+            if tipo == 'AJUSTE':
+                cantidad -= insumo.stock_actual
+            if not cantidad:
+                continue
+            movimientos.append(MovimientoInventario(
+                insumo_id=insumo.pk,
+                tipo=tipo,
+                cantidad=cantidad,
+                usuario=usuario,
+                nota=nota,
+                costo_unitario_movimiento=abs(cantidad * insumo.costo_unitario),
+                origen_tipo='CARGA',
+            ))
+        creados = registrar_movimientos(movimientos)
+        cerrar_lote(creados)
+    return creados
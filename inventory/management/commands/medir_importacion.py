@@ -0,0 +1,88 @@
+import io
+import time
+import tracemalloc
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from inventory.importar_stock import analizar_archivo, aplicar_carga
+from inventory.models import Insumo, UnidadMedida
+
+
+class _Deshacer(Exception):
+    """ Sale del atomic() para que no quede nada de los datos de prueba """
+
+
+class Command(BaseCommand):
+    help = ('Mide la carga de inventario desde un CSV de N líneas (análisis y aplicación, ENTRADA y AJUSTE): '
+            'tiempo, consultas y memoria máxima del análisis. Los datos se crean dentro de una transacción '
+            'que se deshace al final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--insumos', type=int, default=2000, help='Insumos del catálogo (2000 por defecto)')
+        parser.add_argument('--lineas', type=int, nargs='+', default=[10000, 100000], help='Líneas del CSV (10000 100000 por defecto)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                usuario, insumos = self._datos(options['insumos'])
+                self.stdout.write(f"{len(insumos)} insumos")
+                for lineas in options['lineas']:
+                    for tipo in ('ENTRADA', 'AJUSTE'):
+                        self._medir(usuario, insumos, lineas, tipo)
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+    def _datos(self, cuantos):
+        usuario = User.objects.create(username='medicion-importacion')
+        gramos = UnidadMedida.objects.create(nombre='Gramos (medición)', codigo='GRM', factor=1)
+        UnidadMedida.objects.get_or_create(codigo='KG', defaults={'nombre': 'Kilogramos', 'factor': 1000})
+        insumos = Insumo.objects.bulk_create([
+            Insumo(nombre=f'Insumo de medición {i}', unidad=gramos, costo_unitario=Decimal('0.01'), stock_actual=Decimal('100'))
+            for i in range(cuantos)
+        ])
+        return usuario, insumos
+
+    def _csv(self, insumos, lineas):
+        """ Mitad de las filas por código y mitad por nombre (en mayúsculas), una de cada diez en KG """
+        texto = io.StringIO()
+        texto.write('Código;Insumo;Cantidad;Unidad\n')
+        for i in range(lineas):
+            insumo = insumos[i % len(insumos)]
+            if i % 2:
+                texto.write(f';{insumo.nombre.upper()};{i % 7 + 1},5;{"KG" if i % 10 == 1 else ""}\n')
+            else:
+                texto.write(f'{insumo.pk};;{i % 7 + 1};\n')
+        return texto.getvalue().encode('utf-8')
+
+    def _medir(self, usuario, insumos, lineas, tipo):
+        datos = self._csv(insumos, lineas)
+
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as consultas_analisis:
+            inicio = time.perf_counter()
+            resultado = analizar_archivo(io.BytesIO(datos), 'carga.csv', tipo)
+            analisis = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        antes = dict(Insumo.objects.filter(pk__in=list(resultado['cantidades'])).values_list('pk', 'stock_actual'))
+        with CaptureQueriesContext(connection) as consultas_aplicar:
+            inicio = time.perf_counter()
+            movimientos = aplicar_carga(resultado['cantidades'], tipo, usuario, 'Medición')
+            aplicar = time.perf_counter() - inicio
+
+        # El stock quedó como se esperaba: sumado (ENTRADA) o igual a lo contado (AJUSTE)
+        esperados = {pk: cantidad.quantize(Decimal('0.001')) for pk, cantidad in resultado['cantidades'].items()}
+        stock = dict(Insumo.objects.filter(pk__in=list(esperados)).values_list('pk', 'stock_actual'))
+        if tipo == 'ENTRADA':
+            esperados = {pk: antes[pk] + cantidad for pk, cantidad in esperados.items()}
+        correcto = stock == esperados
+
+        self.stdout.write(
+            f"  {lineas:>7} líneas {tipo:<7} análisis {analisis:.2f} s ({len(consultas_analisis)} consultas, "
+            f"{pico / 1024 / 1024:.1f} MB máx.), aplicar {aplicar:.2f} s ({len(consultas_aplicar)} consultas, "
+            f"{len(movimientos)} movimientos), errores {resultado['total_errores']}, stock {'correcto' if correcto else 'INCORRECTO'}"
+        )
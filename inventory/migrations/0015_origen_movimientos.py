@@ -0,0 +1,65 @@
+from django.conf import settings
+import re
+from django.db import migrations, models
+
+# Lo que antes solo quedaba escrito en la nota de cada movimiento
+CONSUMO = re.compile(r'^(?:Base Personal|Extra Personal|Regalo|Personal|ANULACIÓN Salida) #(\d+)$')
+ANULACION_VENTA = re.compile(r'^ANULACIÓN Venta #([^:]+):')
+ORDEN = re.compile(r'^(?:Orden Mesa|Rep\. edición Mesa|Eliminación Mesa) ')
+PRODUCCION = re.compile(r'^(?:Producción|Prod\. )')
+CARGA = re.compile(r'\((?:Carga Masiva\)|Carga directa: )')
+
+
+def rellenar_origen(apps, schema_editor):
+    MovimientoInventario = apps.get_model('inventory', 'MovimientoInventario')
+    Venta = apps.get_model('tables', 'Venta')
+    ventas = dict(Venta.objects.values_list('codigo_factura', 'id'))
+
+    pendientes = []
+    for mov in MovimientoInventario.objects.exclude(nota__isnull=True).exclude(nota='').only('id', 'nota').iterator(chunk_size=2000):
+        nota = mov.nota.strip()
+        if m := CONSUMO.match(nota):
+            mov.origen_tipo, mov.origen_id = 'CONSUMO', int(m.group(1))
+        elif m := ANULACION_VENTA.match(nota):
+            mov.origen_tipo, mov.origen_id = 'VENTA', ventas.get(m.group(1))
+        elif ORDEN.match(nota):
+            # La nota solo trae el número de mesa, no el de la orden
+            mov.origen_tipo = 'ORDEN'
+        elif PRODUCCION.match(nota):
+            mov.origen_tipo = 'PRODUCCION'
+        elif CARGA.search(nota):
+            mov.origen_tipo = 'CARGA'
+        else:
+            continue
+        pendientes.append(mov)
+        if len(pendientes) >= 2000:
+            MovimientoInventario.objects.bulk_update(pendientes, ['origen_tipo', 'origen_id'])
+            pendientes = []
+    MovimientoInventario.objects.bulk_update(pendientes, ['origen_tipo', 'origen_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_indices_consultas'),
+        ('tables', '0028_indices_consultas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='origen_id',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='origen_tipo',
+            field=models.CharField(blank=True, choices=[('VENTA', 'Venta'), ('ORDEN', 'Orden de mesa'), ('CONSUMO', 'Consumo interno'), ('PRODUCCION', 'Lote de producción'), ('CARGA', 'Carga de inventario')], default='', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['origen_tipo', 'origen_id'], name='mov_origen_idx'),
+        ),
+        migrations.RunPython(rellenar_origen, migrations.RunPython.noop),
+    ]
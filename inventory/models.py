@@ -59,167 +59,20 @@ class Insumo(models.Model):
         return round(self.stock_actual * self.costo_unitario, 2)
 
     # --- MÉTODO 1: CÁLCULO AUTOMÁTICO DE RECETAS ---
-    # inventory/models.py
-
-    # inventory/models.py
-
     def calcular_costo_desde_subreceta(self):
         """
-        LÓGICA BLINDADA PARA RECETAS:
         Calcula cuánto cuesta 1 GRAMO de la receta final.
         Fórmula: (Costo Total de Ingredientes) / (Peso Total de la Receta)
-        """
-        # 1. VALIDACIÓN: Solo aplica si es Compuesto (Receta)
-        if not self.es_insumo_compuesto:
-            return
-
-        total_costo_fabricacion = Decimal(0)
-        total_peso_calculado = Decimal(0)
-
-        # 2. SUMAR COSTOS Y PESOS DE LOS INGREDIENTES
-        for componente in self.componentes.all():
-            # Cuánto cuesta esta cantidad de ingrediente (Ej: 2500g Tomate * Precio Tomate)
-            costo_linea = componente.cantidad * componente.insumo_hijo.costo_unitario
-            total_costo_fabricacion += costo_linea
-            
-            # Cuánto pesa este ingrediente
-            total_peso_calculado += componente.cantidad
-
-        # 3. DETERMINAR EL PESO FINAL (EL DIVISOR)
-        # Si definiste manualmente que la receta rinde 2700g (rendimiento), usamos eso.
-        # Si no, usamos la suma de los ingredientes.
-        if self.rendimiento > 1:
-            peso_final = self.rendimiento
-        else:
-            peso_final = total_peso_calculado
-            # Guardamos este peso calculado como rendimiento
-            self.rendimiento = peso_final
-
-        # 4. APLICAR LA FÓRMULA (DIVISIÓN)
-        # AQUÍ ESTÁ LA SOLUCIÓN: Costo Total / Peso Total = Costo Unitario
-        if peso_final > 0:
-            self.costo_unitario = total_costo_fabricacion / peso_final
-        else:
-            self.costo_unitario = 0
-
-        # 5. GUARDAR EN BASE DE DATOS
-        # Usamos update para ser directos y evitar bucles
-        Insumo.objects.filter(pk=self.pk).update(
-            costo_unitario=self.costo_unitario,
-            rendimiento=self.rendimiento
-        )
-        """
-        Lógica Blindada:
-        1. Suma todo lo que gastaste en ingredientes (Costo de Fabricación).
-        2. Suma todo lo que pesan los ingredientes (Peso Total).
-        3. REALIZA LA DIVISIÓN: Costo / Peso = Precio Real por Gramo.
+        El peso total queda guardado como rendimiento. Lo hace el motor de
+        costos (tables/costos.py), que de paso recalcula las recetas y los
+        productos que usan esta receta.
         """
         # SOLO APLICA PARA COMPUESTOS (RECETAS)
         if not self.es_insumo_compuesto:
             return
 
-        total_costo_fabricacion = Decimal(0)
-        total_peso_resultante = Decimal(0)
-
-        # 1. Sumamos costo y peso de los ingredientes
-        for componente in self.componentes.all():
-            total_costo_fabricacion += componente.cantidad * componente.insumo_hijo.costo_unitario
-            total_peso_resultante += componente.cantidad
-
-        # 2. VALIDACIÓN DE PESO (DIVISOR)
-        # Si el usuario configuró manualmente que la receta rinde 2000g, usamos eso.
-        # Si no, usamos la suma automática de los ingredientes.
-        if self.rendimiento > 1:
-            peso_final_divisor = self.rendimiento
-        else:
-            peso_final_divisor = total_peso_resultante
-            # Actualizamos el rendimiento automáticamente si estaba en 0
-            self.rendimiento = peso_final_divisor
-
-        # 3. LA VALIDACIÓN QUE PEDISTE (CÁLCULO FINAL)
-        # Si es compuesto, JAMÁS guardamos el costo total ($13) como unitario.
-        # Siempre dividimos entre el peso ($13 / 1000g = $0.013).
-        
-        if peso_final_divisor > 0:
-            self.costo_unitario = total_costo_fabricacion / peso_final_divisor
-        else:
-            self.costo_unitario = 0
-
-        # Guardamos en BD usando update para no disparar bucles
-        Insumo.objects.filter(pk=self.pk).update(
-            costo_unitario=self.costo_unitario,
-            rendimiento=self.rendimiento
-        )
-        """
-        Calcula el costo unitario real (por gramo/ml) de una receta.
-        Fórmula: Costo Total de Ingredientes / Rendimiento Total.
-        """
-        if not self.es_insumo_compuesto:
-            return
-
-        # 1. Calcular Costo Total del Lote ($)
-        # (Cuánto cuesta la olla completa con todos los ingredientes)
-        total_costo_lote = Decimal(0)
-        total_peso_ingredientes = Decimal(0)
-
-        for componente in self.componentes.all():
-            total_costo_lote += componente.cantidad * componente.insumo_hijo.costo_unitario
-            total_peso_ingredientes += componente.cantidad
-
-        # 2. Definir el Divisor (Rendimiento)
-        # VALIDACIÓN IMPORTANTE: 
-        # Si el usuario configuró un rendimiento manual (ej: 2700g) usamos ese.
-        # Si no (está en 0 o 1), usamos la suma de los pesos de los ingredientes.
-        if self.rendimiento > 1: 
-            peso_final = self.rendimiento
-        else:
-            peso_final = total_peso_ingredientes
-            # Si calculamos el peso sumando, actualizamos el campo rendimiento para referencia
-            if peso_final > 0:
-                self.rendimiento = peso_final
-
-        # 3. CÁLCULO DEL PRECIO POR GRAMO (Tu validación solicitada)
-        # Nunca guardamos el precio de fabricación directo. Siempre dividimos.
-        if peso_final > 0:
-            nuevo_costo_unitario = total_costo_lote / peso_final
-        else:
-            # Si no hay peso (receta vacía), el costo unitario es 0
-            nuevo_costo_unitario = 0
-
-        # 4. Guardar en Base de Datos
-        # Usamos .update() para ser eficientes y evitar bucles de señales
-        Insumo.objects.filter(pk=self.pk).update(
-            costo_unitario=nuevo_costo_unitario,
-            rendimiento=self.rendimiento
-        )
-        if not self.es_insumo_compuesto:
-            return
-
-        total_costo = Decimal('0.0')
-        total_peso_teorico = Decimal('0.0') 
-        
-        # Recorremos los ingredientes
-        for componente in self.componentes.all():
-            # 1. Sumar Costo ($)
-            total_costo += componente.cantidad * componente.insumo_hijo.costo_unitario
-            
-            # 2. Sumar Peso (Gramos/ML) - AUTOMÁTICO
-            total_peso_teorico += componente.cantidad
-            
-        # 3. Asignamos el rendimiento calculado automáticamente
-        self.rendimiento = total_peso_teorico 
-
-        # 4. Cálculo del Costo Unitario (Costo Total / Peso Total)
-        if total_peso_teorico > 0:
-            nuevo_costo_unitario = total_costo / total_peso_teorico
-        else:
-            nuevo_costo_unitario = total_costo 
-
-        # Actualizamos la base de datos directamente
-        Insumo.objects.filter(pk=self.pk).update(
-            costo_unitario=nuevo_costo_unitario,
-            rendimiento=total_peso_teorico
-        )
+        from tables.costos import recalcular_costos
+        self.costo_unitario, self.rendimiento = recalcular_costos(insumo_ids=[self.pk])['insumos'][self.pk]
     
     # --- MÉTODO 2: CÁLCULO DESDE EL MAESTRO (MATERIA PRIMA) ---
     def save(self, *args, **kwargs):
@@ -260,6 +113,15 @@ class IngredienteCompuesto(models.Model):
 
 class MovimientoInventario(models.Model):
     TIPOS_MOVIMIENTO = [('ENTRADA', 'Compra/Prod'), ('SALIDA', 'Consumo/Merma'), ('AJUSTE', 'Ajuste')]
+    # Documento que generó el movimiento. Para producción y cargas no hay un
+    # modelo propio: el id es el del primer movimiento del lote.
+    ORIGENES = [
+        ('VENTA', 'Venta'),
+        ('ORDEN', 'Orden de mesa'),
+        ('CONSUMO', 'Consumo interno'),
+        ('PRODUCCION', 'Lote de producción'),
+        ('CARGA', 'Carga de inventario'),
+    ]
     insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='movimientos')
     tipo = models.CharField(max_length=10, choices=TIPOS_MOVIMIENTO)
     cantidad = models.DecimalField(max_digits=10, decimal_places=3)
@@ -268,6 +130,18 @@ class MovimientoInventario(models.Model):
     fecha = models.DateTimeField(auto_now_add=True)
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     nota = models.CharField(max_length=255, blank=True, null=True)
+    origen_tipo = models.CharField(max_length=12, choices=ORIGENES, blank=True, default='')
+    origen_id = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        # Reporte de inventario: rango de fechas, por tipo (top consumo) o por insumo.
+        # Anulaciones y reimpresiones buscan los movimientos por su documento de origen.
+        indexes = [
+            models.Index(fields=['fecha'], name='mov_fecha_idx'),
+            models.Index(fields=['tipo', 'fecha'], name='mov_tipo_fecha_idx'),
+            models.Index(fields=['insumo', 'fecha'], name='mov_insumo_fecha_idx'),
+            models.Index(fields=['origen_tipo', 'origen_id'], name='mov_origen_idx'),
+        ]
 
 # --- SEÑAL DE ACTUALIZACIÓN DE STOCK ---
 @receiver(post_save, sender=MovimientoInventario, dispatch_uid="actualizar_stock_conversion_unico")
@@ -0,0 +1,80 @@
+import io
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from .importar_stock import TAMANO_MUESTRA, analizar_archivo, aplicar_carga, leer_filas
+from .models import Insumo, MovimientoInventario, UnidadMedida
+
+
+class LecturaCsvTest(SimpleTestCase):
+    def _filas(self, datos):
+        return list(leer_filas(io.BytesIO(datos), 'conteo.csv'))
+
+    def test_utf8_con_letra_cortada_en_la_muestra(self):
+        titulos = 'Insumo;Cantidad\n'.encode('utf-8')
+        linea = 'Piña;1\n'.encode('utf-8')
+        # Relleno para que la 'ñ' de una línea quede partida justo en el borde de la muestra
+        fijo = len(titulos) + len(b'Relleno;0\n')
+        relleno = b'x' * ((TAMANO_MUESTRA - 3 - fijo) % len(linea))
+        datos = titulos + b'Relleno' + relleno + b';0\n' + linea * (TAMANO_MUESTRA // len(linea) + 10)
+        corte = datos.index('ñ'.encode('utf-8'), TAMANO_MUESTRA - len(linea))
+        self.assertEqual(corte, TAMANO_MUESTRA - 1)
+
+        filas = self._filas(datos)
+        self.assertEqual(filas[0], ['Insumo', 'Cantidad'])
+        self.assertEqual({fila[0] for fila in filas[2:]}, {'Piña'})
+
+    def test_ansi_de_excel(self):
+        filas = self._filas('Insumo;Cantidad\nPiña;2\nAzúcar;3,5\n'.encode('cp1252'))
+        self.assertEqual(filas, [['Insumo', 'Cantidad'], ['Piña', '2'], ['Azúcar', '3,5']])
+
+
+class CargaArchivoTest(TestCase):
+    """ Del archivo a los movimientos: cada fila se ubica en el índice y el stock queda como debe """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('almacen', password='x', is_staff=True)
+        gramos = UnidadMedida.objects.create(nombre='Gramos', codigo='GR', factor=1)
+        UnidadMedida.objects.create(nombre='Kilogramos', codigo='KG', factor=1000)
+        cls.harina = Insumo.objects.create(nombre='Harina de Trigo', unidad=gramos, merma_porcentaje=Decimal('0'), stock_actual=Decimal('500'))
+        cls.pina = Insumo.objects.create(nombre='Piña', unidad=gramos, merma_porcentaje=Decimal('0'), stock_actual=Decimal('40'))
+        cls.salsa = Insumo.objects.create(nombre='Salsa', unidad=gramos, es_insumo_compuesto=True)
+
+    def _analizar(self, tipo):
+        datos = (
+            'Distribuidora El Trigal;;;\n'
+            'Código;Insumo;Cantidad;Unidad\n'
+            f'{self.harina.pk};;1,5;KG\n'
+            ';  HARINA   DE TRIGO ;250;\n'
+            ';pina;12;\n'
+            ';Salsa;3;\n'
+            ';Queso;7;\n'
+        ).encode('utf-8')
+        return analizar_archivo(io.BytesIO(datos), 'factura.csv', tipo)
+
+    def test_entrada_suma_por_insumo(self):
+        resultado = self._analizar('ENTRADA')
+        self.assertEqual(resultado['lineas'], 5)
+        self.assertEqual(resultado['cantidades'], {self.harina.pk: Decimal('1750'), self.pina.pk: Decimal('12')})
+        self.assertEqual([(linea, motivo) for linea, _, motivo in resultado['errores']], [
+            (6, "Es una receta: su stock se carga con Producción"),
+            (7, "No existe un insumo con ese nombre"),
+        ])
+
+        movimientos = aplicar_carga(resultado['cantidades'], 'ENTRADA', self.usuario, 'Factura 123')
+        self.assertEqual(len(movimientos), 2)
+        self.assertEqual({m.origen_id for m in movimientos}, {movimientos[0].pk})
+        self.assertEqual(Insumo.objects.get(pk=self.harina.pk).stock_actual, Decimal('2250'))
+        self.assertEqual(Insumo.objects.get(pk=self.pina.pk).stock_actual, Decimal('52'))
+
+    def test_ajuste_deja_lo_contado(self):
+        movimientos = aplicar_carga(self._analizar('AJUSTE')['cantidades'], 'AJUSTE', self.usuario, 'Conteo')
+        self.assertEqual(
+            {m.insumo_id: m.cantidad for m in movimientos},
+            {self.harina.pk: Decimal('1250'), self.pina.pk: Decimal('-28')},
+        )
+        self.assertEqual(Insumo.objects.get(pk=self.harina.pk).stock_actual, Decimal('1750'))
+        self.assertEqual(Insumo.objects.get(pk=self.pina.pk).stock_actual, Decimal('12'))
+        self.assertTrue(MovimientoInventario.objects.filter(origen_tipo='CARGA', tipo='AJUSTE').exists())
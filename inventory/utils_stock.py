@@ -0,0 +1,78 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Value, DecimalField, Case, When
+from django.db.models.functions import Greatest
+
+from .models import Insumo, MovimientoInventario
+
+
+def delta_stock_movimiento(movimiento):
+    """
+    Devuelve cuánto cambia el stock (en unidad base) por un movimiento.
+    Es la misma matemática que aplica la señal actualizar_stock_conversion.
+    """
+    factor = movimiento.unidad_movimiento.factor if movimiento.unidad_movimiento else 1
+    if movimiento.tipo == 'ENTRADA':
+        return abs(movimiento.cantidad * factor)
+    elif movimiento.tipo == 'SALIDA':
+        return -abs(movimiento.cantidad * factor)
+    elif movimiento.tipo == 'AJUSTE':
+        return movimiento.cantidad * factor
+    return Decimal('0')
+
+
+def aplicar_deltas_stock(deltas, tamano_bloque=500):
+    """
+    Aplica un diccionario {insumo_id: delta} con un solo UPDATE por bloque de
+    insumos (un CASE con el delta de cada uno), usando F() para no pisar
+    cambios hechos por otros meseros en paralelo.
+    Igual que la señal, el stock nunca queda en negativo.
+    """
+    ids = [insumo_id for insumo_id, delta in deltas.items() if delta]
+    for inicio in range(0, len(ids), tamano_bloque):
+        bloque = ids[inicio:inicio + tamano_bloque]
+        delta = Case(
+            *[When(pk=insumo_id, then=Value(deltas[insumo_id], output_field=DecimalField())) for insumo_id in bloque],
+            output_field=DecimalField(),
+        )
+        Insumo.objects.filter(pk__in=bloque).update(
+            stock_actual=Greatest(
+                F('stock_actual') + delta,
+                Value(Decimal('0'), output_field=DecimalField()),
+                output_field=DecimalField(),
+            )
+        )
+
+
+def registrar_movimientos(movimientos):
+    """
+    Guarda en bloque una lista de MovimientoInventario (aún sin guardar) y
+    actualiza el stock agregando todos los movimientos de cada insumo.
+
+    bulk_create no dispara post_save, así que la señal de stock no corre fila
+    por fila: el efecto se calcula aquí una sola vez por insumo.
+    """
+    if not movimientos:
+        return []
+
+    deltas = {}
+    for mov in movimientos:
+        deltas[mov.insumo_id] = deltas.get(mov.insumo_id, Decimal('0')) + delta_stock_movimiento(mov)
+
+    with transaction.atomic():
+        creados = MovimientoInventario.objects.bulk_create(movimientos)
+        aplicar_deltas_stock(deltas)
+    return creados
+
+
+def cerrar_lote(movimientos):
+    """
+    Producción y cargas no tienen un documento propio: todos los movimientos
+    (ya guardados) del lote se identifican con el id del primero.
+    """
+    if not movimientos:
+        return
+    lote_id = movimientos[0].pk
+    MovimientoInventario.objects.filter(pk__in=[mov.pk for mov in movimientos]).update(origen_id=lote_id)
+    for mov in movimientos:
+        mov.origen_id = lote_id
@@ -6,14 +6,17 @@ from django.db import models, transaction
 from django.db.models import ProtectedError, Sum
 from django.core.paginator import Paginator
 from django.urls import reverse
-from django.http import HttpResponseRedirect, HttpResponse, HttpResponseForbidden
+from django.http import HttpResponseRedirect, HttpResponseForbidden
 from django.template.loader import get_template
-from xhtml2pdf import pisa
-from decimal import Decimal
+from core.pdf import respuesta_pdf_en_cola
+from decimal import Decimal, InvalidOperation
 
 from .models import Insumo, MovimientoInventario, CategoriaInsumo, IngredienteCompuesto, ConsumoInterno
 from .forms import InsumoForm, ComponenteForm, MovimientoInventarioForm, ProduccionForm
+from .utils_stock import cerrar_lote
+from .importar_stock import ArchivoInvalido, analizar_archivo, vista_previa, aplicar_carga
 from tables.models import PrecioExtra
+from tables.costos import crea_ciclo, recalcular_costos
 from tables.utils_impresora import imprimir_consumo_interno
 
 @never_cache
@@ -99,14 +102,16 @@ def add_movement(request):
         costo_total_movimiento = abs(cantidad_real_gramos * insumo.costo_unitario)
 
         try:
-            MovimientoInventario.objects.create(
+            movimiento = MovimientoInventario.objects.create(
                 insumo=insumo,
                 tipo=tipo,
                 cantidad=cantidad_real_gramos, 
                 usuario=request.user if request.user.is_authenticated else None,
                 nota=f"{nota} (Carga directa: {cantidad_ingresada:g} {insumo.unidad.codigo})",
-                costo_unitario_movimiento=costo_total_movimiento 
+                costo_unitario_movimiento=costo_total_movimiento,
+                origen_tipo='CARGA'
             )
+            cerrar_lote([movimiento])
             messages.success(request, f"Movimiento registrado correctamente.")
         except Exception as e:
             messages.error(request, f"Error: {e}")
@@ -151,13 +156,18 @@ def insumo_composition(request, insumo_id):
         if hijo_id and cantidad:
             try:
                 insumo_hijo = Insumo.objects.get(id=hijo_id)
-                IngredienteCompuesto.objects.create(
-                    insumo_padre=insumo_padre,
-                    insumo_hijo=insumo_hijo,
-                    cantidad=cantidad
-                )
-                # FORZAMOS RE-CALCULO INMEDIATO
-                insumo_padre.calcular_costo_desde_subreceta()
+                # Una receta no puede llevarse a sí misma (ni a otra que ya la use)
+                if crea_ciclo(insumo_padre.id, insumo_hijo.id):
+                    messages.error(request, f"No se puede agregar {insumo_hijo.nombre}: esa receta ya usa a {insumo_padre.nombre}.")
+                    return redirect('insumo_composition', insumo_id=insumo_id)
+                with transaction.atomic():
+                    IngredienteCompuesto.objects.create(
+                        insumo_padre=insumo_padre,
+                        insumo_hijo=insumo_hijo,
+                        cantidad=cantidad
+                    )
+                    # FORZAMOS RE-CALCULO INMEDIATO (también de las recetas y productos que la usan)
+                    insumo_padre.calcular_costo_desde_subreceta()
                 messages.success(request, f"Agregado: {insumo_hijo.nombre}")
             except Exception as e:
                 messages.error(request, f"Error al agregar: {e}")
@@ -390,27 +400,31 @@ def insumo_produccion(request, pk):
                     return redirect('insumo_produccion', pk=pk)
 
                 # B. DESCONTAR INGREDIENTES
+                lote = []
                 for componente in ingredientes:
                     cantidad_a_descontar = componente.cantidad * factor
                     
-                    MovimientoInventario.objects.create(
+                    lote.append(MovimientoInventario.objects.create(
                         insumo=componente.insumo_hijo,
                         tipo='SALIDA',
                         cantidad=cantidad_a_descontar,
                         usuario=request.user,
-                        nota=f"Producción: {lotes} Lotes de {insumo_padre.nombre}"
-                    )
+                        nota=f"Producción: {lotes} Lotes de {insumo_padre.nombre}",
+                        origen_tipo='PRODUCCION'
+                    ))
 
                 # C. SUMAR PRODUCTO TERMINADO
-                MovimientoInventario.objects.create(
+                lote.append(MovimientoInventario.objects.create(
                     insumo=insumo_padre,
                     tipo='ENTRADA',
                     cantidad=cantidad_total_producir,
                     usuario=request.user,
                     # El costo unitario se mantiene, multiplicamos por la cantidad total producida
                     costo_unitario_movimiento=insumo_padre.costo_unitario * cantidad_total_producir, 
-                    nota=f"Producción Finalizada ({lotes} Lotes)"
-                )
+                    nota=f"Producción Finalizada ({lotes} Lotes)",
+                    origen_tipo='PRODUCCION'
+                ))
+                cerrar_lote(lote)
                 
                 messages.success(request, f"¡Listo! Se cocinaron {lotes} lotes ({cantidad_total_producir:g} {insumo_padre.unidad.codigo}).")
                 return redirect('inventory_index')
@@ -465,27 +479,31 @@ def insumo_produccion(request, pk):
                     return redirect('insumo_produccion', pk=pk)
 
                 # 2. DESCONTAR INGREDIENTES (SALIDA)
+                lote = []
                 for componente in ingredientes:
                     cantidad_a_descontar = componente.cantidad * factor
                     
-                    MovimientoInventario.objects.create(
+                    lote.append(MovimientoInventario.objects.create(
                         insumo=componente.insumo_hijo,
                         tipo='SALIDA',
                         cantidad=cantidad_a_descontar,
                         usuario=request.user,
-                        nota=f"Producción de {cantidad_a_producir} {insumo_padre.unidad.codigo} de {insumo_padre.nombre}"
-                    )
+                        nota=f"Producción de {cantidad_a_producir} {insumo_padre.unidad.codigo} de {insumo_padre.nombre}",
+                        origen_tipo='PRODUCCION'
+                    ))
 
                 # 3. SUMAR PRODUCTO TERMINADO (ENTRADA)
-                MovimientoInventario.objects.create(
+                lote.append(MovimientoInventario.objects.create(
                     insumo=insumo_padre,
                     tipo='ENTRADA',
                     cantidad=cantidad_a_producir,
                     usuario=request.user,
                     # El costo ya viene calculado en el insumo padre, pero aquí podríamos recalcularlo si quisiéramos
                     costo_unitario_movimiento=insumo_padre.costo_unitario * cantidad_a_producir, 
-                    nota=f"Producción interna (Lote cocinado)"
-                )
+                    nota=f"Producción interna (Lote cocinado)",
+                    origen_tipo='PRODUCCION'
+                ))
+                cerrar_lote(lote)
                 
                 messages.success(request, f"¡Éxito! Se produjeron {cantidad_a_producir} {insumo_padre.unidad.codigo} de {insumo_padre.nombre}. Ingredientes descontados.")
                 return redirect('inventory_index')
@@ -539,22 +557,24 @@ def insumo_produccion(request, pk):
                 try:
                     with transaction.atomic():
                         # A) RESTAR INGREDIENTES
+                        lote = []
                         for comp in componentes:
                             cantidad_descontar = comp.cantidad * lotes
                             
-                            MovimientoInventario.objects.create(
+                            lote.append(MovimientoInventario.objects.create(
                                 insumo=comp.insumo_hijo,
                                 tipo='SALIDA',
                                 cantidad=cantidad_descontar,
                                 unidad_movimiento=comp.insumo_hijo.unidad,
                                 usuario=request.user,
-                                nota=f"Prod. {lotes} lote(s) de {insumo_padre.nombre}"
-                            )
+                                nota=f"Prod. {lotes} lote(s) de {insumo_padre.nombre}",
+                                origen_tipo='PRODUCCION'
+                            ))
 
                         # B) SUMAR PRODUCTO TERMINADO (Peso del lote * lotes)
                         cantidad_producida = peso_por_lote * lotes
                         
-                        MovimientoInventario.objects.create(
+                        lote.append(MovimientoInventario.objects.create(
                             insumo=insumo_padre,
                             tipo='ENTRADA',
                             cantidad=cantidad_producida,
@@ -562,8 +582,10 @@ def insumo_produccion(request, pk):
                             # El costo unitario se mantiene
                             costo_unitario_movimiento=insumo_padre.costo_unitario * cantidad_producida,
                             usuario=request.user,
-                            nota=f"Producción {lotes} lote(s). {nota}"
-                        )
+                            nota=f"Producción {lotes} lote(s). {nota}",
+                            origen_tipo='PRODUCCION'
+                        ))
+                        cerrar_lote(lote)
                     
                     messages.success(request, f"¡Listo! Se agregaron {cantidad_producida:.0f}g de {insumo_padre.nombre} (x{lotes} Lotes).")
                     return redirect('inventory_index')
@@ -622,9 +644,10 @@ def insumo_produccion(request, pk):
                 try:
                     with transaction.atomic():
                         # A) RESTAR INGREDIENTES (Salidas)
+                        lote = []
                         for comp in componentes:
                             cantidad_descontar = comp.cantidad * cantidad_producir
-                            MovimientoInventario.objects.create(
+                            lote.append(MovimientoInventario.objects.create(
                                 insumo=comp.insumo_hijo,
                                 tipo='SALIDA',
                                 cantidad=cantidad_descontar,
@@ -633,19 +656,22 @@ def insumo_produccion(request, pk):
                                 # Para simplificar, dejamos unidad_movimiento en None (Factor 1) o buscamos la unidad base.
                                 unidad_movimiento=comp.insumo_hijo.unidad, 
                                 usuario=request.user,
-                                nota=f"Prod. {insumo_padre.nombre} (ID: {insumo_padre.id})"
-                            )
+                                nota=f"Prod. {insumo_padre.nombre} (ID: {insumo_padre.id})",
+                                origen_tipo='PRODUCCION'
+                            ))
 
                         # B) SUMAR PRODUCTO TERMINADO (Entrada)
-                        MovimientoInventario.objects.create(
+                        lote.append(MovimientoInventario.objects.create(
                             insumo=insumo_padre,
                             tipo='ENTRADA',
                             cantidad=cantidad_producir,
                             unidad_movimiento=insumo_padre.unidad,
                             costo_unitario_movimiento=insumo_padre.costo_unitario * cantidad_producir, # Valor total
                             usuario=request.user,
-                            nota=f"Producción Interna. {nota}"
-                        )
+                            nota=f"Producción Interna. {nota}",
+                            origen_tipo='PRODUCCION'
+                        ))
+                        cerrar_lote(lote)
                     
                     messages.success(request, f"¡Producción exitosa! Se han creado {cantidad_producir} {insumo_padre.unidad.codigo} de {insumo_padre.nombre}.")
                     return redirect('inventory_index')
@@ -735,7 +761,9 @@ def salidas_especiales_view(request):
                             cantidad=componente.cantidad,
                             unidad_movimiento=componente.insumo.unidad,
                             usuario=request.user,
-                            nota=f"Base Personal #{registro.id}"
+                            nota=f"Base Personal #{registro.id}",
+                            origen_tipo='CONSUMO',
+                            origen_id=registro.id
                         )
                         costo_total_operacion += (componente.insumo.costo_unitario * componente.cantidad)
 
@@ -761,7 +789,9 @@ def salidas_especiales_view(request):
                                 cantidad=cantidad,
                                 unidad_movimiento=insumo_extra.unidad,
                                 usuario=request.user,
-                                nota=f"Extra Personal #{registro.id}"
+                                nota=f"Extra Personal #{registro.id}",
+                                origen_tipo='CONSUMO',
+                                origen_id=registro.id
                             )
                             costo_total_operacion += (insumo_extra.costo_unitario * cantidad)
 
@@ -789,7 +819,9 @@ def salidas_especiales_view(request):
                             cantidad=ing.cantidad,
                             unidad_movimiento=ing.insumo.unidad,
                             usuario=request.user,
-                            nota=f"Regalo #{registro.id}"
+                            nota=f"Regalo #{registro.id}",
+                            origen_tipo='CONSUMO',
+                            origen_id=registro.id
                         )
                         costo_total_operacion += (ing.insumo.costo_unitario * ing.cantidad)
 
@@ -846,7 +878,7 @@ def generar_comanda_interno_pdf(request, consumo_id):
 
     if consumo.tipo == 'PERSONAL':
         movimientos_extra = MovimientoInventario.objects.filter(
-            nota=f"Extra Personal #{consumo.id}"
+            origen_tipo='CONSUMO', origen_id=consumo.id, nota=f"Extra Personal #{consumo.id}"
         )
         context['extras'] = movimientos_extra
     
@@ -855,14 +887,7 @@ def generar_comanda_interno_pdf(request, consumo_id):
     template = get_template(template_path)
     html = template.render(context)
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename="comanda_interna_{consumo.id}.pdf"'
-
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    if pisa_status.err:
-        return HttpResponse('Error al generar PDF', status=500)
-    
-    return response
+    return respuesta_pdf_en_cola(request, html, f"comanda_interna_{consumo.id}.pdf")
 
 from .forms import RecetaInsumoForm # Importa el formulario nuevo
 
@@ -896,10 +921,7 @@ def anular_consumo_interno(request, consumo_id):
             with transaction.atomic():
                 # Buscar todos los movimientos de inventario que generó esta salida
                 movimientos = MovimientoInventario.objects.filter(
-                    models.Q(nota=f"Base Personal #{consumo.id}") |
-                    models.Q(nota=f"Extra Personal #{consumo.id}") |
-                    models.Q(nota=f"Regalo #{consumo.id}") |
-                    models.Q(nota=f"Personal #{consumo.id}")
+                    origen_tipo='CONSUMO', origen_id=consumo.id, tipo='SALIDA'
                 )
 
                 # Devolver el inventario (Generar Entradas)
@@ -910,7 +932,9 @@ def anular_consumo_interno(request, consumo_id):
                         cantidad=mov.cantidad,
                         unidad_movimiento=mov.unidad_movimiento,
                         usuario=request.user,
-                        nota=f"ANULACIÓN Salida #{consumo.id}"
+                        nota=f"ANULACIÓN Salida #{consumo.id}",
+                        origen_tipo='CONSUMO',
+                        origen_id=consumo.id
                     )
                 
                 # Marcar el registro visualmente como anulado
@@ -923,54 +947,98 @@ def anular_consumo_interno(request, consumo_id):
             
     return redirect('salidas_especiales')
 
+# Carga desde archivo (ver inventory/importar_stock.py): la vista previa queda en
+# la sesión hasta que se confirma
+TIPOS_CARGA = [
+    ('ENTRADA', 'Compra / Factura de proveedor (suma al stock)'),
+    ('AJUSTE', 'Conteo físico (el stock queda en lo contado)'),
+]
+SESION_CARGA = 'carga_inventario'
+
 @staff_member_required
 @never_cache
 def carga_masiva_inventario(request):
     # Traemos todos los insumos base (excluyendo recetas) ordenados por categoría y nombre
-    insumos = Insumo.objects.filter(es_insumo_compuesto=False).order_by('categoria__nombre', 'nombre')
+    insumos = Insumo.objects.filter(es_insumo_compuesto=False).select_related('categoria', 'unidad').order_by('categoria__nombre', 'nombre')
+    contexto = {'insumos': insumos, 'tipos_carga': TIPOS_CARGA}
 
     if request.method == 'POST':
-        nota_general = request.POST.get('nota_general', 'Carga Masiva de Inventario')
-        movimientos_creados = 0
+        accion = request.POST.get('accion', 'formulario')
+
+        # --- ARCHIVO, PASO 1: leer y mostrar qué va a cambiar (no se guarda nada) ---
+        if accion == 'analizar':
+            archivo = request.FILES.get('archivo')
+            tipo = request.POST.get('tipo_carga', 'ENTRADA')
+            if not archivo or tipo not in dict(TIPOS_CARGA):
+                messages.error(request, "Seleccione el archivo y el tipo de carga.")
+                return redirect('carga_masiva_inventario')
+            try:
+                resultado = analizar_archivo(archivo, archivo.name, tipo)
+            except ArchivoInvalido as e:
+                messages.error(request, str(e))
+                return redirect('carga_masiva_inventario')
+
+            nota = request.POST.get('nota_general') or 'Carga de Inventario'
+            request.session[SESION_CARGA] = {
+                'tipo': tipo,
+                'nota': f"{nota} (Archivo: {archivo.name})"[:255],
+                'cantidades': {str(pk): str(cantidad) for pk, cantidad in resultado['cantidades'].items()},
+            }
+            contexto.update({
+                'previa': vista_previa(resultado['cantidades'], tipo),
+                'tipo_carga': tipo,
+                'tipo_carga_nombre': dict(TIPOS_CARGA)[tipo],
+                'archivo': archivo.name,
+                'lineas': resultado['lineas'],
+                'errores': resultado['errores'],
+                'total_errores': resultado['total_errores'],
+                'errores_ocultos': resultado['total_errores'] - len(resultado['errores']),
+            })
+            return render(request, 'inventory/carga_masiva.html', contexto)
+
+        # --- ARCHIVO, PASO 2: confirmar o descartar la vista previa ---
+        if accion in ('confirmar', 'cancelar'):
+            carga = request.session.pop(SESION_CARGA, None)
+            if accion == 'cancelar':
+                messages.info(request, "Carga descartada. No se hicieron cambios.")
+                return redirect('carga_masiva_inventario')
+            if not carga:
+                messages.error(request, "La vista previa expiró. Vuelva a subir el archivo.")
+                return redirect('carga_masiva_inventario')
+            cantidades = {int(pk): Decimal(cantidad) for pk, cantidad in carga['cantidades'].items()}
+            tipo, nota = carga['tipo'], carga['nota']
+
+        # --- FORMULARIO: una casilla por insumo, siempre ENTRADA ---
+        else:
+            nota_general = request.POST.get('nota_general', 'Carga Masiva de Inventario')
+            tipo, nota = 'ENTRADA', f"{nota_general} (Carga Masiva)"
+            cantidades = {}
+            for insumo in insumos:
+                # Buscamos en el POST el campo correspondiente a este insumo
+                cantidad_str = request.POST.get(f'cantidad_insumo_{insumo.id}')
+                if cantidad_str:
+                    try:
+                        cantidad = Decimal(cantidad_str)
+                    except InvalidOperation:
+                        cantidad = Decimal('0')
+                    if cantidad > 0:
+                        cantidades[insumo.id] = cantidad
 
         try:
-            with transaction.atomic():
-                for insumo in insumos:
-                    # Buscamos en el POST el campo correspondiente a este insumo
-                    cantidad_str = request.POST.get(f'cantidad_insumo_{insumo.id}')
-                    
-                    if cantidad_str:
-                        try:
-                            cantidad = Decimal(cantidad_str)
-                        except:
-                            cantidad = Decimal('0')
-
-                        if cantidad > 0:
-                            # Costo de la entrada basado en su costo unitario actual
-                            costo_total_movimiento = cantidad * insumo.costo_unitario
-                            MovimientoInventario.objects.create(
-                                insumo=insumo,
-                                tipo='ENTRADA',
-                                cantidad=cantidad,
-                                usuario=request.user,
-                                nota=f"{nota_general} (Carga Masiva)",
-                                costo_unitario_movimiento=costo_total_movimiento
-                            )
-                            movimientos_creados += 1
-                            
-                if movimientos_creados > 0:
-                    messages.success(request, f"¡Carga exitosa! Se ingresó stock a {movimientos_creados} insumos.")
-                else:
-                    messages.warning(request, "No se ingresó ninguna cantidad mayor a 0. No se hicieron cambios.")
-                
-                return redirect('inventory_index')
-
+            movimientos = aplicar_carga(cantidades, tipo, request.user, nota)
         except Exception as e:
             messages.error(request, f"Error durante la carga masiva: {str(e)}")
+        else:
+            if not movimientos:
+                messages.warning(request, "No se ingresó ninguna cantidad mayor a 0. No se hicieron cambios." if tipo == 'ENTRADA'
+                                 else "El conteo coincide con el stock actual. No se hicieron cambios.")
+            elif tipo == 'ENTRADA':
+                messages.success(request, f"¡Carga exitosa! Se ingresó stock a {len(movimientos)} insumos.")
+            else:
+                messages.success(request, f"¡Ajuste exitoso! Se corrigió el stock de {len(movimientos)} insumos según el conteo.")
+            return redirect('inventory_index')
 
-    return render(request, 'inventory/carga_masiva.html', {
-        'insumos': insumos
-    })
+    return render(request, 'inventory/carga_masiva.html', contexto)
 
 @staff_member_required
 @never_cache
@@ -996,10 +1064,8 @@ def eliminacion_masiva_receta(request):
                     insumo_hijo_id__in=ingredientes_ids
                 ).delete()
 
-                # Forzamos el recálculo del costo de las recetas afectadas
-                for receta_id in recetas_ids:
-                    receta = Insumo.objects.get(id=receta_id)
-                    receta.calcular_costo_desde_subreceta()
+                # Forzamos el recálculo del costo de las recetas afectadas (y de lo que las usa)
+                recalcular_costos(insumo_ids=[int(receta_id) for receta_id in recetas_ids])
 
                 if eliminados > 0:
                     messages.success(request, f"¡Éxito! Se eliminaron {eliminados} ingredientes de las recetas seleccionadas.")
@@ -90,9 +90,77 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reutilizamos la conexión entre peticiones (se verifica antes de usarla)
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # busy_timeout: segundos que una conexión espera a que otra termine de escribir
+            'timeout': 20,
+            # Las transacciones toman el permiso de escritura al empezar: evita el
+            # "database is locked" inmediato cuando dos ventas escriben a la vez
+            'transaction_mode': 'IMMEDIATE',
+            # WAL: las lecturas (reportes) no bloquean a la caja mientras se escribe
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+        # Las pruebas usan un archivo (no la BD en memoria) para que las de
+        # concurrencia corran con WAL y busy_timeout como en la caja
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+# Si aun así la BD está ocupada, las vistas de la caja repiten la operación
+BD_REINTENTOS = 3
+BD_ESPERA_REINTENTO = 0.1
+
+# Caché compartida entre los procesos del servidor (configuración, tasas, etc.)
+# Se usa archivo para que todos los workers vean lo mismo sin instalar Redis/Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache_django',
+        'TIMEOUT': 300,
     }
 }
 
+# Segundos que vive en caché la Configuración general (se invalida al guardarla)
+CONFIGURACION_CACHE_TTL = 300
+
+# --- TASA BCV ---
+# Página de donde se lee la tasa y cada cuántos segundos se vuelve a consultar
+BCV_URL = 'https://www.bcv.org.ve'
+BCV_INTERVALO_ACTUALIZACION = 3600
+
+# --- COLA DE IMPRESIÓN ---
+# Reintentos de un ticket si la impresora no responde (espera 2s, 4s, 8s... hasta 60s)
+IMPRESION_MAX_INTENTOS = 5
+IMPRESION_ESPERA_BASE = 2
+IMPRESION_ESPERA_MAXIMA = 60
+# Cuántas impresoras se atienden a la vez
+IMPRESION_MAX_HILOS = 4
+# Retomar al arrancar los tickets que quedaron en la fila. Solo en el proceso
+# que atiende la caja: COLA_IMPRESION_AUTOARRANQUE=1 en el entorno del servidor
+COLA_IMPRESION_AUTOARRANQUE = os.environ.get('COLA_IMPRESION_AUTOARRANQUE') == '1'
+
+# --- PDF DE FACTURAS ---
+# Carpeta donde se guardan las facturas ya generadas (no debe ser pública como MEDIA)
+FACTURAS_PDF_DIR = BASE_DIR / 'facturas_pdf'
+
+# --- GENERACIÓN DE PDF EN SEGUNDO PLANO ---
+# Procesos que generan PDF a la vez y cuánto duran (segundos) los PDF generados para descargar
+PDF_MAX_WORKERS = 2
+PDF_TRABAJOS_DIR = BASE_DIR / 'pdf_trabajos'
+PDF_TRABAJOS_TTL = 3600
+
+# --- TURNOS DE CAJA ---
+# (nombre, hora local de inicio). Cada venta se resume en el último turno que ya había empezado.
+TURNOS_CAJA = [('DIA', 0), ('NOCHE', 16)]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -169,4 +237,10 @@ SESSION_COOKIE_AGE = 36000
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 # Cada vez que el usuario hace una petición, el contador de inactividad se reinicia.
-SESSION_SAVE_EVERY_REQUEST = True
\ No newline at end of file
+SESSION_SAVE_EVERY_REQUEST = True
+
+# --- FORMULARIOS GRANDES ---
+# Los cambios masivos (recetas y costos) mandan un campo por producto marcado y
+# la tabla de precios de extras dos por extra y tamaño: el límite de Django
+# (1000 campos) se queda corto con un catálogo grande.
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
@@ -0,0 +1,115 @@
+import csv
+import tempfile
+from decimal import Decimal
+from django.http import FileResponse, StreamingHttpResponse
+
+# ==========================================
+#  EXPORTACIÓN DE REPORTES (CSV / EXCEL)
+# ==========================================
+# Los reportes se mandan mientras se generan: la vista entrega un generador de
+# filas (idealmente sobre queryset.iterator()) y aquí se escriben por bloques,
+# sin armar el archivo completo en memoria.
+#
+# Las columnas son (título, decimales): decimales=None para texto y un número
+# para montos, que en CSV salen con coma decimal (Excel en español) y en XLSX
+# como números de verdad.
+
+FILAS_POR_BLOQUE = 500
+
+
+def en_bloques(iterable, tamano):
+    """ Agrupa un iterable en listas de tamano elementos (la última puede ser menor) """
+    bloque = []
+    for elemento in iterable:
+        bloque.append(elemento)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+class _Eco:
+    """ "Archivo" para csv.writer que devuelve la línea en lugar de guardarla """
+    def write(self, valor):
+        return valor
+
+
+def _texto_csv(valor, decimales):
+    if valor is None:
+        return ''
+    if decimales is not None:
+        return f"{float(valor):.{decimales}f}".replace('.', ',')
+    return valor
+
+
+def _lineas_csv(columnas, filas, delimitador):
+    escritor = csv.writer(_Eco(), delimiter=delimitador)
+    decimales = [dec for _, dec in columnas]
+    # BOM UTF-8 para que Excel detecte los acentos
+    bloque = ['\ufeff' + escritor.writerow([titulo for titulo, _ in columnas])]
+    for fila in filas:
+        bloque.append(escritor.writerow([_texto_csv(valor, dec) for valor, dec in zip(fila, decimales)]))
+        if len(bloque) >= FILAS_POR_BLOQUE:
+            yield ''.join(bloque)
+            bloque = []
+    if bloque:
+        yield ''.join(bloque)
+
+
+def respuesta_csv(nombre_archivo, columnas, filas, delimitador=';'):
+    response = StreamingHttpResponse(_lineas_csv(columnas, filas, delimitador), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}.csv"'
+    return response
+
+
+def xlsx_disponible():
+    try:
+        import openpyxl  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def formato_exportar():
+    """ Formato del botón "Excel" de los reportes: xlsx si se puede, si no csv """
+    return 'xlsx' if xlsx_disponible() else 'csv'
+
+
+def respuesta_xlsx(nombre_archivo, columnas, filas, titulo_hoja='Reporte'):
+    """
+    Excel con openpyxl en modo write_only (memoria constante: las filas van a
+    un temporal en disco). El .xlsx es un zip, así que se termina de escribir
+    y luego se manda el archivo por partes.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(titulo_hoja[:31])
+    hoja.append([titulo for titulo, _ in columnas])
+    decimales = [dec for _, dec in columnas]
+    for fila in filas:
+        hoja.append([
+            float(valor) if dec is not None and isinstance(valor, (Decimal, float, int)) else valor
+            for valor, dec in zip(fila, decimales)
+        ])
+
+    temporal = tempfile.TemporaryFile(suffix='.xlsx')
+    libro.save(temporal)
+    temporal.seek(0)
+    return FileResponse(
+        temporal,
+        as_attachment=True,
+        filename=f"{nombre_archivo}.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+def respuesta_exportar(formato, nombre_archivo, columnas, filas, titulo_hoja='Reporte'):
+    """
+    Respuesta de descarga para cualquier reporte: formato 'xlsx' (si openpyxl
+    está instalado) o 'csv'. filas es un iterable de listas en el orden de columnas.
+    """
+    if formato == 'xlsx' and xlsx_disponible():
+        return respuesta_xlsx(nombre_archivo, columnas, filas, titulo_hoja)
+    return respuesta_csv(nombre_archivo, columnas, filas)
@@ -6,14 +6,13 @@ from django.db.models import F, ExpressionWrapper, DecimalField
 from inventory.models import Insumo
 from core.models import Configuracion
 import datetime
-from io import BytesIO
-from xhtml2pdf import pisa
+from core.pdf import renderizar_pdf
 
 class Command(BaseCommand):
     help = 'Genera PDF de alertas de stock y lo envía por correo'
 
     def handle(self, *args, **options):
-        config = Configuracion.get_solo()
+        config = Configuracion.get_cached()
         
         if not config.enviar_alerta_stock_correo or not config.correo_destino_alertas:
             self.stdout.write(self.style.WARNING('Las alertas automáticas por correo están desactivadas o no hay correo configurado.'))
@@ -41,12 +40,11 @@ class Command(BaseCommand):
             }
             html_string = render_to_string('reports/pdf_alerta.html', context)
 
-            # 3. Convertir HTML a PDF en memoria (BytesIO)
+            # 3. Convertir HTML a PDF en memoria (en un proceso aparte del servicio de PDF)
             # Esto evita tener que guardar el archivo en el disco duro
-            pdf_file = BytesIO()
-            pisa_status = pisa.CreatePDF(html_string, dest=pdf_file)
-
-            if pisa_status.err:
+            try:
+                pdf_bytes = renderizar_pdf(html_string)
+            except Exception:
                 self.stdout.write(self.style.ERROR('Error generando el PDF'))
                 return
 
@@ -65,16 +63,13 @@ class Command(BaseCommand):
 
             # Adjuntar el PDF desde la memoria
             # nombre_archivo, contenido, tipo_mime
-            email.attach('Alerta_Stock.pdf', pdf_file.getvalue(), 'application/pdf')
+            email.attach('Alerta_Stock.pdf', pdf_bytes, 'application/pdf')
 
             try:
                 email.send()
                 self.stdout.write(self.style.SUCCESS(f'✅ Correo con PDF enviado exitosamente ({insumos_criticos.count()} items).'))
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'❌ Error enviando correo: {e}'))
-            
-            # Cerrar el archivo en memoria
-            pdf_file.close()
 
         else:
             self.stdout.write(self.style.SUCCESS('Inventario OK. No se generó reporte.'))
\ No newline at end of file
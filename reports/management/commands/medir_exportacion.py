@@ -0,0 +1,76 @@
+import time
+import tracemalloc
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from reports.exportar import respuesta_exportar, xlsx_disponible
+from reports.views import COLUMNAS_VENTAS_DETALLE, _filas_ventas_detalle
+from tables.models import Venta, DetalleVenta, Pago
+
+
+class _Deshacer(Exception):
+    """ Sale del atomic() para que no quede nada de los datos de prueba """
+
+
+class Command(BaseCommand):
+    help = ('Mide la exportación del detalle de ventas (CSV y, si está openpyxl, XLSX): tiempo hasta el primer '
+            'bloque, tiempo total, consultas y memoria máxima. Las ventas se crean dentro de una transacción '
+            'que se deshace al final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ventas', type=int, default=50000, help='Ventas a exportar (50000 por defecto)')
+        parser.add_argument('--lineas', type=int, default=3, help='Productos por venta (3 por defecto)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._datos(options['ventas'], options['lineas'])
+                self.stdout.write(f"{options['ventas']} ventas, {options['lineas']} productos y 2 pagos por venta")
+                for formato in ('csv', 'xlsx') if xlsx_disponible() else ('csv',):
+                    self._medir(formato)
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+    def _datos(self, ventas, lineas):
+        mesero = User.objects.create(username='medicion-exportacion')
+        creadas = Venta.objects.bulk_create([
+            Venta(codigo_factura=f"MEDEXP{i:08d}", total=Decimal('25.50'), metodo_pago='MIXTO', mesero=mesero, mesa_numero=i % 30,
+                  monto_recibido=Decimal('25.50'), propina=Decimal('1.25'), anulada=(i % 50 == 0))
+            for i in range(ventas)
+        ], batch_size=2000)
+        DetalleVenta.objects.bulk_create([
+            DetalleVenta(venta=venta, nombre_producto=f"Pizza {j}", cantidad=1, precio_unitario=Decimal('8.50'), subtotal=Decimal('8.50'))
+            for venta in creadas for j in range(lineas)
+        ], batch_size=2000)
+        Pago.objects.bulk_create([
+            pago for venta in creadas for pago in (
+                Pago(venta=venta, metodo='EFECTIVO_USD', monto=Decimal('10.00')),
+                Pago(venta=venta, metodo='PUNTO', monto=Decimal('16.75'), referencia='0042'),
+            )
+        ], batch_size=2000)
+
+    def _medir(self, formato):
+        ventas = Venta.objects.filter(codigo_factura__startswith='MEDEXP').select_related('mesero').order_by('-fecha')
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        primer_bloque = None
+        tamano = 0
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = respuesta_exportar(formato, 'medicion', COLUMNAS_VENTAS_DETALLE, _filas_ventas_detalle(ventas))
+            for bloque in respuesta.streaming_content:
+                if primer_bloque is None:
+                    primer_bloque = time.perf_counter() - inicio
+                tamano += len(bloque)
+            # close() dispara request_finished, que cerraría la conexión en plena transacción
+            if getattr(respuesta, 'file_to_stream', None):
+                respuesta.file_to_stream.close()
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"  {formato.upper():<4} primer bloque {primer_bloque:.2f} s, total {segundos:.2f} s, {len(consultas)} consultas, "
+            f"{tamano / 1024 / 1024:.1f} MB, memoria máxima {pico / 1024 / 1024:.1f} MB"
+        )
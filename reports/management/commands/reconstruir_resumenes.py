@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from reports.resumenes import reconstruir_resumenes
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los resúmenes diarios de ventas (cuadre y reportes) a partir de las ventas guardadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer día a recalcular (YYYY-MM-DD). Sin fechas se recalcula todo el historial.')
+        parser.add_argument('--hasta', help='Último día a recalcular (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        fechas = {}
+        for opcion in ('desde', 'hasta'):
+            if options[opcion]:
+                fechas[opcion] = parse_date(options[opcion])
+                if fechas[opcion] is None:
+                    raise CommandError(f"Fecha inválida en --{opcion}: {options[opcion]}")
+
+        turnos = reconstruir_resumenes(fechas.get('desde'), fechas.get('hasta'))
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes recalculados: {turnos} turno(s) con ventas.'))
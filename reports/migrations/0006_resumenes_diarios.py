@@ -0,0 +1,164 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Copia congelada del cálculo de reports.resumenes (aportes_venta): la migración
+# no debe cambiar si más adelante cambia el código de la aplicación.
+CERO = Decimal('0')
+CAMPOS_DIA = [
+    'ventas', 'total', 'total_bs', 'total_sin_tasa', 'propina', 'propina_bs', 'propina_sin_tasa',
+    'ventas_cashea', 'cashea_financiado', 'cashea_financiado_bruto',
+]
+CAMPOS_PAGO = [
+    'monto', 'monto_bs', 'monto_sin_tasa', 'transacciones', 'asignado', 'asignado_bs', 'asignado_sin_tasa',
+]
+
+
+def _fila_vacia(campos):
+    return {campo: 0 if campo in ('ventas', 'transacciones') else CERO for campo in campos}
+
+
+def _clave(fecha):
+    turnos = getattr(settings, 'TURNOS_CAJA', [('DIA', 0)])
+    local = timezone.localtime(fecha)
+    turno = turnos[0][0]
+    for nombre, inicio in turnos:
+        if local.hour >= inicio:
+            turno = nombre
+    return local.date(), turno
+
+
+def _dec(valor):
+    return Decimal(str(valor or 0))
+
+
+def _en_bs(monto, tasa):
+    return (monto * tasa, CERO) if tasa else (CERO, monto)
+
+
+def _aportes(venta):
+    total = _dec(venta.total)
+    propina = _dec(venta.propina)
+    tasa = _dec(venta.tasa_aplicada) if venta.tasa_aplicada and venta.tasa_aplicada > 0 else None
+    pagos = sorted(venta.pagos.all(), key=lambda p: p.pk)
+
+    dia = {'ventas': 1, 'total': total, 'propina': propina}
+    dia['total_bs'], dia['total_sin_tasa'] = _en_bs(total, tasa)
+    dia['propina_bs'], dia['propina_sin_tasa'] = _en_bs(propina, tasa)
+    dia['ventas_cashea'] = dia['cashea_financiado'] = dia['cashea_financiado_bruto'] = CERO
+
+    montos_cashea = [_dec(p.monto) for p in pagos if p.metodo == 'CASHEA']
+    if montos_cashea:
+        dia['ventas_cashea'] = total
+        pago_inicial = max(CERO, sum(montos_cashea) - propina)
+        dia['cashea_financiado'] = max(CERO, total - pago_inicial)
+        dia['cashea_financiado_bruto'] = total - montos_cashea[0]
+
+    metodos = {}
+    if pagos:
+        restante = total + propina
+        for pago in sorted(pagos, key=lambda p: 1 if 'EFECTIVO' in p.metodo else 0):
+            monto = _dec(pago.monto)
+            asignado = min(monto, restante)
+            fila = metodos.setdefault(pago.metodo, _fila_vacia(CAMPOS_PAGO))
+            fila['monto'] += monto
+            bs, sin_tasa = _en_bs(monto, tasa)
+            fila['monto_bs'] += bs
+            fila['monto_sin_tasa'] += sin_tasa
+            if asignado > 0:
+                fila['transacciones'] += 1
+                fila['asignado'] += asignado
+                bs, sin_tasa = _en_bs(asignado, tasa)
+                fila['asignado_bs'] += bs
+                fila['asignado_sin_tasa'] += sin_tasa
+                restante -= asignado
+    else:
+        fila = metodos.setdefault(venta.metodo_pago, _fila_vacia(CAMPOS_PAGO))
+        asignado = total + propina
+        fila['transacciones'] += 1
+        fila['asignado'] += asignado
+        fila['asignado_bs'], fila['asignado_sin_tasa'] = _en_bs(asignado, tasa)
+    return dia, metodos
+
+
+def llenar_resumenes(apps, schema_editor):
+    Venta = apps.get_model('tables', 'Venta')
+    ResumenVentaDiaria = apps.get_model('reports', 'ResumenVentaDiaria')
+    ResumenPagoDiario = apps.get_model('reports', 'ResumenPagoDiario')
+
+    resumen_dias = {}
+    resumen_pagos = {}
+    for venta in Venta.objects.filter(anulada=False).prefetch_related('pagos').iterator(chunk_size=2000):
+        fecha, turno = _clave(venta.fecha)
+        dia, metodos = _aportes(venta)
+        acumulado = resumen_dias.setdefault((fecha, turno), _fila_vacia(CAMPOS_DIA))
+        for campo, valor in dia.items():
+            acumulado[campo] += valor
+        for metodo, valores in metodos.items():
+            acumulado = resumen_pagos.setdefault((fecha, turno, metodo), _fila_vacia(CAMPOS_PAGO))
+            for campo, valor in valores.items():
+                acumulado[campo] += valor
+
+    ResumenVentaDiaria.objects.bulk_create(
+        [ResumenVentaDiaria(fecha=fecha, turno=turno, **valores) for (fecha, turno), valores in resumen_dias.items()],
+        batch_size=500,
+    )
+    ResumenPagoDiario.objects.bulk_create(
+        [ResumenPagoDiario(fecha=fecha, turno=turno, metodo=metodo, **valores)
+         for (fecha, turno, metodo), valores in resumen_pagos.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_auditoriaconfiguracion_accion_detalle'),
+        ('tables', '0028_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenPagoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('turno', models.CharField(max_length=20)),
+                ('metodo', models.CharField(max_length=20)),
+                ('monto', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('monto_bs', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('monto_sin_tasa', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('transacciones', models.IntegerField(default=0)),
+                ('asignado', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('asignado_bs', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('asignado_sin_tasa', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+            ],
+            options={
+                'unique_together': {('fecha', 'turno', 'metodo')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenVentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('turno', models.CharField(max_length=20)),
+                ('ventas', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('total_bs', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('total_sin_tasa', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('propina', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('propina_bs', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('propina_sin_tasa', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('ventas_cashea', models.DecimalField(decimal_places=4, default=0, help_text='Total de las ventas con algún pago Cashea', max_digits=14)),
+                ('cashea_financiado', models.DecimalField(decimal_places=4, default=0, help_text='Lo que financia Cashea, descontando la propina (cuadre)', max_digits=14)),
+                ('cashea_financiado_bruto', models.DecimalField(decimal_places=4, default=0, help_text='Total menos el primer pago Cashea (reporte de ventas)', max_digits=14)),
+            ],
+            options={
+                'unique_together': {('fecha', 'turno')},
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0006_resumenes_diarios'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='resumenpagodiario',
+            name='monto',
+        ),
+        migrations.RemoveField(
+            model_name='resumenpagodiario',
+            name='monto_bs',
+        ),
+        migrations.RemoveField(
+            model_name='resumenpagodiario',
+            name='monto_sin_tasa',
+        ),
+        migrations.RemoveField(
+            model_name='resumenventadiaria',
+            name='cashea_financiado',
+        ),
+    ]
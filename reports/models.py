@@ -30,4 +30,56 @@ class AuditoriaConfiguracion(models.Model):
         ordering = ['-fecha']
 
     def __str__(self):
-        return f"{self.fecha.strftime('%d/%m/%Y %H:%M')} - {self.accion}"
\ No newline at end of file
+        return f"{self.fecha.strftime('%d/%m/%Y %H:%M')} - {self.accion}"
+
+# ==========================================
+#  RESÚMENES DIARIOS DE VENTAS
+# ==========================================
+# Totales de las ventas válidas por (día local, turno). Se actualizan en la
+# misma transacción que factura o anula la venta, así los reportes suman unas
+# pocas filas por día en lugar de recorrer cada venta. (El cuadre de caja lee
+# directo de las ventas y los pagos: caja/totales.py.)
+# Los montos en Bs se guardan ya convertidos con la tasa de cada venta; las
+# ventas viejas sin tasa se acumulan aparte en USD (*_sin_tasa) y se convierten
+# al leer con la tasa del momento, igual que hacían los reportes.
+# Si algo se desfasa: python manage.py reconstruir_resumenes
+
+class ResumenVentaDiaria(models.Model):
+    fecha = models.DateField()
+    turno = models.CharField(max_length=20)
+
+    ventas = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    total_bs = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    total_sin_tasa = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    propina = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    propina_bs = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    propina_sin_tasa = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    # --- CASHEA ---
+    ventas_cashea = models.DecimalField(max_digits=14, decimal_places=4, default=0, help_text="Total de las ventas con algún pago Cashea")
+    cashea_financiado_bruto = models.DecimalField(max_digits=14, decimal_places=4, default=0, help_text="Total menos el primer pago Cashea (reporte de ventas)")
+
+    class Meta:
+        unique_together = ('fecha', 'turno')
+
+    def __str__(self):
+        return f"{self.fecha:%d/%m/%Y} {self.turno}: {self.ventas} ventas"
+
+
+class ResumenPagoDiario(models.Model):
+    fecha = models.DateField()
+    turno = models.CharField(max_length=20)
+    metodo = models.CharField(max_length=20)
+
+    # Lo asignado a la venta (total + propina, sin el vuelto): reporte por método de pago
+    transacciones = models.IntegerField(default=0)
+    asignado = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    asignado_bs = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    asignado_sin_tasa = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    class Meta:
+        unique_together = ('fecha', 'turno', 'metodo')
+
+    def __str__(self):
+        return f"{self.fecha:%d/%m/%Y} {self.turno} {self.metodo}: ${self.asignado}"
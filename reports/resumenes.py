@@ -0,0 +1,207 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from core.fechas import dias, rango_dias
+from tables.models import Venta
+from .models import ResumenVentaDiaria, ResumenPagoDiario
+
+# ==========================================
+#  MANTENIMIENTO DE LOS RESÚMENES DIARIOS
+# ==========================================
+
+CERO = Decimal('0')
+
+CAMPOS_DIA = [
+    'ventas', 'total', 'total_bs', 'total_sin_tasa', 'propina', 'propina_bs', 'propina_sin_tasa',
+    'ventas_cashea', 'cashea_financiado_bruto',
+]
+CAMPOS_PAGO = ['transacciones', 'asignado', 'asignado_bs', 'asignado_sin_tasa']
+
+
+def _fila_vacia(campos):
+    return {campo: 0 if campo in ('ventas', 'transacciones') else CERO for campo in campos}
+
+
+def turno_de(fecha):
+    """ Nombre del turno (según TURNOS_CAJA) en el que cae una fecha/hora """
+    turnos = getattr(settings, 'TURNOS_CAJA', [('DIA', 0)])
+    hora = timezone.localtime(fecha).hour
+    turno = turnos[0][0]
+    for nombre, inicio in turnos:
+        if hora >= inicio:
+            turno = nombre
+    return turno
+
+
+def clave_de(fecha):
+    return timezone.localtime(fecha).date(), turno_de(fecha)
+
+
+def _dec(valor):
+    return Decimal(str(valor or 0))
+
+
+def _en_bs(monto, tasa):
+    """ (monto en Bs, monto sin tasa) según la venta tenga o no su tasa guardada """
+    return (monto * tasa, CERO) if tasa else (CERO, monto)
+
+
+def aportes_venta(venta):
+    """
+    Lo que suma una venta válida a los resúmenes: ({campo: valor} del día, {metodo: {campo: valor}}).
+    Espera los pagos precargados. Es la misma cuenta que hacían los reportes venta por venta.
+    """
+    total = _dec(venta.total)
+    propina = _dec(venta.propina)
+    tasa = _dec(venta.tasa_aplicada) if venta.tasa_aplicada and venta.tasa_aplicada > 0 else None
+    pagos = sorted(venta.pagos.all(), key=lambda p: p.pk)
+
+    dia = {'ventas': 1, 'total': total, 'propina': propina}
+    dia['total_bs'], dia['total_sin_tasa'] = _en_bs(total, tasa)
+    dia['propina_bs'], dia['propina_sin_tasa'] = _en_bs(propina, tasa)
+    dia['ventas_cashea'] = dia['cashea_financiado_bruto'] = CERO
+
+    montos_cashea = [_dec(p.monto) for p in pagos if p.metodo == 'CASHEA']
+    if montos_cashea:
+        dia['ventas_cashea'] = total
+        dia['cashea_financiado_bruto'] = total - montos_cashea[0]
+
+    metodos = {}
+
+    def sumar(metodo, asignado):
+        fila = metodos.setdefault(metodo, _fila_vacia(CAMPOS_PAGO))
+        if asignado > 0:
+            fila['transacciones'] += 1
+            fila['asignado'] += asignado
+            bs, sin_tasa = _en_bs(asignado, tasa)
+            fila['asignado_bs'] += bs
+            fila['asignado_sin_tasa'] += sin_tasa
+
+    if pagos:
+        # Electrónicos primero y el efectivo de último: si hubo vuelto, se dio en efectivo
+        restante = total + propina
+        for pago in sorted(pagos, key=lambda p: 1 if 'EFECTIVO' in p.metodo else 0):
+            monto = _dec(pago.monto)
+            asignado = min(monto, restante)
+            sumar(pago.metodo, asignado)
+            if asignado > 0:
+                restante -= asignado
+    else:
+        # Ventas viejas sin detalle de pagos: todo al método de la venta
+        fila = metodos.setdefault(venta.metodo_pago, _fila_vacia(CAMPOS_PAGO))
+        asignado = total + propina
+        fila['transacciones'] += 1
+        fila['asignado'] += asignado
+        fila['asignado_bs'], fila['asignado_sin_tasa'] = _en_bs(asignado, tasa)
+
+    return dia, metodos
+
+
+def _sumar_fila(modelo, claves, valores, signo):
+    cambios = {campo: F(campo) + valor * signo for campo, valor in valores.items() if valor}
+    if not cambios:
+        return
+    if modelo.objects.filter(**claves).update(**cambios):
+        return
+    try:
+        with transaction.atomic():
+            modelo.objects.create(**claves, **{campo: valor * signo for campo, valor in valores.items()})
+    except IntegrityError:
+        # Otra transacción creó la fila entre el UPDATE y el INSERT
+        modelo.objects.filter(**claves).update(**cambios)
+
+
+def sumar_venta(venta, signo=1):
+    """
+    Suma una venta a los resúmenes (signo=-1 la descuenta, al anularla).
+    Debe llamarse dentro de la misma transacción que factura o anula la venta.
+    """
+    venta = Venta.objects.prefetch_related('pagos').get(pk=venta.pk)
+    fecha, turno = clave_de(venta.fecha)
+    dia, metodos = aportes_venta(venta)
+    _sumar_fila(ResumenVentaDiaria, {'fecha': fecha, 'turno': turno}, dia, signo)
+    for metodo, valores in metodos.items():
+        _sumar_fila(ResumenPagoDiario, {'fecha': fecha, 'turno': turno, 'metodo': metodo}, valores, signo)
+
+
+def calcular_resumenes(ventas):
+    """
+    Acumula en memoria las ventas válidas de un queryset:
+    ({(fecha, turno): {campo: valor}}, {(fecha, turno, metodo): {campo: valor}})
+    """
+    resumen_dias = {}
+    resumen_pagos = {}
+    for venta in ventas.prefetch_related('pagos').iterator(chunk_size=2000):
+        fecha, turno = clave_de(venta.fecha)
+        dia, metodos = aportes_venta(venta)
+        acumulado = resumen_dias.setdefault((fecha, turno), _fila_vacia(CAMPOS_DIA))
+        for campo, valor in dia.items():
+            acumulado[campo] += valor
+        for metodo, valores in metodos.items():
+            acumulado = resumen_pagos.setdefault((fecha, turno, metodo), _fila_vacia(CAMPOS_PAGO))
+            for campo, valor in valores.items():
+                acumulado[campo] += valor
+    return resumen_dias, resumen_pagos
+
+
+def reconstruir_resumenes(inicio=None, fin=None):
+    """
+    Vuelve a calcular los resúmenes desde las ventas (todo el historial si no hay fechas).
+    Devuelve cuántos días/turnos quedaron con ventas.
+    """
+    ventas = Venta.objects.filter(anulada=False)
+    filas_dia = ResumenVentaDiaria.objects.all()
+    filas_pago = ResumenPagoDiario.objects.all()
+    if inicio is not None:
+        desde, _ = rango_dias(inicio)
+        ventas = ventas.filter(fecha__gte=desde)
+        filas_dia = filas_dia.filter(fecha__gte=desde.date())
+        filas_pago = filas_pago.filter(fecha__gte=desde.date())
+    if fin is not None:
+        _, hasta = rango_dias(fin)
+        ventas = ventas.filter(fecha__lt=hasta)
+        filas_dia = filas_dia.filter(fecha__lt=hasta.date())
+        filas_pago = filas_pago.filter(fecha__lt=hasta.date())
+
+    resumen_dias, resumen_pagos = calcular_resumenes(ventas)
+    with transaction.atomic():
+        filas_dia.delete()
+        filas_pago.delete()
+        ResumenVentaDiaria.objects.bulk_create(
+            [ResumenVentaDiaria(fecha=fecha, turno=turno, **valores) for (fecha, turno), valores in resumen_dias.items()],
+            batch_size=500,
+        )
+        ResumenPagoDiario.objects.bulk_create(
+            [ResumenPagoDiario(fecha=fecha, turno=turno, metodo=metodo, **valores)
+             for (fecha, turno, metodo), valores in resumen_pagos.items()],
+            batch_size=500,
+        )
+    return len(resumen_dias)
+
+
+# ==========================================
+#  LECTURA (cuadre y reportes)
+# ==========================================
+
+def a_bs(en_bs, sin_tasa, tasa_actual):
+    """ Monto en Bs de un resumen: lo ya convertido más lo que no tenía tasa, a la tasa de hoy """
+    return en_bs + sin_tasa * _dec(tasa_actual)
+
+
+def totales_ventas(inicio, fin=None):
+    """ {campo: Decimal} con la suma de los resúmenes de los días inicio..fin """
+    inicio, fin = dias(inicio, fin)
+    totales = ResumenVentaDiaria.objects.filter(fecha__gte=inicio, fecha__lte=fin).aggregate(
+        **{campo: Sum(campo) for campo in CAMPOS_DIA}
+    )
+    return {campo: valor or CERO for campo, valor in totales.items()}
+
+
+def totales_por_metodo(inicio, fin=None):
+    """ {metodo: {campo: Decimal}} con la suma de los resúmenes de pago de los días inicio..fin """
+    inicio, fin = dias(inicio, fin)
+    filas = (ResumenPagoDiario.objects.filter(fecha__gte=inicio, fecha__lte=fin)
+             .values('metodo').annotate(**{campo: Sum(campo) for campo in CAMPOS_PAGO}))
+    return {fila.pop('metodo'): {campo: valor or CERO for campo, valor in fila.items()} for fila in filas}
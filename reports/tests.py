@@ -0,0 +1,215 @@
+import random
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from core.fechas import filtro_dias
+from inventory.models import MovimientoInventario
+from tables.models import Venta, DetalleVenta, Pago, TasaBCV
+from . import exportar, views
+from .models import ResumenVentaDiaria, ResumenPagoDiario
+from .resumenes import sumar_venta, reconstruir_resumenes, totales_ventas, totales_por_metodo
+
+# Tablas grandes: si alguna de estas aparece con "SCAN" sin índice, la consulta
+# recorre la tabla entera y se pone lenta a medida que crecen las ventas.
+TABLAS_CALIENTES = {
+    Venta._meta.db_table,
+    DetalleVenta._meta.db_table,
+    Pago._meta.db_table,
+    MovimientoInventario._meta.db_table,
+    TasaBCV._meta.db_table,
+}
+SCAN_COMPLETO = re.compile(r'\bSCAN (\w+)(?! USING)')
+
+
+def consultas_frecuentes():
+    """ (descripción, queryset) de las consultas de reportes, cuadre y punto de venta """
+    hoy = timezone.localtime().date()
+    rango = filtro_dias('fecha', hoy, hoy)
+    return [
+        ("Cuadre / reportes: ventas válidas del período",
+         Venta.objects.filter(**rango, anulada=False)),
+        ("Reporte de ventas: todas las ventas del período",
+         Venta.objects.filter(**rango).order_by('-fecha')),
+        ("Ventas por producto",
+         DetalleVenta.objects.filter(**filtro_dias('venta__fecha', hoy, hoy), venta__anulada=False)
+         .values('nombre_producto').annotate(total=Sum('subtotal'))),
+        ("Pagos de las ventas (prefetch)",
+         Pago.objects.filter(venta_id__in=[1, 2, 3])),
+        ("Pago Cashea de una venta",
+         Pago.objects.filter(venta_id=1, metodo='CASHEA')[:1]),
+        ("Reporte de inventario: movimientos del período",
+         MovimientoInventario.objects.filter(**rango).order_by('-fecha')),
+        ("Top consumo del período",
+         MovimientoInventario.objects.filter(**rango, tipo='SALIDA')
+         .values('insumo__nombre').annotate(total=Sum('cantidad'))),
+        ("Tasa BCV vigente",
+         TasaBCV.objects.order_by('-fecha_actualizacion')[:1]),
+    ]
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class PlanesConsultasTest(TestCase):
+    """ Las consultas frecuentes usan índices: ninguna recorre completa una tabla grande (EXPLAIN QUERY PLAN) """
+
+    def test_consultas_frecuentes_usan_indices(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Solo se leen los planes de SQLite')
+        for descripcion, queryset in consultas_frecuentes():
+            with self.subTest(descripcion):
+                plan = queryset.explain()
+                tablas_scan = [t for t in SCAN_COMPLETO.findall(plan) if t in TABLAS_CALIENTES]
+                self.assertEqual(tablas_scan, [], f"{descripcion}: recorre la tabla completa\n{plan}")
+
+
+class ResumenesDiariosTest(TestCase):
+    """ Lo que se suma al facturar y se resta al anular queda igual que recalcular todo desde las ventas """
+
+    # Hora local de cada venta: los dos turnos (DIA desde las 0, NOCHE desde las 16) y el cambio de día
+    HORAS = [(0, 10, 5), (0, 15, 59), (0, 16, 0), (0, 23, 59), (1, 0, 0), (1, 0, 30), (1, 12, 0), (1, 20, 15), (2, 0, 1)]
+    METODOS = ['EFECTIVO_USD', 'EFECTIVO_BS', 'PUNTO', 'PAGO_MOVIL', 'CASHEA']
+
+    def _filas(self):
+        campos_dia = [f.name for f in ResumenVentaDiaria._meta.fields if f.name != 'id']
+        campos_pago = [f.name for f in ResumenPagoDiario._meta.fields if f.name != 'id']
+        dias = list(ResumenVentaDiaria.objects.filter(ventas__gt=0).order_by('fecha', 'turno').values_list(*campos_dia))
+        pagos = list(ResumenPagoDiario.objects.filter(transacciones__gt=0).order_by('fecha', 'turno', 'metodo').values_list(*campos_pago))
+        return dias, pagos
+
+    def test_incremental_igual_a_reconstruir(self):
+        azar = random.Random(18)
+        zona = timezone.get_current_timezone()
+        base = timezone.localtime().date() - timedelta(days=10)
+        ventas = []
+        for n in range(60):
+            dia, hora, minuto = self.HORAS[n % len(self.HORAS)]
+            momento = timezone.make_aware(datetime.combine(base + timedelta(days=dia), datetime.min.time()), zona) \
+                + timedelta(hours=hora, minutes=minuto)
+            total = Decimal(azar.randint(500, 6000)) / 100
+            propina = Decimal(azar.choice([0, 0, 150])) / 100
+            venta = Venta.objects.create(
+                codigo_factura=f"{n:06d}", total=total, propina=propina, metodo_pago='MIXTO', mesa_numero=1,
+                monto_recibido=total + propina, tasa_aplicada=azar.choice([None, Decimal('36.50'), Decimal('40.00')]),
+            )
+            Venta.objects.filter(pk=venta.pk).update(fecha=momento)
+            # Uno o dos pagos que cubren la cuenta (a veces con vuelto en efectivo)
+            metodos = azar.sample(self.METODOS, azar.randint(1, 2))
+            primero = (total + propina) / 2 if len(metodos) == 2 else total + propina
+            Pago.objects.create(venta=venta, metodo=metodos[0], monto=primero.quantize(Decimal('0.01')))
+            if len(metodos) == 2:
+                Pago.objects.create(venta=venta, metodo=metodos[1], monto=(total + propina - primero + 1).quantize(Decimal('0.01')))
+            venta.refresh_from_db()
+            sumar_venta(venta)
+            ventas.append(venta)
+
+        # Se anulan algunas, igual que anular_venta
+        anuladas = ventas[::7]
+        for venta in anuladas:
+            sumar_venta(venta, signo=-1)
+            Venta.objects.filter(pk=venta.pk).update(anulada=True)
+
+        incremental = self._filas()
+        self.assertEqual({fila[1] for fila in incremental[0]}, {'DIA', 'NOCHE'})
+        dias_con_ventas = reconstruir_resumenes()
+        self.assertEqual(dias_con_ventas, len(incremental[0]))
+        self.assertEqual(self._filas(), incremental)
+
+        # Y coincide con sumar venta por venta (día local de cada una)
+        validas = [v for v in ventas if v not in anuladas]
+        for dia in range(3):
+            fecha = base + timedelta(days=dia)
+            del_dia = [v for v in validas if timezone.localtime(v.fecha).date() == fecha]
+            totales = totales_ventas(fecha)
+            self.assertEqual(totales['ventas'], len(del_dia))
+            self.assertEqual(totales['total'], sum((v.total for v in del_dia), Decimal('0')))
+            self.assertEqual(totales['propina'], sum((v.propina for v in del_dia), Decimal('0')))
+            asignado = sum((fila['asignado'] for fila in totales_por_metodo(fecha).values()), Decimal('0'))
+            self.assertEqual(asignado, totales['total'] + totales['propina'])
+
+    def test_turno_de_la_venta(self):
+        zona = timezone.get_current_timezone()
+        fecha = timezone.localtime().date() - timedelta(days=3)
+        for hora, turno in ((15, 'DIA'), (16, 'NOCHE'), (23, 'NOCHE')):
+            venta = Venta.objects.create(codigo_factura=f"T{hora}", total=Decimal('10'), metodo_pago='EFECTIVO_USD', mesa_numero=1)
+            Venta.objects.filter(pk=venta.pk).update(fecha=timezone.make_aware(datetime(fecha.year, fecha.month, fecha.day, hora, 59), zona))
+            venta.refresh_from_db()
+            sumar_venta(venta)
+            with self.subTest(hora=hora):
+                self.assertTrue(ResumenVentaDiaria.objects.filter(fecha=fecha, turno=turno, ventas__gte=1).exists())
+
+
+class ExportarTest(TestCase):
+    """ La descarga se genera por bloques mientras se manda, con una fila por venta """
+
+    def test_csv_por_bloques_sin_leer_todo_antes(self):
+        leidas = []
+
+        def filas(cuantas):
+            for i in range(cuantas):
+                leidas.append(i)
+                yield [f"Fila {i}", Decimal('1.5') * i]
+
+        cuantas = exportar.FILAS_POR_BLOQUE * 2 + 3
+        respuesta = exportar.respuesta_exportar('csv', 'prueba', [('Nombre', None), ('Monto', 2)], filas(cuantas))
+        self.assertTrue(respuesta.streaming)
+        self.assertEqual(leidas, [])
+        self.assertEqual(respuesta['Content-Disposition'], 'attachment; filename="prueba.csv"')
+
+        bloques = [bloque.decode('utf-8') for bloque in respuesta.streaming_content]
+        # El primer bloque lleva el encabezado; cada bloque, a lo sumo FILAS_POR_BLOQUE líneas
+        self.assertEqual(len(bloques), 3)
+        lineas = ''.join(bloques).splitlines()
+        self.assertEqual(len(lineas), cuantas + 1)
+        self.assertEqual(lineas[0], '\ufeffNombre;Monto')
+        self.assertEqual(lineas[3], 'Fila 2;3,00')
+        self.assertEqual(len(leidas), cuantas)
+
+    def test_ventas_detalle_una_fila_por_venta(self):
+        usuario = User.objects.create_user('gerente', password='x', is_staff=True)
+        hoy = timezone.localtime().date().strftime('%Y-%m-%d')
+        for i in range(7):
+            venta = Venta.objects.create(
+                codigo_factura=f"E{i:03d}", total=Decimal('10.00'), metodo_pago='MIXTO', mesa_numero=1, mesero=usuario, anulada=(i == 3),
+            )
+            DetalleVenta.objects.create(venta=venta, nombre_producto='Pizza', cantidad=2, precio_unitario=Decimal('5.00'), subtotal=Decimal('10.00'))
+            Pago.objects.bulk_create([
+                Pago(venta=venta, metodo='EFECTIVO_USD', monto=Decimal('4.00')),
+                Pago(venta=venta, metodo='PUNTO', monto=Decimal('6.00'), referencia='123'),
+            ])
+        ventas = Venta.objects.all()
+
+        # Bloques de 3 ventas: una consulta de ventas y, por bloque, una de detalles y una de pagos
+        with self.assertNumQueries(1 + 3 * 2):
+            filas = list(views._filas_ventas_detalle(ventas, tamano_bloque=3))
+        self.assertEqual(len(filas), 7)
+        self.assertEqual(filas[0][4], '2x Pizza')
+        self.assertEqual(filas[0][5], 'Efectivo ($) ($4.00) + Punto de Venta (Ref: 123) ($6.00)')
+        self.assertEqual(sum(fila[6] == 'ANULADA' for fila in filas), 1)
+
+        self.client.force_login(usuario)
+        respuesta = self.client.get(reverse('reporte_ventas_detalle'), {'fecha_inicio': hoy, 'fecha_fin': hoy, 'exportar': 'csv'})
+        self.assertTrue(respuesta.streaming)
+        lineas = b''.join(respuesta.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lineas), 1 + 7)
+
+    @skipUnless(exportar.xlsx_disponible(), "openpyxl no está instalado")
+    def test_xlsx_con_montos_numericos(self):
+        from openpyxl import load_workbook
+
+        respuesta = exportar.respuesta_exportar(
+            'xlsx', 'prueba', [('Nombre', None), ('Monto', 2)], ([f"Fila {i}", Decimal('2.25')] for i in range(1200)), 'Hoja'
+        )
+        contenido = b''.join(respuesta.streaming_content)
+        respuesta.close()
+        hoja = load_workbook(BytesIO(contenido), read_only=True)['Hoja']
+        filas = list(hoja.iter_rows(values_only=True))
+        self.assertEqual(len(filas), 1201)
+        self.assertEqual(filas[1], ('Fila 0', 2.25))
@@ -2,18 +2,22 @@ from django.shortcuts import render, get_object_or_404
 from django.db.models import Sum, Count, F, ExpressionWrapper, DecimalField
 from django.utils import timezone
 from datetime import timedelta
+from collections import defaultdict
 from django.views.decorators.cache import never_cache
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from .models import AuditoriaEliminacion, AuditoriaConfiguracion
 from decimal import Decimal
-from django.http import HttpResponse
 from core.models import Configuracion
+from core.fechas import filtro_dias
+from .resumenes import totales_ventas, totales_por_metodo, a_bs
+from .exportar import respuesta_exportar, formato_exportar, en_bloques
 
 # Importamos modelos de ambas aplicaciones (Inventario y Ventas)
 from inventory.models import Insumo, MovimientoInventario
-from tables.models import Venta, DetalleVenta, TasaBCV
+from tables.models import Venta, DetalleVenta, Pago, TasaBCV
+from tables.tasas import obtener_tasas, serie_tasas
 
 # 1. MENÚ PRINCIPAL DE REPORTES (Centro de Mando)
 @never_cache
@@ -45,7 +49,7 @@ def reporte_inventario(request):
     
     # Datos para gráficos (Top 5 Consumo)
     movimientos_rango = MovimientoInventario.objects.filter(
-        fecha__date__range=[fecha_inicio, fecha_fin]
+        **filtro_dias('fecha', fecha_inicio, fecha_fin)
     )
     
     top_consumo = (movimientos_rango.filter(tipo='SALIDA')
@@ -84,7 +88,7 @@ def ventas_mesero(request):
     fecha_fin = request.GET.get('fecha_fin', timezone.now().strftime('%Y-%m-%d'))
 
     # Agrupamos ventas por Mesero
-    data = (Venta.objects.filter(fecha__date__range=[fecha_inicio, fecha_fin], anulada=False)
+    data = (Venta.objects.filter(**filtro_dias('fecha', fecha_inicio, fecha_fin), anulada=False)
             .values('mesero__username')
             .annotate(total_vendido=Sum('total'), total_ordenes=Count('id'))
             .order_by('-total_vendido'))
@@ -113,7 +117,7 @@ def ventas_producto(request):
     fecha_fin = request.GET.get('fecha_fin', timezone.now().strftime('%Y-%m-%d'))
 
     # Agrupamos detalles por Producto (Top 10)
-    data_qs = (DetalleVenta.objects.filter(venta__fecha__date__range=[fecha_inicio, fecha_fin], venta__anulada=False)
+    data_qs = (DetalleVenta.objects.filter(**filtro_dias('venta__fecha', fecha_inicio, fecha_fin), venta__anulada=False)
             .values('nombre_producto', 'nombre_mitad')
             .annotate(cantidad_total=Sum('cantidad'), dinero_generado=Sum('subtotal'))
             .order_by('-cantidad_total')[:10])
@@ -179,6 +183,66 @@ def historial_tasas_bcv(request):
     
     return render(request, 'reports/tasa_bcv_history.html', {'tasas': tasas})
 
+# --- EXPORTACIÓN: columnas (título, decimales) y filas de cada reporte ---
+COLUMNAS_VENTAS_DETALLE = [
+    ('Fecha', None), ('Hora', None), ('N Factura', None), ('Mesero', None), ('Productos', None),
+    ('Metodo Pago', None), ('Estado', None), ('Propina ($)', 4), ('Total ($)', 2),
+]
+COLUMNAS_PROPINAS = [
+    ('Fecha', None), ('Hora', None), ('N Factura', None), ('Mesa', None), ('Mesero', None),
+    ('Tasa (Bs/$)', 2), ('Propina ($)', 4), ('Propina (Bs)', 2),
+]
+
+
+def _filas_ventas_detalle(ventas, tamano_bloque=2000):
+    # Por bloque de ventas: una consulta de detalles y una de pagos (values, sin
+    # armar objetos), en lugar del prefetch que crea un queryset por cada venta.
+    metodos_pago = dict(Pago.METODOS)
+    metodos_venta = dict(Venta.METODOS_PAGO)
+    filas = ventas.prefetch_related(None).values_list(
+        'id', 'fecha', 'codigo_factura', 'mesero__username', 'metodo_pago', 'anulada', 'propina', 'total'
+    )
+    for bloque in en_bloques(filas.iterator(chunk_size=tamano_bloque), tamano_bloque):
+        ids = [fila[0] for fila in bloque]
+
+        productos = defaultdict(list)
+        for venta_id, cantidad, nombre in DetalleVenta.objects.filter(venta_id__in=ids).values_list('venta_id', 'cantidad', 'nombre_producto'):
+            productos[venta_id].append(f"{cantidad}x {nombre}")
+
+        pagos = defaultdict(list)
+        for venta_id, metodo, referencia, monto in Pago.objects.filter(venta_id__in=ids).values_list('venta_id', 'metodo', 'referencia', 'monto'):
+            pagos[venta_id].append(
+                f"{metodos_pago.get(metodo, metodo)}" + (f" (Ref: {referencia})" if referencia else "") + f" (${monto})"
+            )
+
+        for venta_id, fecha, codigo_factura, mesero, metodo_pago, anulada, propina, total in bloque:
+            yield [
+                fecha.strftime("%d/%m/%Y"),
+                fecha.strftime("%H:%M"),
+                codigo_factura,
+                mesero.title() if mesero else "Sin Asignar",
+                " | ".join(productos[venta_id]),
+                " + ".join(pagos[venta_id]) if pagos[venta_id] else metodos_venta.get(metodo_pago, metodo_pago),
+                "ANULADA" if anulada else "COBRADA",
+                propina,
+                total,
+            ]
+
+
+def _filas_propinas(ventas, tasa_valor):
+    for v in ventas.iterator(chunk_size=2000):
+        mesero_nombre = v.mesero.username.title() if v.mesero else "Sin Asignar"
+        yield [
+            v.fecha.strftime("%d/%m/%Y"),
+            v.fecha.strftime("%H:%M"),
+            v.codigo_factura,
+            f"Mesa {v.mesa_numero}",
+            mesero_nombre,
+            tasa_valor,
+            v.propina,
+            float(v.propina) * tasa_valor,
+        ]
+
 # reports/views.py
 
 @never_cache
@@ -195,95 +259,54 @@ def reporte_ventas_detalle(request):
 
     # 3. Consulta Base (Por fecha)
     ventas_list = Venta.objects.filter(
-        fecha__date__range=[fecha_inicio, fecha_fin]
+        **filtro_dias('fecha', fecha_inicio, fecha_fin)
     ).select_related('mesero').prefetch_related('detalles', 'pagos').order_by('-fecha')
 
+    # Detectamos si el usuario presionó el botón de exportar (csv o xlsx)
+    formato = request.GET.get('exportar')
+    if formato in ('csv', 'xlsx'):
+        return respuesta_exportar(
+            formato, f"ventas_detalle_{fecha_inicio}_al_{fecha_fin}",
+            COLUMNAS_VENTAS_DETALLE, _filas_ventas_detalle(ventas_list), 'Ventas'
+        )
+
     # 4. APLICACIÓN DE FILTROS Y CÁLCULO DE TOTALES
     total_periodo = 0
     total_propina = 0
     total_financiado_cashea = 0
     total_periodo_bs = 0
 
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
+    tasas = obtener_tasas(request)
+    tasa_valor = float(tasas.bcv or 0)
 
     if estado_filtro == 'anuladas':
-        ventas_iter = ventas_list.filter(anulada=True)
-    elif estado_filtro == 'validas':
-        ventas_iter = ventas_list.filter(anulada=False)
+        # Las anuladas no entran en los resúmenes (y son pocas): se suman una por una
+        for v in ventas_list.filter(anulada=True):
+            total_periodo += float(v.total)
+            total_propina += float(v.propina)
+            tasa_uso = float(v.tasa_aplicada) if v.tasa_aplicada else tasa_valor
+            total_periodo_bs += float(v.total) * tasa_uso
+
+            pago_cashea = next((p for p in v.pagos.all() if p.metodo == 'CASHEA'), None)
+            if pago_cashea:
+                total_financiado_cashea += float(v.total) - float(pago_cashea.monto)
     else:
-        # Caso 'todas' suma solo lo real (No anulado)
-        ventas_iter = ventas_list.filter(anulada=False)
-
-    for v in ventas_iter:
-        total_periodo += float(v.total)
-        total_propina += float(v.propina)
-        tasa_uso = float(v.tasa_aplicada) if v.tasa_aplicada else tasa_valor
-        total_periodo_bs += float(v.total) * tasa_uso
-
-        pago_cashea = v.pagos.filter(metodo='CASHEA').first()
-        if pago_cashea:
-            total_financiado_cashea += float(v.total) - float(pago_cashea.monto)
-
-    # Detectamos si el usuario presionó el botón de exportar
-    if request.GET.get('exportar') == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="ventas_detalle_{fecha_inicio}_al_{fecha_fin}.csv"'
-        
-        # Formato UTF-8 BOM para que Excel detecte acentos
-        response.write(u'\ufeff'.encode('utf8'))
-        writer = csv.writer(response, delimiter=';')
-        
-        writer.writerow(['Fecha', 'Hora', 'N Factura', 'Mesero', 'Productos', 'Metodo Pago', 'Estado', 'Propina ($)', 'Total ($)'])
-        
-        for v in ventas_list:
-            mesero_nombre = v.mesero.username.title() if v.mesero else "Sin Asignar"
-            
-            prods = []
-            for d in v.detalles.all():
-                prods.append(f"{d.cantidad}x {d.nombre_producto}")
-            productos_str = " | ".join(prods)
-            
-            if v.pagos.exists():
-                pagos_list = [
-                    f"{p.get_metodo_display()}" + (f" (Ref: {p.referencia})" if p.referencia else "") + f" (${p.monto})"
-                    for p in v.pagos.all()
-                ]
-                pagos_str = " + ".join(pagos_list)
-            else:
-                pagos_str = v.get_metodo_pago_display()
-                
-            estado_str = "ANULADA" if v.anulada else "COBRADA"
-            
-            writer.writerow([
-                v.fecha.strftime("%d/%m/%Y"),
-                v.fecha.strftime("%H:%M"),
-                v.codigo_factura,
-                mesero_nombre,
-                productos_str,
-                pagos_str,
-                estado_str,
-                f"{float(v.propina):.4f}".replace('.', ','),
-                f"{float(v.total):.2f}".replace('.', ',')
-            ])
-            
-        return response
+        # 'validas' y 'todas' suman solo lo real (No anulado), desde los resúmenes diarios
+        totales = totales_ventas(fecha_inicio, fecha_fin)
+        total_periodo = float(totales['total'])
+        total_propina = float(totales['propina'])
+        total_periodo_bs = float(a_bs(totales['total_bs'], totales['total_sin_tasa'], tasa_valor))
+        total_financiado_cashea = float(totales['cashea_financiado_bruto'])
 
     paginator = Paginator(ventas_list, 10)
     page_number = request.GET.get('page')
     ventas = paginator.get_page(page_number)
 
-    # --- OPTIMIZACIÓN: OBTENER TODAS LAS TASAS NECESARIAS EN UNA SOLA CONSULTA ---
-    # Creamos un diccionario para mapear fechas a tasas para un acceso rápido.
-    fechas_ventas = [v.fecha.date() for v in ventas]
-    tasas_del_periodo = TasaBCV.objects.filter(fecha_actualizacion__date__in=fechas_ventas).order_by('fecha_actualizacion')
-    
-    tasas_por_dia = {}
-    for tasa in tasas_del_periodo:
-        tasas_por_dia[tasa.fecha_actualizacion.date()] = tasa.precio
-    
+    # --- TASAS HISTÓRICAS: la que regía en el momento de cada venta (búsqueda en memoria) ---
+    historial_tasas = serie_tasas(request)
+
     # --- LÓGICA DE TASA CASHEA ---
-    config = Configuracion.get_solo()
+    config = Configuracion.get_cached()
     tasa_cashea_especial = 0
     if not config.usar_tasa_bcv_para_cashea and config.tasa_cashea > 0:
         tasa_cashea_especial = float(config.tasa_cashea)
@@ -300,7 +323,7 @@ def reporte_ventas_detalle(request):
         # --- LÓGICA ESPECIAL PARA CASHEA (REQUERIMIENTO DEL USUARIO) ---
         # Si la venta es de Cashea, recalculamos el total en USD basado en el total en Bs.
         # y la tasa del día de la venta, para reflejar el valor a tasa BCV oficial.
-        tasa_dia_venta = tasas_por_dia.get(v.fecha.date())
+        tasa_dia_venta = historial_tasas.tasa_en(v.fecha)
         if v.es_cashea:
             # Usamos la tasa especial de Cashea si está activa, si no, la del día de la venta
             tasa_para_recalculo = tasa_cashea_especial if tasa_cashea_especial > 0 else tasa_dia_venta
@@ -327,7 +350,8 @@ def reporte_ventas_detalle(request):
         'total_financiado_cashea': total_financiado_cashea,
         'total_periodo_bs': total_periodo_bs,
         'total_propina': total_propina,
-        'estado_filtro': estado_filtro # Pasamos esto para pintar los botones
+        'estado_filtro': estado_filtro, # Pasamos esto para pintar los botones
+        'formato_exportar': formato_exportar(),
     }
     return render(request, 'reports/sales_detail_report.html', context)
 
@@ -347,8 +371,8 @@ def detalle_venta_view(request, venta_id):
         id=venta_id
     )
 
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
+    tasas = obtener_tasas(request)
+    tasa_valor = float(tasas.bcv or 0)
     tasa_uso = float(venta.tasa_aplicada) if venta.tasa_aplicada else tasa_valor
 
     # Calcular total de la propina en bolívares
@@ -391,45 +415,25 @@ def reporte_propinas(request):
     fecha_fin = request.GET.get('fecha_fin', hoy_str)
 
     ventas_list = Venta.objects.filter(
-        fecha__date__range=[fecha_inicio, fecha_fin],
+        **filtro_dias('fecha', fecha_inicio, fecha_fin),
         propina__gt=0,
         anulada=False
     ).select_related('mesero').order_by('-fecha')
 
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
+    tasas = obtener_tasas(request)
+    tasa_valor = float(tasas.bcv or 0)
 
-    # Detectamos si el usuario presionó el botón de exportar
-    if request.GET.get('exportar') == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="propinas_{fecha_inicio}_al_{fecha_fin}.csv"'
-        
-        # Le agregamos el formato BOM para que Excel lea los caracteres en español sin problemas (UTF-8)
-        response.write(u'\ufeff'.encode('utf8'))
-        writer = csv.writer(response, delimiter=';')
-        
-        # Escribimos las cabeceras
-        writer.writerow(['Fecha', 'Hora', 'N Factura', 'Mesa', 'Mesero', 'Tasa (Bs/$)', 'Propina ($)', 'Propina (Bs)'])
-        
-        # Escribimos los datos, cambiando el punto decimal por coma para Excel en español
-        for v in ventas_list:
-            mesero_nombre = v.mesero.username.title() if v.mesero else "Sin Asignar"
-            propina_bs = float(v.propina) * tasa_valor
-            writer.writerow([
-                v.fecha.strftime("%d/%m/%Y"),
-                v.fecha.strftime("%H:%M"),
-                v.codigo_factura,
-                f"Mesa {v.mesa_numero}",
-                mesero_nombre,
-                f"{tasa_valor:.2f}".replace('.', ','),
-                f"{float(v.propina):.4f}".replace('.', ','),
-                f"{propina_bs:.2f}".replace('.', ',')
-            ])
-            
-        return response
+    # Detectamos si el usuario presionó el botón de exportar (csv o xlsx)
+    formato = request.GET.get('exportar')
+    if formato in ('csv', 'xlsx'):
+        return respuesta_exportar(
+            formato, f"propinas_{fecha_inicio}_al_{fecha_fin}",
+            COLUMNAS_PROPINAS, _filas_propinas(ventas_list, tasa_valor), 'Propinas'
+        )
 
-    total_propina = ventas_list.aggregate(Sum('propina'))['propina__sum'] or 0
-    total_propina_bs = sum(float(v.propina) * (float(v.tasa_aplicada) if v.tasa_aplicada else tasa_valor) for v in ventas_list)
+    totales = totales_ventas(fecha_inicio, fecha_fin)
+    total_propina = totales['propina']
+    total_propina_bs = float(a_bs(totales['propina_bs'], totales['propina_sin_tasa'], tasa_valor))
 
     paginator = Paginator(ventas_list, 10)
     page_number = request.GET.get('page')
@@ -445,7 +449,8 @@ def reporte_propinas(request):
         'fecha_fin': fecha_fin,
         'total_propina': total_propina,
         'total_propina_bs': total_propina_bs,
-        'tasa': tasa_valor
+        'tasa': tasa_valor,
+        'formato_exportar': formato_exportar(),
     }
     return render(request, 'reports/propinas_report.html', context)
 
@@ -457,26 +462,12 @@ def ventas_pago(request):
     fecha_inicio_str = request.GET.get('fecha_inicio', hoy_str)
     fecha_fin_str = request.GET.get('fecha_fin', hoy_str)
 
-    # 1. Filtrar estrictamente las VENTAS VÁLIDAS (Excluyendo las anuladas)
-    ventas_validas = Venta.objects.filter(
-        fecha__date__range=[fecha_inicio_str, fecha_fin_str],
-        anulada=False
-    ).prefetch_related('pagos')
-
-    # --- OPTIMIZACIÓN: OBTENER TODAS LAS TASAS NECESARIAS EN UNA SOLA CONSULTA ---
-    # Creamos un diccionario para mapear fechas a tasas para un acceso rápido.
-    fechas_ventas = [v.fecha.date() for v in ventas_validas]
-    tasas_del_periodo = TasaBCV.objects.filter(fecha_actualizacion__date__in=fechas_ventas).order_by('fecha_actualizacion')
-    tasas_por_dia = {}
-    for tasa in tasas_del_periodo:
-        tasas_por_dia[tasa.fecha_actualizacion.date()] = float(tasa.precio)
-
     # Obtenemos la tasa actual
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
+    tasas = obtener_tasas(request)
+    tasa_valor = float(tasas.bcv or 0)
 
     # --- LÓGICA DE TASA CASHEA ---
-    config = Configuracion.get_solo()
+    config = Configuracion.get_cached()
     tasa_cashea_especial = 0
     if not config.usar_tasa_bcv_para_cashea and config.tasa_cashea > 0:
         tasa_cashea_especial = float(config.tasa_cashea)
@@ -498,63 +489,26 @@ def ventas_pago(request):
         'MIXTO': 'Mixto (Legacy)'
     }
 
-    # 2. Procesar cada venta individualmente para distribuir exactamente "venta.total + propina"
-    for venta in ventas_validas:
-        pagos = venta.pagos.all()
-        
-        if pagos.exists():
-            # Ordenamos los pagos: los electrónicos primero, el efectivo de último.
-            # Esto asume que si hay vuelto/cambio, se da en efectivo.
-            pagos_ordenados = sorted(pagos, key=lambda p: 1 if 'EFECTIVO' in p.metodo else 0)
-            
-            monto_restante = float(venta.total) + float(venta.propina or 0)
-            
-            for pago in pagos_ordenados:
-                metodo_raw = pago.metodo
-                metodo_nombre = nombres_metodos.get(metodo_raw, str(metodo_raw).replace('_', ' ').title())
-                
-                # --- LÓGICA ESPECIAL PARA CASHEA (REQUERIMIENTO DEL USUARIO) ---
-                # Si el pago es de Cashea, recalculamos su valor en USD a tasa BCV.
-                monto_pago_usd = float(pago.monto) # Por defecto
-                if metodo_raw == 'CASHEA':
-                    tasa_para_recalculo = tasa_cashea_especial if tasa_cashea_especial > 0 else tasas_por_dia.get(venta.fecha.date())
-                    if tasa_para_recalculo and tasa_para_recalculo > 0:
-                        # El monto del pago en Bs se divide entre la tasa del día
-                        tasa_venta_cashea = float(venta.tasa_aplicada) if venta.tasa_aplicada else tasa_valor
-                        monto_pago_en_bs = float(pago.monto) * tasa_venta_cashea
-                        monto_pago_usd = monto_pago_en_bs / tasa_para_recalculo
-
-                monto_pago = monto_pago_usd
-                # Incluimos total de la venta y propina, ignorando únicamente excesos que correspondan a vueltos/cambios
-                monto_a_sumar = min(monto_pago, monto_restante)
-                
-                if monto_a_sumar > 0:
-                    tasa_uso = float(venta.tasa_aplicada) if venta.tasa_aplicada else tasa_valor
-                    monto_a_sumar_bs = monto_a_sumar * tasa_uso
-
-                    if metodo_nombre not in resultados_dict:
-                        resultados_dict[metodo_nombre] = {'transacciones': 0, 'total_dolares': 0, 'total_bs': 0}
-                    
-                    resultados_dict[metodo_nombre]['transacciones'] += 1
-                    resultados_dict[metodo_nombre]['total_dolares'] += monto_a_sumar
-                    resultados_dict[metodo_nombre]['total_bs'] += monto_a_sumar_bs
-                    
-                    monto_restante -= monto_a_sumar
-                    
-        else:
-            # Ventas antiguas (legacy) que no tienen detalle de pagos
-            metodo_raw = venta.metodo_pago
-            metodo_nombre = nombres_metodos.get(metodo_raw, str(metodo_raw).replace('_', ' ').title())
-            monto_a_sumar = float(venta.total) + float(venta.propina or 0)
-            tasa_uso = float(venta.tasa_aplicada) if venta.tasa_aplicada else tasa_valor
-            monto_a_sumar_bs = monto_a_sumar * tasa_uso
-            
-            if metodo_nombre not in resultados_dict:
-                resultados_dict[metodo_nombre] = {'transacciones': 0, 'total_dolares': 0, 'total_bs': 0}
-                
-            resultados_dict[metodo_nombre]['transacciones'] += 1
-            resultados_dict[metodo_nombre]['total_dolares'] += monto_a_sumar
-            resultados_dict[metodo_nombre]['total_bs'] += monto_a_sumar_bs
+    # 2. Totales por método desde los resúmenes diarios. Cada pago ya viene asignado
+    # a su venta (total + propina, sin el vuelto): los electrónicos primero y el
+    # efectivo de último, porque si hubo vuelto se dio en efectivo.
+    for metodo_raw, fila in totales_por_metodo(fecha_inicio_str, fecha_fin_str).items():
+        if not fila['transacciones']:
+            continue
+        metodo_nombre = nombres_metodos.get(metodo_raw, str(metodo_raw).replace('_', ' ').title())
+        total_bs = float(a_bs(fila['asignado_bs'], fila['asignado_sin_tasa'], tasa_valor))
+        total_usd = float(fila['asignado'])
+
+        # --- LÓGICA ESPECIAL PARA CASHEA (REQUERIMIENTO DEL USUARIO) ---
+        # Lo cobrado por Cashea en Bs se lleva a dólares con la tasa de Cashea.
+        if metodo_raw == 'CASHEA' and tasa_cashea_especial > 0:
+            total_usd = total_bs / tasa_cashea_especial
+
+        if metodo_nombre not in resultados_dict:
+            resultados_dict[metodo_nombre] = {'transacciones': 0, 'total_dolares': 0, 'total_bs': 0}
+        resultados_dict[metodo_nombre]['transacciones'] += fila['transacciones']
+        resultados_dict[metodo_nombre]['total_dolares'] += total_usd
+        resultados_dict[metodo_nombre]['total_bs'] += total_bs
 
     # Formatear para la vista
     resultados = []
@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.db.models import F
 from django.utils.html import format_html
-from .models import Table, Categoria, Producto, TasaBCV, IngredienteProducto, CostoAdicional, CostoAsignadoProducto
+from .models import Table, Categoria, Producto, TasaBCV, IngredienteProducto, CostoAdicional, CostoAsignadoProducto, TrabajoImpresion
 
 # --- INLINE DE INGREDIENTES ---
 class IngredienteInline(admin.TabularInline):
@@ -49,7 +50,7 @@ class ProductoAdmin(admin.ModelAdmin):
     # Campos que el usuario NO puede editar (porque son cálculos)
     readonly_fields = ('ver_costo_receta', 'ver_ganancia')
 
-    list_display = ('nombre', 'tamano', 'precio', 'ver_costo_receta', 'ver_ganancia_lista')
+    list_display = ('nombre', 'tamano', 'precio', 'ver_costo_receta', 'costo_total', 'ver_ganancia_lista', 'margen')
     list_filter = ('categoria', 'tamano')
     search_fields = ('nombre',)
 
@@ -59,6 +60,7 @@ class ProductoAdmin(admin.ModelAdmin):
         # Esto muestra el costo en el formulario de edición
         return f"${obj.costo_receta:.2f}"
     ver_costo_receta.short_description = "COSTO REAL (Suma de Ingredientes)"
+    ver_costo_receta.admin_order_field = 'costo_materia_prima'
 
     def ver_ganancia(self, obj):
         ganancia = obj.ganancia_estimada
@@ -75,6 +77,7 @@ class ProductoAdmin(admin.ModelAdmin):
     def ver_ganancia_lista(self, obj):
         return f"${obj.ganancia_estimada:.2f}"
     ver_ganancia_lista.short_description = "Ganancia"
+    ver_ganancia_lista.admin_order_field = F('precio') - F('costo_total')
 
 # Registros simples
 admin.site.register(Table)
@@ -82,4 +85,17 @@ admin.site.register(Categoria)
 admin.site.register(TasaBCV)
 
 admin.site.register(CostoAdicional)
-# admin.site.register(CostoAsignadoProducto) # No es necesario registrar este, lo veremos en la vista visual
\ No newline at end of file
+# admin.site.register(CostoAsignadoProducto) # No es necesario registrar este, lo veremos en la vista visual
+# --- COLA DE IMPRESIÓN ---
+@admin.register(TrabajoImpresion)
+class TrabajoImpresionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'titulo', 'impresora', 'mesa', 'estado', 'intentos', 'ultimo_error', 'creado')
+    list_filter = ('estado', 'impresora')
+    exclude = ('datos',)
+    actions = ['reintentar']
+
+    @admin.action(description="Reintentar impresión")
+    def reintentar(self, request, queryset):
+        queryset.filter(estado='ERROR').update(estado='PENDIENTE', intentos=0, proximo_intento=None)
+        from .cola_impresion import reanudar_pendientes
+        reanudar_pendientes()
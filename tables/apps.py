@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TablesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tables'
+
+    def ready(self):
+        # Los tickets que quedaron en la fila al apagar se retoman al arrancar
+        from .cola_impresion import iniciar_cola
+        iniciar_cola()
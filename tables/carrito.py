@@ -0,0 +1,228 @@
+import logging
+from decimal import Decimal
+from django.db.models import Prefetch
+from inventory.models import Insumo
+from .models import Producto, PrecioExtra, DetalleOrdenRemovido, DetalleOrdenExtra
+
+logger = logging.getLogger(__name__)
+
+
+def detalles_para_carrito(orden):
+    """
+    Detalles de la orden con todo lo que el carrito necesita ya cargado:
+    la cantidad de consultas no crece con la cantidad de ítems.
+    """
+    return orden.detalles.select_related(
+        'producto', 'mitad_producto', 'cuarto_2_producto', 'cuarto_3_producto', 'cuarto_4_producto'
+    ).prefetch_related(
+        'extras_elegidos',
+        Prefetch('ingredientes_removidos', queryset=Insumo.objects.only('id', 'nombre')),
+        Prefetch('removidos_detalles', queryset=DetalleOrdenRemovido.objects.select_related('insumo')),
+    )
+
+
+def serializar_detalle(detalle):
+    """ Convierte un DetalleOrden al formato de ítem que usa el carrito en JS """
+    nombre_display = detalle.producto.nombre
+    if detalle.producto.tamano != 'UNI':
+        nombre_display += f" ({detalle.producto.tamano})"
+
+    # Recuperar Extras
+    extras_list = [{
+        'id': extra.insumo_id,
+        'porcion': float(extra.porcion),
+        'es_sustituto': float(extra.precio) == 0.0
+    } for extra in detalle.extras_elegidos.all()]
+
+    removidos = []
+    removidos_nombres = []
+    for rem in detalle.ingredientes_removidos.all():
+        removidos.append({'id': rem.id, 'porcion': 1.0})
+        removidos_nombres.append(rem.nombre)
+    for rem in detalle.removidos_detalles.all():
+        removidos.append({'id': rem.insumo.id, 'porcion': float(rem.porcion)})
+        removidos_nombres.append(f"{rem.porcion_display}{rem.insumo.nombre}")
+
+    item = {
+        'detalle_id': detalle.id,
+        'id': detalle.producto.id,
+        'nombre': nombre_display,
+        'precio': float(detalle.precio_unitario),
+        'cantidad': detalle.cantidad,
+        'tamano_codigo': detalle.producto.tamano,
+        'para_llevar': detalle.es_para_llevar,
+        'extras': extras_list,
+    }
+    for campo in ('mitad', 'cuarto_2', 'cuarto_3', 'cuarto_4'):
+        parte = getattr(detalle, f'{campo}_producto')
+        item[f'{campo}_id'] = parte.id if parte else None
+        item[f'{campo}_nombre'] = parte.nombre if parte else None
+    item.update({
+        'removidos': removidos,
+        'removidos_nombres': removidos_nombres,
+        'es_nuevo': not detalle.impreso
+    })
+    return item
+
+
+def serializar_carrito(orden):
+    if not orden:
+        return []
+    return [serializar_detalle(detalle) for detalle in detalles_para_carrito(orden)]
+
+
+
+# ==========================================
+#  COMPARACIÓN CARRITO <-> DETALLES GRABADOS
+# ==========================================
+# La "firma" de una línea es todo lo que afecta al precio y al inventario.
+# Si la firma de un ítem del carrito coincide con la de un detalle ya grabado,
+# esa línea no se toca al volver a grabar la mesa.
+
+def _partes_item(item):
+    """ (mitad, cuarto_2, cuarto_3, cuarto_4) con la misma regla que se usa al grabar """
+    c2, c3, c4 = item.get('cuarto_2_id'), item.get('cuarto_3_id'), item.get('cuarto_4_id')
+    if c2 and c3 and c4:
+        return (None, int(c2), int(c3), int(c4))
+    if item.get('mitad_id'):
+        return (int(item['mitad_id']), None, None, None)
+    return (None, None, None, None)
+
+
+def _removidos_item(item):
+    removidos = []
+    for rem_data in item.get('removidos', []) or []:
+        try:
+            if isinstance(rem_data, dict):
+                rem_id = int(rem_data.get('id', 0))
+                porcion = Decimal(str(rem_data.get('porcion', 1.0)))
+            else:
+                rem_id = int(rem_data)
+                porcion = Decimal('1.0')
+        except (TypeError, ValueError, ArithmeticError):
+            logger.warning("Removido inválido en el carrito: %r", rem_data)
+            continue
+        if rem_id > 0:
+            removidos.append((rem_id, porcion))
+    return removidos
+
+
+def _extras_item(item):
+    extras = []
+    for extra_data in item.get('extras', []) or []:
+        try:
+            if isinstance(extra_data, dict):
+                extras.append((int(extra_data.get('id')), Decimal(str(extra_data.get('porcion', 1.0))), bool(extra_data.get('es_sustituto', False))))
+            else:
+                extras.append((int(extra_data), Decimal('1.0'), False))
+        except (TypeError, ValueError, ArithmeticError):
+            logger.warning("Extra inválido en el carrito: %r", extra_data)
+    return extras
+
+
+def leer_item(item):
+    """
+    Interpreta una sola vez un ítem del carrito (lo que manda el JS). El
+    resultado sirve para la firma y para grabar la línea.
+    """
+    return {
+        'producto_id': int(item.get('id')),
+        'cantidad': int(item.get('cantidad')),
+        'precio': Decimal(str(item.get('precio'))).quantize(Decimal('0.01')),
+        'para_llevar': bool(item.get('para_llevar', False)),
+        'es_nuevo': bool(item.get('es_nuevo', False)),
+        'partes': _partes_item(item),
+        'removidos': _removidos_item(item),
+        'extras': _extras_item(item),
+    }
+
+
+def firma_item(leido):
+    """ Firma de un ítem ya interpretado con leer_item() """
+    return (
+        leido['producto_id'],
+        leido['cantidad'],
+        leido['precio'],
+        leido['para_llevar'],
+        leido['partes'],
+        tuple(sorted(leido['removidos'])),
+        tuple(sorted(leido['extras'])),
+    )
+
+
+def firma_detalle(detalle):
+    """ Firma de un DetalleOrden cargado con utils_inventario.preparar_detalles """
+    removidos = [(r.id, Decimal('1.0')) for r in detalle.ingredientes_removidos.all()]
+    removidos += [(r.insumo_id, r.porcion) for r in detalle.removidos_detalles.all()]
+    extras = [(e.insumo_id, e.porcion, e.precio == 0) for e in detalle.extras_elegidos.all()]
+    return (
+        detalle.producto_id,
+        detalle.cantidad,
+        detalle.precio_unitario.quantize(Decimal('0.01')),
+        detalle.es_para_llevar,
+        (detalle.mitad_producto_id, detalle.cuarto_2_producto_id, detalle.cuarto_3_producto_id, detalle.cuarto_4_producto_id),
+        tuple(sorted(removidos)),
+        tuple(sorted(extras)),
+    )
+
+
+def aplicar_item_a_detalle(detalle, leido):
+    """
+    Llena (o reescribe) un DetalleOrden con un ítem interpretado con leer_item():
+    producto, partes, removidos y extras con el precio según el tamaño.
+    """
+    prod_obj = Producto.objects.get(id=leido['producto_id'])
+    mitad_id, cuarto_2_id, cuarto_3_id, cuarto_4_id = leido['partes']
+
+    detalle.producto = prod_obj
+    detalle.cantidad = leido['cantidad']
+    detalle.precio_unitario = leido['precio']
+    detalle.es_para_llevar = leido['para_llevar']
+    detalle.impreso = not leido['es_nuevo']
+    detalle.mitad_producto_id = mitad_id
+    detalle.cuarto_2_producto_id = cuarto_2_id
+    detalle.cuarto_3_producto_id = cuarto_3_id
+    detalle.cuarto_4_producto_id = cuarto_4_id
+    es_edicion = detalle.pk is not None
+    detalle.save()
+
+    if es_edicion:
+        # Si la línea se está editando, se arma de nuevo lo personalizado
+        detalle.ingredientes_removidos.clear()
+        detalle.removidos_detalles.all().delete()
+        detalle.extras_elegidos.all().delete()
+
+    # Los insumos y sus precios por tamaño se buscan una vez por línea
+    ids = {rem_id for rem_id, _ in leido['removidos']} | {extra_id for extra_id, _, _ in leido['extras']}
+    insumos = Insumo.objects.in_bulk(ids) if ids else {}
+    precios = dict(PrecioExtra.objects.filter(
+        insumo_id__in=[extra_id for extra_id, _, _ in leido['extras']], tamano=prod_obj.tamano
+    ).values_list('insumo_id', 'precio')) if leido['extras'] else {}
+
+    for rem_id, porcion in leido['removidos']:
+        if rem_id not in insumos:
+            logger.warning("Removido ignorado: el insumo %s no existe", rem_id)
+            continue
+        if porcion == Decimal('1.0'):
+            detalle.ingredientes_removidos.add(rem_id)
+        else:
+            DetalleOrdenRemovido.objects.create(detalle_orden=detalle, insumo=insumos[rem_id], porcion=porcion)
+
+    # GUARDAR EXTRAS
+    for extra_id, porcion, es_sustituto in leido['extras']:
+        insumo = insumos.get(extra_id)
+        if insumo is None:
+            logger.warning("Extra ignorado: el insumo %s no existe", extra_id)
+            continue
+
+        # Precio según tamaño del producto; si no hay, el precio general del extra
+        precio_final = precios.get(extra_id, insumo.precio_venta_extra)
+        precio_cobrado = Decimal('0.00') if es_sustituto else (precio_final * porcion)
+
+        DetalleOrdenExtra.objects.create(
+            detalle_orden=detalle,
+            insumo=insumo,
+            precio=precio_cobrado,
+            porcion=porcion
+        )
+    return detalle
@@ -0,0 +1,67 @@
+import json
+import uuid
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from inventory.models import Insumo
+from .models import Producto, IngredienteProducto, CATALOGO_CACHE_KEY
+
+
+def ingredientes_por_producto(productos):
+    """ {producto_id: [{'id', 'nombre'}]} de la receta de cada producto, en una sola consulta """
+    resultado = {p.id: [] for p in productos}
+    ingredientes = IngredienteProducto.objects.filter(
+        producto_id__in=resultado.keys()
+    ).select_related('insumo').only('producto', 'insumo__id', 'insumo__nombre').order_by('id')
+    for ing in ingredientes:
+        resultado[ing.producto_id].append({'id': ing.insumo.id, 'nombre': ing.insumo.nombre})
+    return resultado
+
+
+def construir_catalogo():
+    """
+    Menú que necesita la pantalla de pedidos: productos a la venta, sus recetas y
+    los extras con precio por tamaño. No incluye stock (los extras agotados se
+    mandan aparte con la página porque cambian con cada venta).
+    """
+    productos = list(Producto.objects.filter(precio__gt=0).order_by('id'))
+    productos_lista = [
+        {'id': p.id, 'nombre': p.nombre, 'tamano': p.tamano, 'precio': float(p.precio)}
+        for p in productos
+    ]
+
+    extras = []
+    for insumo in Insumo.objects.filter(es_extra=True).select_related('unidad').prefetch_related('precios_extra').order_by('id'):
+        extras.append({
+            'id': insumo.id,
+            'nombre': insumo.nombre,
+            'precio_venta_extra': float(insumo.precio_venta_extra), # Precio base por si acaso
+            'unidad__codigo': insumo.unidad.codigo,
+            # { 'IND': 1.50, 'MED': 2.00 }
+            'precios_por_tamano': {pe.tamano: float(pe.precio) for pe in insumo.precios_extra.all()}
+        })
+
+    version = uuid.uuid4().hex
+    datos = {
+        'version': version,
+        'productos': productos_lista,
+        'ingredientes': ingredientes_por_producto(productos),
+        'extras': extras,
+    }
+    return {'version': version, 'json': json.dumps(datos, cls=DjangoJSONEncoder)}
+
+
+def obtener_catalogo():
+    """
+    {'version', 'json'} del catálogo. Se construye una sola vez y queda en la
+    caché compartida hasta que las señales de productos/recetas/extras lo borren.
+    """
+    catalogo = cache.get(CATALOGO_CACHE_KEY)
+    if catalogo is None:
+        catalogo = construir_catalogo()
+        cache.set(CATALOGO_CACHE_KEY, catalogo, None)
+    return catalogo
+
+
+def extras_agotados():
+    """ IDs de los extras sin stock, para ocultarlos en la pantalla de pedidos """
+    return list(Insumo.objects.filter(es_extra=True, stock_actual__lte=0).values_list('id', flat=True))
@@ -0,0 +1,203 @@
+import os
+import socket
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import TrabajoImpresion, DetalleOrden
+from .impresoras import obtener_backend
+
+# Un hilo por impresora: los tickets de una misma impresora salen en el orden
+# en que se encolaron (FIFO). El semáforo limita cuántas impresoras se atienden
+# a la vez. Los trabajos viven en la BD, así que sobreviven a un reinicio.
+#
+# Para imprimir, un hilo primero "reserva" el trabajo con un UPDATE condicional
+# (solo si sigue PENDIENTE, o si la reserva de otro ya venció). Si el UPDATE no
+# cambió ninguna fila, otro hilo o proceso lo tomó antes y este no lo imprime:
+# un ticket nunca sale dos veces por dos trabajadores a la vez.
+_trabajadores = {}
+_avisos = {}
+_lock = threading.Lock()
+_semaforo = None
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _limite_hilos():
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = threading.BoundedSemaphore(_config('IMPRESION_MAX_HILOS', 4))
+    return _semaforo
+
+
+def _enviar_a_impresora(nombre_impresora, datos_bytes, titulo_doc):
+    """ Manda los bytes RAW por la conexión configurada. Lanza excepción si no se pudo. """
+    obtener_backend(nombre_impresora).enviar(datos_bytes, titulo_doc)
+
+
+def _espera_reintento(intentos):
+    # 2s, 4s, 8s... con tope
+    base = _config('IMPRESION_ESPERA_BASE', 2)
+    return min(base * (2 ** (intentos - 1)), _config('IMPRESION_ESPERA_MAXIMA', 60))
+
+
+def _duracion_reserva():
+    # Debe cubrir de sobra lo que tarda una impresión (conexión + envío)
+    return timedelta(seconds=_config('IMPRESION_RESERVA_SEGUNDOS', 120))
+
+
+def _propietario():
+    """ Identifica al hilo que imprime: equipo, proceso e hilo """
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"[:100]
+
+
+def _reservar(trabajo, propietario):
+    """
+    Marca el trabajo como IMPRIMIENDO a nombre de este hilo, solo si nadie lo
+    tiene (PENDIENTE) o si la reserva anterior venció. True si se lo quedó.
+    """
+    ahora = timezone.now()
+    vencido = Q(reservado_hasta__lt=ahora) | Q(reservado_hasta__isnull=True)
+    libre = Q(estado='PENDIENTE') | (Q(estado='IMPRIMIENDO') & vencido)
+    return TrabajoImpresion.objects.filter(libre, pk=trabajo.pk).update(
+        estado='IMPRIMIENDO', propietario=propietario, reservado_hasta=ahora + _duracion_reserva(), actualizado=ahora
+    ) == 1
+
+
+def _procesar(trabajo):
+    propietario = _propietario()
+    if not _reservar(trabajo, propietario):
+        return
+    # Los cambios de estado solo valen si la reserva sigue siendo nuestra
+    mio = TrabajoImpresion.objects.filter(pk=trabajo.pk, estado='IMPRIMIENDO', propietario=propietario)
+    try:
+        with _limite_hilos():
+            _enviar_a_impresora(trabajo.impresora, bytes(trabajo.datos), trabajo.titulo)
+    except Exception as e:
+        intentos = trabajo.intentos + 1
+        print(f"Error Spooler ({trabajo.titulo} #{trabajo.id}, intento {intentos}): {e}")
+        cambios = {'intentos': intentos, 'ultimo_error': str(e)[:255], 'actualizado': timezone.now(),
+                   'propietario': "", 'reservado_hasta': None}
+        if intentos >= _config('IMPRESION_MAX_INTENTOS', 5):
+            cambios.update(estado='ERROR', proximo_intento=None)
+        else:
+            cambios.update(estado='PENDIENTE', proximo_intento=timezone.now() + timedelta(seconds=_espera_reintento(intentos)))
+        mio.update(**cambios)
+        return
+
+    with transaction.atomic():
+        terminado = mio.update(
+            estado='IMPRESO', intentos=trabajo.intentos + 1, ultimo_error="", proximo_intento=None,
+            propietario="", reservado_hasta=None, actualizado=timezone.now()
+        )
+        # Solo ahora, con la impresión confirmada, las líneas cuentan como impresas
+        if terminado and trabajo.detalles_ids:
+            DetalleOrden.objects.filter(id__in=trabajo.detalles_ids).update(impreso=True)
+
+
+def _bucle_impresora(impresora, aviso):
+    while True:
+        try:
+            # El primero de la fila; si está esperando su reintento (o lo está
+            # imprimiendo otro hilo con la reserva vigente), la fila espera con él
+            trabajo = TrabajoImpresion.objects.filter(
+                impresora=impresora, estado__in=['PENDIENTE', 'IMPRIMIENDO']
+            ).order_by('id').first()
+            ahora = timezone.now()
+            if trabajo is None:
+                espera = None
+            elif trabajo.estado == 'IMPRIMIENDO' and trabajo.reservado_hasta and trabajo.reservado_hasta > ahora:
+                espera = (trabajo.reservado_hasta - ahora).total_seconds()
+            elif trabajo.proximo_intento and trabajo.proximo_intento > ahora:
+                espera = (trabajo.proximo_intento - ahora).total_seconds()
+            else:
+                _procesar(trabajo)
+                continue
+        except Exception as e:
+            print(f"Error en cola de impresión ({impresora}): {e}")
+            espera = 5
+        finally:
+            close_old_connections()
+
+        aviso.wait(timeout=espera if espera is not None else 30)
+        aviso.clear()
+
+
+def asegurar_trabajador(impresora):
+    """ Arranca (si hace falta) el hilo de esa impresora y le avisa que hay trabajo """
+    with _lock:
+        hilo = _trabajadores.get(impresora)
+        if hilo is None or not hilo.is_alive():
+            _avisos[impresora] = threading.Event()
+            hilo = threading.Thread(target=_bucle_impresora, args=(impresora, _avisos[impresora]),
+                                    name=f'impresora-{impresora}', daemon=True)
+            _trabajadores[impresora] = hilo
+            hilo.start()
+        _avisos[impresora].set()
+
+
+def reanudar_pendientes():
+    """ Arranca los hilos de las impresoras que tienen trabajos sin terminar (p. ej. tras reiniciar) """
+    impresoras = TrabajoImpresion.objects.filter(
+        estado__in=['PENDIENTE', 'IMPRIMIENDO']
+    ).values_list('impresora', flat=True).distinct()
+    for impresora in impresoras:
+        asegurar_trabajador(impresora)
+
+
+def _reanudar_al_arrancar():
+    try:
+        reanudar_pendientes()
+    except Exception as e:
+        print(f"Error reanudando la cola de impresión: {e}")
+    finally:
+        close_old_connections()
+
+
+def iniciar_cola():
+    """
+    Se llama una vez al arrancar (TablesConfig.ready): retoma los trabajos que
+    quedaron pendientes. Va en un hilo para no consultar la BD mientras Django
+    todavía está cargando las apps.
+    Solo si COLA_IMPRESION_AUTOARRANQUE está activo (en el servidor de la caja):
+    migrate, shell, las pruebas o un script suelto no deben tocar la cola.
+    """
+    if getattr(settings, 'COLA_IMPRESION_AUTOARRANQUE', False):
+        threading.Thread(target=_reanudar_al_arrancar, name='reanudar-impresion', daemon=True).start()
+
+
+def encolar(impresora, contenido, titulo, mesa=None, detalles_ids=None):
+    """ Registra el trabajo y lo deja en la fila de su impresora. Devuelve el TrabajoImpresion. """
+    if isinstance(contenido, str):
+        contenido = contenido.encode('cp850', errors='replace')
+    trabajo = TrabajoImpresion.objects.create(
+        impresora=impresora, titulo=titulo, datos=contenido, mesa=mesa, detalles_ids=list(detalles_ids or [])
+    )
+    # Si estamos dentro de una transacción, el hilo solo debe verlo cuando se confirme
+    transaction.on_commit(lambda: asegurar_trabajador(impresora))
+    return trabajo
+
+
+def detalles_en_cola(mesa):
+    """ IDs de líneas de la mesa que ya tienen una comanda esperando en la fila """
+    ids = set()
+    for lista in TrabajoImpresion.objects.filter(mesa=mesa, estado__in=['PENDIENTE', 'IMPRIMIENDO']).values_list('detalles_ids', flat=True):
+        ids.update(lista or [])
+    return ids
+
+
+def estado_mesa(mesa, limite=10):
+    """ Últimos trabajos de la mesa, para que la pantalla de pedidos muestre si algo falló """
+    trabajos = TrabajoImpresion.objects.filter(mesa=mesa).order_by('-id')[:limite]
+    return [{
+        'id': t.id,
+        'titulo': t.titulo,
+        'estado': t.estado,
+        'intentos': t.intentos,
+        'error': t.ultimo_error,
+        'creado': timezone.localtime(t.creado).strftime('%H:%M:%S'),
+    } for t in trabajos]
@@ -0,0 +1,198 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from inventory.models import Insumo, IngredienteCompuesto
+from .models import Producto, IngredienteProducto, CostoAsignadoProducto, calcular_margen
+
+# ==========================================
+#  MOTOR DE COSTOS (insumo -> receta -> producto)
+# ==========================================
+# Los costos forman un grafo sin ciclos: las materias primas entran en los
+# insumos compuestos (IngredienteCompuesto), que a su vez pueden usarse en
+# otros compuestos, y todo termina en las recetas de los productos
+# (IngredienteProducto). Cuando cambia un insumo se recalcula solo lo que
+# depende de él, cada receta después de sus componentes, y se guarda con
+# bulk_update: unas pocas consultas sin importar cuántos productos toque.
+
+
+class CicloDeRecetas(ValueError):
+    """ Una receta se contiene a sí misma (directa o indirectamente) """
+
+
+def _redondear(valor, modelo, campo):
+    """ Redondea como queda guardado en la BD, para que los padres usen el mismo valor """
+    decimales = modelo._meta.get_field(campo).decimal_places
+    return Decimal(valor).quantize(Decimal(1).scaleb(-decimales))
+
+
+def grafo_compuestos():
+    """
+    Sub-recetas en una consulta: ({padre_id: [(hijo_id, cantidad)]}, {hijo_id: {padre_id}}).
+    """
+    componentes = defaultdict(list)
+    usado_en = defaultdict(set)
+    for padre_id, hijo_id, cantidad in IngredienteCompuesto.objects.values_list('insumo_padre_id', 'insumo_hijo_id', 'cantidad'):
+        componentes[padre_id].append((hijo_id, cantidad))
+        usado_en[hijo_id].add(padre_id)
+    return componentes, usado_en
+
+
+def dependientes(insumo_ids, usado_en):
+    """ Los insumos dados y todos los compuestos que los usan, en cualquier nivel """
+    afectados = set(insumo_ids)
+    pendientes = list(afectados)
+    while pendientes:
+        for padre_id in usado_en.get(pendientes.pop(), ()):
+            if padre_id not in afectados:
+                afectados.add(padre_id)
+                pendientes.append(padre_id)
+    return afectados
+
+
+def orden_topologico(nodos, componentes, usado_en):
+    """
+    Los nodos ordenados de forma que cada receta quede después de sus componentes.
+    Lanza CicloDeRecetas si alguna receta termina conteniéndose a sí misma.
+    """
+    faltan = {n: len({hijo for hijo, _ in componentes.get(n, ()) if hijo in nodos}) for n in nodos}
+    listos = [n for n, cuantos in faltan.items() if cuantos == 0]
+    orden = []
+    while listos:
+        nodo = listos.pop()
+        orden.append(nodo)
+        for padre_id in usado_en.get(nodo, ()):
+            if padre_id in faltan:
+                faltan[padre_id] -= 1
+                if faltan[padre_id] == 0:
+                    listos.append(padre_id)
+
+    if len(orden) < len(nodos):
+        en_ciclo = [n for n, cuantos in faltan.items() if cuantos > 0]
+        nombres = Insumo.objects.filter(pk__in=en_ciclo).order_by('nombre').values_list('nombre', flat=True)
+        raise CicloDeRecetas(f"Las recetas se contienen entre sí: {', '.join(nombres)}")
+    return orden
+
+
+def crea_ciclo(padre_id, hijo_id):
+    """ True si agregar hijo_id a la receta padre_id haría que la receta se contenga a sí misma """
+    # Hay ciclo si el hijo ya usa al padre (o es el mismo insumo)
+    _, usado_en = grafo_compuestos()
+    return int(hijo_id) in dependientes([int(padre_id)], usado_en)
+
+
+def costo_compuesto(componentes, costos):
+    """
+    (costo_unitario, rendimiento) de una receta: lo que cuestan los ingredientes
+    entre lo que pesan. El peso total queda como rendimiento de la receta.
+    """
+    total_costo = Decimal('0.0')
+    total_peso = Decimal('0.0')
+    for hijo_id, cantidad in componentes:
+        total_costo += cantidad * costos[hijo_id]
+        total_peso += cantidad
+
+    if total_peso > 0:
+        return total_costo / total_peso, total_peso
+    return total_costo, total_peso
+
+
+def _recalcular_compuestos(insumo_ids):
+    """ Recalcula y guarda los compuestos afectados. Devuelve {id: (costo_unitario, rendimiento)} """
+    componentes, usado_en = grafo_compuestos()
+    afectados = dependientes(insumo_ids, usado_en)
+    orden = orden_topologico(afectados, componentes, usado_en)
+
+    necesarios = afectados | {hijo for n in afectados for hijo, _ in componentes.get(n, ())}
+    datos = {
+        pk: (compuesto, costo, rendimiento)
+        for pk, compuesto, costo, rendimiento in Insumo.objects.filter(pk__in=necesarios)
+        .values_list('pk', 'es_insumo_compuesto', 'costo_unitario', 'rendimiento')
+    }
+    costos = {pk: costo for pk, (_, costo, _) in datos.items()}
+
+    recalculados = {}
+    cambios = []
+    for pk in orden:
+        compuesto, costo_anterior, rendimiento_anterior = datos.get(pk, (False, None, None))
+        if not compuesto:
+            continue
+        costo, rendimiento = costo_compuesto(componentes.get(pk, ()), costos)
+        costo = _redondear(costo, Insumo, 'costo_unitario')
+        rendimiento = _redondear(rendimiento, Insumo, 'rendimiento')
+        costos[pk] = costo
+        recalculados[pk] = (costo, rendimiento)
+        if (costo, rendimiento) != (costo_anterior, rendimiento_anterior):
+            cambios.append(Insumo(pk=pk, costo_unitario=costo, rendimiento=rendimiento))
+
+    if cambios:
+        # bulk_update no dispara post_save: los productos se recalculan abajo, una sola vez
+        Insumo.objects.bulk_update(cambios, ['costo_unitario', 'rendimiento'])
+    return afectados, recalculados
+
+
+def _recalcular_productos(insumo_ids, producto_ids=()):
+    """
+    Recalcula los costos guardados (materia prima, indirectos, total y margen) de
+    los productos que usan esos insumos y de producto_ids. Devuelve {id: costo_materia_prima}.
+    """
+    ids = set(producto_ids)
+    if insumo_ids:
+        ids.update(IngredienteProducto.objects.filter(insumo_id__in=insumo_ids).values_list('producto_id', flat=True))
+    if not ids:
+        return {}
+
+    recetas = dict.fromkeys(ids, Decimal('0.00'))
+    for producto_id, cantidad, costo_unitario in IngredienteProducto.objects.filter(
+        producto_id__in=ids
+    ).values_list('producto_id', 'cantidad', 'insumo__costo_unitario'):
+        recetas[producto_id] += cantidad * costo_unitario
+
+    # Costos adicionales: fijos en $ o % sobre el costo de los ingredientes
+    indirectos = dict.fromkeys(ids, Decimal('0.00'))
+    for producto_id, tipo, valor in CostoAsignadoProducto.objects.filter(
+        producto_id__in=ids
+    ).values_list('producto_id', 'costo_adicional__tipo', 'valor_aplicado'):
+        indirectos[producto_id] += valor if tipo == 'FIJO' else (valor / 100) * recetas[producto_id]
+
+    campos = ['costo_materia_prima', 'costo_indirectos', 'costo_total', 'margen']
+    cambios = defaultdict(list)
+    totales = {}
+    for producto_id, precio, *anteriores in Producto.objects.filter(pk__in=ids).values_list('pk', 'precio', *campos):
+        receta = recetas[producto_id]
+        total = _redondear(receta + indirectos[producto_id], Producto, 'costo_total')
+        nuevos = (
+            _redondear(receta, Producto, 'costo_materia_prima'),
+            _redondear(indirectos[producto_id], Producto, 'costo_indirectos'),
+            total,
+            calcular_margen(precio, total),
+        )
+        totales[producto_id] = nuevos[0]
+        if list(nuevos) != anteriores:
+            cambios[nuevos].append(producto_id)
+
+    # Ni update() ni bulk_update pasan por Producto.save(): el margen ya viene calculado.
+    # Los productos que quedan con los mismos valores (típico de un cambio masivo)
+    # van en un solo UPDATE; el resto en un bulk_update (un CASE por fila).
+    sueltos = []
+    for nuevos, pks in cambios.items():
+        if len(pks) > 1:
+            for lote in (pks[i:i + 900] for i in range(0, len(pks), 900)):
+                Producto.objects.filter(pk__in=lote).update(**dict(zip(campos, nuevos)))
+        else:
+            sueltos.append(Producto(pk=pks[0], **dict(zip(campos, nuevos))))
+    if sueltos:
+        Producto.objects.bulk_update(sueltos, campos, batch_size=500)
+    return totales
+
+
+def recalcular_costos(insumo_ids=(), producto_ids=()):
+    """
+    Recalcula todo lo que depende de los insumos dados: los compuestos que los
+    usan (en cualquier nivel, incluidos ellos mismos si son recetas) y los
+    productos que los llevan, más los productos de producto_ids.
+    Devuelve {'insumos': {id: (costo_unitario, rendimiento)}, 'productos': {id: costo_materia_prima}}.
+    """
+    with transaction.atomic():
+        afectados, insumos = _recalcular_compuestos(insumo_ids) if insumo_ids else (set(), {})
+        productos = _recalcular_productos(afectados, producto_ids)
+    return {'insumos': insumos, 'productos': productos}
@@ -0,0 +1,126 @@
+import glob
+import hashlib
+import os
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import prefetch_related_objects
+from django.template.loader import get_template
+from core.models import Configuracion
+from core.pdf import renderizar_pdf
+from .models import Venta
+from .tasas import obtener_tasas
+
+# ==========================================
+#  PDF DE FACTURAS EN DISCO
+# ==========================================
+# Una venta facturada no cambia (salvo al anularla), así que el PDF se genera
+# una sola vez y se guarda como <venta_id>_<huella>.pdf. La huella sale de lo
+# que puede cambiar el documento sin tocar la venta: la anulación, la tasa (si
+# la venta no guardó la suya), la versión de la plantilla y la de la
+# configuración del negocio. Se calcula sin armar el HTML, así que una factura
+# ya generada (o que el navegador ya tiene) no se vuelve a renderizar.
+
+TEMPLATE_FACTURA = 'tables/factura_final_pdf.html'
+
+
+def _carpeta():
+    return getattr(settings, 'FACTURAS_PDF_DIR', os.path.join(settings.BASE_DIR, 'facturas_pdf'))
+
+
+def _cargar_detalles(venta):
+    """ Precarga en la venta lo que usa la plantilla """
+    prefetch_related_objects(
+        [venta],
+        'pagos',
+        'detalles__extras',
+        'detalles__ingredientes_removidos',
+        'detalles__removidos_detalles__insumo',
+    )
+    return venta
+
+
+def _tasa_factura(venta, request=None):
+    if venta.tasa_aplicada:
+        return float(venta.tasa_aplicada)
+    return float(obtener_tasas(request).bcv or 0)
+
+
+def html_factura(venta, request=None):
+    tasa_uso = _tasa_factura(venta, request)
+    context = {
+        'venta': venta,
+        'detalles': venta.detalles.all(),
+        'tasa': tasa_uso,
+        'total_bs': float(venta.total) * tasa_uso,
+        'vuelto': float(venta.monto_recibido) - float(venta.total) - float(venta.propina),
+        'config': Configuracion.get_cached(),
+    }
+    return get_template(TEMPLATE_FACTURA).render(context)
+
+
+def huella_factura(venta, request=None):
+    """ Versión del PDF de la venta; sirve de nombre de archivo y de ETag """
+    config = Configuracion.get_cached()
+    plantilla = get_template(TEMPLATE_FACTURA).origin.name
+    partes = (
+        venta.id,
+        venta.anulada,
+        venta.tasa_aplicada or _tasa_factura(venta, request),
+        os.path.getmtime(plantilla),
+        config.actualizado.isoformat() if config.actualizado else '',
+    )
+    return hashlib.sha1('|'.join(map(str, partes)).encode('utf-8')).hexdigest()[:20]
+
+
+def ruta_pdf_factura(venta_id, huella):
+    return os.path.join(_carpeta(), f"{venta_id}_{huella}.pdf")
+
+
+def obtener_pdf_factura(venta, request=None, huella=None):
+    """
+    (ruta, huella) del PDF de la factura, generándolo solo si no existe.
+    venta: la Venta ya cargada (o su id). Lanza Venta.DoesNotExist si no hay
+    venta y RuntimeError si xhtml2pdf falla.
+    """
+    if not isinstance(venta, Venta):
+        venta = Venta.objects.select_related('mesero').get(id=venta)
+    huella = huella or huella_factura(venta, request)
+    ruta = ruta_pdf_factura(venta.id, huella)
+    if os.path.exists(ruta):
+        return ruta, huella
+
+    # xhtml2pdf corre en el pool de PDF (lanza RuntimeError si falla)
+    datos = renderizar_pdf(html_factura(_cargar_detalles(venta), request))
+
+    os.makedirs(_carpeta(), exist_ok=True)
+    # Se escribe en un temporal y se renombra: nunca se sirve un PDF a medio escribir
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as destino:
+        destino.write(datos)
+    borrar_pdf_factura(venta.id)
+    os.replace(temporal, ruta)
+    return ruta, huella
+
+
+def borrar_pdf_factura(venta_id):
+    """ Elimina los PDF guardados de una venta (p. ej. al anularla) """
+    for ruta in glob.glob(os.path.join(_carpeta(), f"{venta_id}_*.pdf")):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _prerenderizar(venta_id):
+    try:
+        obtener_pdf_factura(venta_id)
+    except Exception as e:
+        print(f"Error pre-generando PDF de la venta #{venta_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def prerenderizar_factura(venta_id):
+    """ Genera el PDF en segundo plano para que la primera reimpresión ya lo encuentre hecho """
+    threading.Thread(target=_prerenderizar, args=(venta_id,), name=f'pdf-factura-{venta_id}', daemon=True).start()
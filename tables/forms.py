@@ -17,7 +17,7 @@ class ProductoBasicForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        config = Configuracion.get_solo()
+        config = Configuracion.get_cached()
         if config.codigo_producto_automatico:
             self.fields['codigo'].required = False
             self.fields['codigo'].widget.attrs['readonly'] = True
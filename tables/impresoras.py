@@ -0,0 +1,114 @@
+import os
+import socket
+from django.conf import settings
+from django.utils import timezone
+
+# ==========================================
+#  CONEXIONES DE IMPRESORA
+# ==========================================
+# Todas reciben los bytes ESC/POS ya armados y lanzan excepción si no pudieron
+# imprimir (la cola de impresión se encarga de reintentar).
+
+class BackendImpresora:
+    def enviar(self, datos, titulo):
+        raise NotImplementedError
+
+
+class ImpresoraWindows(BackendImpresora):
+    """ Spooler de Windows. win32print se importa aquí para que el resto del sistema funcione en Linux. """
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def enviar(self, datos, titulo):
+        import win32print
+        hPrinter = win32print.OpenPrinter(self.nombre)
+        try:
+            win32print.StartDocPrinter(hPrinter, 1, (titulo, None, "RAW"))
+            win32print.StartPagePrinter(hPrinter)
+            win32print.WritePrinter(hPrinter, datos)
+            win32print.EndPagePrinter(hPrinter)
+            win32print.EndDocPrinter(hPrinter)
+        finally:
+            win32print.ClosePrinter(hPrinter)
+
+
+class ImpresoraRed(BackendImpresora):
+    """
+    Impresora térmica de red (puerto RAW 9100). Cada ticket abre su propia
+    conexión y la cierra al terminar: un socket que quedó abierto puede aceptar
+    los bytes sin error aunque la impresora se haya reiniciado y no imprima.
+    Antes de mandar el ticket se le pide el estado (DLE EOT 1); si no contesta,
+    el ticket no se envía y la cola lo reintenta.
+    """
+    PEDIR_ESTADO = b'\x10\x04\x01'
+
+    def __init__(self, host, puerto=9100, timeout=5, verificar_estado=True):
+        self.host = host
+        self.puerto = puerto
+        self.timeout = timeout
+        self.verificar_estado = verificar_estado
+
+    def _verificar(self, conexion):
+        conexion.sendall(self.PEDIR_ESTADO)
+        try:
+            estado = conexion.recv(1)
+        except socket.timeout:
+            raise OSError(f"La impresora {self.host} no responde")
+        # Byte de estado ESC/POS: bit 1 y bit 4 siempre en 1, bit 0 y bit 7 en 0
+        if len(estado) != 1 or estado[0] & 0b10010011 != 0b00010010:
+            raise OSError(f"La impresora {self.host} cerró la conexión o respondió algo inesperado")
+
+    def enviar(self, datos, titulo):
+        with socket.create_connection((self.host, self.puerto), timeout=self.timeout) as conexion:
+            if self.verificar_estado:
+                self._verificar(conexion)
+            conexion.sendall(datos)
+
+
+class ImpresoraArchivo(BackendImpresora):
+    """ Guarda cada ticket como un archivo .bin en una carpeta (para revisar tickets sin papel) """
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+
+    def enviar(self, datos, titulo):
+        os.makedirs(self.carpeta, exist_ok=True)
+        nombre = f"{timezone.localtime().strftime('%Y%m%d_%H%M%S_%f')}_{titulo.replace(' ', '_')}.bin"
+        with open(os.path.join(self.carpeta, nombre), 'wb') as archivo:
+            archivo.write(datos)
+
+
+class ImpresoraMemoria(BackendImpresora):
+    """ Guarda los tickets en una lista (pruebas). ImpresoraMemoria.tickets[nombre] -> [(titulo, bytes)] """
+    tickets = {}
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def enviar(self, datos, titulo):
+        ImpresoraMemoria.tickets.setdefault(self.nombre, []).append((titulo, bytes(datos)))
+
+
+def _separar_host_puerto(direccion):
+    host, _, puerto = direccion.strip().partition(':')
+    return host, int(puerto) if puerto else 9100
+
+
+def crear_backend(nombre_impresora, tipo, direccion):
+    if tipo == 'RED':
+        host, puerto = _separar_host_puerto(direccion or nombre_impresora)
+        return ImpresoraRed(host, puerto, verificar_estado=getattr(settings, 'IMPRESION_RED_VERIFICAR_ESTADO', True))
+    if tipo == 'ARCHIVO':
+        return ImpresoraArchivo(direccion or os.path.join(settings.MEDIA_ROOT, 'tickets'))
+    if tipo == 'MEMORIA':
+        return ImpresoraMemoria(nombre_impresora)
+    return ImpresoraWindows(nombre_impresora)
+
+
+def obtener_backend(nombre_impresora):
+    """
+    Conexión para una impresora según su fila en Impresora (por nombre). Si no
+    tiene fila, es una impresora de Windows con ese nombre.
+    """
+    from core.models import Impresora
+    tipo, direccion = Impresora.objects.filter(nombre=nombre_impresora).values_list('tipo', 'direccion').first() or ('WINDOWS', '')
+    return crear_backend(nombre_impresora, tipo, direccion)
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from tables.scrapping import refrescar_tasa_bcv, _intervalo_actualizacion
+
+
+class Command(BaseCommand):
+    help = 'Consulta la tasa del dólar en el BCV y la guarda (úsese con el Programador de Tareas o con --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true', help='Consulta aunque la última tasa sea reciente')
+        parser.add_argument('--loop', action='store_true', help='Se queda corriendo y actualiza cada intervalo')
+        parser.add_argument('--url', default=None, help='URL alternativa de la página del BCV')
+
+    def handle(self, *args, **options):
+        espera_error = 60
+        while True:
+            try:
+                tasa = refrescar_tasa_bcv(forzar=options['forzar'], url=options['url'])
+                if tasa is None:
+                    self.stdout.write(self.style.WARNING('La tasa automática está desactivada en la configuración.'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'Tasa BCV vigente: {tasa} Bs/S'))
+                espera = _intervalo_actualizacion()
+                espera_error = 60
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error consultando el BCV: {e}'))
+                if not options['loop']:
+                    return
+                espera = espera_error
+                espera_error = min(espera_error * 2, _intervalo_actualizacion())
+            finally:
+                close_old_connections()
+
+            if not options['loop']:
+                return
+            time.sleep(espera)
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import time
+from unittest import mock
+from django.core.management.base import BaseCommand
+from core.models import Configuracion
+from tables import utils_impresora
+
+
+def _raster_por_pixeles(img_path, ancho_papel):
+    """ El empaquetado de bits de antes, punto por punto, para comparar """
+    from PIL import Image
+
+    img = Image.open(img_path)
+    max_width = 300 if ancho_papel == 58 else 400
+    img = img.resize((max_width, int(img.size[1] * (max_width / img.size[0]))), getattr(Image, 'Resampling', Image).LANCZOS)
+    img = img.convert('L').point(lambda x: 0 if x < 128 else 255, '1')
+    width, height = img.size
+    if width % 8 != 0:
+        width += 8 - (width % 8)
+        relleno = Image.new('1', (width, height), 1)
+        relleno.paste(img, (0, 0))
+        img = relleno
+    header = b'\x1d\x76\x30\x00' + bytes([(width // 8) % 256, (width // 8) // 256, height % 256, height // 256])
+    pixels = list(img.getdata())
+    raster = bytearray()
+    for y in range(height):
+        for x in range(0, width, 8):
+            raster.append(sum((1 << (7 - bit)) for bit in range(8) if pixels[y * width + x + bit] == 0))
+    return b'\x1b\x61\x01' + header + bytes(raster) + b'\n\x1b\x61\x00'
+
+
+class Command(BaseCommand):
+    help = ('Mide cuánto tarda armar el raster ESC/POS del logo: punto por punto (como antes), con tobytes() de PIL '
+            'y desde la caché. Usa el logo configurado o, con --imagen, cualquier archivo; sin ninguno, uno inventado.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--imagen', help='Imagen a usar en lugar del logo configurado')
+        parser.add_argument('--repeticiones', type=int, default=50, help='Veces que se arma el raster (50 por defecto)')
+        parser.add_argument('--ancho', type=int, choices=[58, 80], default=80, help='Ancho del papel en mm')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = options['imagen'] or self._logo_configurado() or self._logo_inventado(carpeta)
+            self._medir(ruta, options['ancho'], options['repeticiones'])
+
+    def _logo_configurado(self):
+        config = Configuracion.get_cached()
+        if config.logo and os.path.exists(config.logo.path):
+            return config.logo.path
+        return None
+
+    def _logo_inventado(self, carpeta):
+        from PIL import Image, ImageDraw
+
+        ruta = os.path.join(carpeta, 'logo.png')
+        imagen = Image.linear_gradient('L').resize((517, 233)).convert('RGB')
+        dibujo = ImageDraw.Draw(imagen)
+        dibujo.ellipse((40, 20, 260, 210), fill=(200, 30, 30))
+        dibujo.rectangle((300, 60, 480, 180), outline=(0, 0, 0), width=9)
+        imagen.save(ruta)
+        return ruta
+
+    def _medir(self, ruta, ancho, repeticiones):
+        from PIL import Image
+
+        with Image.open(ruta) as imagen:
+            self.stdout.write(f"{os.path.basename(ruta)} ({imagen.size[0]}x{imagen.size[1]}), papel de {ancho} mm, {repeticiones} repeticiones")
+
+        def tiempo(funcion):
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                resultado = funcion()
+            return (time.perf_counter() - inicio) * 1000 / repeticiones, resultado
+
+        antes_ms, antes = tiempo(lambda: _raster_por_pixeles(ruta, ancho))
+        ahora_ms, ahora = tiempo(lambda: utils_impresora._raster_logo(ruta, ancho))
+
+        config = mock.Mock(usar_logo_impresora=True, logo=mock.Mock(path=ruta), ancho_papel=ancho)
+        utils_impresora._logo_en_memoria.clear()
+        utils_impresora.obtener_logo_bytes(config)
+        cache_ms, en_cache = tiempo(lambda: utils_impresora.obtener_logo_bytes(config))
+        utils_impresora._logo_en_memoria.clear()
+
+        self.stdout.write(f"  Punto por punto  {antes_ms:>8.3f} ms")
+        self.stdout.write(f"  tobytes() de PIL {ahora_ms:>8.3f} ms")
+        self.stdout.write(f"  Desde la caché   {cache_ms:>8.3f} ms")
+        if antes == ahora == en_cache:
+            self.stdout.write(self.style.SUCCESS(f"  Mismo raster ({len(ahora)} bytes)"))
+        else:
+            self.stdout.write(self.style.ERROR("  ¡Los raster son distintos!"))
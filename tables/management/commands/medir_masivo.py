@@ -0,0 +1,70 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from inventory.models import Insumo, UnidadMedida
+from tables import masivo
+from tables.models import Categoria, Producto, IngredienteProducto, CostoAdicional, PrecioExtra
+
+
+class _Deshacer(Exception):
+    """ Sale del atomic() para que no quede nada de los datos de prueba """
+
+
+class Command(BaseCommand):
+    help = ('Mide cuántas consultas y cuánto tiempo toman los cambios masivos (ingrediente, costo adicional y '
+            'precios de extras) sobre N productos. Los datos se crean dentro de una transacción que se deshace al final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=1000, help='Productos seleccionados (1000 por defecto)')
+        parser.add_argument('--extras', type=int, default=30, help='Insumos en la tabla de extras (30 por defecto, x3 tamaños x2 campos)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._medir(options['productos'], options['extras'])
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+    def _datos(self, productos, extras):
+        unidad = UnidadMedida.objects.create(nombre='Gramos (medición)', codigo='GRM', factor=1)
+        insumos = [
+            Insumo.objects.create(
+                nombre=f'Ingrediente {i}', unidad=unidad, precio_mercado=Decimal('10'), peso_standar=Decimal('1000'), merma_porcentaje=Decimal('0')
+            )
+            for i in range(max(extras, 3))
+        ]
+        categoria = Categoria.objects.create(nombre='Medición')
+        creados = Producto.objects.bulk_create([
+            Producto(nombre=f'Producto de medición {i}', tamano='FAM', precio=Decimal('10.00') + i % 7, categoria=categoria)
+            for i in range(productos)
+        ])
+        IngredienteProducto.objects.bulk_create([
+            IngredienteProducto(producto=producto, insumo=insumos[j], cantidad=Decimal(50 + i % 40))
+            for i, producto in enumerate(creados) for j in range(2)
+        ])
+        costo = CostoAdicional.objects.create(nombre='Empaque (medición)', tipo='PORCENTAJE', valor_defecto=Decimal('10'))
+        return insumos, [p.pk for p in creados], costo
+
+    def _medir(self, productos, extras):
+        insumos, ids, costo = self._datos(productos, extras)
+        datos_extras = {
+            f'{campo}_{insumo.pk}_{tamano}': '1,25'
+            for insumo in insumos[:extras] for tamano, _ in PrecioExtra.TAMANOS for campo in ('precio', 'cantidad')
+        }
+        pasos = [
+            ('Ingrediente (nuevo)', lambda: masivo.asignar_ingrediente(insumos[2], Decimal('30'), ids)),
+            ('Ingrediente (cambio)', lambda: masivo.asignar_ingrediente(insumos[2], Decimal('35'), ids)),
+            ('Aplicar costo', lambda: masivo.asignar_costo(costo, Decimal('10'), ids)),
+            ('Quitar costo', lambda: masivo.quitar_costo(costo, ids)),
+            (f'{len(datos_extras)} campos de extras', lambda: masivo.guardar_precios_extras(datos_extras, [i.pk for i in insumos])),
+        ]
+        self.stdout.write(f"{productos} productos")
+        for nombre, paso in pasos:
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                paso()
+                segundos = time.perf_counter() - inicio
+            self.stdout.write(f"  {nombre:<24} {len(consultas):>5} consultas  {segundos:>6.2f} s")
@@ -0,0 +1,102 @@
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from core.models import Configuracion
+from inventory.models import Insumo, UnidadMedida
+from tables.models import (
+    Categoria, Producto, Table, Orden, DetalleOrden, DetalleOrdenExtra, DetalleOrdenRemovido,
+    Venta, DetalleVenta, DetalleVentaExtra, Pago,
+)
+from tables.tickets import (
+    cargar_venta_para_ticket, detalles_orden_para_ticket, render_factura, render_precuenta, render_comanda,
+)
+
+
+class _Deshacer(Exception):
+    """ Sale del atomic() para que no quede nada de los datos de prueba """
+
+
+class Command(BaseCommand):
+    help = ('Mide cuántas consultas y cuánto tiempo toma armar la factura, la precuenta y la comanda '
+            'de una orden de N líneas. Los datos se crean dentro de una transacción que se deshace al final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, default=30, help='Líneas de la orden y de la venta (30 por defecto)')
+        parser.add_argument('--repeticiones', type=int, default=200, help='Veces que se arma cada ticket (200 por defecto)')
+        parser.add_argument('--ancho', type=int, choices=[58, 80], default=80, help='Ancho del papel en mm')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._medir(options['lineas'], options['repeticiones'], options['ancho'])
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+    def _datos(self, lineas):
+        """ Orden y venta con mitades, cuartos, extras (con precio y sustitutos) y removidos """
+        mesero = User.objects.create(username='medicion-tickets')
+        unidad = UnidadMedida.objects.create(nombre='Gramos (medición)', codigo='GRM', factor=1)
+        insumos = [Insumo.objects.create(nombre=f'Ingrediente {i}', unidad=unidad, merma_porcentaje=Decimal('0')) for i in range(4)]
+        categoria = Categoria.objects.create(nombre='Medición')
+        productos = [
+            Producto.objects.create(nombre=f'Pizza de prueba {i}', tamano='FAM', precio=Decimal('12.00'), categoria=categoria)
+            for i in range(4)
+        ]
+        mesa = Table.objects.create(number='MEDICION')
+        orden = Orden.objects.create(mesa=mesa, mesero=mesero)
+        venta = Venta.objects.create(
+            codigo_factura='MEDICION', total=Decimal('0'), metodo_pago='EFECTIVO_USD', mesero=mesero, mesa_numero=0,
+            monto_recibido=Decimal('0'), tasa_aplicada=Decimal('36.50'),
+        )
+        Pago.objects.create(venta=venta, metodo='EFECTIVO_USD', monto=Decimal('100.00'))
+
+        for i in range(lineas):
+            partes = {}
+            if i % 3 == 1:
+                partes = {'mitad_producto': productos[1]}
+            elif i % 3 == 2:
+                partes = {'cuarto_2_producto': productos[1], 'cuarto_3_producto': productos[2], 'cuarto_4_producto': productos[3]}
+            detalle = DetalleOrden.objects.create(orden=orden, producto=productos[0], cantidad=1, precio_unitario=Decimal('12.00'), **partes)
+            DetalleOrdenExtra.objects.create(detalle_orden=detalle, insumo=insumos[0], precio=Decimal('1.50'), porcion=Decimal('1.00'))
+            DetalleOrdenExtra.objects.create(detalle_orden=detalle, insumo=insumos[1], precio=Decimal('0.00'), porcion=Decimal('0.50'))
+            detalle.ingredientes_removidos.add(insumos[2])
+            DetalleOrdenRemovido.objects.create(detalle_orden=detalle, insumo=insumos[3], porcion=Decimal('0.50'))
+
+            vendido = DetalleVenta.objects.create(
+                venta=venta, producto=productos[0], nombre_producto=productos[0].nombre, cantidad=1,
+                precio_unitario=Decimal('12.00'), subtotal=Decimal('12.00'),
+                nombre_mitad=productos[1].nombre if 'mitad_producto' in partes else None,
+                nombre_cuarto_2=productos[1].nombre if partes.get('cuarto_2_producto') else None,
+                nombre_cuarto_3=productos[2].nombre if partes.get('cuarto_2_producto') else None,
+                nombre_cuarto_4=productos[3].nombre if partes.get('cuarto_2_producto') else None,
+                **partes,
+            )
+            DetalleVentaExtra.objects.create(detalle_venta=vendido, nombre_extra=insumos[0].nombre, precio=Decimal('1.50'))
+        return orden, venta
+
+    def _medir(self, lineas, repeticiones, ancho):
+        orden, venta = self._datos(lineas)
+        config = Configuracion.get_cached()
+        config.ancho_papel = ancho
+        tasa = Decimal('36.50')
+        total = Decimal('100.00')
+
+        tickets = [
+            ('Factura', lambda: render_factura(
+                cargar_venta_para_ticket(Venta.objects.get(pk=venta.pk)), config, total, total * tasa, total, Decimal('0'), Decimal('0'))),
+            ('Precuenta', lambda: render_precuenta(orden, detalles_orden_para_ticket(orden.detalles.all()), config, tasa)),
+            ('Comanda', lambda: render_comanda(orden, list(detalles_orden_para_ticket(orden.detalles.all())), config)),
+        ]
+        self.stdout.write(f"{lineas} líneas, papel de {ancho} mm, {repeticiones} repeticiones")
+        for nombre, armar in tickets:
+            with CaptureQueriesContext(connection) as consultas:
+                datos = armar()
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                armar()
+            ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+            self.stdout.write(f"  {nombre:<10} {len(consultas):>3} consultas  {ms:>7.2f} ms  {len(datos):>6} bytes")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from inventory.models import Insumo
+from tables.costos import recalcular_costos, CicloDeRecetas
+from tables.models import Producto
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el costo de todas las recetas (insumos compuestos) y productos a partir del costo de la materia prima'
+
+    def handle(self, *args, **options):
+        try:
+            resultado = recalcular_costos(
+                insumo_ids=list(Insumo.objects.values_list('id', flat=True)),
+                producto_ids=list(Producto.objects.values_list('id', flat=True)),
+            )
+        except CicloDeRecetas as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Costos recalculados: {len(resultado['insumos'])} receta(s) y {len(resultado['productos'])} producto(s)."
+        ))
@@ -0,0 +1,148 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from .costos import recalcular_costos
+from .models import Producto, IngredienteProducto, CostoAsignadoProducto, PrecioExtra, CATALOGO_CACHE_KEY
+
+# ==========================================
+#  CAMBIOS MASIVOS (recetas, costos adicionales, precios de extras)
+# ==========================================
+# Las pantallas de "aplicar a varios productos" validan todo una sola vez,
+# escriben con bulk_create / bulk_update y recalculan los costos de los
+# productos tocados al final, en una sola pasada del motor de costos.
+# Mientras dura el lote, las señales por fila (recalcular el producto, borrar
+# el catálogo en caché) no hacen nada: se hace una vez al terminar.
+
+_estado = threading.local()
+
+
+def senales_suspendidas():
+    """ True si estamos dentro de un en_lote() en este hilo """
+    return getattr(_estado, 'profundidad', 0) > 0
+
+
+@contextmanager
+def en_lote():
+    """ Todo dentro es una transacción y las señales de costos/catálogo esperan al final """
+    _estado.profundidad = getattr(_estado, 'profundidad', 0) + 1
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        _estado.profundidad -= 1
+
+
+def _terminar_lote(producto_ids=()):
+    if producto_ids:
+        recalcular_costos(producto_ids=producto_ids)
+    # Después del COMMIT: si se borra antes, otra petición puede volver a llenar
+    # la caché con el catálogo viejo mientras la transacción sigue abierta
+    transaction.on_commit(lambda: cache.delete(CATALOGO_CACHE_KEY))
+
+
+def validar_productos(producto_ids):
+    """ Los ids como enteros, sin repetir y en el orden recibido. ValueError si alguno no existe """
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in producto_ids))
+    except (TypeError, ValueError):
+        raise ValueError("La lista de productos tiene valores inválidos.")
+    existentes = set(Producto.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    faltan = [pk for pk in ids if pk not in existentes]
+    if faltan:
+        raise ValueError(f"No existen los productos: {', '.join(map(str, faltan))}")
+    return ids
+
+
+def asignar_ingrediente(insumo, cantidad, producto_ids):
+    """
+    Pone (o cambia) la cantidad de un insumo en la receta de todos los productos.
+    Devuelve (creados, actualizados).
+    """
+    ids = validar_productos(producto_ids)
+    with en_lote():
+        # Sin restricción única en (producto, insumo) no se puede usar update_conflicts:
+        # se buscan las líneas que ya existen en una consulta y se separan
+        existentes = list(IngredienteProducto.objects.filter(producto_id__in=ids, insumo=insumo).only('pk', 'producto_id'))
+        for linea in existentes:
+            linea.cantidad = cantidad
+        IngredienteProducto.objects.bulk_update(existentes, ['cantidad'], batch_size=500)
+
+        con_linea = {linea.producto_id for linea in existentes}
+        nuevas = [IngredienteProducto(producto_id=pk, insumo=insumo, cantidad=cantidad) for pk in ids if pk not in con_linea]
+        IngredienteProducto.objects.bulk_create(nuevas, batch_size=500)
+        _terminar_lote(ids)
+    return len(nuevas), len(existentes)
+
+
+def asignar_costo(costo_adicional, valor, producto_ids):
+    """
+    Agrega el costo adicional a los productos que no lo tienen (los que ya lo
+    tienen se dejan como están). Devuelve (agregados, omitidos).
+    """
+    ids = validar_productos(producto_ids)
+    with en_lote():
+        ya_tienen = set(CostoAsignadoProducto.objects.filter(
+            producto_id__in=ids, costo_adicional=costo_adicional
+        ).values_list('producto_id', flat=True))
+        nuevos = [
+            CostoAsignadoProducto(producto_id=pk, costo_adicional=costo_adicional, valor_aplicado=valor)
+            for pk in ids if pk not in ya_tienen
+        ]
+        CostoAsignadoProducto.objects.bulk_create(nuevos, batch_size=500)
+        _terminar_lote([asignado.producto_id for asignado in nuevos])
+    return len(nuevos), len(ids) - len(nuevos)
+
+
+def quitar_costo(costo_adicional, producto_ids):
+    """ Quita el costo adicional de los productos. Devuelve cuántas asignaciones se borraron """
+    ids = validar_productos(producto_ids)
+    with en_lote():
+        asignados = CostoAsignadoProducto.objects.filter(producto_id__in=ids, costo_adicional=costo_adicional)
+        afectados = list(asignados.values_list('producto_id', flat=True).distinct())
+        borrados, _ = asignados.delete()
+        _terminar_lote(afectados)
+    return borrados
+
+
+def _decimal(valor):
+    """ '' -> 0; acepta coma decimal. ValueError si no es un número """
+    texto = str(valor or '').strip().replace(',', '.')
+    try:
+        return Decimal(texto) if texto else Decimal('0')
+    except ArithmeticError:
+        raise ValueError(f"'{valor}' no es un número válido.")
+
+
+def guardar_precios_extras(datos, insumos_validos):
+    """
+    datos: lo que manda la tabla de extras, {'precio_<insumo>_<TAM>': valor, 'cantidad_<insumo>_<TAM>': valor}.
+    Crea o actualiza cada PrecioExtra (insumo, tamaño) con un solo upsert por
+    grupo de campos. Devuelve cuántos registros se escribieron.
+    """
+    tamanos = {codigo for codigo, _ in PrecioExtra.TAMANOS}
+    insumos_validos = set(insumos_validos)
+    filas = {}
+    for clave, valor in datos.items():
+        campo, _, resto = clave.partition('_')
+        if campo not in ('precio', 'cantidad'):
+            continue
+        insumo_id, _, tamano = resto.partition('_')
+        if not insumo_id.isdigit() or int(insumo_id) not in insumos_validos or tamano not in tamanos:
+            raise ValueError(f"Campo desconocido: {clave}")
+        filas.setdefault((int(insumo_id), tamano), {})[campo] = _decimal(valor)
+
+    # Si llega solo el precio (o solo la cantidad) el otro campo no se toca
+    grupos = {}
+    for (insumo_id, tamano), valores in filas.items():
+        grupos.setdefault(tuple(sorted(valores)), []).append(PrecioExtra(insumo_id=insumo_id, tamano=tamano, **valores))
+
+    with en_lote():
+        for campos, registros in grupos.items():
+            PrecioExtra.objects.bulk_create(
+                registros, batch_size=500,
+                update_conflicts=True, unique_fields=['insumo', 'tamano'], update_fields=list(campos),
+            )
+        _terminar_lote()
+    return len(filas)
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def inicializar_contador(apps, schema_editor):
+    Venta = apps.get_model('tables', 'Venta')
+    ContadorFactura = apps.get_model('tables', 'ContadorFactura')
+    codigos = Venta.objects.values_list('codigo_factura', flat=True)
+    ultimo = max((int(c) for c in codigos if c.isdigit()), default=0)
+    ContadorFactura.objects.update_or_create(pk=1, defaults={'ultimo_numero': ultimo})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0024_venta_tasa_aplicada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorFactura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_numero', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(inicializar_contador, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='table',
+            name='color',
+            field=models.CharField(default='#0d6efd', max_length=7, verbose_name='Color'),
+        ),
+    ]
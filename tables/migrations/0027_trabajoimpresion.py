@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0026_tasabcv_fecha_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoImpresion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('impresora', models.CharField(max_length=100)),
+                ('titulo', models.CharField(max_length=50)),
+                ('datos', models.BinaryField()),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('IMPRIMIENDO', 'Imprimiendo'), ('IMPRESO', 'Impreso'), ('ERROR', 'Error')], default='PENDIENTE', max_length=12)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('ultimo_error', models.CharField(blank=True, default='', max_length=255)),
+                ('proximo_intento', models.DateTimeField(blank=True, null=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('detalles_ids', models.JSONField(blank=True, default=list)),
+                ('mesa', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos_impresion', to='tables.table')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Impresión',
+                'verbose_name_plural': 'Trabajos de Impresión',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['impresora', 'estado', 'id'], name='trabajo_impresora_estado_idx'), models.Index(fields=['mesa', 'estado'], name='trabajo_mesa_estado_idx')],
+            },
+        ),
+    ]
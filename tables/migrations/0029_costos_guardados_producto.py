@@ -0,0 +1,70 @@
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def calcular_margen(precio, costo_total):
+    """ Copia de tables.models.calcular_margen al momento de esta migración """
+    precio = Decimal(precio or 0)
+    if precio > 0:
+        return ((precio - Decimal(costo_total or 0)) / precio * 100).quantize(Decimal('0.01'))
+    return Decimal('0.00')
+
+
+def llenar_costos(apps, schema_editor):
+    # Mismas fórmulas de tables/costos.py, con los modelos históricos
+    Producto = apps.get_model('tables', 'Producto')
+    IngredienteProducto = apps.get_model('tables', 'IngredienteProducto')
+    CostoAsignadoProducto = apps.get_model('tables', 'CostoAsignadoProducto')
+
+    recetas = {}
+    for producto_id, cantidad, costo_unitario in IngredienteProducto.objects.values_list('producto_id', 'cantidad', 'insumo__costo_unitario'):
+        recetas[producto_id] = recetas.get(producto_id, Decimal('0')) + cantidad * costo_unitario
+    indirectos = {}
+    for producto_id, tipo, valor in CostoAsignadoProducto.objects.values_list('producto_id', 'costo_adicional__tipo', 'valor_aplicado'):
+        monto = valor if tipo == 'FIJO' else (valor / 100) * recetas.get(producto_id, Decimal('0'))
+        indirectos[producto_id] = indirectos.get(producto_id, Decimal('0')) + monto
+
+    centavos = Decimal('0.01')
+    productos = list(Producto.objects.all())
+    for producto in productos:
+        receta = recetas.get(producto.pk, Decimal('0'))
+        extra = indirectos.get(producto.pk, Decimal('0'))
+        producto.costo_materia_prima = receta.quantize(centavos)
+        producto.costo_indirectos = extra.quantize(centavos)
+        producto.costo_total = (receta + extra).quantize(centavos)
+        producto.margen = calcular_margen(producto.precio, producto.costo_total)
+    Producto.objects.bulk_update(productos, ['costo_materia_prima', 'costo_indirectos', 'costo_total', 'margen'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0028_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='costo_indirectos',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10, verbose_name='Costos Adicionales ($)'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='costo_total',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10, verbose_name='Costo Total ($)'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='margen',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Margen (%)'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['margen'], name='producto_margen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['costo_total'], name='producto_costo_total_idx'),
+        ),
+        migrations.RunPython(llenar_costos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0029_costos_guardados_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoimpresion',
+            name='propietario',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='trabajoimpresion',
+            name='reservado_hasta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -2,17 +2,26 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.core.cache import cache
 from decimal import Decimal
 from inventory.models import Insumo
 
 # 1. Modelo para optimizar el BCV (Punto 1)
 class TasaBCV(models.Model):
     precio = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Precio en Bs")
-    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Tasa: {self.precio} (Actualizada: {self.fecha_actualizacion.strftime('%d/%m %H:%M')})"
 
+# Claves de caché de las tasas (ver tables/tasas.py)
+TASA_BCV_CACHE_KEY = 'tables:tasa_bcv'
+SERIE_TASAS_CACHE_KEY = 'tables:serie_tasas'
+
+@receiver([post_save, post_delete], sender=TasaBCV, dispatch_uid="invalidar_cache_tasas")
+def invalidar_cache_tasas(sender, instance, **kwargs):
+    cache.delete_many([TASA_BCV_CACHE_KEY, SERIE_TASAS_CACHE_KEY])
+
 # 2. Modelos para el POS (Punto 2)
 class Categoria(models.Model):
     nombre = models.CharField(max_length=50) # Ej: IND, MED, FAM, BEBIDAS
@@ -20,6 +29,13 @@ class Categoria(models.Model):
     def __str__(self):
         return self.nombre
 
+def calcular_margen(precio, costo_total):
+    """ Margen de ganancia en % sobre el precio de venta (0 si no tiene precio) """
+    precio = Decimal(precio or 0)
+    if precio > 0:
+        return ((precio - Decimal(costo_total or 0)) / precio * 100).quantize(Decimal('0.01'))
+    return Decimal('0.00')
+
 class Producto(models.Model):
     OPCIONES_TAMANO = [
         ('IND', 'Individual'),
@@ -53,79 +69,62 @@ class Producto(models.Model):
     # OPCIONAL: Imagen del producto
     # imagen = models.ImageField(upload_to='productos/', blank=True, null=True)
 
+    # --- COSTOS GUARDADOS ---
+    # Los mantiene al día el motor de costos (tables/costos.py) cada vez que cambia
+    # un insumo, una receta o un costo adicional. Así el catálogo puede ordenar y
+    # filtrar por costo o margen en la BD sin recorrer las recetas.
+    costo_materia_prima = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Costo Ingredientes ($)")
+    costo_indirectos = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Costos Adicionales ($)")
+    costo_total = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Costo Total ($)")
+    margen = models.DecimalField(max_digits=12, decimal_places=2, default=0.00, verbose_name="Margen (%)")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['margen'], name='producto_margen_idx'),
+            models.Index(fields=['costo_total'], name='producto_costo_total_idx'),
+        ]
+
     def __str__(self):
         if self.tamano == 'UNI':
             return self.nombre
         return f"{self.nombre} ({self.get_tamano_display()})"
 
-    # --- LÓGICA DE COSTOS AUTOMÁTICA ---
-    @property
-    def costo_receta(self):
-        """Calcula cuánto cuesta hacer este producto sumando sus ingredientes"""
-        total_costo = Decimal('0.00')
-        # Recorremos todos los ingredientes de este producto
-        for ingrediente in self.ingredientes.all():
-            if ingrediente.insumo:
-                # Costo = Cantidad de la receta * Costo Promedio actual del insumo
-                costo_insumo = ingrediente.cantidad * ingrediente.insumo.costo_unitario
-                total_costo += costo_insumo
-        return total_costo
-
-    @property
-    def ganancia_estimada(self):
-        """Muestra cuánto ganas: Precio Venta - Costo Receta"""
-        return self.precio - self.costo_receta
-    
-    @property
-    def margen_ganancia(self):
-        """Margen en porcentaje"""
-        if self.precio > 0:
-            return (self.ganancia_estimada / self.precio) * 100
-        return 0
+    def save(self, *args, **kwargs):
+        # El margen depende del precio: se recalcula aquí; los costos los pone el motor
+        self.margen = calcular_margen(self.precio, self.costo_total)
+        super().save(*args, **kwargs)
 
     # COSTO 1: Solo Ingredientes (Materia Prima)
     @property
     def costo_receta(self):
-        total_costo = Decimal('0.00')
-        for ingrediente in self.ingredientes.all():
-            if ingrediente.insumo:
-                total_costo += ingrediente.cantidad * ingrediente.insumo.costo_unitario
-        return total_costo
+        return self.costo_materia_prima
 
-    costo_materia_prima = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Costo Ingredientes ($)")
-
-    def __str__(self):
-        if self.tamano == 'UNI':
-            return self.nombre
-        return f"{self.nombre} ({self.get_tamano_display()})"
     # COSTO 2: Suma de Costos Adicionales (Mano de obra, gas, etc)
     @property
     def costo_indirectos_total(self):
-        total = Decimal('0.00')
-        for costo in self.costos_adicionales.all():
-            total += costo.monto_calculado
-        return total
+        return self.costo_indirectos
 
     # COSTO 3: Costo TOTAL FINAL (Ingredientes + Indirectos)
     @property
     def costo_total_real(self):
-        return self.costo_receta + self.costo_indirectos_total
+        return self.costo_total
 
     # GANANCIA REAL (Precio Venta - Costo Total Real)
     @property
     def ganancia_estimada(self):
-        return self.precio - self.costo_total_real
+        return self.precio - self.costo_total
+
+    @property
+    def margen_ganancia(self):
+        """Margen en porcentaje"""
+        return self.margen
     
     # --- FUNCIÓN DE ACTUALIZACIÓN ---
     def actualizar_costo_receta(self):
-        """Recorre los ingredientes y actualiza el campo costo_materia_prima"""
-        total = Decimal('0.00')
-        for ingrediente in self.ingredientes.all():
-            if ingrediente.insumo:
-                total += ingrediente.cantidad * ingrediente.insumo.costo_unitario
-        
-        self.costo_materia_prima = total
-        self.save() # Guardamos el nuevo costo en la BD
+        """Recalcula los costos guardados del producto con el motor de costos (tables/costos.py)"""
+        from .costos import recalcular_costos
+        recalcular_costos(producto_ids=[self.pk])
+        self.refresh_from_db(fields=['costo_materia_prima', 'costo_indirectos', 'costo_total', 'margen'])
     
     
 class Table(models.Model):
@@ -190,32 +189,50 @@ class CostoAsignadoProducto(models.Model):
             return self.valor_aplicado
         else:
             # Si es porcentaje, calculamos sobre el costo de los ingredientes
-            # (Valor / 100) * CostoReceta
-            return (self.valor_aplicado / 100) * self.producto.costo_receta
+            # (Valor / 100) * CostoReceta, sin redondear (igual que el motor de costos)
+            receta = sum(
+                (cantidad * costo_unitario for cantidad, costo_unitario in
+                 self.producto.ingredientes.values_list('cantidad', 'insumo__costo_unitario')),
+                Decimal('0.00'),
+            )
+            return (self.valor_aplicado / 100) * receta
         
 # SEÑAL 3: Si se edita un Costo Adicional Maestro -> Actualizar el valor en TODOS los productos
 @receiver(post_save, sender=CostoAdicional, dispatch_uid="update_costos_asignados_unico")
 def update_costos_asignados(sender, instance, **kwargs):
-    CostoAsignadoProducto.objects.filter(costo_adicional=instance).update(valor_aplicado=instance.valor_defecto)
+    asignados = CostoAsignadoProducto.objects.filter(costo_adicional=instance)
+    asignados.update(valor_aplicado=instance.valor_defecto)
+    # update() no dispara señales: recalculamos los productos que llevan este costo
+    from .costos import recalcular_costos
+    recalcular_costos(producto_ids=list(asignados.values_list('producto_id', flat=True)))
+
+# SEÑAL 4: Si se agrega, cambia o quita un costo adicional de un producto -> Recalcular ese producto
+@receiver([post_save, post_delete], sender=CostoAsignadoProducto, dispatch_uid="update_costo_asignado_unico")
+def update_costo_por_costo_asignado(sender, instance, **kwargs):
+    from .masivo import senales_suspendidas
+    if senales_suspendidas():
+        return  # Cambio masivo: se recalcula todo junto al final (tables/masivo.py)
+    from .costos import recalcular_costos
+    recalcular_costos(producto_ids=[instance.producto_id])
 
 @receiver([post_save, post_delete], sender=IngredienteProducto, dispatch_uid="update_costo_receta_unico")
 def update_costo_por_receta(sender, instance, **kwargs):
     # 'instance' es el IngredienteProducto
-    if instance.producto:
-        instance.producto.actualizar_costo_receta()
+    from .masivo import senales_suspendidas
+    if instance.producto_id and not senales_suspendidas():
+        from .costos import recalcular_costos
+        recalcular_costos(producto_ids=[instance.producto_id])
 
-# SEÑAL 2: Si cambia el precio del INSUMO en Inventario -> Actualizar TODOS los productos que lo usen
+# SEÑAL 2: Si cambia el precio del INSUMO en Inventario -> Actualizar las recetas y productos que lo usen
 @receiver(post_save, sender=Insumo, dispatch_uid="update_costo_insumo_unico")
 def update_costo_por_insumo(sender, instance, **kwargs):
-    # 'instance' es el Insumo (ej: Harina) que acaba de cambiar de precio
-    
-    # Buscamos todas las recetas que usan este insumo
-    # (Usamos el 'related_name' por defecto o el set inverso)
-    ingredientes_afectados = instance.ingredienteproducto_set.all()
-    
-    # Para cada ingrediente encontrado, le decimos a su producto que se recalcule
-    for ingrediente in ingredientes_afectados:
-        ingrediente.producto.actualizar_costo_receta()
+    # 'instance' es el Insumo (ej: Harina) que acaba de cambiar de precio.
+    # Las recetas se recalculan en Insumo.save() (calcular_costo_desde_subreceta),
+    # que ya arrastra a sus padres y productos: aquí solo la materia prima.
+    if instance.es_insumo_compuesto:
+        return
+    from .costos import recalcular_costos
+    recalcular_costos(insumo_ids=[instance.pk])
 
 # --- HISTORIAL DE VENTAS (Para Reportes) ---
 class Venta(models.Model):
@@ -250,10 +267,43 @@ class Venta(models.Model):
     tasa_aplicada = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, help_text="Tasa en el momento de la venta")
     # =======================
 
+    class Meta:
+        # Los reportes y el cuadre filtran por rango de fechas (y casi siempre anulada=False)
+        indexes = [
+            models.Index(fields=['fecha'], name='venta_fecha_idx'),
+            # Índice parcial solo con las ventas válidas (el filtro más usado)
+            models.Index(fields=['fecha'], condition=models.Q(anulada=False), name='venta_valida_fecha_idx'),
+        ]
+
     def __str__(self):
         estado = " (ANULADA)" if self.anulada else ""
         return f"Factura #{self.codigo_factura}{estado}"
 
+# --- CONTADOR DE FACTURAS ---
+# Una sola fila con el último número emitido. Se incrementa con un UPDATE atómico
+# dentro de la misma transacción que crea la Venta: si la venta falla, el número
+# se devuelve con el rollback (sin huecos) y dos cajeros nunca reciben el mismo.
+class ContadorFactura(models.Model):
+    ultimo_numero = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Última factura: {self.ultimo_numero:06d}"
+
+    @classmethod
+    def siguiente_codigo(cls):
+        """ Reserva el próximo número de factura. Debe llamarse dentro de transaction.atomic() """
+        actualizados = cls.objects.filter(pk=1).update(ultimo_numero=models.F('ultimo_numero') + 1)
+        if not actualizados:
+            # Primera factura del sistema (o la fila fue borrada): se arranca desde el mayor código existente
+            cls.objects.get_or_create(pk=1, defaults={'ultimo_numero': cls._mayor_codigo_emitido()})
+            cls.objects.filter(pk=1).update(ultimo_numero=models.F('ultimo_numero') + 1)
+        numero = cls.objects.filter(pk=1).values_list('ultimo_numero', flat=True).get()
+        return f"{numero:06d}"
+
+    @staticmethod
+    def _mayor_codigo_emitido():
+        return max((int(c) for c in Venta.objects.values_list('codigo_factura', flat=True) if c.isdigit()), default=0)
+
 class DetalleVenta(models.Model):
     venta = models.ForeignKey(Venta, on_delete=models.CASCADE, related_name='detalles')
     producto = models.ForeignKey(Producto, on_delete=models.SET_NULL, null=True)
@@ -382,6 +432,11 @@ class Pago(models.Model):
     monto = models.DecimalField(max_digits=10, decimal_places=2, help_text="Monto abonado en USD")
     referencia = models.CharField(max_length=50, blank=True, null=True, help_text="Ref bancaria si aplica")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['venta', 'metodo'], name='pago_venta_metodo_idx'),
+        ]
+
     def __str__(self):
         return f"{self.get_metodo_display()}: ${self.monto}"
     
@@ -428,4 +483,60 @@ class PrecioExtra(models.Model):
 
     def __str__(self):
         return f"{self.insumo.nombre} ({self.tamano}) - ${self.precio}"
-    
\ No newline at end of file
+    
+# --- CATÁLOGO DEL MENÚ (ver tables/catalogo.py) ---
+# Cualquier cambio en productos, recetas, precios de extras o insumos (nombre,
+# es_extra, unidad) borra el catálogo en caché; se reconstruye al pedirlo.
+CATALOGO_CACHE_KEY = 'tables:catalogo'
+
+@receiver([post_save, post_delete], sender=Producto, dispatch_uid="invalidar_catalogo_producto")
+@receiver([post_save, post_delete], sender=IngredienteProducto, dispatch_uid="invalidar_catalogo_receta")
+@receiver([post_save, post_delete], sender=PrecioExtra, dispatch_uid="invalidar_catalogo_precio_extra")
+@receiver([post_save, post_delete], sender=Insumo, dispatch_uid="invalidar_catalogo_insumo")
+def invalidar_catalogo(sender, instance, **kwargs):
+    from .masivo import senales_suspendidas
+    if not senales_suspendidas():
+        cache.delete(CATALOGO_CACHE_KEY)
+
+# --- COLA DE IMPRESIÓN (ver tables/cola_impresion.py) ---
+# Cada ticket (comanda, factura, precuenta...) queda registrado aquí antes de
+# mandarse a la impresora: si la impresora está apagada se reintenta y, si
+# falla del todo, queda el error a la vista en vez de perderse.
+class TrabajoImpresion(models.Model):
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('IMPRIMIENDO', 'Imprimiendo'),
+        ('IMPRESO', 'Impreso'),
+        ('ERROR', 'Error'),
+    ]
+
+    impresora = models.CharField(max_length=100)
+    titulo = models.CharField(max_length=50)
+    datos = models.BinaryField()
+    estado = models.CharField(max_length=12, choices=ESTADOS, default='PENDIENTE')
+    intentos = models.PositiveIntegerField(default=0)
+    ultimo_error = models.CharField(max_length=255, blank=True, default="")
+    proximo_intento = models.DateTimeField(null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    # Para la pantalla de pedidos: de qué mesa es y qué líneas marcar como impresas
+    mesa = models.ForeignKey(Table, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos_impresion')
+    detalles_ids = models.JSONField(default=list, blank=True)
+
+    # Quién lo está imprimiendo y hasta cuándo vale esa reserva: si el proceso
+    # muere a mitad de la impresión, al vencer la reserva otro hilo lo retoma
+    propietario = models.CharField(max_length=100, blank=True, default="")
+    reservado_hasta = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['impresora', 'estado', 'id'], name='trabajo_impresora_estado_idx'),
+            models.Index(fields=['mesa', 'estado'], name='trabajo_mesa_estado_idx'),
+        ]
+        verbose_name = "Trabajo de Impresión"
+        verbose_name_plural = "Trabajos de Impresión"
+
+    def __str__(self):
+        return f"{self.titulo} #{self.id} ({self.get_estado_display()})"
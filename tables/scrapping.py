@@ -1,68 +1,149 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
 import requests
 from bs4 import BeautifulSoup
 import urllib3
+from django.conf import settings
+from django.db import close_old_connections
 from django.utils import timezone
 from .models import TasaBCV # Importamos el modelo que acabamos de crear
+from .tasas import tasa_bcv_actual
 from core.models import Configuracion
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Agregamos cabeceras (User-Agent) porque el BCV bloquea peticiones de bots (HTTP 403)
+HEADERS_BCV = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+_actualizador = None
+_actualizador_lock = threading.Lock()
+
+
+def _intervalo_actualizacion():
+    # Limitamos a 1 consulta cada HORA por defecto: evita que el BCV bloquee la IP
+    return getattr(settings, 'BCV_INTERVALO_ACTUALIZACION', 3600)
+
+
+def extraer_tasa_de_html(html):
+    """ Saca el precio del dólar de la página del BCV. Devuelve Decimal o None. """
+    soup = BeautifulSoup(html, 'html.parser')
+    contenedor = soup.find(id='dolar')
+    if not contenedor:
+        return None
+    dolar_tag = contenedor.find('strong')
+    if not dolar_tag:
+        return None
+    texto_punto = dolar_tag.get_text().strip().replace(',', '.')
+    try:
+        return Decimal(texto_punto).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+
+def descargar_tasa_bcv(url=None, timeout=10):
+    """ Conexión a Internet (lenta). Lanza excepción si no se pudo leer la tasa. """
+    url = url or getattr(settings, 'BCV_URL', 'https://www.bcv.org.ve')
+    response = requests.get(url, verify=False, headers=HEADERS_BCV, timeout=timeout)
+    response.raise_for_status()
+    tasa = extraer_tasa_de_html(response.text)
+    if tasa is None:
+        raise ValueError("No se encontró la tasa del dólar en la página del BCV")
+    return tasa
+
+
+def refrescar_tasa_bcv(forzar=False, url=None):
+    """
+    Hace el scraping y guarda la tasa, salvo que la última guardada sea reciente
+    o que la configuración no use la tasa automática (y no se pida forzar).
+    Devuelve la tasa vigente (Decimal) o None. Lanza excepción si el scraping falla.
+    """
+    config = Configuracion.get_cached()
+    if not forzar and not config.usar_scraping_bcv and not config.usar_tasa_bcv_para_cashea:
+        return None
+
+    ultima_tasa = TasaBCV.objects.order_by('-fecha_actualizacion').first()
+    if not forzar and ultima_tasa:
+        tiempo_transcurrido = timezone.now() - ultima_tasa.fecha_actualizacion
+        if tiempo_transcurrido.total_seconds() < _intervalo_actualizacion():
+            return ultima_tasa.precio
+
+    print("Actualizando tasa desde BCV (Internet)...")
+    tasa = descargar_tasa_bcv(url=url)
+    # Guardamos siempre para mantener el historial (auditoría) solicitado
+    # (al guardar, la señal de TasaBCV limpia la caché de tasas)
+    TasaBCV.objects.create(precio=tasa)
+    return tasa
+
+
+def current_rate():
+    """
+    Tasa BCV vigente SIN tocar Internet: la caché compartida o, si está vacía,
+    la última guardada en la BD. Es lo que deben usar las vistas. Devuelve Decimal o None.
+    """
+    return tasa_bcv_actual()
+
+
+def _segundos_hasta_proxima_actualizacion():
+    """
+    Cuánto falta para que la última tasa guardada deje de ser reciente. Si se
+    saltó el scraping porque la tasa era reciente, hay que despertar cuando
+    venza, no un intervalo completo después (la tasa mostrada llegaría a tener
+    casi dos intervalos).
+    """
+    intervalo = _intervalo_actualizacion()
+    ultima = TasaBCV.objects.order_by('-fecha_actualizacion').values_list('fecha_actualizacion', flat=True).first()
+    if ultima is None:
+        return intervalo
+    restante = (ultima + timedelta(seconds=intervalo) - timezone.now()).total_seconds()
+    # Ya vencida (p. ej. la tasa automática está desactivada): se revisa en un intervalo
+    return max(restante, 1) if restante > 0 else intervalo
+
+
+def _bucle_actualizador():
+    espera_error = 60
+    while True:
+        try:
+            refrescar_tasa_bcv()
+            espera = _segundos_hasta_proxima_actualizacion()
+            espera_error = 60
+        except Exception as e:
+            print(f"Error scraping: {e}")
+            # Reintento con espera creciente (1 min, 2 min, 4 min... hasta el intervalo normal)
+            espera = espera_error
+            espera_error = min(espera_error * 2, _intervalo_actualizacion())
+        finally:
+            close_old_connections()
+        time.sleep(espera)
+
+
+def iniciar_actualizador_tasa():
+    """ Arranca (una sola vez por proceso) el hilo que mantiene la tasa al día. """
+    global _actualizador
+    with _actualizador_lock:
+        if _actualizador is None or not _actualizador.is_alive():
+            _actualizador = threading.Thread(target=_bucle_actualizador, name='actualizador-tasa-bcv', daemon=True)
+            _actualizador.start()
+
+
 def obtener_tasa_bcv():
     """
-    Lógica inteligente:
-    1. Revisa si ya tenemos una tasa guardada de HOY.
-    2. Si existe, la devuelve (Rápido).
-    3. Si no existe o es vieja, hace scraping (Lento), la guarda y la devuelve.
+    Texto de la tasa para mostrar. Ya no hace scraping en la petición:
+    se asegura de que el actualizador en segundo plano esté corriendo y
+    devuelve lo que haya en caché/BD.
     """
-    config = Configuracion.get_solo()
-    
+    config = Configuracion.get_cached()
+
     # Si NINGUNO de los dos necesita scraping, no hacemos nada con la BD
     if not config.usar_scraping_bcv and not config.usar_tasa_bcv_para_cashea:
         return f"{config.tasa_dolar} Bs/S (Manual)"
-    
-    # --- 1. INTENTO DE BASE DE DATOS ---
-    # Buscamos la última tasa guardada
-    ultima_tasa = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    
-    if ultima_tasa:
-        # Permitimos múltiples actualizaciones al día.
-        # En lugar de 1 por día, limitamos a 1 consulta cada HORA (3600 segundos).
-        # Esto evita que el BCV bloquee tu IP por exceso de peticiones.
-        tiempo_transcurrido = timezone.now() - ultima_tasa.fecha_actualizacion
-        if tiempo_transcurrido.total_seconds() < 3600:
-            # Ya tenemos una tasa reciente (< 1 hora), no hace falta hacer scraping
-            return f"{ultima_tasa.precio}"
 
-    # --- 2. INTENTO DE SCRAPING (Conexión a Internet) ---
-    print("Actualizando tasa desde BCV (Internet)...")
-    url = 'https://www.bcv.org.ve'
-    
-    try:
-        # Agregamos cabeceras (User-Agent) porque el BCV bloquea peticiones de bots (HTTP 403)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        response = requests.get(url, verify=False, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        contenedor = soup.find(id='dolar')
-        
-        if contenedor:
-            dolar_tag = contenedor.find('strong')
-            if dolar_tag:
-                texto_crudo = dolar_tag.get_text().strip()
-                texto_punto = texto_crudo.replace(',', '.')
-                valor_float = float(texto_punto)
-
-                # --- 3. GUARDAMOS EN BASE DE DATOS ---
-                # Guardamos siempre para mantener el historial (auditoría) solicitado
-                TasaBCV.objects.create(precio=valor_float)
-
-                return f"{valor_float:.2f} Bs/S"
-                
-    except Exception as e:
-        print(f"Error scraping: {e}")
-        # Si falla el scraping, intentamos devolver la vieja aunque no sea de hoy
-        if ultima_tasa:
-             return f"{ultima_tasa.precio} Bs/S"
-        return "Sin conexión"
\ No newline at end of file
+    iniciar_actualizador_tasa()
+    tasa = current_rate()
+    if tasa is None:
+        return "Sin conexión"
+    return f"{tasa:.2f} Bs/S"
@@ -0,0 +1,188 @@
+from inventory.models import Insumo
+from .costos import grafo_compuestos, orden_topologico
+from .models import Producto, IngredienteProducto, CostoAsignadoProducto
+
+# ==========================================
+#  SIMULADOR DE PRECIOS ("¿y si sube la harina?")
+# ==========================================
+# Carga el catálogo completo (costos de insumos, sub-recetas, recetas de los
+# productos y costos adicionales) en arreglos de NumPy y recalcula el costo y
+# el margen de todos los productos con precios o mermas hipotéticos, sin
+# escribir nada en la BD. Cada relación (receta, sub-receta) es una matriz
+# dispersa guardada como listas de (fila, columna, cantidad); multiplicarla por
+# el vector de costos es un np.bincount.
+#
+# Las fórmulas son las mismas de Insumo.save() (materia prima),
+# tables/costos.py (recetas) y Producto.costo_total_real (productos).
+#
+# numpy es opcional: sin él la página del simulador avisa que falta instalarlo.
+
+
+def simulador_disponible():
+    try:
+        import numpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class CatalogoCostos:
+    """ Foto del catálogo en arreglos, lista para simular tantas veces como se quiera """
+
+    def __init__(self):
+        import numpy as np
+
+        # --- INSUMOS ---
+        insumos = list(Insumo.objects.order_by('id').values_list(
+            'id', 'nombre', 'es_insumo_compuesto', 'precio_mercado', 'peso_standar', 'merma_porcentaje', 'costo_unitario'
+        ))
+        self.insumo_ids = [fila[0] for fila in insumos]
+        self.insumo_nombres = [fila[1] for fila in insumos]
+        self.indice_insumo = {pk: i for i, pk in enumerate(self.insumo_ids)}
+        self.es_compuesto = np.array([fila[2] for fila in insumos], dtype=bool)
+        self.precio_mercado = np.array([fila[3] for fila in insumos], dtype=float)
+        self.peso_standar = np.array([fila[4] for fila in insumos], dtype=float)
+        self.merma = np.array([fila[5] for fila in insumos], dtype=float)
+        self.costo_guardado = np.array([fila[6] for fila in insumos], dtype=float)
+
+        # --- SUB-RECETAS: una matriz por nivel, para calcular hijos antes que padres ---
+        componentes, usado_en = grafo_compuestos()
+        nivel = {}
+        for pk in orden_topologico(set(self.insumo_ids), componentes, usado_en):
+            hijos = [hijo for hijo, _ in componentes.get(pk, ())]
+            nivel[pk] = 1 + max(nivel[h] for h in hijos) if hijos and self.es_compuesto[self.indice_insumo[pk]] else 0
+
+        aristas = {}
+        for padre_id, lineas in componentes.items():
+            if nivel.get(padre_id, 0) == 0:
+                continue
+            for hijo_id, cantidad in lineas:
+                aristas.setdefault(nivel[padre_id], []).append(
+                    (self.indice_insumo[padre_id], self.indice_insumo[hijo_id], float(cantidad))
+                )
+        n = len(self.insumo_ids)
+        self.niveles = []
+        for _, filas in sorted(aristas.items()):
+            padres, hijos, cantidades = (np.array(columna) for columna in zip(*filas))
+            peso = np.bincount(padres, weights=cantidades, minlength=n)
+            self.niveles.append((padres, hijos, cantidades, np.unique(padres), peso))
+        # Compuestos sin ingredientes: el motor de costos los deja en 0
+        con_ingredientes = np.zeros(n, dtype=bool)
+        for _, _, _, unicos, _ in self.niveles:
+            con_ingredientes[unicos] = True
+        self.compuestos_vacios = self.es_compuesto & ~con_ingredientes
+
+        # --- PRODUCTOS ---
+        productos = list(Producto.objects.only('id', 'nombre', 'tamano', 'precio').order_by('id'))
+        self.producto_ids = [p.id for p in productos]
+        self.producto_nombres = [str(p) for p in productos]
+        self.indice_producto = {pk: i for i, pk in enumerate(self.producto_ids)}
+        self.precio_venta = np.array([p.precio for p in productos], dtype=float)
+        m = len(productos)
+
+        lineas = list(IngredienteProducto.objects.values_list('producto_id', 'insumo_id', 'cantidad'))
+        self.receta_producto = np.array([self.indice_producto[l[0]] for l in lineas], dtype=int)
+        self.receta_insumo = np.array([self.indice_insumo[l[1]] for l in lineas], dtype=int)
+        self.receta_cantidad = np.array([l[2] for l in lineas], dtype=float)
+
+        fijos = np.zeros(m)
+        porcentajes = np.zeros(m)
+        for producto_id, tipo, valor in CostoAsignadoProducto.objects.values_list('producto_id', 'costo_adicional__tipo', 'valor_aplicado'):
+            destino = fijos if tipo == 'FIJO' else porcentajes
+            destino[self.indice_producto[producto_id]] += float(valor)
+        self.costos_fijos = fijos
+        self.costos_porcentaje = porcentajes
+
+        self.actual = self.calcular()
+
+    def costos_insumos(self, precio_mercado, merma):
+        """ Costo por gramo de cada insumo: materia prima como Insumo.save(), recetas como el motor de costos """
+        import numpy as np
+
+        costo = self.costo_guardado.copy()
+        con_datos = ~self.es_compuesto & (precio_mercado > 0) & (self.peso_standar > 0)
+        base = np.divide(precio_mercado, self.peso_standar, out=np.zeros_like(costo), where=con_datos)
+        factor = 1 - merma / 100
+        factor = np.where(factor > 0, factor, 1)  # merma de 100% o más: se queda el costo base
+        costo[con_datos] = base[con_datos] / factor[con_datos]
+        costo[self.compuestos_vacios] = 0
+
+        for padres, hijos, cantidades, unicos, peso in self.niveles:
+            suma = np.bincount(padres, weights=cantidades * costo[hijos], minlength=len(costo))
+            unitario = np.divide(suma, peso, out=suma.copy(), where=peso > 0)
+            costo[unicos] = unitario[unicos]
+        return costo
+
+    def calcular(self, precio_mercado=None, merma=None):
+        """ {'costo_insumo', 'costo_receta', 'indirectos', 'costo_total', 'ganancia', 'margen'} por producto """
+        import numpy as np
+
+        costo_insumo = self.costos_insumos(
+            self.precio_mercado if precio_mercado is None else precio_mercado,
+            self.merma if merma is None else merma,
+        )
+        receta = np.bincount(
+            self.receta_producto, weights=self.receta_cantidad * costo_insumo[self.receta_insumo], minlength=len(self.producto_ids)
+        )
+        indirectos = self.costos_fijos + self.costos_porcentaje / 100 * receta
+        total = receta + indirectos
+        ganancia = self.precio_venta - total
+        margen = np.divide(ganancia * 100, self.precio_venta, out=np.zeros_like(ganancia), where=self.precio_venta > 0)
+        return {
+            'costo_insumo': costo_insumo,
+            'costo_receta': receta,
+            'indirectos': indirectos,
+            'costo_total': total,
+            'ganancia': ganancia,
+            'margen': margen,
+        }
+
+    def simular(self, cambios=None, aumento_general=0):
+        """
+        cambios: {insumo_id: {'precio_mercado': valor, 'merma_porcentaje': valor}} (cualquiera de los dos).
+        aumento_general: % que sube (o baja, si es negativo) el precio de toda la
+        materia prima que no tenga un precio propio en cambios.
+        """
+        precio = self.precio_mercado.copy()
+        merma = self.merma.copy()
+        if aumento_general:
+            precio[~self.es_compuesto] *= 1 + float(aumento_general) / 100
+        for insumo_id, cambio in (cambios or {}).items():
+            i = self.indice_insumo.get(int(insumo_id))
+            if i is None:
+                raise ValueError(f"El insumo {insumo_id} no existe.")
+            if cambio.get('precio_mercado') is not None:
+                precio[i] = float(cambio['precio_mercado'])
+            if cambio.get('merma_porcentaje') is not None:
+                merma[i] = float(cambio['merma_porcentaje'])
+        return self.calcular(precio, merma)
+
+    def comparar(self, simulado):
+        """ Filas por producto (de la mayor caída de margen a la mayor subida) y un resumen """
+        import numpy as np
+
+        actual = self.actual
+        diferencia = simulado['margen'] - actual['margen']
+        filas = [
+            {
+                'id': self.producto_ids[i],
+                'nombre': self.producto_nombres[i],
+                'precio': float(self.precio_venta[i]),
+                'costo_actual': float(actual['costo_total'][i]),
+                'costo_simulado': float(simulado['costo_total'][i]),
+                'margen_actual': float(actual['margen'][i]),
+                'margen_simulado': float(simulado['margen'][i]),
+                'diferencia_margen': float(diferencia[i]),
+            }
+            for i in np.argsort(diferencia, kind='stable')
+        ]
+        con_precio = self.precio_venta > 0
+        resumen = {
+            'productos': len(self.producto_ids),
+            'afectados': int(np.count_nonzero(np.abs(simulado['costo_total'] - actual['costo_total']) > 1e-9)),
+            'margen_promedio_actual': float(actual['margen'][con_precio].mean()) if con_precio.any() else 0.0,
+            'margen_promedio_simulado': float(simulado['margen'][con_precio].mean()) if con_precio.any() else 0.0,
+            'perdida_actual': int(np.count_nonzero(actual['ganancia'][con_precio] < 0)),
+            'perdida_simulada': int(np.count_nonzero(simulado['ganancia'][con_precio] < 0)),
+        }
+        return filas, resumen
@@ -0,0 +1,84 @@
+from bisect import bisect_right
+from django.core.cache import cache
+from core.models import Configuracion
+from .models import TasaBCV, TASA_BCV_CACHE_KEY, SERIE_TASAS_CACHE_KEY
+
+
+class TasasVigentes:
+    """
+    Las tres tasas que usa el sistema, resueltas en un solo lugar:
+    - bcv: la última TasaBCV guardada (None si nunca se ha guardado una)
+    - general: la que se usa para cobrar (BCV automática o la manual de Configuración)
+    - cashea: la que se usa cuando hay un pago con Cashea
+    """
+    def __init__(self, tasa_bcv, config):
+        self.bcv = tasa_bcv
+        bcv_o_manual = tasa_bcv if tasa_bcv else config.tasa_dolar
+
+        self.manual = not config.usar_scraping_bcv
+        self.general = config.tasa_dolar if self.manual else bcv_o_manual
+
+        if config.usar_tasa_bcv_para_cashea:
+            self.cashea = bcv_o_manual
+        elif config.tasa_cashea > 0:
+            self.cashea = config.tasa_cashea
+        else:
+            self.cashea = self.general
+
+    @property
+    def texto_general(self):
+        return f"{self.general:.2f} Bs/S" + (" (Manual)" if self.manual else "")
+
+
+def tasa_bcv_actual():
+    """ Última TasaBCV (Decimal o None), desde la caché compartida; se invalida al guardar una tasa """
+    tasa = cache.get(TASA_BCV_CACHE_KEY)
+    if tasa is None:
+        ultima_tasa = TasaBCV.objects.order_by('-fecha_actualizacion').only('precio').first()
+        if ultima_tasa is None:
+            return None
+        tasa = ultima_tasa.precio
+        cache.set(TASA_BCV_CACHE_KEY, tasa, None)
+    return tasa
+
+
+def obtener_tasas(request=None):
+    """
+    Tasas vigentes. Si se pasa el request, se calculan una sola vez por petición
+    aunque varias partes de la vista (o plantillas) las pidan.
+    """
+    tasas = getattr(request, '_tasas_vigentes', None)
+    if tasas is None:
+        tasas = TasasVigentes(tasa_bcv_actual(), Configuracion.get_cached())
+        if request is not None:
+            request._tasas_vigentes = tasas
+    return tasas
+
+
+class SerieTasas:
+    """ Historial de TasaBCV ordenado por fecha, para buscar qué tasa regía en un momento dado """
+    def __init__(self, filas):
+        self.marcas = [fecha.timestamp() for fecha, _ in filas]
+        self.precios = [precio for _, precio in filas]
+
+    def tasa_en(self, momento):
+        """ Última tasa guardada en o antes de 'momento' (None si es anterior a todas) """
+        i = bisect_right(self.marcas, momento.timestamp())
+        return self.precios[i - 1] if i else None
+
+
+def serie_tasas(request=None):
+    serie = getattr(request, '_serie_tasas', None)
+    if serie is None:
+        serie = cache.get(SERIE_TASAS_CACHE_KEY)
+        if serie is None:
+            filas = TasaBCV.objects.order_by('fecha_actualizacion').values_list('fecha_actualizacion', 'precio')
+            serie = SerieTasas(list(filas))
+            cache.set(SERIE_TASAS_CACHE_KEY, serie, None)
+        if request is not None:
+            request._serie_tasas = serie
+    return serie
+
+
+def tasa_en(momento, request=None):
+    return serie_tasas(request).tasa_en(momento)
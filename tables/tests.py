@@ -0,0 +1,1325 @@
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Configuracion, Impresora
+from inventory.models import Insumo, IngredienteCompuesto, UnidadMedida, ConsumoInterno, MovimientoInventario
+from . import cola_impresion, facturas_pdf, masivo, scrapping, utils_impresora, views
+from .impresoras import ImpresoraRed, ImpresoraMemoria, ImpresoraWindows, obtener_backend
+from .carrito import serializar_carrito
+from .catalogo import obtener_catalogo
+from .costos import CicloDeRecetas, crea_ciclo, orden_topologico, recalcular_costos
+from .simulador import CatalogoCostos, simulador_disponible
+from .tasas import SerieTasas, TasasVigentes, serie_tasas, tasa_bcv_actual, tasa_en
+from .models import (
+    ContadorFactura, Venta, TasaBCV, Categoria, Producto, Table, Orden, DetalleOrden,
+    DetalleOrdenExtra, DetalleOrdenRemovido, PrecioExtra, TrabajoImpresion, DetalleVenta, DetalleVentaExtra, Pago,
+    IngredienteProducto, CostoAdicional, CostoAsignadoProducto, CATALOGO_CACHE_KEY,
+)
+
+# Las pruebas no tocan la caché en disco de la instalación
+CACHE_PRUEBAS = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class ContadorFacturaConcurrenteTest(TransactionTestCase):
+    """ Varias cajas facturando a la vez: números seguidos, sin huecos ni repetidos """
+
+    HILOS = 8
+    FACTURAS_POR_HILO = 15
+
+    def _facturar(self, barrera, codigos, errores):
+        try:
+            barrera.wait()
+            for i in range(self.FACTURAS_POR_HILO):
+                try:
+                    with transaction.atomic():
+                        codigo = ContadorFactura.siguiente_codigo()
+                        Venta.objects.create(codigo_factura=codigo, total=Decimal('10.00'), metodo_pago='EFECTIVO_USD', mesa_numero=1)
+                        # Una de cada cinco falla después de tomar el número: debe devolverlo
+                        if i % 5 == 4:
+                            raise RuntimeError("venta fallida")
+                    codigos.append(codigo)
+                except RuntimeError:
+                    pass
+        except Exception as e:
+            errores.append(e)
+        finally:
+            connection.close()
+
+    def test_sin_huecos_ni_repetidos(self):
+        barrera = threading.Barrier(self.HILOS)
+        codigos, errores = [], []
+        hilos = [threading.Thread(target=self._facturar, args=(barrera, codigos, errores)) for _ in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        esperadas = self.HILOS * (self.FACTURAS_POR_HILO - self.FACTURAS_POR_HILO // 5)
+        self.assertEqual(len(codigos), esperadas)
+        self.assertEqual(sorted(codigos), [f"{n:06d}" for n in range(1, esperadas + 1)])
+        self.assertEqual(Venta.objects.count(), esperadas)
+        self.assertEqual(ContadorFactura.objects.get(pk=1).ultimo_numero, esperadas)
+
+    def test_arranca_desde_el_mayor_codigo_emitido(self):
+        # Sin la fila del contador (base vieja o fila borrada) se sigue desde la última factura
+        ContadorFactura.objects.all().delete()
+        Venta.objects.create(codigo_factura='000041', total=Decimal('1'), metodo_pago='EFECTIVO_USD', mesa_numero=1)
+        with transaction.atomic():
+            self.assertEqual(ContadorFactura.siguiente_codigo(), '000042')
+
+
+# ==========================================
+#  TASA BCV (servidor falso con la página del BCV)
+# ==========================================
+PAGINA_BCV = """
+<html><body>
+  <div id="euro"><strong> 39,10230000 </strong></div>
+  <div id="dolar" class="col-sm-12"><div class="field-content">
+    <span>USD</span><strong> 36,50120000 </strong>
+  </div></div>
+</body></html>
+"""
+
+
+class _PaginaBCV(BaseHTTPRequestHandler):
+    estado = 200
+    cuerpo = PAGINA_BCV
+    peticiones = 0
+
+    def do_GET(self):
+        type(self).peticiones += 1
+        datos = self.cuerpo.encode('utf-8')
+        self.send_response(self.estado)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Despertar(Exception):
+    """ Corta el bucle del actualizador en su primer sleep """
+
+
+@override_settings(CACHES=CACHE_PRUEBAS, BCV_INTERVALO_ACTUALIZACION=3600)
+class TasaBCVTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), _PaginaBCV)
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_port}/"
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _PaginaBCV.estado, _PaginaBCV.cuerpo, _PaginaBCV.peticiones = 200, PAGINA_BCV, 0
+        config = Configuracion.get_solo()
+        config.usar_scraping_bcv = True
+        config.save()
+
+    def _tasa_con_edad(self, segundos, precio='35.00'):
+        tasa = TasaBCV.objects.create(precio=Decimal(precio))
+        # fecha_actualizacion es auto_now: se cambia con update()
+        TasaBCV.objects.filter(pk=tasa.pk).update(fecha_actualizacion=timezone.now() - timedelta(seconds=segundos))
+
+    def test_descarga_la_tasa_del_dolar(self):
+        self.assertEqual(scrapping.descargar_tasa_bcv(url=self.url), Decimal('36.50'))
+
+    def test_refrescar_guarda_la_tasa(self):
+        self.assertEqual(scrapping.refrescar_tasa_bcv(url=self.url), Decimal('36.50'))
+        self.assertEqual(TasaBCV.objects.get().precio, Decimal('36.50'))
+        self.assertEqual(scrapping.current_rate(), Decimal('36.50'))
+
+    def test_tasa_reciente_no_va_a_internet(self):
+        self._tasa_con_edad(600)
+        self.assertEqual(scrapping.refrescar_tasa_bcv(url=self.url), Decimal('35.00'))
+        self.assertEqual(_PaginaBCV.peticiones, 0)
+        self.assertEqual(TasaBCV.objects.count(), 1)
+
+    def test_tasa_vencida_se_actualiza(self):
+        self._tasa_con_edad(4000)
+        self.assertEqual(scrapping.refrescar_tasa_bcv(url=self.url), Decimal('36.50'))
+        self.assertEqual(_PaginaBCV.peticiones, 1)
+        self.assertEqual(scrapping.current_rate(), Decimal('36.50'))
+
+    def test_errores_del_servidor(self):
+        _PaginaBCV.estado = 503
+        with self.assertRaises(Exception):
+            scrapping.refrescar_tasa_bcv(forzar=True, url=self.url)
+        _PaginaBCV.estado, _PaginaBCV.cuerpo = 200, "<html><body>Mantenimiento</body></html>"
+        with self.assertRaises(ValueError):
+            scrapping.refrescar_tasa_bcv(forzar=True, url=self.url)
+        self.assertFalse(TasaBCV.objects.exists())
+
+    def _primera_espera(self):
+        esperas = []
+
+        def dormir(segundos):
+            esperas.append(segundos)
+            raise _Despertar()
+
+        # close_old_connections() cerraría la conexión de la transacción de la prueba
+        with mock.patch.object(scrapping.time, 'sleep', dormir), mock.patch.object(scrapping, 'close_old_connections'), \
+                self.settings(BCV_URL=self.url):
+            with self.assertRaises(_Despertar):
+                scrapping._bucle_actualizador()
+        return esperas[0]
+
+    def test_bucle_duerme_hasta_que_vence_la_tasa(self):
+        # Tasa de hace 1000 s con intervalo de 3600: se salta el scraping y despierta en ~2600 s
+        self._tasa_con_edad(1000)
+        espera = self._primera_espera()
+        self.assertAlmostEqual(espera, 2600, delta=5)
+        self.assertEqual(_PaginaBCV.peticiones, 0)
+
+    def test_bucle_tras_actualizar_duerme_un_intervalo(self):
+        self._tasa_con_edad(5000)
+        espera = self._primera_espera()
+        self.assertEqual(_PaginaBCV.peticiones, 1)
+        self.assertAlmostEqual(espera, 3600, delta=5)
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class TasasVigentesTest(TestCase):
+    """ La tasa que regía en cada momento y la caché de tasas, que se borra al guardar o borrar una TasaBCV """
+
+    def setUp(self):
+        cache.clear()
+
+    def _tasa(self, precio, momento):
+        tasa = TasaBCV.objects.create(precio=Decimal(precio))
+        # auto_now pisa la fecha al guardar: se fija con update()
+        TasaBCV.objects.filter(pk=tasa.pk).update(fecha_actualizacion=momento)
+        return tasa
+
+    def test_tasa_en_los_bordes(self):
+        inicio = timezone.make_aware(datetime(2026, 3, 2, 8, 0))
+        for dias, precio in ((0, '36.10'), (1, '36.40'), (3, '37.00')):
+            self._tasa(precio, inicio + timedelta(days=dias))
+        cache.clear()
+        segundo = timedelta(seconds=1)
+        casos = [
+            (inicio - segundo, None),                               # antes de la primera
+            (inicio, Decimal('36.10')),                             # justo a la hora de guardarse
+            (inicio + timedelta(days=1) - segundo, Decimal('36.10')),
+            (inicio + timedelta(days=1), Decimal('36.40')),
+            (inicio + timedelta(days=2), Decimal('36.40')),         # día sin tasa: sigue la anterior
+            (inicio + timedelta(days=3), Decimal('37.00')),
+            (inicio + timedelta(days=400), Decimal('37.00')),       # después de la última
+        ]
+        for momento, esperada in casos:
+            with self.subTest(momento=momento):
+                self.assertEqual(tasa_en(momento), esperada)
+        self.assertIsNone(SerieTasas([]).tasa_en(inicio))
+
+    def test_guardar_o_borrar_una_tasa_invalida(self):
+        self.assertIsNone(tasa_bcv_actual())
+        vieja = TasaBCV.objects.create(precio=Decimal('36.10'))
+        ahora = timezone.now()
+        self.assertEqual(tasa_bcv_actual(), Decimal('36.10'))
+        self.assertEqual(tasa_en(ahora), Decimal('36.10'))
+        with self.assertNumQueries(0):
+            tasa_bcv_actual()
+            serie_tasas()
+
+        nueva = TasaBCV.objects.create(precio=Decimal('36.90'))
+        self.assertEqual(tasa_bcv_actual(), Decimal('36.90'))
+        self.assertEqual(tasa_en(timezone.now()), Decimal('36.90'))
+        self.assertEqual(tasa_en(ahora), Decimal('36.10'))
+
+        nueva.delete()
+        self.assertEqual(tasa_bcv_actual(), Decimal('36.10'))
+        self.assertEqual(tasa_en(timezone.now()), Decimal('36.10'))
+        vieja.delete()
+        self.assertIsNone(tasa_bcv_actual())
+        self.assertIsNone(tasa_en(timezone.now()))
+
+    def test_tasa_general_y_cashea(self):
+        config = Configuracion(tasa_dolar=Decimal('40.00'), tasa_cashea=Decimal('0'), usar_scraping_bcv=True, usar_tasa_bcv_para_cashea=False)
+        tasas = TasasVigentes(Decimal('36.50'), config)
+        self.assertEqual((tasas.general, tasas.cashea, tasas.manual), (Decimal('36.50'), Decimal('36.50'), False))
+        # Sin ninguna TasaBCV guardada se cobra con la manual
+        self.assertEqual(TasasVigentes(None, config).general, Decimal('40.00'))
+
+        config.tasa_cashea = Decimal('38.00')
+        self.assertEqual(TasasVigentes(Decimal('36.50'), config).cashea, Decimal('38.00'))
+        config.usar_tasa_bcv_para_cashea = True
+        self.assertEqual(TasasVigentes(Decimal('36.50'), config).cashea, Decimal('36.50'))
+
+        config.usar_scraping_bcv = False
+        tasas = TasasVigentes(Decimal('36.50'), config)
+        self.assertEqual((tasas.general, tasas.bcv, tasas.texto_general), (Decimal('40.00'), Decimal('36.50'), '40.00 Bs/S (Manual)'))
+
+
+# ==========================================
+#  PANTALLA DE PEDIDOS: consultas constantes sin importar el carrito
+# ==========================================
+class DatosCarrito:
+    """ Mesa, productos FAM e insumos para armar carritos con mitades, cuartos, extras y removidos """
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('cajero', password='x', is_staff=True)
+        gramos = UnidadMedida.objects.create(nombre='Gramos', codigo='GR', factor=1)
+        cls.queso = Insumo.objects.create(nombre='Queso', unidad=gramos, merma_porcentaje=Decimal('0'), es_extra=True)
+        cls.cebolla = Insumo.objects.create(nombre='Cebolla', unidad=gramos, merma_porcentaje=Decimal('0'))
+        cls.pimenton = Insumo.objects.create(nombre='Pimentón', unidad=gramos, merma_porcentaje=Decimal('0'))
+        PrecioExtra.objects.create(insumo=cls.queso, tamano='FAM', precio=Decimal('2.00'), cantidad=Decimal('0.05'))
+        pizzas = Categoria.objects.create(nombre='Pizzas')
+        cls.productos = [
+            Producto.objects.create(nombre=f'Pizza {i}', precio=Decimal('12.00'), tamano='FAM', categoria=pizzas)
+            for i in range(4)
+        ]
+        cls.mesa = Table.objects.create(number='1')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.url = reverse('table_order', args=[self.mesa.id])
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class CarritoConsultasTest(DatosCarrito, TestCase):
+    def _linea(self, orden, i):
+        """ Líneas variadas: mitades, cuartos, extras (normal y sustituto) y removidos enteros y parciales """
+        p = self.productos
+        detalle = DetalleOrden.objects.create(orden=orden, producto=p[0], cantidad=1 + i % 2, precio_unitario=Decimal('12.00'))
+        if i % 3 == 1:
+            detalle.mitad_producto = p[1]
+        elif i % 3 == 2:
+            detalle.cuarto_2_producto, detalle.cuarto_3_producto, detalle.cuarto_4_producto = p[1], p[2], p[3]
+        detalle.save()
+        DetalleOrdenExtra.objects.create(detalle_orden=detalle, insumo=self.queso, precio=Decimal('2.00'), porcion=Decimal('1.00'))
+        DetalleOrdenExtra.objects.create(detalle_orden=detalle, insumo=self.queso, precio=Decimal('0.00'), porcion=Decimal('0.50'))
+        detalle.ingredientes_removidos.add(self.cebolla)
+        DetalleOrdenRemovido.objects.create(detalle_orden=detalle, insumo=self.pimenton, porcion=Decimal('0.50'))
+
+    def _orden(self, lineas):
+        Orden.objects.filter(mesa=self.mesa).delete()
+        orden = Orden.objects.create(mesa=self.mesa, mesero=self.usuario)
+        for i in range(lineas):
+            self._linea(orden, i)
+        return orden
+
+    def _consultas_pantalla(self, lineas):
+        self._orden(lineas)
+        self.client.get(self.url)  # llena la caché de configuración, tasas y catálogo
+        with self.assertNumQueries(self.CONSULTAS_PANTALLA):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta
+
+    # Sesión y usuario (2), mesa, tasa, meseros, orden, detalles con sus partes (1)
+    # + extras, removidos y removidos parciales (3), extras agotados, productos del
+    # menú y el guardado de la sesión (3). El número no depende de las líneas.
+    CONSULTAS_PANTALLA = 15
+
+    def test_una_linea(self):
+        self._consultas_pantalla(1)
+
+    def test_muchas_lineas(self):
+        self._consultas_pantalla(30)
+
+    def test_carrito_serializado(self):
+        orden = self._orden(3)
+        with self.assertNumQueries(4):
+            carrito = serializar_carrito(orden)
+        self.assertEqual(len(carrito), 3)
+        self.assertEqual(carrito[1]['mitad_id'], self.productos[1].id)
+        self.assertEqual([carrito[2][f'cuarto_{n}_id'] for n in (2, 3, 4)], [p.id for p in self.productos[1:]])
+        self.assertEqual(carrito[0]['extras'], [
+            {'id': self.queso.id, 'porcion': 1.0, 'es_sustituto': False},
+            {'id': self.queso.id, 'porcion': 0.5, 'es_sustituto': True},
+        ])
+        self.assertEqual(carrito[0]['removidos'], [{'id': self.cebolla.id, 'porcion': 1.0}, {'id': self.pimenton.id, 'porcion': 0.5}])
+        self.assertEqual(carrito[0]['removidos_nombres'], ['Cebolla', '1/2 Pimentón'])
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class CatalogoCacheTest(DatosCarrito, TestCase):
+    """ El catálogo se arma una vez y cambia de versión con cada cambio de productos, recetas o extras """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def _catalogo(self):
+        catalogo = obtener_catalogo()
+        return catalogo['version'], json.loads(catalogo['json'])
+
+    def test_segunda_lectura_sin_consultas(self):
+        version, _ = self._catalogo()
+        with self.assertNumQueries(0):
+            self.assertEqual(obtener_catalogo()['version'], version)
+
+    def test_cada_cambio_da_otra_version(self):
+        precio = PrecioExtra.objects.get(insumo=self.queso, tamano='FAM')
+        linea = IngredienteProducto(producto=self.productos[0], insumo=self.cebolla, cantidad=Decimal('30'))
+
+        def precio_producto():
+            producto = Producto.objects.get(pk=self.productos[1].pk)
+            producto.precio = Decimal('13.50')
+            producto.save()
+
+        def precio_extra():
+            precio.precio = Decimal('2.75')
+            precio.save()
+
+        def nombre_insumo():
+            self.queso.nombre = 'Queso mozzarella'
+            self.queso.save()
+
+        pasos = [
+            ('precio de un producto', precio_producto, lambda d: {p['id']: p['precio'] for p in d['productos']}[self.productos[1].pk] == 13.5),
+            ('línea de receta nueva', linea.save,
+             lambda d: {'id': self.cebolla.pk, 'nombre': 'Cebolla'} in d['ingredientes'][str(self.productos[0].pk)]),
+            ('línea de receta borrada', linea.delete, lambda d: d['ingredientes'][str(self.productos[0].pk)] == []),
+            ('precio de un extra', precio_extra, lambda d: d['extras'][0]['precios_por_tamano']['FAM'] == 2.75),
+            ('nombre de un extra', nombre_insumo, lambda d: d['extras'][0]['nombre'] == 'Queso mozzarella'),
+            ('producto borrado', self.productos[3].delete, lambda d: len(d['productos']) == 3),
+        ]
+        version, _ = self._catalogo()
+        for descripcion, cambio, se_ve in pasos:
+            with self.subTest(descripcion):
+                cambio()
+                nueva, datos = self._catalogo()
+                self.assertNotEqual(nueva, version)
+                self.assertTrue(se_ve(datos))
+                version = nueva
+
+    def test_etag_del_endpoint(self):
+        url = reverse('catalogo_json')
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 304)
+
+        producto = Producto.objects.get(pk=self.productos[0].pk)
+        producto.nombre = 'Pizza margarita'
+        producto.save()
+        cambiada = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(cambiada.status_code, 200)
+        self.assertNotEqual(cambiada['ETag'], primera['ETag'])
+        self.assertIn('Pizza margarita', cambiada.content.decode('utf-8'))
+
+
+# ==========================================
+#  GRABAR LA MESA: cada ítem se interpreta una vez y lo igual no se toca
+# ==========================================
+@override_settings(CACHES=CACHE_PRUEBAS)
+class GrabarMesaTest(DatosCarrito, TestCase):
+    def _grabar(self, carrito):
+        respuesta = self.client.post(
+            reverse('grabar_mesa', args=[self.mesa.id]),
+            json.dumps({'carrito': carrito, 'is_sync': True}), content_type='application/json',
+        )
+        self.assertEqual(respuesta.json()['status'], 'ok')
+
+    def test_grabar_y_volver_a_grabar(self):
+        p = self.productos
+        carrito = [
+            {'id': p[0].id, 'cantidad': 1, 'precio': 14.0, 'mitad_id': p[1].id, 'es_nuevo': True,
+             'extras': [{'id': self.queso.id, 'porcion': 1.0, 'es_sustituto': False}],
+             'removidos': [{'id': self.cebolla.id, 'porcion': 1.0}, {'id': self.pimenton.id, 'porcion': 0.5}]},
+            {'id': p[0].id, 'cantidad': 2, 'precio': 12.0, 'cuarto_2_id': p[1].id, 'cuarto_3_id': p[2].id,
+             'cuarto_4_id': p[3].id, 'es_nuevo': True, 'extras': [self.queso.id]},
+        ]
+        self._grabar(carrito)
+        orden = Orden.objects.get(mesa=self.mesa)
+        grabado = serializar_carrito(orden)
+        self.assertEqual(grabado[0]['removidos_nombres'], ['Cebolla', '1/2 Pimentón'])
+        self.assertEqual([e['id'] for e in grabado[1]['extras']], [self.queso.id])
+        # El precio del extra sale de PrecioExtra del tamaño del producto
+        self.assertEqual(orden.detalles.get(id=grabado[0]['detalle_id']).extras_elegidos.get().precio, Decimal('2.00'))
+
+        # Volver a grabar el carrito tal cual (ahora con sus ids) no reescribe las líneas
+        extras_antes = list(DetalleOrdenExtra.objects.order_by('id').values_list('id', flat=True))
+        self._grabar(grabado)
+        self.assertEqual(serializar_carrito(orden), [dict(item, es_nuevo=True) for item in grabado])
+        self.assertEqual(list(DetalleOrdenExtra.objects.order_by('id').values_list('id', flat=True)), extras_antes)
+
+    def test_datos_invalidos_se_ignoran_con_aviso(self):
+        carrito = [{'id': self.productos[0].id, 'cantidad': 1, 'precio': 12.0, 'es_nuevo': True,
+                    'extras': ['x', 999999], 'removidos': [{'id': 'y'}]}]
+        with self.assertLogs('tables.carrito', 'WARNING') as avisos:
+            self._grabar(carrito)
+        self.assertEqual(len(avisos.output), 3)
+        detalle = Orden.objects.get(mesa=self.mesa).detalles.get()
+        self.assertFalse(detalle.extras_elegidos.exists())
+
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+@mock.patch.object(views, 'prerenderizar_factura', lambda venta_id: None)
+@mock.patch.object(views, 'mandar_a_tickera', lambda venta: (False, ''))
+@mock.patch.object(views, 'imprimir_comanda', lambda orden: None)
+class FacturarAnularInventarioTest(DatosCarrito, TestCase):
+    """ La anulación devuelve exactamente lo que descontó la orden, aunque la receta haya cambiado """
+
+    def setUp(self):
+        super().setUp()
+        TasaBCV.objects.create(precio=Decimal('36.50'))
+        Insumo.objects.update(stock_actual=Decimal('1000'))
+        IngredienteProducto.objects.create(producto=self.productos[0], insumo=self.cebolla, cantidad=Decimal('100'))
+        IngredienteProducto.objects.create(producto=self.productos[0], insumo=self.pimenton, cantidad=Decimal('40'))
+        IngredienteProducto.objects.create(producto=self.productos[1], insumo=self.pimenton, cantidad=Decimal('80'))
+
+    def _stock(self):
+        return dict(Insumo.objects.values_list('nombre', 'stock_actual'))
+
+    def test_anular_devuelve_lo_descontado(self):
+        p = self.productos
+        inicial = self._stock()
+        carrito = [
+            {'id': p[0].id, 'cantidad': 2, 'precio': 14.0, 'es_nuevo': True, 'extras': [self.queso.id]},
+            {'id': p[0].id, 'cantidad': 1, 'precio': 12.0, 'mitad_id': p[1].id, 'es_nuevo': True,
+             'removidos': [{'id': self.cebolla.id, 'porcion': 0.5}]},
+        ]
+        respuesta = self.client.post(
+            reverse('grabar_mesa', args=[self.mesa.id]),
+            json.dumps({'carrito': carrito, 'is_sync': True}), content_type='application/json',
+        )
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        orden = Orden.objects.get(mesa=self.mesa)
+        descontados = MovimientoInventario.objects.filter(origen_tipo='ORDEN', origen_id=orden.id).count()
+        self.assertGreater(descontados, 0)
+        self.assertNotEqual(self._stock(), inicial)
+
+        respuesta = self.client.post(
+            reverse('facturar_mesa', args=[self.mesa.id]),
+            json.dumps({'lista_pagos': [{'metodo': 'EFECTIVO_USD', 'monto': 40}], 'monto_recibido_total': 40}),
+            content_type='application/json',
+        )
+        venta_id = respuesta.json()['venta_id']
+        self.assertFalse(MovimientoInventario.objects.filter(origen_tipo='ORDEN').exists())
+        self.assertEqual(MovimientoInventario.objects.filter(origen_tipo='VENTA', origen_id=venta_id).count(), descontados)
+
+        # La receta cambia entre la venta y la anulación: no debe importar
+        IngredienteProducto.objects.filter(producto=p[0]).update(cantidad=Decimal('500'))
+        self.client.post(reverse('anular_venta', args=[venta_id]), {'motivo': 'Prueba'})
+
+        self.assertTrue(Venta.objects.get(pk=venta_id).anulada)
+        self.assertEqual(self._stock(), inicial)
+        self.assertEqual(MovimientoInventario.objects.filter(origen_tipo='VENTA', origen_id=venta_id).count(), 2 * descontados)
+
+    def _venta_vieja(self):
+        """ Venta facturada antes del cambio: sus movimientos quedaron como ORDEN sin id """
+        p = self.productos
+        venta = Venta.objects.create(codigo_factura='000900', total=Decimal('24.00'), metodo_pago='EFECTIVO_USD', mesa_numero=1)
+        DetalleVenta.objects.create(venta=venta, producto=p[0], nombre_producto=p[0].nombre, cantidad=2,
+                                    precio_unitario=Decimal('12.00'), subtotal=Decimal('24.00'))
+        DetalleVenta.objects.create(venta=venta, producto=p[0], nombre_producto=p[0].nombre, cantidad=1, precio_unitario=Decimal('12.00'),
+                                    subtotal=Decimal('12.00'), mitad_producto=p[1], nombre_mitad=p[1].nombre)
+        # 2 enteras: 200 cebolla, 80 pimentón; mitad/mitad: 50 cebolla, min(40, 80) pimentón
+        for insumo, cantidad in ((self.cebolla, Decimal('250')), (self.pimenton, Decimal('120'))):
+            MovimientoInventario.objects.create(insumo=insumo, tipo='SALIDA', cantidad=cantidad, unidad_movimiento=insumo.unidad,
+                                                nota='Orden Mesa 1', origen_tipo='ORDEN')
+        return venta
+
+    def test_venta_sin_movimientos_propios_se_devuelve_por_receta(self):
+        inicial = self._stock()
+        venta = self._venta_vieja()
+        self.client.post(reverse('anular_venta', args=[venta.id]), {'motivo': 'Prueba'})
+        self.assertTrue(Venta.objects.get(pk=venta.pk).anulada)
+        self.assertEqual(self._stock(), inicial)
+
+    def test_orden_editada_despues_del_cambio_no_descuenta_dos_veces(self):
+        # La reposición de una edición quedó a nombre de la venta, pero no la SALIDA original
+        inicial = self._stock()
+        venta = self._venta_vieja()
+        MovimientoInventario.objects.create(insumo=self.cebolla, tipo='ENTRADA', cantidad=Decimal('100'), unidad_movimiento=self.cebolla.unidad,
+                                            nota='Rep. edición Mesa 1', origen_tipo='VENTA', origen_id=venta.id)
+        MovimientoInventario.objects.create(insumo=self.cebolla, tipo='SALIDA', cantidad=Decimal('100'), unidad_movimiento=self.cebolla.unidad,
+                                            nota='Orden Mesa 1', origen_tipo='ORDEN')
+        self.client.post(reverse('anular_venta', args=[venta.id]), {'motivo': 'Prueba'})
+        self.assertEqual(self._stock(), inicial)
+
+    def test_dos_anulaciones_a_la_vez_devuelven_una_sola_vez(self):
+        inicial = self._stock()
+        venta = self._venta_vieja()
+        vista = Venta.objects.get(pk=venta.pk)  # la segunda petición leyó la venta antes de que la primera confirmara
+        self.client.post(reverse('anular_venta', args=[venta.id]), {'motivo': 'Primera'})
+        with mock.patch.object(views, 'get_object_or_404', lambda *args, **kwargs: vista):
+            self.client.post(reverse('anular_venta', args=[venta.id]), {'motivo': 'Segunda'})
+        self.assertEqual(self._stock(), inicial)
+        self.assertEqual(Venta.objects.get(pk=venta.pk).motivo_anulacion, 'Primera')
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class CambioMasivoCatalogoTest(DatosCarrito, TestCase):
+    def test_catalogo_se_borra_al_confirmar(self):
+        cache.set(CATALOGO_CACHE_KEY, 'catálogo viejo')
+        with self.captureOnCommitCallbacks(execute=True) as al_confirmar:
+            masivo.guardar_precios_extras({f'precio_{self.queso.id}_FAM': '3,50'}, [self.queso.id])
+            # Dentro de la transacción la caché sigue intacta
+            self.assertEqual(cache.get(CATALOGO_CACHE_KEY), 'catálogo viejo')
+        self.assertEqual(len(al_confirmar), 1)
+        self.assertIsNone(cache.get(CATALOGO_CACHE_KEY))
+        self.assertEqual(PrecioExtra.objects.get(insumo=self.queso, tamano='FAM').precio, Decimal('3.50'))
+
+# ==========================================
+#  COSTOS GUARDADOS: insumo -> sub-receta -> producto
+# ==========================================
+class DatosCostos:
+    """
+    Harina, tomate y aceite; dos niveles de sub-recetas (salsa y base, que lleva
+    salsa) y tres productos con costos adicionales fijos y en porcentaje.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        gramos = UnidadMedida.objects.create(nombre='Gramos', codigo='GR', factor=1)
+
+        def materia_prima(nombre, precio, peso, merma='0'):
+            return Insumo.objects.create(
+                nombre=nombre, unidad=gramos, precio_mercado=Decimal(precio), peso_standar=Decimal(peso), merma_porcentaje=Decimal(merma)
+            )
+
+        def receta(nombre, lineas):
+            compuesto = Insumo.objects.create(nombre=nombre, unidad=gramos, es_insumo_compuesto=True)
+            for hijo, cantidad in lineas:
+                IngredienteCompuesto.objects.create(insumo_padre=compuesto, insumo_hijo=hijo, cantidad=Decimal(cantidad))
+            compuesto.save()
+            return compuesto
+
+        cls.harina = materia_prima('Harina', '45.00', '25000')
+        cls.tomate = materia_prima('Tomate', '3.00', '1000', merma='10')
+        cls.aceite = materia_prima('Aceite', '10.00', '900')
+        cls.salsa = receta('Salsa', [(cls.tomate, '800'), (cls.aceite, '200')])
+        cls.base = receta('Base', [(cls.harina, '500'), (cls.salsa, '300')])
+
+        pizzas = Categoria.objects.create(nombre='Pizzas')
+
+        def producto(nombre, precio, lineas):
+            nuevo = Producto.objects.create(nombre=nombre, precio=Decimal(precio), tamano='FAM', categoria=pizzas)
+            for insumo, cantidad in lineas:
+                IngredienteProducto.objects.create(producto=nuevo, insumo=insumo, cantidad=Decimal(cantidad))
+            return nuevo
+
+        cls.margarita = producto('Margarita', '9.00', [(cls.base, '437'), (cls.aceite, '13')])
+        cls.focaccia = producto('Focaccia', '6.50', [(cls.salsa, '151'), (cls.harina, '233')])
+        cls.bruschetta = producto('Bruschetta', '4.00', [(cls.tomate, '77')])
+
+        cls.empaque = CostoAdicional.objects.create(nombre='Empaque', tipo='FIJO', valor_defecto=Decimal('0.50'))
+        cls.gas = CostoAdicional.objects.create(nombre='Gas', tipo='PORCENTAJE', valor_defecto=Decimal('7'))
+        CostoAsignadoProducto.objects.create(producto=cls.margarita, costo_adicional=cls.empaque, valor_aplicado=Decimal('0.50'))
+        CostoAsignadoProducto.objects.create(producto=cls.margarita, costo_adicional=cls.gas, valor_aplicado=Decimal('7'))
+        CostoAsignadoProducto.objects.create(producto=cls.focaccia, costo_adicional=cls.gas, valor_aplicado=Decimal('12.5'))
+
+
+def costos_esperados(producto):
+    """ Los costos como los calculaban las propiedades originales: recorriendo la receta, sin redondear """
+    receta = sum(
+        (ing.cantidad * ing.insumo.costo_unitario for ing in IngredienteProducto.objects.filter(producto=producto).select_related('insumo')),
+        Decimal('0.00'),
+    )
+    indirectos = sum(
+        (ca.valor_aplicado if ca.costo_adicional.tipo == 'FIJO' else ca.valor_aplicado / 100 * receta
+         for ca in CostoAsignadoProducto.objects.filter(producto=producto).select_related('costo_adicional')),
+        Decimal('0.00'),
+    )
+    centavos = Decimal('0.01')
+    total = (receta + indirectos).quantize(centavos)
+    precio = Producto.objects.get(pk=producto.pk).precio
+    return {
+        'costo_materia_prima': receta.quantize(centavos),
+        'costo_indirectos': indirectos.quantize(centavos),
+        'costo_total': total,
+        'margen': ((precio - total) / precio * 100).quantize(centavos),
+    }
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class CostosGuardadosTest(DatosCostos, TestCase):
+    """ Las columnas guardadas de Producto siguen a la receta en cada cambio """
+
+    def _revisar(self):
+        for producto in (self.margarita, self.focaccia, self.bruschetta):
+            guardado = Producto.objects.filter(pk=producto.pk).values(
+                'costo_materia_prima', 'costo_indirectos', 'costo_total', 'margen'
+            ).get()
+            with self.subTest(producto=producto.nombre):
+                self.assertEqual(guardado, costos_esperados(producto))
+
+    def test_al_crear(self):
+        self._revisar()
+        self.assertGreater(Producto.objects.get(pk=self.margarita.pk).costo_indirectos, Decimal('0.50'))
+
+    def test_cambio_de_precio_de_un_insumo(self):
+        antes = Producto.objects.get(pk=self.margarita.pk).costo_total
+        self.tomate.precio_mercado = Decimal('4.80')
+        self.tomate.save()
+        self._revisar()
+        self.assertGreater(Producto.objects.get(pk=self.margarita.pk).costo_total, antes)
+
+    def test_agregar_y_quitar_un_costo_adicional(self):
+        asignado = CostoAsignadoProducto.objects.create(producto=self.bruschetta, costo_adicional=self.gas, valor_aplicado=Decimal('33'))
+        self._revisar()
+        self.assertGreater(Producto.objects.get(pk=self.bruschetta.pk).costo_indirectos, 0)
+        asignado.delete()
+        self._revisar()
+        self.assertEqual(Producto.objects.get(pk=self.bruschetta.pk).costo_indirectos, 0)
+
+    def test_editar_la_receta(self):
+        linea = IngredienteProducto.objects.get(producto=self.focaccia, insumo=self.harina)
+        linea.cantidad = Decimal('310')
+        linea.save()
+        self._revisar()
+        nueva = IngredienteProducto.objects.create(producto=self.bruschetta, insumo=self.base, cantidad=Decimal('55'))
+        self._revisar()
+        nueva.delete()
+        IngredienteProducto.objects.filter(producto=self.margarita, insumo=self.aceite).get().delete()
+        self._revisar()
+
+    def test_porcentaje_sobre_la_receta_sin_redondear(self):
+        receta = sum(
+            (ing.cantidad * ing.insumo.costo_unitario for ing in self.focaccia.ingredientes.select_related('insumo')),
+            Decimal('0.00'),
+        )
+        # La receta tiene más de dos decimales: redondearla antes cambiaría el monto
+        self.assertNotEqual(receta, receta.quantize(Decimal('0.01')))
+        gas = CostoAsignadoProducto.objects.get(producto=self.focaccia, costo_adicional=self.gas)
+        self.assertEqual(gas.monto_calculado, Decimal('12.5') / 100 * receta)
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class MotorCostosTest(DatosCostos, TestCase):
+    """ Un cambio llega a todos los niveles en una pasada y solo toca lo que depende de él """
+
+    def _costo(self, insumo):
+        return Insumo.objects.values_list('costo_unitario', flat=True).get(pk=insumo.pk)
+
+    def test_sub_receta_anidada_llega_a_los_productos_en_una_pasada(self):
+        # update() no dispara señales: todo lo recalcula la llamada de abajo
+        Insumo.objects.filter(pk=self.tomate.pk).update(precio_mercado=Decimal('6.00'), costo_unitario=Decimal('6.00') / 1000 / Decimal('0.9'))
+        resultado = recalcular_costos(insumo_ids=[self.tomate.pk])
+
+        seis = Decimal('0.000001')
+        tomate, aceite, harina = self._costo(self.tomate), self._costo(self.aceite), self._costo(self.harina)
+        salsa = ((800 * tomate + 200 * aceite) / 1000).quantize(seis)
+        base = ((500 * harina + 300 * salsa) / 800).quantize(seis)
+        self.assertEqual(self._costo(self.salsa), salsa)
+        self.assertEqual(self._costo(self.base), base)
+        self.assertEqual(resultado['insumos'], {
+            self.salsa.pk: (salsa, Decimal('1000.000')),
+            self.base.pk: (base, Decimal('800.000')),
+        })
+        for producto in (self.margarita, self.focaccia, self.bruschetta):
+            with self.subTest(producto=producto.nombre):
+                self.assertEqual(
+                    Producto.objects.values_list('costo_total', flat=True).get(pk=producto.pk),
+                    costos_esperados(producto)['costo_total'],
+                )
+
+    def test_solo_se_recalcula_lo_afectado(self):
+        bruschetta = Producto.objects.values_list('costo_total', 'margen').get(pk=self.bruschetta.pk)
+        resultado = recalcular_costos(insumo_ids=[self.harina.pk])
+        # La harina está en la base (y por ella en la margarita) y directa en la focaccia
+        self.assertEqual(set(resultado['insumos']), {self.base.pk})
+        self.assertEqual(set(resultado['productos']), {self.margarita.pk, self.focaccia.pk})
+        self.assertEqual(Producto.objects.values_list('costo_total', 'margen').get(pk=self.bruschetta.pk), bruschetta)
+
+        resultado = recalcular_costos(producto_ids=[self.bruschetta.pk])
+        self.assertEqual(resultado['insumos'], {})
+        self.assertEqual(set(resultado['productos']), {self.bruschetta.pk})
+
+    def test_ciclo_lanza_error_en_vez_de_recursion(self):
+        self.assertTrue(crea_ciclo(self.salsa.pk, self.base.pk))
+        self.assertTrue(crea_ciclo(self.salsa.pk, self.salsa.pk))
+        self.assertFalse(crea_ciclo(self.base.pk, self.aceite.pk))
+
+        antes = (self._costo(self.salsa), self._costo(self.base))
+        IngredienteCompuesto.objects.create(insumo_padre=self.salsa, insumo_hijo=self.base, cantidad=Decimal('10'))
+        with self.assertRaisesMessage(CicloDeRecetas, 'Base, Salsa'):
+            recalcular_costos(insumo_ids=[self.tomate.pk])
+        self.assertEqual((self._costo(self.salsa), self._costo(self.base)), antes)
+
+        componentes, usado_en = {1: [(1, Decimal('1'))]}, {1: {1}}
+        with self.assertRaises(CicloDeRecetas):
+            orden_topologico({1}, componentes, usado_en)
+
+
+@skipUnless(simulador_disponible(), "numpy no está instalado")
+@override_settings(CACHES=CACHE_PRUEBAS)
+class SimuladorPreciosTest(DatosCostos, TestCase):
+    """ El simulador parte de los mismos costos que están guardados y simula sin escribir en la BD """
+
+    def test_costo_actual_igual_al_guardado(self):
+        catalogo = CatalogoCostos()
+        for producto in (self.margarita, self.focaccia, self.bruschetta):
+            guardado = Producto.objects.get(pk=producto.pk)
+            i = catalogo.indice_producto[producto.pk]
+            with self.subTest(producto=producto.nombre):
+                # El simulador no redondea: a lo sumo medio centavo de diferencia
+                self.assertAlmostEqual(catalogo.actual['costo_total'][i], float(guardado.costo_total), delta=0.005)
+                tolerancia = 0.005 / float(guardado.precio) * 100 + 0.005
+                self.assertAlmostEqual(catalogo.actual['margen'][i], float(guardado.margen), delta=tolerancia)
+
+    def test_simular_precio_de_mercado(self):
+        catalogo = CatalogoCostos()
+        simulado = catalogo.simular({self.harina.pk: {'precio_mercado': '90.00'}})
+
+        # A mano: la harina pasa de 45 a 90 el saco de 25 kg
+        harina = 90 / 25000
+        tomate = 3 / 1000 / 0.9
+        aceite = 10 / 900
+        salsa = (800 * tomate + 200 * aceite) / 1000
+        base = (500 * harina + 300 * salsa) / 800
+        margarita = 437 * base + 13 * aceite
+        margarita += 0.50 + 0.07 * margarita
+        focaccia = 151 * salsa + 233 * harina
+        focaccia += 0.125 * focaccia
+        esperados = {
+            self.margarita.pk: (margarita, (9.00 - margarita) / 9.00 * 100),
+            self.focaccia.pk: (focaccia, (6.50 - focaccia) / 6.50 * 100),
+        }
+        for pk, (costo, margen) in esperados.items():
+            i = catalogo.indice_producto[pk]
+            self.assertAlmostEqual(simulado['costo_total'][i], costo, places=9)
+            self.assertAlmostEqual(simulado['margen'][i], margen, places=7)
+            self.assertLess(simulado['margen'][i], catalogo.actual['margen'][i])
+
+        # La bruschetta no lleva harina; y nada se guardó
+        i = catalogo.indice_producto[self.bruschetta.pk]
+        self.assertEqual(simulado['costo_total'][i], catalogo.actual['costo_total'][i])
+        self.assertEqual(Insumo.objects.get(pk=self.harina.pk).precio_mercado, Decimal('45.00'))
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class CambioMasivoUpsertTest(DatosCostos, TestCase):
+    """ Los cambios masivos escriben por lotes, no duplican filas y dejan los costos al día """
+
+    def _consultas(self, funcion, *args):
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = funcion(*args)
+        return resultado, len(consultas)
+
+    def _mas_productos(self, cuantos):
+        categoria = Categoria.objects.get(nombre='Pizzas')
+        return [
+            Producto.objects.create(nombre=f'Calzone {i}', precio=Decimal('7.00'), tamano='FAM', categoria=categoria).pk
+            for i in range(cuantos)
+        ]
+
+    def test_asignar_ingrediente_crea_y_actualiza(self):
+        ids = [self.margarita.pk, self.focaccia.pk, self.bruschetta.pk]
+        resultado = masivo.asignar_ingrediente(self.aceite, Decimal('20'), ids)
+        # La margarita ya llevaba aceite: se actualiza su línea, no se agrega otra
+        self.assertEqual(resultado, (2, 1))
+        self.assertEqual(IngredienteProducto.objects.filter(insumo=self.aceite).count(), 3)
+        self.assertEqual(set(IngredienteProducto.objects.filter(insumo=self.aceite).values_list('cantidad', flat=True)), {Decimal('20')})
+        for producto in (self.margarita, self.focaccia, self.bruschetta):
+            with self.subTest(producto=producto.nombre):
+                self.assertEqual(Producto.objects.values_list('costo_total', flat=True).get(pk=producto.pk), costos_esperados(producto)['costo_total'])
+
+        # Diez veces más productos, las mismas consultas
+        pocos = self._mas_productos(3)
+        resultado, pocas = self._consultas(masivo.asignar_ingrediente, self.aceite, Decimal('25'), ids + pocos)
+        self.assertEqual(resultado, (3, 3))
+        resultado, muchas = self._consultas(masivo.asignar_ingrediente, self.aceite, Decimal('30'), ids + pocos + self._mas_productos(27))
+        self.assertEqual(resultado, (27, 6))
+        self.assertEqual(muchas, pocas)
+
+    def test_asignar_y_quitar_costo(self):
+        ids = [self.margarita.pk, self.focaccia.pk, self.bruschetta.pk]
+        # La margarita ya tiene el empaque: no se duplica ni se cambia su valor
+        self.assertEqual(masivo.asignar_costo(self.empaque, Decimal('0.75'), ids), (2, 1))
+        self.assertEqual(CostoAsignadoProducto.objects.filter(costo_adicional=self.empaque).count(), 3)
+        self.assertEqual(CostoAsignadoProducto.objects.get(producto=self.margarita, costo_adicional=self.empaque).valor_aplicado, Decimal('0.50'))
+        for producto in (self.focaccia, self.bruschetta):
+            self.assertEqual(Producto.objects.values_list('costo_indirectos', flat=True).get(pk=producto.pk), costos_esperados(producto)['costo_indirectos'])
+
+        self.assertEqual(masivo.quitar_costo(self.empaque, ids), 3)
+        self.assertFalse(CostoAsignadoProducto.objects.filter(costo_adicional=self.empaque).exists())
+        self.assertEqual(Producto.objects.values_list('costo_indirectos', flat=True).get(pk=self.bruschetta.pk), 0)
+
+    def test_producto_inexistente_no_escribe_nada(self):
+        with self.assertRaisesMessage(ValueError, 'No existen los productos: 999999'):
+            masivo.asignar_ingrediente(self.aceite, Decimal('5'), [self.focaccia.pk, 999999])
+        self.assertFalse(IngredienteProducto.objects.filter(producto=self.focaccia, insumo=self.aceite).exists())
+
+    def test_precios_extras_upsert(self):
+        PrecioExtra.objects.create(insumo=self.harina, tamano='FAM', precio=Decimal('1.00'), cantidad=Decimal('0.1000'))
+        datos = {
+            'precio_%d_FAM' % self.harina.pk: '2,50',
+            'precio_%d_FAM' % self.tomate.pk: '1.00', 'cantidad_%d_FAM' % self.tomate.pk: '0,08',
+            'cantidad_%d_IND' % self.tomate.pk: '0.03',
+            'csrfmiddlewaretoken': 'x',
+        }
+        validos = [self.harina.pk, self.tomate.pk]
+        # Un INSERT ... ON CONFLICT DO UPDATE por grupo de campos
+        escritos, consultas = self._consultas(masivo.guardar_precios_extras, datos, validos)
+        self.assertEqual(escritos, 3)
+        self.assertLessEqual(consultas, 3 + 2)  # 3 grupos, más el SAVEPOINT y su RELEASE
+
+        # Solo llegó el precio de la harina: la porción que tenía se queda
+        harina = PrecioExtra.objects.get(insumo=self.harina, tamano='FAM')
+        self.assertEqual((harina.precio, harina.cantidad), (Decimal('2.50'), Decimal('0.1000')))
+        tomate = PrecioExtra.objects.get(insumo=self.tomate, tamano='FAM')
+        self.assertEqual((tomate.precio, tomate.cantidad), (Decimal('1.00'), Decimal('0.0800')))
+        self.assertEqual(PrecioExtra.objects.get(insumo=self.tomate, tamano='IND').cantidad, Decimal('0.0300'))
+        self.assertEqual(PrecioExtra.objects.count(), 3)
+
+        # Repetirlo no crea filas nuevas
+        masivo.guardar_precios_extras(datos, validos)
+        self.assertEqual(PrecioExtra.objects.count(), 3)
+
+        with self.assertRaisesMessage(ValueError, 'Campo desconocido'):
+            masivo.guardar_precios_extras({'precio_%d_FAM' % self.aceite.pk: '1'}, validos)
+
+
+# ==========================================
+#  COLA DE IMPRESIÓN: un trabajo lo imprime un solo hilo
+# ==========================================
+class ColaImpresionConcurrenteTest(TransactionTestCase):
+    HILOS = 6
+
+    def test_dos_trabajadores_no_imprimen_el_mismo_ticket(self):
+        trabajo = TrabajoImpresion.objects.create(impresora='COCINA', titulo='Comanda', datos=b'\x1b@hola')
+        enviados = []
+        barrera = threading.Barrier(self.HILOS)
+
+        def enviar(impresora, datos, titulo):
+            enviados.append(datos)
+
+        def trabajador():
+            try:
+                copia = TrabajoImpresion.objects.get(pk=trabajo.pk)  # todos lo leen PENDIENTE
+                barrera.wait()
+                cola_impresion._procesar(copia)
+            finally:
+                connection.close()
+
+        with mock.patch.object(cola_impresion, '_enviar_a_impresora', side_effect=enviar):
+            hilos = [threading.Thread(target=trabajador) for _ in range(self.HILOS)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+
+        self.assertEqual(enviados, [b'\x1b@hola'])
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos, trabajo.propietario), ('IMPRESO', 1, ''))
+
+
+class ColaImpresionArranqueTest(SimpleTestCase):
+    """ La fila solo se retoma al arrancar si el servidor lo pide (COLA_IMPRESION_AUTOARRANQUE) """
+
+    def _arrancar(self):
+        llamadas = []
+        with mock.patch.object(cola_impresion, 'reanudar_pendientes', lambda: llamadas.append(1)), \
+                mock.patch.object(cola_impresion, 'close_old_connections'):
+            cola_impresion.iniciar_cola()
+            for hilo in threading.enumerate():
+                if hilo.name == 'reanudar-impresion':
+                    hilo.join()
+        return len(llamadas)
+
+    def test_apagado_por_defecto(self):
+        with self.settings(COLA_IMPRESION_AUTOARRANQUE=False):
+            self.assertEqual(self._arrancar(), 0)
+
+    def test_encendido_por_configuracion(self):
+        with self.settings(COLA_IMPRESION_AUTOARRANQUE=True):
+            self.assertEqual(self._arrancar(), 1)
+
+class ColaImpresionReservaTest(TestCase):
+    def _trabajo(self, **campos):
+        return TrabajoImpresion.objects.create(impresora='CAJA', titulo='Factura', datos=b'x', **campos)
+
+    def test_reserva_vigente_no_se_toca(self):
+        trabajo = self._trabajo(estado='IMPRIMIENDO', propietario='otro', reservado_hasta=timezone.now() + timedelta(minutes=1))
+        with mock.patch.object(cola_impresion, '_enviar_a_impresora') as enviar:
+            cola_impresion._procesar(trabajo)
+        enviar.assert_not_called()
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.propietario), ('IMPRIMIENDO', 'otro'))
+
+    def test_reserva_vencida_se_retoma(self):
+        trabajo = self._trabajo(estado='IMPRIMIENDO', propietario='caido', reservado_hasta=timezone.now() - timedelta(seconds=1))
+        with mock.patch.object(cola_impresion, '_enviar_a_impresora') as enviar:
+            cola_impresion._procesar(trabajo)
+        enviar.assert_called_once()
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'IMPRESO')
+
+    def test_error_libera_la_reserva(self):
+        trabajo = self._trabajo()
+        with mock.patch.object(cola_impresion, '_enviar_a_impresora', side_effect=OSError('sin papel')):
+            cola_impresion._procesar(trabajo)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.propietario, trabajo.reservado_hasta), ('PENDIENTE', '', None))
+        self.assertEqual(trabajo.ultimo_error, 'sin papel')
+
+    def test_la_fila_espera_al_que_esta_imprimiendo(self):
+        self._trabajo(estado='IMPRIMIENDO', propietario='otro', reservado_hasta=timezone.now() + timedelta(seconds=40))
+        self._trabajo()
+        aviso = mock.Mock()
+        aviso.wait.side_effect = _Despertar
+        with mock.patch.object(cola_impresion, '_procesar') as procesar, \
+                mock.patch.object(cola_impresion, 'close_old_connections'):
+            with self.assertRaises(_Despertar):
+                cola_impresion._bucle_impresora('CAJA', aviso)
+        procesar.assert_not_called()
+        self.assertAlmostEqual(aviso.wait.call_args.kwargs['timeout'], 40, delta=5)
+
+
+# ==========================================
+#  IMPRESORA DE RED: una conexión por ticket, con consulta de estado
+# ==========================================
+class _ImpresoraFalsa(socketserver.BaseRequestHandler):
+    """ Contesta DLE EOT 1 con un estado 'en línea' (o no contesta) y guarda lo recibido por conexión """
+    responde = True
+    conexiones = []
+
+    def handle(self):
+        recibido = b''
+        self.request.settimeout(2)
+        while True:
+            try:
+                bloque = self.request.recv(4096)
+            except OSError:
+                break
+            if not bloque:
+                break
+            recibido += bloque
+            if recibido.endswith(ImpresoraRed.PEDIR_ESTADO) and self.responde:
+                self.request.sendall(b'\x16')
+        _ImpresoraFalsa.conexiones.append(recibido)
+
+
+class ImpresoraRedTest(TestCase):
+    def setUp(self):
+        _ImpresoraFalsa.responde = True
+        _ImpresoraFalsa.conexiones = []
+        self.servidor = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _ImpresoraFalsa)
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.puerto = self.servidor.server_address[1]
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def _esperar_conexiones(self, cuantas):
+        for _ in range(100):
+            if len(_ImpresoraFalsa.conexiones) >= cuantas:
+                return
+            threading.Event().wait(0.02)
+
+    def test_cada_ticket_usa_su_propia_conexion(self):
+        impresora = ImpresoraRed('127.0.0.1', self.puerto, timeout=1)
+        impresora.enviar(b'ticket 1', 'Comanda')
+        impresora.enviar(b'ticket 2', 'Comanda')
+        self._esperar_conexiones(2)
+        self.assertEqual(sorted(_ImpresoraFalsa.conexiones), [
+            ImpresoraRed.PEDIR_ESTADO + b'ticket 1', ImpresoraRed.PEDIR_ESTADO + b'ticket 2',
+        ])
+
+    def test_si_no_contesta_el_estado_no_se_envia(self):
+        _ImpresoraFalsa.responde = False
+        with self.assertRaises(OSError):
+            ImpresoraRed('127.0.0.1', self.puerto, timeout=0.3).enviar(b'ticket', 'Factura')
+        self._esperar_conexiones(1)
+        self.assertEqual(_ImpresoraFalsa.conexiones, [ImpresoraRed.PEDIR_ESTADO])
+
+    def test_impresora_apagada(self):
+        with socket.socket() as libre:
+            libre.bind(('127.0.0.1', 0))
+            puerto = libre.getsockname()[1]
+        with self.assertRaises(OSError):
+            ImpresoraRed('127.0.0.1', puerto, timeout=0.3).enviar(b'ticket', 'Factura')
+
+    def test_conexion_segun_el_nombre_de_la_impresora(self):
+        Impresora.objects.create(nombre='COCINA', tipo='RED', direccion=f'127.0.0.1:{self.puerto}')
+        Impresora.objects.create(nombre='PRUEBAS', tipo='MEMORIA')
+        cocina = obtener_backend('COCINA')
+        self.assertIsInstance(cocina, ImpresoraRed)
+        self.assertEqual((cocina.host, cocina.puerto), ('127.0.0.1', self.puerto))
+        self.assertIsInstance(obtener_backend('PRUEBAS'), ImpresoraMemoria)
+        self.assertIsInstance(obtener_backend('CAJA'), ImpresoraWindows)
+
+
+# ==========================================
+#  TICKETS ESC/POS: salida byte a byte contra los archivos de referencia
+# ==========================================
+# tickets_esperados/<ticket>_58.bin son los bytes que armaban los constructores
+# anteriores (concatenación de texto a 32 columnas) con estos mismos datos. Los
+# de 80 mm fijan el diseño de 48 columnas, que antes no existía.
+TICKETS_ESPERADOS = os.path.join(os.path.dirname(__file__), 'tickets_esperados')
+AHORA_TICKETS = timezone.make_aware(datetime(2026, 3, 14, 20, 45))
+
+
+def datos_tickets():
+    """ Una orden, una venta y un consumo interno con todos los casos de los tickets (ids fijos) """
+    mesero = User.objects.create(id=901, username='maria')
+    gramos = UnidadMedida.objects.create(nombre='Gramos', codigo='GR', factor=1)
+    insumo = lambda pk, nombre: Insumo.objects.create(id=pk, nombre=nombre, unidad=gramos, merma_porcentaje=Decimal('0'))
+    queso, tocineta, cebolla, champinon = insumo(901, 'Queso Mozzarella'), insumo(902, 'Tocineta Ahumada Premium'), insumo(903, 'Cebolla'), insumo(904, 'Champiñón')
+    pizzas = Categoria.objects.create(nombre='Pizzas')
+    producto = lambda pk, nombre, tamano, precio: Producto.objects.create(id=pk, nombre=nombre, tamano=tamano, precio=Decimal(precio), categoria=pizzas)
+    margarita = producto(901, 'Margarita', 'FAM', '12.00')
+    pepperoni = producto(902, 'Pepperoni', 'FAM', '14.00')
+    cuatro_quesos = producto(903, 'Cuatro Quesos Especial de la Casa', 'FAM', '16.50')
+    vegetariana = producto(904, 'Vegetariana', 'FAM', '13.00')
+    refresco = producto(905, 'Refresco 1.5L', 'UNI', '2.50')
+    mesa = Table.objects.create(id=901, number='7', name='Terraza')
+
+    orden = Orden.objects.create(id=901, mesa=mesa, mesero=mesero)
+    linea = lambda **campos: DetalleOrden.objects.create(orden=orden, **campos)
+    d1 = linea(id=901, producto=margarita, cantidad=2, precio_unitario=Decimal('12.00'), nota='Bien cocida, cortar en 12')
+    DetalleOrdenExtra.objects.create(detalle_orden=d1, insumo=tocineta, precio=Decimal('1.50'), porcion=Decimal('1.00'))
+    DetalleOrdenExtra.objects.create(detalle_orden=d1, insumo=queso, precio=Decimal('0.75'), porcion=Decimal('0.50'))
+    DetalleOrdenExtra.objects.create(detalle_orden=d1, insumo=champinon, precio=Decimal('0.00'), porcion=Decimal('1.00'))
+    d1.ingredientes_removidos.add(cebolla)
+    DetalleOrdenRemovido.objects.create(detalle_orden=d1, insumo=queso, porcion=Decimal('0.25'))
+    linea(id=902, producto=pepperoni, mitad_producto=cuatro_quesos, cantidad=1, precio_unitario=Decimal('15.25'), es_para_llevar=True)
+    linea(id=903, producto=margarita, cuarto_2_producto=pepperoni, cuarto_3_producto=cuatro_quesos,
+          cuarto_4_producto=vegetariana, cantidad=1, precio_unitario=Decimal('16.50'))
+    d4 = linea(id=904, producto=refresco, cantidad=3, precio_unitario=Decimal('2.50'))
+    DetalleOrdenRemovido.objects.create(detalle_orden=d4, insumo=cebolla, porcion=Decimal('0.75'))
+
+    venta = Venta.objects.create(
+        id=901, codigo_factura='000123', total=Decimal('72.75'), metodo_pago='MIXTO', mesero=mesero, mesa_numero=7,
+        monto_recibido=Decimal('80.00'), propina=Decimal('2.00'), tasa_aplicada=Decimal('36.5012'),
+    )
+    Venta.objects.filter(id=901).update(fecha=AHORA_TICKETS)
+    vendido = lambda **campos: DetalleVenta.objects.create(venta=venta, subtotal=campos['precio_unitario'] * campos['cantidad'], **campos)
+    v1 = vendido(producto=margarita, nombre_producto='Margarita (Familiar)', cantidad=2, precio_unitario=Decimal('12.00'))
+    DetalleVentaExtra.objects.create(detalle_venta=v1, nombre_extra='Tocineta Ahumada Premium', precio=Decimal('1.50'), porcion=Decimal('1.00'))
+    DetalleVentaExtra.objects.create(detalle_venta=v1, nombre_extra='Queso Mozzarella', precio=Decimal('0.75'), porcion=Decimal('0.50'))
+    DetalleVentaExtra.objects.create(detalle_venta=v1, nombre_extra='Champiñón', precio=Decimal('0.00'), porcion=Decimal('1.00'))
+    vendido(producto=pepperoni, nombre_producto='Pepperoni', mitad_producto=cuatro_quesos, nombre_mitad='Cuatro Quesos Especial de la Casa',
+            cantidad=1, precio_unitario=Decimal('15.25'))
+    vendido(producto=margarita, nombre_producto='Margarita', cantidad=1, precio_unitario=Decimal('16.50'),
+            cuarto_2_producto=pepperoni, nombre_cuarto_2='Pepperoni', cuarto_3_producto=cuatro_quesos,
+            nombre_cuarto_3='Cuatro Quesos Especial de la Casa', cuarto_4_producto=vegetariana, nombre_cuarto_4='Vegetariana')
+    vendido(producto=refresco, nombre_producto='Refresco 1.5L Coca-Cola Original', cantidad=3, precio_unitario=Decimal('2.50'))
+    Pago.objects.create(venta=venta, metodo='EFECTIVO_USD', monto=Decimal('50.00'))
+    Pago.objects.create(venta=venta, metodo='PAGO_MOVIL', monto=Decimal('30.00'), referencia='0412')
+
+    consumo = ConsumoInterno.objects.create(id=901, tipo='PERSONAL', usuario=mesero, descripcion='Almuerzo cocina: 2 pizzas medianas')
+    for extra in (tocineta, queso):
+        MovimientoInventario.objects.create(
+            insumo=extra, tipo='SALIDA', cantidad=Decimal('0.050'), nota=f"Extra Personal #{consumo.id}",
+            origen_tipo='CONSUMO', origen_id=consumo.id,
+        )
+    return orden, venta, consumo
+
+
+def configurar_tickets(ancho_papel):
+    config = Configuracion.get_solo()
+    config.nombre_empresa = 'Di Catia Pizzas'
+    config.direccion = 'Av. Sucre, Catia, Caracas - Frente a la plaza'
+    config.telefono = '0212-5551234'
+    config.mensaje_ticket = '¡Gracias por su compra!'
+    config.pm_banco, config.pm_telefono, config.pm_cedula = 'Banesco (0134)', '04141234567', 'V12345678'
+    config.impresora_ticket = 'TICKETS'
+    config.auto_imprimir, config.usar_logo_impresora, config.abrir_caja_registradora = True, False, True
+    config.ancho_papel = ancho_papel
+    config.save()
+
+
+def imprimir_tickets(orden, venta, consumo):
+    """ {nombre: bytes} de los cuatro tickets, tal como quedan en la cola de impresión """
+    with mock.patch('django.utils.timezone.now', return_value=AHORA_TICKETS):
+        utils_impresora.mandar_a_tickera(Venta.objects.get(pk=venta.pk))
+        utils_impresora.imprimir_precuenta(Orden.objects.get(pk=orden.pk), None)
+        utils_impresora.imprimir_comanda(Orden.objects.get(pk=orden.pk))
+        utils_impresora.imprimir_consumo_interno(ConsumoInterno.objects.get(pk=consumo.pk))
+    return {
+        trabajo.titulo.lower().replace(' ', '_'): bytes(trabajo.datos)
+        for trabajo in TrabajoImpresion.objects.order_by('id')
+    }
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class TicketsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TasaBCV.objects.create(precio=Decimal('36.5012'))
+        cls.orden, cls.venta, cls.consumo = datos_tickets()
+
+    def _comparar(self, ancho_papel):
+        configurar_tickets(ancho_papel)
+        tickets = imprimir_tickets(self.orden, self.venta, self.consumo)
+        self.assertEqual(sorted(tickets), ['comanda', 'consumo_interno', 'factura', 'precuenta'])
+        for nombre, datos in tickets.items():
+            with self.subTest(ticket=nombre, ancho=ancho_papel):
+                with open(os.path.join(TICKETS_ESPERADOS, f'{nombre}_{ancho_papel}.bin'), 'rb') as archivo:
+                    self.assertEqual(datos, archivo.read())
+
+    def test_tickets_58mm(self):
+        self._comparar(58)
+
+    def test_tickets_80mm(self):
+        self._comparar(80)
+
+
+# ==========================================
+#  LOGO DE LA TICKERA: raster calculado una vez
+# ==========================================
+def raster_por_pixeles(img_path, ancho_papel):
+    """ El raster como se armaba antes, punto por punto (referencia para comparar) """
+    from PIL import Image
+
+    img = Image.open(img_path)
+    max_width = 300 if ancho_papel == 58 else 400
+    img = img.resize((max_width, int(img.size[1] * (max_width / img.size[0]))), getattr(Image, 'Resampling', Image).LANCZOS)
+    img = img.convert('L').point(lambda x: 0 if x < 128 else 255, '1')
+    width, height = img.size
+    if width % 8 != 0:
+        width += 8 - (width % 8)
+        relleno = Image.new('1', (width, height), 1)
+        relleno.paste(img, (0, 0))
+        img = relleno
+    header = b'\x1d\x76\x30\x00' + bytes([(width // 8) % 256, (width // 8) // 256, height % 256, height // 256])
+    pixels = list(img.getdata())
+    raster = bytearray()
+    for y in range(height):
+        for x in range(0, width, 8):
+            raster.append(sum((1 << (7 - bit)) for bit in range(8) if pixels[y * width + x + bit] == 0))
+    return b'\x1b\x61\x01' + header + bytes(raster) + b'\n\x1b\x61\x00'
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class LogoImpresoraTest(SimpleTestCase):
+    """ El logo se convierte una vez por archivo, fecha y ancho, y sale igual que punto por punto """
+
+    def setUp(self):
+        from PIL import Image, ImageDraw
+
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.ruta = os.path.join(carpeta.name, 'logo.png')
+        # Degradado con figuras: bordes y grises de todo tipo alrededor del umbral
+        imagen = Image.linear_gradient('L').resize((517, 233)).convert('RGB')
+        dibujo = ImageDraw.Draw(imagen)
+        dibujo.ellipse((40, 20, 260, 210), fill=(200, 30, 30))
+        dibujo.rectangle((300, 60, 480, 180), outline=(0, 0, 0), width=9)
+        imagen.save(self.ruta)
+
+        cache.clear()
+        utils_impresora._logo_en_memoria.clear()
+        self.addCleanup(utils_impresora._logo_en_memoria.clear)
+
+    def _config(self, ancho_papel=80):
+        return mock.Mock(usar_logo_impresora=True, logo=mock.Mock(path=self.ruta), ancho_papel=ancho_papel)
+
+    def test_igual_que_punto_por_punto(self):
+        for ancho_papel in (58, 80):
+            with self.subTest(ancho=ancho_papel):
+                self.assertEqual(utils_impresora._raster_logo(self.ruta, ancho_papel), raster_por_pixeles(self.ruta, ancho_papel))
+
+    def test_se_convierte_una_vez_por_archivo_y_ancho(self):
+        with mock.patch.object(utils_impresora, '_raster_logo', wraps=utils_impresora._raster_logo) as raster:
+            primero = utils_impresora.obtener_logo_bytes(self._config())
+            self.assertEqual(utils_impresora.obtener_logo_bytes(self._config()), primero)
+            self.assertEqual(raster.call_count, 1)
+
+            # Otro proceso: sin memoria, lo toma de la caché compartida
+            utils_impresora._logo_en_memoria.clear()
+            self.assertEqual(utils_impresora.obtener_logo_bytes(self._config()), primero)
+            self.assertEqual(raster.call_count, 1)
+
+            utils_impresora.obtener_logo_bytes(self._config(58))
+            self.assertEqual(raster.call_count, 2)
+
+            # Logo nuevo con el mismo nombre: cambia la fecha de modificación
+            modificado = os.path.getmtime(self.ruta) + 60
+            os.utime(self.ruta, (modificado, modificado))
+            utils_impresora.obtener_logo_bytes(self._config())
+            self.assertEqual(raster.call_count, 3)
+
+        self.assertEqual(utils_impresora.obtener_logo_bytes(mock.Mock(usar_logo_impresora=False)), b'')
+
+
+# ==========================================
+#  PDF DE FACTURAS: se renderiza solo si no está en disco
+# ==========================================
+def _cerrar(respuesta):
+    """ Cierra un FileResponse sin que request_finished cierre la conexión de la prueba """
+    request_finished.disconnect(close_old_connections)
+    try:
+        respuesta.close()
+    finally:
+        request_finished.connect(close_old_connections)
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class FacturaPdfTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.venta = Venta.objects.create(
+            codigo_factura='000777', total=Decimal('20.00'), metodo_pago='EFECTIVO_USD', mesa_numero=3,
+            monto_recibido=Decimal('20.00'), tasa_aplicada=Decimal('36.50'),
+        )
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        ajustes = self.settings(FACTURAS_PDF_DIR=carpeta.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        renderizar = mock.patch.object(facturas_pdf, 'renderizar_pdf', return_value=b'%PDF-1.4 prueba')
+        self.renderizar = renderizar.start()
+        self.addCleanup(renderizar.stop)
+        self.client.force_login(self.usuario)
+        self.url = reverse('generar_factura_pdf', args=[self.venta.id])
+
+    def test_solo_la_primera_vez_se_renderiza(self):
+        primera = self.client.get(self.url)
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(b''.join(primera.streaming_content), b'%PDF-1.4 prueba')
+        _cerrar(primera)
+        with mock.patch.object(facturas_pdf, 'html_factura') as html:
+            segunda = self.client.get(self.url)
+            _cerrar(segunda)
+            # El navegador que ya la tiene recibe un 304 sin armar nada
+            no_modificada = self.client.get(self.url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        html.assert_not_called()
+        self.assertEqual(segunda['ETag'], primera['ETag'])
+        self.assertEqual(no_modificada.status_code, 304)
+        self.assertEqual(self.renderizar.call_count, 1)
+
+    def test_cambiar_la_configuracion_o_anular_genera_otra_version(self):
+        huellas = {facturas_pdf.obtener_pdf_factura(self.venta.id)[1]}
+        config = Configuracion.get_solo()
+        config.mensaje_ticket = 'Vuelva pronto'
+        config.save()
+        huellas.add(facturas_pdf.obtener_pdf_factura(self.venta.id)[1])
+        Venta.objects.filter(pk=self.venta.pk).update(anulada=True)
+        huellas.add(facturas_pdf.obtener_pdf_factura(self.venta.id)[1])
+        self.assertEqual(len(huellas), 3)
+        self.assertEqual(self.renderizar.call_count, 3)
+        # Solo queda en disco la última versión
+        self.assertEqual(len(os.listdir(facturas_pdf._carpeta())), 1)
+
+    def test_consultas_de_un_pdf_ya_generado(self):
+        _cerrar(self.client.get(self.url))
+        # Sesión y usuario, la venta (con su mesero) y el guardado de la sesión (3)
+        with self.assertNumQueries(6):
+            respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH='"otra"')
+            _cerrar(respuesta)
@@ -0,0 +1,352 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from inventory.models import Insumo
+from .models import Producto, DetalleVenta, DetalleOrdenExtra, DetalleOrdenRemovido
+
+# ==========================================
+#  MOTOR DE DISEÑO DE TICKETS (ESC/POS)
+# ==========================================
+# Cada ancho de papel tiene sus formatos de columna armados una sola vez.
+# El ticket se escribe directo en un bytearray ya codificado en cp850 y
+# recibe los datos precargados: la cantidad de consultas no depende de
+# la cantidad de líneas.
+
+CORTE_PAPEL = "\x1D\x56\x41\x10"
+TAMANOS = dict(Producto.OPCIONES_TAMANO)
+
+# Títulos fijos; se centran en el ancho del papel
+TITULOS = {
+    'comanda': "COMANDA DE COCINA",
+    'precuenta': "*** PRE-CUENTA ***",
+    'total_a_pagar': "TOTAL A PAGAR:",
+    'sin_servicio': "NO COBRAMOS 10% DE SERVICIO",
+    'personal': "COMIDA DE PERSONAL",
+    'cortesia': "CORTESIA / REGALO",
+    'consumo': "{}",
+}
+# En 58 mm los títulos salen exactamente como se imprimían antes del motor
+TITULOS_58 = {
+    'comanda': "      COMANDA DE COCINA       ",
+    'precuenta': "       *** PRE-CUENTA *** ",
+    'total_a_pagar': "     TOTAL A PAGAR:     ",
+    'sin_servicio': "  NO COBRAMOS 10% DE SERVICIO  ",
+    'personal': "      COMIDA DE PERSONAL      ",
+    'cortesia': "      CORTESIA / REGALO       ",
+    'consumo': "      {}      ",
+}
+
+
+class Diseno:
+    """ Formatos de línea para un ancho de papel (en caracteres) """
+    def __init__(self, columnas, titulos=None):
+        c = columnas
+        self.columnas = c
+        self.titulos = titulos or {}
+        self.linea_doble = "=" * c + "\n"
+        self.linea_simple = "-" * c + "\n"
+        self.titulos_items = "CANT DESCRIPCION".ljust(c - 5) + "TOTAL\n"
+
+        # Factura y precuenta: cantidad | descripción | total
+        self.item = "{:<4}{:<%d.%d} {:>8.2f}\n" % (c - 13, c - 13)
+        self.parte = "  {}{:.%d}\n" % (c - 6)
+        self.extra_con_precio = "  {:<%d.%d}{:>9.2f}\n" % (c - 11, c - 11)
+        self.extra = "  {:.%d}\n" % (c - 11)
+        self.monto_usd = "{:<%d}{:>8}{:>8.2f}\n" % (c - 16)
+        self.monto_bs = "{:<%d}{:>6}{:>10.2f}\n" % (c - 16)
+        self.pago = "  {:<14.14}{:>%d}{:>8.2f}\n" % (c - 24)
+        self.a_llenar = "{:<16}" + "_" * (c - 16) + "\n"
+
+        # Comanda de cocina
+        self.comanda_item = "{:<4} {:.%d}\n" % (c - 5)
+        self.comanda_parte = "   >> {}{:.%d}\n" % (c - 10)
+        self.comanda_extra = "   + {:.%d}\n" % (c - 10)
+        self.comanda_sin = "   - SIN {:.%d}\n" % (c - 10)
+        self.comanda_sin_porcion = "   - SIN {}{:.%d}\n" % (c - 14)
+        self.comanda_nota = "   ** {:.%d} **\n" % (c - 7)
+        self.consumo_extra = "   EXTRA {:.%d}\n" % (c - 10)
+
+
+DISENOS = {58: Diseno(32, TITULOS_58), 80: Diseno(48)}
+
+
+def diseno_para(ancho_papel):
+    return DISENOS.get(ancho_papel, DISENOS[80])
+
+
+class Ticket:
+    """ Acumula el ticket ya codificado para la impresora """
+    def __init__(self, diseno, prefijo=b''):
+        self.d = diseno
+        self.datos = bytearray(prefijo)
+
+    def texto(self, texto):
+        self.datos += texto.encode('cp850', errors='replace')
+
+    def linea(self, formato, *valores):
+        self.texto(formato.format(*valores))
+
+    def centrado(self, texto):
+        self.texto(texto.center(self.d.columnas) + "\n")
+
+    def titulo(self, clave, *valores):
+        formato = self.d.titulos.get(clave)
+        if formato is None:
+            self.centrado(TITULOS[clave].format(*valores))
+        else:
+            self.texto(formato.format(*valores) + "\n")
+
+    def doble(self):
+        self.texto(self.d.linea_doble)
+
+    def simple(self):
+        self.texto(self.d.linea_simple)
+
+    def cortar(self, avance=2):
+        """ Avanza unas líneas en blanco, corta el papel y devuelve los bytes """
+        self.texto("\n" * avance + CORTE_PAPEL)
+        return bytes(self.datos)
+
+
+def _nombre_con_tamano(producto):
+    if producto.tamano != 'UNI':
+        return f"{producto.nombre} ({TAMANOS.get(producto.tamano, producto.tamano)})"
+    return producto.nombre
+
+
+def _tamano_comanda(producto):
+    return f" ({TAMANOS.get(producto.tamano, producto.tamano).upper()})" if producto.tamano != 'UNI' else ""
+
+
+def _usuario(usuario, defecto):
+    return usuario.username.upper() if usuario else defecto
+
+
+# ==========================================
+#  CARGA DE DATOS
+# ==========================================
+
+def detalles_orden_para_ticket(detalles):
+    """ Detalles de orden con productos, extras y removidos ya cargados """
+    return detalles.select_related(
+        'producto', 'mitad_producto', 'cuarto_2_producto', 'cuarto_3_producto', 'cuarto_4_producto'
+    ).prefetch_related(
+        Prefetch('extras_elegidos', queryset=DetalleOrdenExtra.objects.select_related('insumo')),
+        Prefetch('ingredientes_removidos', queryset=Insumo.objects.only('id', 'nombre')),
+        Prefetch('removidos_detalles', queryset=DetalleOrdenRemovido.objects.select_related('insumo')),
+    )
+
+
+def cargar_venta_para_ticket(venta):
+    """ Precarga en la venta sus detalles (con extras) y sus pagos """
+    prefetch_related_objects(
+        [venta],
+        Prefetch('detalles', queryset=DetalleVenta.objects.select_related('mitad_producto').prefetch_related('extras')),
+        'pagos',
+    )
+    return venta
+
+
+# ==========================================
+#  TICKETS
+# ==========================================
+
+def _lineas_extras(t, extras, cantidad, nombre_extra):
+    d = t.d
+    for ex in extras:
+        precio_ex = ex.precio * cantidad
+        nombre = f"+ {ex.porcion_display}{nombre_extra(ex)}"
+        if precio_ex > 0:
+            t.linea(d.extra_con_precio, nombre, precio_ex)
+        else:
+            t.linea(d.extra, nombre)
+
+
+def render_factura(venta, config, total_usd, total_bs, monto_recibido, vuelto_usd, propina, prefijo=b''):
+    """ Factura final. La venta debe venir de cargar_venta_para_ticket. """
+    t = Ticket(diseno_para(config.ancho_papel), prefijo)
+    d = t.d
+    t.centrado(config.nombre_empresa.upper())
+    t.centrado(config.direccion[:d.columnas])
+    if config.telefono: t.texto(f"Telf: {config.telefono.center(d.columnas - 6)}\n")
+    t.doble()
+    t.texto(f"FACTURA: {venta.codigo_factura}\n")
+    t.texto(f"FECHA: {timezone.localtime(venta.fecha).strftime('%d/%m/%Y %H:%M')}\n")
+    t.texto(f"Ticket: #{venta.id}\n")
+    t.texto(f"MESA: {venta.mesa_numero} | MESERO: {_usuario(venta.mesero, 'CAJA')}\n")
+    t.simple()
+    t.texto(d.titulos_items)
+    t.simple()
+
+    for item in venta.detalles.all():
+        subt_base = item.precio_unitario * item.cantidad
+        qty_str = f"{item.cantidad}x"
+        if item.cuarto_2_producto_id:
+            t.linea(d.item, qty_str, '4 ESTACIONES', subt_base)
+            for nombre in (item.nombre_producto, item.nombre_cuarto_2, item.nombre_cuarto_3, item.nombre_cuarto_4):
+                t.linea(d.parte, "1/4 ", nombre or "")
+        elif item.mitad_producto_id:
+            t.linea(d.item, qty_str, 'MITAD/MITAD', subt_base)
+            t.linea(d.parte, "1/2 ", item.nombre_producto)
+            mitad = item.mitad_producto
+            t.linea(d.parte, "1/2 ", mitad.nombre if mitad else (item.nombre_mitad or ""))
+        else:
+            t.linea(d.item, qty_str, item.nombre_producto, subt_base)
+        _lineas_extras(t, item.extras.all(), item.cantidad, lambda ex: ex.nombre_extra)
+
+    t.simple()
+    t.linea(d.monto_usd, 'TOTAL USD:', '$', total_usd)
+    t.linea(d.monto_bs, 'TOTAL Bs.:', 'Bs.', total_bs)
+    t.simple()
+
+    pagos = venta.pagos.all()
+    if pagos:
+        t.texto("FORMAS DE PAGO:\n")
+        for pago in pagos:
+            t.linea(d.pago, pago.get_metodo_display(), '$', pago.monto)
+    else:
+        t.texto(f"PAGO: {venta.get_metodo_pago_display()[:14]}\n")
+    t.simple()
+
+    t.linea(d.monto_usd, 'TOTAL PAGADO:', '$', monto_recibido)
+    if vuelto_usd > 0:
+        t.linea(d.monto_usd, 'VUELTO USD:', '$', vuelto_usd)
+    if propina > 0:
+        t.linea(d.monto_usd, 'PROPINA:', '$', propina)
+    t.doble()
+    t.centrado(config.mensaje_ticket)
+    return t.cortar()
+
+
+def render_precuenta(orden, detalles, config, tasa, ahora=None, prefijo=b''):
+    """ Pre-cuenta. Los detalles deben venir de detalles_orden_para_ticket. """
+    t = Ticket(diseno_para(config.ancho_papel), prefijo)
+    d = t.d
+    hora_local = timezone.localtime(ahora or timezone.now())
+    t.centrado(config.nombre_empresa.upper())
+    t.titulo('precuenta')
+    t.texto(f"MESA: {orden.mesa.number} | {hora_local.strftime('%H:%M')}\n")
+    t.texto(f"MESERO: {_usuario(orden.mesero, 'CAJA')}\n")
+    t.simple()
+    t.texto(d.titulos_items)
+    t.simple()
+
+    total_usd = Decimal('0.00')
+    for item in detalles:
+        extras = item.extras_elegidos.all()
+        p_base = item.precio_unitario
+        total_usd += (p_base + sum(e.precio for e in extras)) * item.cantidad
+
+        subtotal_base = p_base * item.cantidad
+        qty_str = f"{item.cantidad}x"
+        if item.cuarto_2_producto_id:
+            t.linea(d.item, qty_str, '4 ESTACIONES', subtotal_base)
+            for parte in (item.producto, item.cuarto_2_producto, item.cuarto_3_producto, item.cuarto_4_producto):
+                t.linea(d.parte, "1/4 ", parte.nombre if parte else "")
+        elif item.mitad_producto_id:
+            t.linea(d.item, qty_str, 'MITAD/MITAD', subtotal_base)
+            t.linea(d.parte, "1/2 ", item.producto.nombre)
+            t.linea(d.parte, "1/2 ", item.mitad_producto.nombre)
+        else:
+            t.linea(d.item, qty_str, _nombre_con_tamano(item.producto), subtotal_base)
+        _lineas_extras(t, extras, item.cantidad, lambda ex: ex.insumo.nombre)
+
+    total_bs = (total_usd * tasa).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    t.simple()
+    t.linea(d.monto_usd, 'SUBTOTAL USD:', '$', total_usd)
+    t.texto("\n")
+    t.titulo('total_a_pagar')
+    t.linea(d.monto_usd, 'USD:', '$', total_usd)
+    t.linea(d.monto_bs, 'Bs.:', 'Bs.', total_bs)
+
+    if config.pm_banco or config.pm_telefono or config.pm_cedula:
+        t.simple()
+        t.centrado("PAGO MOVIL")
+        if config.pm_banco: t.texto(f"BANCO: {config.pm_banco.upper()}\n")
+        if config.pm_telefono: t.texto(f"TELF:  {config.pm_telefono}\n")
+        if config.pm_cedula: t.texto(f"C.I:   {config.pm_cedula}\n")
+
+    t.simple()
+    t.linea(d.a_llenar, "MONTO RECIBIDO:")
+    t.texto("\n")
+    t.linea(d.a_llenar, "REFERENCIA:")
+    t.simple()
+    t.titulo('sin_servicio')
+    return t.cortar()
+
+
+def render_comanda(orden, detalles, config, ahora=None):
+    """ Comanda de cocina con las líneas indicadas (cargadas con detalles_orden_para_ticket) """
+    t = Ticket(diseno_para(config.ancho_papel))
+    d = t.d
+    t.doble()
+    t.titulo('comanda')
+    t.doble()
+    tipo = getattr(orden, 'tipo_servicio', 'MESA')
+    if tipo == 'LLEVAR': t.texto(">>> PARA LLEVAR <<<\n")
+    elif tipo == 'DOMICILIO': t.texto(">>> DELIVERY <<<\n")
+    else:
+        # Texto de la mesa, con el nombre si existe
+        mesa_info = f"MESA: {orden.mesa.number}"
+        if orden.mesa.name:
+            mesa_info += f" ({orden.mesa.name.upper()})"
+        t.texto(f"{mesa_info}\n")
+
+    hora_local = timezone.localtime(ahora or timezone.now())
+    t.texto(f"Ticket: #{orden.id} | Mesero: {_usuario(orden.mesero, 'CAJA')}\n")
+    t.texto(f"Hora: {hora_local.strftime('%H:%M')}\n")
+    t.simple()
+    t.texto("\n")
+
+    for item in detalles:
+        qty_str = f"{item.cantidad}x"
+        tamano_txt = _tamano_comanda(item.producto)
+        if item.cuarto_2_producto_id:
+            t.linea(d.comanda_item, qty_str, f"4 ESTACIONES{tamano_txt}")
+            for parte in (item.producto, item.cuarto_2_producto, item.cuarto_3_producto, item.cuarto_4_producto):
+                t.linea(d.comanda_parte, "1/4 ", parte.nombre.upper() if parte else "")
+        elif item.mitad_producto_id:
+            t.linea(d.comanda_item, qty_str, f"MITAD{tamano_txt}")
+            t.linea(d.comanda_parte, "1/2 ", item.producto.nombre.upper())
+            t.linea(d.comanda_parte, "1/2 ", item.mitad_producto.nombre.upper())
+        else:
+            t.linea(d.comanda_item, qty_str, f"{item.producto.nombre.upper()}{tamano_txt}")
+
+        for extra in item.extras_elegidos.all():
+            t.linea(d.comanda_extra, f"{extra.porcion_display}{extra.insumo.nombre.upper()}")
+        for rem in item.ingredientes_removidos.all():
+            t.linea(d.comanda_sin, rem.nombre.upper())
+        for r in item.removidos_detalles.all():
+            t.linea(d.comanda_sin_porcion, r.porcion_display, r.insumo.nombre.upper())
+        if item.es_para_llevar: t.texto("   [PARA LLEVAR]\n")
+        if item.nota: t.linea(d.comanda_nota, item.nota)
+
+    t.simple()
+    return t.cortar(avance=1)
+
+
+def render_consumo_interno(consumo, extras, config, ahora=None):
+    """ Ticket de comida de personal / cortesía. extras: insumos con select_related ya hecho """
+    t = Ticket(diseno_para(config.ancho_papel))
+    d = t.d
+    t.doble()
+    if consumo.tipo == 'PERSONAL':
+        t.titulo('personal')
+    elif consumo.tipo == 'CORTESIA':
+        t.titulo('cortesia')
+    else:
+        t.titulo('consumo', consumo.get_tipo_display().upper())
+    t.doble()
+    hora_local = timezone.localtime(ahora or timezone.now())
+    t.texto(f"Ticket: #{consumo.id} | Solicita: {_usuario(consumo.usuario, 'SISTEMA')}\n")
+    t.texto(f"Hora: {hora_local.strftime('%H:%M')}\n")
+    t.simple()
+    t.texto("\n")
+    t.texto(f"DETALLE:\n{consumo.descripcion.upper()}\n\n")
+    if extras:
+        t.texto("EXTRAS:\n")
+        for insumo in extras:
+            t.linea(d.consumo_extra, insumo.nombre.upper())
+    t.simple()
+    return t.cortar(avance=1)
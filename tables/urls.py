@@ -12,6 +12,10 @@ urlpatterns = [
     # Esta ruta captura el ID de la mesa en la URL, ej: /table/5/order/
     path('table/<int:table_id>/order/', views.table_order_view, name='table_order'),
     path('table/<int:table_id>/asignar_mesero/', views.asignar_mesero, name='asignar_mesero'),
+    # Catálogo del menú (JSON con ETag) que usa la pantalla de pedidos
+    path('catalogo/', views.catalogo_json, name='catalogo_json'),
+    # Estado de la cola de impresión de la mesa (comandas, precuentas)
+    path('table/<int:table_id>/impresion/', views.estado_impresion_mesa, name='estado_impresion_mesa'),
 
     # 1. Catálogo General
     path('productos/', views.product_list, name='product_list'),
@@ -29,6 +33,8 @@ urlpatterns = [
     path('productos/precio/<int:pk>/', views.product_pricing, name='product_pricing'),
     path('productos/costo-masivo/', views.bulk_cost_update, name='bulk_cost_update'),
     path('productos/eliminar/<int:pk>/', views.product_delete, name='product_delete'),
+    path('productos/simulador/', views.simulador_precios, name='simulador_precios'),
+    path('productos/simulador/api/', views.simulador_precios_api, name='simulador_precios_api'),
     path('mesa/<int:table_id>/grabar/', views.grabar_mesa_ajax, name='grabar_mesa'),
     path('orden/<int:orden_id>/pdf/', views.generar_ticket_pdf, name='generar_ticket_pdf'),
     path('mesa/<int:table_id>/eliminar/', views.eliminar_mesa_ajax, name='eliminar_mesa'),
@@ -0,0 +1,206 @@
+from decimal import Decimal
+from core.models import Configuracion
+from inventory.models import MovimientoInventario
+from .models import IngredienteProducto, PrecioExtra
+
+
+def preparar_detalles(detalles):
+    """
+    Trae de una vez todo lo que el cálculo de insumos necesita de cada detalle
+    (productos, mitades, cuartos, extras y removidos) para no consultar fila por fila.
+    """
+    return detalles.select_related(
+        'producto', 'mitad_producto', 'cuarto_2_producto', 'cuarto_3_producto', 'cuarto_4_producto'
+    ).prefetch_related(
+        'ingredientes_removidos', 'removidos_detalles__insumo', 'extras_elegidos__insumo__unidad'
+    )
+
+
+def recetas_por_producto(detalles):
+    """ {producto_id: [IngredienteProducto, ...]} de todos los productos usados, en una sola consulta """
+    producto_ids = set()
+    for det in detalles:
+        for campo in ('producto_id', 'mitad_producto_id', 'cuarto_2_producto_id', 'cuarto_3_producto_id', 'cuarto_4_producto_id'):
+            if getattr(det, campo):
+                producto_ids.add(getattr(det, campo))
+
+    recetas = {p_id: [] for p_id in producto_ids}
+    for ing in IngredienteProducto.objects.filter(producto_id__in=producto_ids).select_related('insumo__unidad').order_by('id'):
+        recetas[ing.producto_id].append(ing)
+    return recetas
+
+
+def _precios_extra(detalles):
+    """ {(insumo_id, tamano): PrecioExtra} de los extras presentes en los detalles """
+    insumo_ids = {extra.insumo_id for det in detalles for extra in det.extras_elegidos.all()}
+    if not insumo_ids:
+        return {}
+    return {(pe.insumo_id, pe.tamano): pe for pe in PrecioExtra.objects.filter(insumo_id__in=insumo_ids)}
+
+
+def _removidos_de(det):
+    removidos_dict = {}
+    # Primero, los removidos simples (porción completa)
+    for r in det.ingredientes_removidos.all():
+        removidos_dict[r.id] = Decimal('1.0')
+    # Luego, los removidos con porción específica (sobrescribe si es necesario)
+    for r in det.removidos_detalles.all():
+        if r.insumo:
+            removidos_dict[r.insumo.id] = r.porcion
+    return removidos_dict
+
+
+def calcular_movimientos_detalles(detalles, usuario, nota_base, tipo_movimiento, origen_tipo='', origen_id=None):
+    """
+    Calcula en memoria los MovimientoInventario (sin guardar) que genera una lista
+    de DetalleOrden: receta (completa, mitad/mitad o 4 cuartos), extras y empaque.
+    Los movimientos son exactamente los mismos que se creaban uno por uno antes.
+    origen_tipo/origen_id: documento que los generó (p. ej. 'ORDEN', orden.id).
+    """
+    detalles = list(detalles)
+    if not detalles:
+        return []
+
+    recetas = recetas_por_producto(detalles)
+    precios_extra = _precios_extra(detalles)
+    config_global = None
+    movimientos = []
+
+    def agregar(insumo, cantidad, nota):
+        movimientos.append(MovimientoInventario(
+            insumo=insumo, tipo=tipo_movimiento, cantidad=cantidad,
+            unidad_movimiento=insumo.unidad, usuario=usuario, nota=nota,
+            origen_tipo=origen_tipo, origen_id=origen_id
+        ))
+
+    for det in detalles:
+        removidos_dict = _removidos_de(det)
+
+        if det.cuarto_2_producto_id and det.cuarto_3_producto_id and det.cuarto_4_producto_id:
+            partes = [det.producto_id, det.cuarto_2_producto_id, det.cuarto_3_producto_id, det.cuarto_4_producto_id]
+            divisor = Decimal('4.0')
+        elif det.mitad_producto_id:
+            partes = [det.producto_id, det.mitad_producto_id]
+            divisor = Decimal('2.0')
+        else:
+            partes = None
+
+        if partes:
+            ings_por_parte = [{ing.insumo_id: ing for ing in recetas.get(p_id, [])} for p_id in partes]
+            # Mismo orden de recorrido que el cálculo original (unión de los ids)
+            all_i_ids = set()
+            for ings in ings_por_parte:
+                all_i_ids |= set(ings.keys())
+
+            for i_id in all_i_ids:
+                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
+                if porcion_removida >= Decimal('1.0'): continue
+
+                cantidades = []
+                ins = None
+                for ings in ings_por_parte:
+                    if i_id in ings:
+                        cantidades.append(ings[i_id].cantidad)
+                        if not ins: ins = ings[i_id].insumo
+
+                # Estandarizamos a la porción mínima para evitar excesos si una receta difiere
+                qty = min(cantidades) * (Decimal(len(cantidades)) / divisor)
+                qty = qty * (Decimal('1.0') - porcion_removida)
+                if qty > 0 and ins:
+                    agregar(ins, qty * det.cantidad, nota_base)
+        else:
+            for ing in recetas.get(det.producto_id, []):
+                porcion_removida = removidos_dict.get(ing.insumo_id, Decimal('0.0'))
+                if porcion_removida >= Decimal('1.0'): continue
+
+                qty = ing.cantidad * (Decimal('1.0') - porcion_removida)
+                if qty > 0:
+                    agregar(ing.insumo, qty * det.cantidad, nota_base)
+
+        for extra in det.extras_elegidos.all():
+            if extra.precio == Decimal('0.00') or extra.precio == 0:
+                cantidad_a_descontar = extra.porcion
+            else:
+                cantidad_a_descontar = extra.insumo.cantidad_porcion_extra
+                precio_obj = precios_extra.get((extra.insumo_id, det.producto.tamano))
+                if precio_obj and precio_obj.cantidad > 0: cantidad_a_descontar = precio_obj.cantidad
+                cantidad_a_descontar = cantidad_a_descontar * extra.porcion
+
+            cantidad_a_descontar = cantidad_a_descontar * det.cantidad
+            if cantidad_a_descontar > 0:
+                agregar(extra.insumo, cantidad_a_descontar, f"{nota_base} (Extra)")
+
+        if det.es_para_llevar:
+            if config_global is None:
+                config_global = Configuracion.get_cached()
+            caja_insumo = None
+            if det.producto.tamano == 'IND': caja_insumo = config_global.caja_individual
+            elif det.producto.tamano == 'MED': caja_insumo = config_global.caja_mediana
+            elif det.producto.tamano == 'FAM': caja_insumo = config_global.caja_familiar
+            if caja_insumo:
+                agregar(caja_insumo, det.cantidad, f"{nota_base} (Empaque)")
+
+    return movimientos
+
+
+def calcular_movimientos_orden(orden, usuario, nota_base, tipo_movimiento):
+    return calcular_movimientos_detalles(
+        preparar_detalles(orden.detalles.all()), usuario, nota_base, tipo_movimiento, 'ORDEN', orden.id
+    )
+
+
+def movimientos_anulacion_por_receta(venta, usuario):
+    """
+    ENTRADAs (sin guardar) que devuelven el inventario de una venta calculado con las
+    recetas actuales de sus DetalleVenta (receta completa, mitad/mitad o 4 cuartos,
+    descontando los removidos). Solo para ventas cuyos movimientos no quedaron a su nombre
+    (facturadas antes de que la orden pasara sus movimientos a la venta).
+    """
+    detalles = list(venta.detalles.select_related(
+        'producto', 'mitad_producto', 'cuarto_2_producto', 'cuarto_3_producto', 'cuarto_4_producto'
+    ).prefetch_related('ingredientes_removidos', 'removidos_detalles__insumo'))
+    recetas = recetas_por_producto(detalles)
+    movimientos = []
+
+    def devolver(insumo, cantidad, nota):
+        movimientos.append(MovimientoInventario(
+            insumo=insumo, tipo='ENTRADA', cantidad=cantidad, unidad_movimiento=insumo.unidad, usuario=usuario,
+            nota=nota, costo_unitario_movimiento=insumo.costo_unitario, origen_tipo='VENTA', origen_id=venta.id
+        ))
+
+    for detalle in detalles:
+        producto = detalle.producto
+        if not producto:
+            continue
+        removidos = _removidos_de(detalle)
+
+        if detalle.cuarto_2_producto_id and detalle.cuarto_3_producto_id and detalle.cuarto_4_producto_id:
+            partes = [producto.id, detalle.cuarto_2_producto_id, detalle.cuarto_3_producto_id, detalle.cuarto_4_producto_id]
+            nota = f"ANULACIÓN Venta #{venta.codigo_factura}: 4 Cuartos {producto.nombre[:10]}..."
+        elif detalle.mitad_producto_id:
+            partes = [producto.id, detalle.mitad_producto_id]
+            nota = f"ANULACIÓN Venta #{venta.codigo_factura}: Mitad/Mitad"
+        else:
+            partes = [producto.id]
+            nota = f"ANULACIÓN Venta #{venta.codigo_factura}: {producto.nombre}"
+
+        if len(partes) == 1:
+            for ing in recetas.get(producto.id, []):
+                porcion_removida = removidos.get(ing.insumo.id, Decimal('0.0'))
+                qty = ing.cantidad * (Decimal('1.0') - porcion_removida)
+                if porcion_removida < Decimal('1.0') and qty > 0:
+                    devolver(ing.insumo, qty * detalle.cantidad, nota)
+            continue
+
+        # Cada parte aporta 1/n de su receta; un insumo que está en varias partes toma la menor cantidad
+        por_parte = [{ing.insumo.id: ing for ing in recetas.get(parte_id, [])} for parte_id in partes]
+        for insumo_id in set().union(*por_parte):
+            porcion_removida = removidos.get(insumo_id, Decimal('0.0'))
+            if porcion_removida >= Decimal('1.0'):
+                continue
+            presentes = [receta[insumo_id] for receta in por_parte if insumo_id in receta]
+            qty = min(ing.cantidad for ing in presentes) * (Decimal(len(presentes)) / Decimal(len(partes)))
+            qty = qty * (Decimal('1.0') - porcion_removida)
+            if qty > 0:
+                devolver(presentes[0].insumo, qty * detalle.cantidad, nota)
+    return movimientos
@@ -1,8 +1,10 @@
 # tables/views.py
 
 import json
+import os
+import time
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, FileResponse
 from django.db.models import Max
 from django.contrib import messages
 from django.core.paginator import Paginator
@@ -11,20 +13,25 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.template.loader import get_template
 from django.db import transaction
 from django.utils import timezone
+from django.views.decorators.http import condition
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from decimal import Decimal
 from django.db.models.functions import Cast
 from django.db.models import IntegerField
 from django.core.serializers.json import DjangoJSONEncoder
 from xhtml2pdf import pisa
 from core.models import Configuracion
+from core.pdf import respuesta_pdf_en_cola
+from core.db import es_bd_bloqueada, reintentar_si_bd_bloqueada
 from .utils_impresora import mandar_a_tickera, imprimir_comanda, imprimir_precuenta
 
 # --- IMPORTACIONES DE MODELOS CORRECTAS ---
 from .models import (
-    Table, Categoria, Producto, TasaBCV, IngredienteProducto, 
+    Table, Categoria, Producto, IngredienteProducto, 
     Venta, DetalleVenta, Pago, Orden, DetalleOrden, 
-    DetalleOrdenExtra, CostoAdicional, CostoAsignadoProducto, DetalleVentaExtra, PrecioExtra,
-    DetalleOrdenRemovido, DetalleVentaRemovido
+    CostoAdicional, CostoAsignadoProducto, DetalleVentaExtra, PrecioExtra,
+    DetalleVentaRemovido, ContadorFactura
 )
 from .forms import (
     ProductoBasicForm, RecetaProductoForm, ProductoPriceForm, 
@@ -33,7 +40,18 @@ from .forms import (
 # Importamos modelos de otras apps
 from inventory.models import Insumo, MovimientoInventario
 from reports.models import AuditoriaEliminacion
-from .scrapping import obtener_tasa_bcv
+from reports.resumenes import sumar_venta
+from reports.exportar import respuesta_exportar, formato_exportar
+from inventory.utils_stock import registrar_movimientos
+from .scrapping import iniciar_actualizador_tasa
+from .tasas import obtener_tasas
+from .facturas_pdf import obtener_pdf_factura, huella_factura, borrar_pdf_factura, prerenderizar_factura
+from .carrito import serializar_carrito, leer_item, firma_item, firma_detalle, aplicar_item_a_detalle
+from .catalogo import obtener_catalogo, extras_agotados
+from .simulador import CatalogoCostos, simulador_disponible
+from .masivo import asignar_ingrediente, asignar_costo, quitar_costo, guardar_precios_extras
+from .cola_impresion import estado_mesa
+from .utils_inventario import preparar_detalles, calcular_movimientos_detalles, calcular_movimientos_orden, movimientos_anulacion_por_receta
 
 # ==========================================
 #  LÓGICA ORIGINAL (MESAS Y POS)
@@ -47,8 +65,8 @@ def initialize_tables_if_empty():
         Table.objects.bulk_create(tables_to_create)
 
 def index(request):
-    # Actualizamos la tasa al cargar el mapa de mesas (inicio del POS)
-    obtener_tasa_bcv()
+    # Nos aseguramos de que el actualizador de la tasa BCV esté corriendo (no bloquea)
+    iniciar_actualizador_tasa()
     
     # --- LÓGICA CORREGIDA: SEPARAMOS LAS MESAS ---
     internal_tables = Table.objects.filter(is_external=False).order_by(Cast('number', output_field=IntegerField()))
@@ -184,128 +202,26 @@ def asignar_mesero(request, table_id):
 def table_order_view(request, table_id):
     table = get_object_or_404(Table, id=table_id)
     
-    config = Configuracion.get_solo()
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_bcv_real = float(tasa_obj.precio) if tasa_obj else 0
-    
-    # 1. Tasa Global del Sistema
-    if config.usar_scraping_bcv:
-        tasa_numerica = tasa_bcv_real
-        tasa_actual_texto = f"{tasa_numerica:.2f} Bs/S" if tasa_bcv_real else "0.00 Bs/S"
-    else:
-        tasa_numerica = float(config.tasa_dolar)
-        tasa_actual_texto = f"{tasa_numerica:.2f} Bs/S (Manual)"
-    
-    # 2. Tasa Específica de Cashea
-    if config.usar_tasa_bcv_para_cashea:
-        tasa_cashea_valor = tasa_bcv_real
-    else:
-        if config.tasa_cashea > 0:
-            tasa_cashea_valor = float(config.tasa_cashea)
-        else:
-            tasa_cashea_valor = tasa_numerica # fallback
+    # 1. Tasa Global del Sistema y 2. Tasa Específica de Cashea
+    tasas = obtener_tasas(request)
+    tasa_numerica = float(tasas.general)
+    tasa_actual_texto = tasas.texto_general
+    tasa_cashea_valor = float(tasas.cashea)
 
     
     categorias = Categoria.objects.all()
     productos = Producto.objects.filter(precio__gt=0).select_related('categoria').order_by('id')
-    meseros = User.objects.filter(is_active=True, groups__name='Mesero')
+    meseros = list(User.objects.filter(is_active=True, groups__name='Mesero'))
 
     # 2. LOGICA: RECUPERAR EL CARRITO GUARDADO
     orden_activa = Orden.objects.filter(mesa=table).first()
-    carrito_recuperado = []
-    
-    if orden_activa:
-        for detalle in orden_activa.detalles.all():
-            nombre_display = detalle.producto.nombre
-            if detalle.producto.tamano != 'UNI':
-                nombre_display += f" ({detalle.producto.tamano})"
-            
-            # Recuperar Extras
-            extras_list = []
-            for extra in detalle.extras_elegidos.all():
-                extras_list.append({
-                    'id': extra.insumo_id,
-                    'porcion': float(extra.porcion),
-                    'es_sustituto': float(extra.precio) == 0.0
-                })
-            
-            mitad_id = detalle.mitad_producto.id if detalle.mitad_producto else None
-            mitad_nombre = detalle.mitad_producto.nombre if detalle.mitad_producto else None
-            
-            removidos = []
-            removidos_nombres = []
-            for rem in detalle.ingredientes_removidos.all():
-                removidos.append({'id': rem.id, 'porcion': 1.0})
-                removidos_nombres.append(rem.nombre)
-                
-            if hasattr(detalle, 'removidos_detalles'):
-                for rem in detalle.removidos_detalles.all():
-                    removidos.append({'id': rem.insumo.id, 'porcion': float(rem.porcion)})
-                    porcion_str = "1/4 " if rem.porcion == Decimal('0.25') else "1/2 " if rem.porcion == Decimal('0.50') else "3/4 " if rem.porcion == Decimal('0.75') else ""
-                    removidos_nombres.append(f"{porcion_str}{rem.insumo.nombre}")
-            
-            cuarto_2_id = detalle.cuarto_2_producto.id if detalle.cuarto_2_producto else None
-            cuarto_2_nombre = detalle.cuarto_2_producto.nombre if detalle.cuarto_2_producto else None
-            cuarto_3_id = detalle.cuarto_3_producto.id if detalle.cuarto_3_producto else None
-            cuarto_3_nombre = detalle.cuarto_3_producto.nombre if detalle.cuarto_3_producto else None
-            cuarto_4_id = detalle.cuarto_4_producto.id if detalle.cuarto_4_producto else None
-            cuarto_4_nombre = detalle.cuarto_4_producto.nombre if detalle.cuarto_4_producto else None
-
-            carrito_recuperado.append({
-                'id': detalle.producto.id,
-                'nombre': nombre_display,
-                'precio': float(detalle.precio_unitario),
-                'cantidad': detalle.cantidad,
-                'tamano_codigo': detalle.producto.tamano,
-                'para_llevar': detalle.es_para_llevar,
-                'extras': extras_list,
-                'mitad_id': mitad_id,
-                'mitad_nombre': mitad_nombre,
-                'cuarto_2_id': cuarto_2_id,
-                'cuarto_2_nombre': cuarto_2_nombre,
-                'cuarto_3_id': cuarto_3_id,
-                'cuarto_3_nombre': cuarto_3_nombre,
-                'cuarto_4_id': cuarto_4_id,
-                'cuarto_4_nombre': cuarto_4_nombre,
-                'removidos': removidos,
-                'removidos_nombres': removidos_nombres,
-                'es_nuevo': not detalle.impreso
-            })
+    carrito_recuperado = serializar_carrito(orden_activa)
 
     carrito_json = json.dumps(carrito_recuperado, cls=DjangoJSONEncoder)
-    
-    ingredientes_por_producto = {}
-    productos_lista = []
-    for p in productos:
-        ingredientes_por_producto[p.id] = [
-            {'id': ing.insumo.id, 'nombre': ing.insumo.nombre} 
-            for ing in p.ingredientes.all()
-        ]
-        productos_lista.append({
-            'id': p.id, 'nombre': p.nombre, 'tamano': p.tamano, 'precio': float(p.precio)
-        })
-    
-    ingredientes_dict_json = json.dumps(ingredientes_por_producto)
-    productos_json = json.dumps(productos_lista)
-    
-    # 3. EXTRAS DISPONIBLES
-    # MODIFICADO: Traemos los precios específicos por tamaño
-    insumos_extras = Insumo.objects.filter(es_extra=True, stock_actual__gt=0).prefetch_related('precios_extra')
-    lista_extras_procesada = []
-    
-    for insumo in insumos_extras:
-        # Convertimos la relación inversa a un diccionario { 'IND': 1.50, 'MED': 2.00 }
-        precios_dict = {pe.tamano: float(pe.precio) for pe in insumo.precios_extra.all()}
-        
-        lista_extras_procesada.append({
-            'id': insumo.id,
-            'nombre': insumo.nombre,
-            'precio_venta_extra': float(insumo.precio_venta_extra), # Precio base por si acaso
-            'unidad__codigo': insumo.unidad.codigo,
-            'precios_por_tamano': precios_dict 
-        })
 
-    extras_json = json.dumps(lista_extras_procesada, cls=DjangoJSONEncoder)
+    # 3. CATÁLOGO (productos, recetas, extras): lo baja el navegador desde 'catalogo_json'.
+    # Aquí solo mandamos la versión y qué extras están agotados ahora mismo.
+    catalogo = obtener_catalogo()
     
     context = {
         'table': table,
@@ -317,30 +233,59 @@ def table_order_view(request, table_id):
         'meseros': meseros,
         'orden_activa': orden_activa,
         'carrito_json': carrito_json, 
-        'ingredientes_dict_json': ingredientes_dict_json,
-        'productos_json': productos_json,
-        'extras_json': extras_json,
+        'catalogo_version': catalogo['version'],
+        'extras_agotados_json': json.dumps(extras_agotados()),
     }
     
     return render(request, 'tables/order_detail.html', context)
 
 
+def estado_impresion_mesa(request, table_id):
+    """ Estado de los últimos tickets de la mesa (la pantalla de pedidos lo consulta cada pocos segundos) """
+    table = get_object_or_404(Table, id=table_id)
+    return JsonResponse({'status': 'ok', 'trabajos': estado_mesa(table)})
+
+def _etag_catalogo(request):
+    return obtener_catalogo()['version']
+
+@condition(etag_func=_etag_catalogo)
+def catalogo_json(request):
+    """ Catálogo del menú para la pantalla de pedidos. Con ETag: si no cambió, responde 304. """
+    response = HttpResponse(obtener_catalogo()['json'], content_type='application/json')
+    # El navegador lo guarda, pero siempre pregunta si cambió (If-None-Match)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 # ==========================================
 #  NUEVA LÓGICA (PRODUCTOS Y RECETAS)
 # ==========================================
 
+# Orden del catálogo: todas son columnas guardadas (ver tables/costos.py), así
+# la BD ordena y pagina sin calcular el costo de cada producto
+ORDENES_PRODUCTOS = [
+    ('id', 'Más antiguos'),
+    ('nombre', 'Nombre (A-Z)'),
+    ('margen', 'Menor margen'),
+    ('-margen', 'Mayor margen'),
+    ('-costo_total', 'Mayor costo'),
+    ('-precio', 'Mayor precio'),
+]
+
 @staff_member_required
 def product_list(request):
     query = request.GET.get('q', '')
     categoria_id = request.GET.get('categoria', '')
     tamano = request.GET.get('tamano', '')
+    orden = request.GET.get('orden', '')
+    margen_max = request.GET.get('margen_max', '').strip()
+
+    if orden not in dict(ORDENES_PRODUCTOS):
+        orden = 'id'
 
-    # Usamos prefetch_related para traer los datos relacionados en una sola consulta
-    # 'costos_adicionales' es necesario para calcular el Costo Total
-    productos_list = Producto.objects.all().prefetch_related(
-        'ingredientes__insumo', 
-        'costos_adicionales'
-    ).order_by('id')
+    # Costo, indirectos y margen ya vienen guardados en el producto: no hace falta
+    # traer recetas ni costos adicionales
+    productos_list = Producto.objects.select_related('categoria').order_by(orden, 'id')
     
     if query:
         productos_list = productos_list.filter(nombre__icontains=query)
@@ -351,6 +296,13 @@ def product_list(request):
     if tamano:
         productos_list = productos_list.filter(tamano=tamano)
 
+    if margen_max:
+        try:
+            productos_list = productos_list.filter(margen__lt=Decimal(margen_max.replace(',', '.')))
+        except ArithmeticError:
+            messages.error(request, "El margen debe ser un número (ej: 30).")
+            margen_max = ''
+
     paginator = Paginator(productos_list, 10)
     page_number = request.GET.get('page')
     productos = paginator.get_page(page_number)
@@ -363,6 +315,9 @@ def product_list(request):
         'q': query,
         'categoria_sel': categoria_id,
         'tamano_sel': tamano,
+        'orden_sel': orden,
+        'margen_max': margen_max,
+        'ordenes': ORDENES_PRODUCTOS,
         'categorias': categorias,
         'tamanos': tamanos,
     })
@@ -380,7 +335,7 @@ def product_create(request, pk=None):
         form = ProductoBasicForm(request.POST, instance=producto)
         if form.is_valid():
             prod = form.save(commit=False)
-            config = Configuracion.get_solo()
+            config = Configuracion.get_cached()
             if not pk:
                 prod.precio = 0
                 prod.save()
@@ -479,7 +434,7 @@ def product_pricing(request, pk):
         'form_precio': form_precio,
         'form_costo': form_costo,
         'costo_receta': producto.costo_receta,
-        'costos_adicionales': producto.costos_adicionales.all(),
+        'costos_adicionales': producto.costos_adicionales.select_related('costo_adicional'),
         'total_indirectos': producto.costo_indirectos_total,
         'costo_total_final': producto.costo_total_real,
     }
@@ -500,17 +455,7 @@ def bulk_recipe_update(request):
             cantidad = Decimal(cantidad_str.replace(',', '.'))
             insumo = get_object_or_404(Insumo, id=insumo_id)
             
-            with transaction.atomic():
-                for p_id in producto_ids:
-                    producto = Producto.objects.get(id=p_id)
-                    ing_prod, created = IngredienteProducto.objects.get_or_create(
-                        producto=producto,
-                        insumo=insumo,
-                        defaults={'cantidad': cantidad}
-                    )
-                    if not created:
-                        ing_prod.cantidad = cantidad
-                        ing_prod.save()
+            asignar_ingrediente(insumo, cantidad, producto_ids)
                     
             messages.success(request, f"¡Éxito! Se actualizó '{insumo.nombre}' a {cantidad} {insumo.unidad.codigo} en {len(producto_ids)} productos.")
             return redirect('product_list')
@@ -546,34 +491,18 @@ def bulk_cost_update(request):
         try:
             costo_adicional = get_object_or_404(CostoAdicional, id=costo_id)
             
-            with transaction.atomic():
-                if accion == 'eliminar':
-                    CostoAsignadoProducto.objects.filter(
-                        producto_id__in=producto_ids,
-                        costo_adicional=costo_adicional
-                    ).delete()
-                    messages.success(request, f"¡Éxito! Se ELIMINÓ el costo '{costo_adicional.nombre}' de los {len(producto_ids)} productos seleccionados.")
-                else:
-                    valor = Decimal(valor_str.replace(',', '.'))
-                    agregados = 0
-                    omitidos = 0
-                    
-                    for p_id in producto_ids:
-                        producto = Producto.objects.get(id=p_id)
-                        
-                        # Verificamos si ya existe para no duplicarlo ni sobreescribirlo
-                        existe = CostoAsignadoProducto.objects.filter(producto=producto, costo_adicional=costo_adicional).exists()
-                        
-                        if not existe:
-                            CostoAsignadoProducto.objects.create(producto=producto, costo_adicional=costo_adicional, valor_aplicado=valor)
-                            agregados += 1
-                        else:
-                            omitidos += 1
-                            
-                    mensaje = f"¡Éxito! Se aplicó el costo '{costo_adicional.nombre}' a {agregados} producto(s)."
-                    if omitidos > 0:
-                        mensaje += f" Se omitieron {omitidos} porque ya lo tenían."
-                    messages.success(request, mensaje)
+            if accion == 'eliminar':
+                quitar_costo(costo_adicional, producto_ids)
+                messages.success(request, f"¡Éxito! Se ELIMINÓ el costo '{costo_adicional.nombre}' de los {len(producto_ids)} productos seleccionados.")
+            else:
+                valor = Decimal(valor_str.replace(',', '.'))
+                # Los que ya tienen el costo no se duplican ni se sobreescriben
+                agregados, omitidos = asignar_costo(costo_adicional, valor, producto_ids)
+
+                mensaje = f"¡Éxito! Se aplicó el costo '{costo_adicional.nombre}' a {agregados} producto(s)."
+                if omitidos > 0:
+                    mensaje += f" Se omitieron {omitidos} porque ya lo tenían."
+                messages.success(request, mensaje)
 
             return redirect('product_list')
             
@@ -598,6 +527,110 @@ def product_delete(request, pk):
         messages.success(request, f"Producto '{nombre}' eliminado correctamente.")
     return redirect('product_list')
 
+# ==========================================
+#  SIMULADOR DE PRECIOS (ver tables/simulador.py)
+# ==========================================
+COLUMNAS_SIMULADOR = [
+    ('Producto', None), ('Precio ($)', 2), ('Costo Actual ($)', 4), ('Costo Simulado ($)', 4),
+    ('Margen Actual (%)', 2), ('Margen Simulado (%)', 2), ('Diferencia (pts)', 2),
+]
+FILAS_SIMULADOR_EN_PANTALLA = 100
+
+
+def _numero_simulador(texto):
+    """ '45,50', '1.234,5' o '45.50' -> float; vacío -> None. ValueError si no es un número """
+    texto = str(texto or '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto) if texto else None
+
+
+@staff_member_required
+def simulador_precios(request):
+    if not simulador_disponible():
+        messages.error(request, "El simulador necesita la librería numpy (pip install numpy).")
+        return render(request, 'products/simulador_precios.html', {'disponible': False})
+
+    insumos = list(Insumo.objects.filter(es_insumo_compuesto=False).select_related('categoria', 'unidad').order_by('categoria__nombre', 'nombre'))
+    aumento_general = ''
+    filas, resumen, tiempo_ms = None, None, None
+
+    if request.method == 'POST':
+        aumento_general = request.POST.get('aumento_general', '')
+        try:
+            cambios = {}
+            for insumo in insumos:
+                # Devolvemos lo que escribió el usuario para que el formulario no se borre
+                insumo.nuevo_precio = request.POST.get(f'precio_{insumo.id}', '')
+                insumo.nueva_merma = request.POST.get(f'merma_{insumo.id}', '')
+                precio = _numero_simulador(insumo.nuevo_precio)
+                merma = _numero_simulador(insumo.nueva_merma)
+                if precio is not None or merma is not None:
+                    cambios[insumo.id] = {'precio_mercado': precio, 'merma_porcentaje': merma}
+
+            catalogo = CatalogoCostos()
+            inicio = time.perf_counter()
+            filas, resumen = catalogo.comparar(catalogo.simular(cambios, _numero_simulador(aumento_general) or 0))
+            tiempo_ms = (time.perf_counter() - inicio) * 1000
+        except ValueError:
+            messages.error(request, "Revisa los valores: usa solo números (ej: 45,50).")
+        else:
+            formato = request.POST.get('exportar')
+            if formato in ('csv', 'xlsx'):
+                return respuesta_exportar(
+                    formato, f"simulacion_precios_{timezone.localtime().date()}", COLUMNAS_SIMULADOR,
+                    ([f['nombre'], f['precio'], f['costo_actual'], f['costo_simulado'],
+                      f['margen_actual'], f['margen_simulado'], f['diferencia_margen']] for f in filas),
+                    'Simulación'
+                )
+
+    return render(request, 'products/simulador_precios.html', {
+        'disponible': True,
+        'insumos': insumos,
+        'aumento_general': aumento_general,
+        'filas': filas[:FILAS_SIMULADOR_EN_PANTALLA] if filas else filas,
+        'filas_ocultas': max(len(filas) - FILAS_SIMULADOR_EN_PANTALLA, 0) if filas else 0,
+        'resumen': resumen,
+        'tiempo_ms': tiempo_ms,
+        'formato_exportar': formato_exportar(),
+    })
+
+
+@staff_member_required
+def simulador_precios_api(request):
+    """
+    POST JSON: {"aumento_general": 10, "cambios": [{"insumo_id": 3, "precio_mercado": 52.5, "merma_porcentaje": 4}]}
+    Responde el resumen y el costo/margen actual y simulado de cada producto, sin guardar nada.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Método no permitido'}, status=405)
+    if not simulador_disponible():
+        return JsonResponse({'status': 'error', 'message': 'El simulador necesita numpy instalado.'}, status=503)
+
+    try:
+        data = json.loads(request.body)
+        cambios = {
+            int(c['insumo_id']): {
+                'precio_mercado': _numero_simulador(c.get('precio_mercado')),
+                'merma_porcentaje': _numero_simulador(c.get('merma_porcentaje')),
+            }
+            for c in data.get('cambios', [])
+        }
+        inicio = time.perf_counter()
+        catalogo = CatalogoCostos()
+        cargado = time.perf_counter()
+        filas, resumen = catalogo.comparar(catalogo.simular(cambios, _numero_simulador(data.get('aumento_general')) or 0))
+        fin = time.perf_counter()
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'ok',
+        'resumen': resumen,
+        'productos': filas,
+        'tiempo_ms': {'carga': round((cargado - inicio) * 1000, 1), 'simulacion': round((fin - cargado) * 1000, 1)},
+    })
+
 # ==========================================
 #  FUNCIONES AJAX (GUARDADO Y FACTURACIÓN)
 # ==========================================
@@ -696,7 +729,7 @@ def calcular_insumos_requeridos_json(items):
                 except: pass
 
         if para_llevar:
-            config_global = Configuracion.get_solo()
+            config_global = Configuracion.get_cached()
             caja_insumo = None
             if prod_obj.tamano == 'IND': caja_insumo = config_global.caja_individual
             elif prod_obj.tamano == 'MED': caja_insumo = config_global.caja_mediana
@@ -706,189 +739,23 @@ def calcular_insumos_requeridos_json(items):
     return insumos_requeridos
 
 def procesar_inventario_orden(orden, usuario, nota_base, tipo_movimiento):
-    for det in orden.detalles.all():
-        # --- LÓGICA CORREGIDA PARA MANEJAR REMOVIDOS ---
-        removidos_dict = {}
-        # Primero, los removidos simples (porción completa)
-        if hasattr(det, 'ingredientes_removidos') and det.ingredientes_removidos.exists():
-            for r in det.ingredientes_removidos.all():
-                removidos_dict[r.id] = Decimal('1.0')
-        
-        # Luego, los removidos con porción específica (sobrescribe si es necesario)
-        if hasattr(det, 'removidos_detalles'):
-            for r in det.removidos_detalles.all():
-                if r.insumo: # Verificación de seguridad
-                    removidos_dict[r.insumo.id] = r.porcion
-        # --- FIN DE LA CORRECCIÓN ---
-
-        if getattr(det, 'cuarto_2_producto', None) and getattr(det, 'cuarto_3_producto', None) and getattr(det, 'cuarto_4_producto', None):
-            ings_prod1 = {ing.insumo.id: ing for ing in det.producto.ingredientes.all()}
-            ings_prod2 = {ing.insumo.id: ing for ing in det.cuarto_2_producto.ingredientes.all()}
-            ings_prod3 = {ing.insumo.id: ing for ing in det.cuarto_3_producto.ingredientes.all()}
-            ings_prod4 = {ing.insumo.id: ing for ing in det.cuarto_4_producto.ingredientes.all()}
-            
-            all_i_ids = set(ings_prod1.keys()) | set(ings_prod2.keys()) | set(ings_prod3.keys()) | set(ings_prod4.keys())
-            for i_id in all_i_ids:
-                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                cantidades = []
-                ins = None
-                if i_id in ings_prod1: 
-                    cantidades.append(ings_prod1[i_id].cantidad)
-                    ins = ings_prod1[i_id].insumo
-                if i_id in ings_prod2: 
-                    cantidades.append(ings_prod2[i_id].cantidad)
-                    if not ins: ins = ings_prod2[i_id].insumo
-                if i_id in ings_prod3: 
-                    cantidades.append(ings_prod3[i_id].cantidad)
-                    if not ins: ins = ings_prod3[i_id].insumo
-                if i_id in ings_prod4: 
-                    cantidades.append(ings_prod4[i_id].cantidad)
-                    if not ins: ins = ings_prod4[i_id].insumo
-                
-                qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('4.0'))
-                qty = qty * (Decimal('1.0') - porcion_removida)
-                if qty > 0 and ins:
-                    MovimientoInventario.objects.create(insumo=ins, tipo=tipo_movimiento, cantidad=qty * det.cantidad, unidad_movimiento=ins.unidad, usuario=usuario, nota=nota_base)
-        elif det.mitad_producto:
-            ings_prod1 = {ing.insumo.id: ing for ing in det.producto.ingredientes.all()}
-            ings_prod2 = {ing.insumo.id: ing for ing in det.mitad_producto.ingredientes.all()}
-            for i_id in set(ings_prod1.keys()).union(set(ings_prod2.keys())):
-                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                cantidades = []
-                ins = None
-                if i_id in ings_prod1:
-                    cantidades.append(ings_prod1[i_id].cantidad)
-                    ins = ings_prod1[i_id].insumo
-                if i_id in ings_prod2:
-                    cantidades.append(ings_prod2[i_id].cantidad)
-                    if not ins: ins = ings_prod2[i_id].insumo
-                
-                qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('2.0'))
-                qty = qty * (Decimal('1.0') - porcion_removida)
-                if qty > 0 and ins:
-                    MovimientoInventario.objects.create(insumo=ins, tipo=tipo_movimiento, cantidad=qty * det.cantidad, unidad_movimiento=ins.unidad, usuario=usuario, nota=nota_base)
-        else:
-            for ing in det.producto.ingredientes.all():
-                porcion_removida = removidos_dict.get(ing.insumo.id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                qty = ing.cantidad * (Decimal('1.0') - porcion_removida)
-                if qty > 0:
-                    MovimientoInventario.objects.create(insumo=ing.insumo, tipo=tipo_movimiento, cantidad=qty * det.cantidad, unidad_movimiento=ing.insumo.unidad, usuario=usuario, nota=nota_base)
-        for extra in det.extras_elegidos.all():
-            if extra.precio == Decimal('0.00') or extra.precio == 0:
-                cantidad_a_descontar = extra.porcion
-            else:
-                cantidad_a_descontar = extra.insumo.cantidad_porcion_extra 
-                precio_obj = PrecioExtra.objects.filter(insumo=extra.insumo, tamano=det.producto.tamano).first()
-                if precio_obj and precio_obj.cantidad > 0: cantidad_a_descontar = precio_obj.cantidad
-                cantidad_a_descontar = cantidad_a_descontar * extra.porcion
-            
-            cantidad_a_descontar = cantidad_a_descontar * det.cantidad
-            if cantidad_a_descontar > 0:
-                MovimientoInventario.objects.create(insumo=extra.insumo, tipo=tipo_movimiento, cantidad=cantidad_a_descontar, unidad_movimiento=extra.insumo.unidad, usuario=usuario, nota=f"{nota_base} (Extra)")
-        
-        if det.es_para_llevar:
-            config_global = Configuracion.get_solo()
-            caja_insumo = None
-            if det.producto.tamano == 'IND': caja_insumo = config_global.caja_individual
-            elif det.producto.tamano == 'MED': caja_insumo = config_global.caja_mediana
-            elif det.producto.tamano == 'FAM': caja_insumo = config_global.caja_familiar
-            if caja_insumo:
-                MovimientoInventario.objects.create(insumo=caja_insumo, tipo=tipo_movimiento, cantidad=det.cantidad, unidad_movimiento=caja_insumo.unidad, usuario=usuario, nota=f"{nota_base} (Empaque)")
+    # Calculamos todos los movimientos de la orden en memoria y los guardamos en bloque:
+    # un INSERT masivo y un solo UPDATE de stock por insumo (en vez de una señal por fila).
+    movimientos = calcular_movimientos_orden(orden, usuario, nota_base, tipo_movimiento)
+    registrar_movimientos(movimientos)
 
 def calcular_insumos_orden_existente(orden):
     insumos_orden = {}
-    if not orden or not orden.detalles.exists():
+    if not orden:
         return insumos_orden
-        
-    for det in orden.detalles.all():
-        removidos_dict = {}
-        if hasattr(det, 'ingredientes_removidos') and det.ingredientes_removidos.exists():
-            for r in det.ingredientes_removidos.all():
-                removidos_dict[int(r.id)] = Decimal('1.0')
-        if hasattr(det, 'removidos_detalles'):
-            for r in det.removidos_detalles.all():
-                if r.insumo:
-                    removidos_dict[int(r.insumo.id)] = r.porcion
-
-        if getattr(det, 'cuarto_2_producto', None) and getattr(det, 'cuarto_3_producto', None) and getattr(det, 'cuarto_4_producto', None):
-            ings_prod1 = {int(ing.insumo.id): ing for ing in det.producto.ingredientes.all()}
-            ings_prod2 = {int(ing.insumo.id): ing for ing in det.cuarto_2_producto.ingredientes.all()}
-            ings_prod3 = {int(ing.insumo.id): ing for ing in det.cuarto_3_producto.ingredientes.all()}
-            ings_prod4 = {int(ing.insumo.id): ing for ing in det.cuarto_4_producto.ingredientes.all()}
-            
-            all_i_ids = set(ings_prod1.keys()) | set(ings_prod2.keys()) | set(ings_prod3.keys()) | set(ings_prod4.keys())
-            for i_id in all_i_ids:
-                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                cantidades = []
-                if i_id in ings_prod1: cantidades.append(ings_prod1[i_id].cantidad)
-                if i_id in ings_prod2: cantidades.append(ings_prod2[i_id].cantidad)
-                if i_id in ings_prod3: cantidades.append(ings_prod3[i_id].cantidad)
-                if i_id in ings_prod4: cantidades.append(ings_prod4[i_id].cantidad)
-                
-                qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('4.0'))
-                qty = qty * (Decimal('1.0') - porcion_removida)
-                if qty > 0:
-                    insumos_orden[i_id] = insumos_orden.get(i_id, Decimal('0.0')) + (qty * det.cantidad)
-        elif getattr(det, 'mitad_producto', None):
-            ings_prod1 = {int(ing.insumo.id): ing for ing in det.producto.ingredientes.all()}
-            ings_prod2 = {int(ing.insumo.id): ing for ing in det.mitad_producto.ingredientes.all()}
-            for i_id in set(ings_prod1.keys()).union(set(ings_prod2.keys())):
-                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                cantidades = []
-                if i_id in ings_prod1: cantidades.append(ings_prod1[i_id].cantidad)
-                if i_id in ings_prod2: cantidades.append(ings_prod2[i_id].cantidad)
-                
-                qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('2.0'))
-                qty = qty * (Decimal('1.0') - porcion_removida)
-                if qty > 0:
-                    insumos_orden[i_id] = insumos_orden.get(i_id, Decimal('0.0')) + (qty * det.cantidad)
-        else:
-            for ing in det.producto.ingredientes.all():
-                ing_id = int(ing.insumo.id)
-                porcion_removida = removidos_dict.get(ing_id, Decimal('0.0'))
-                if porcion_removida >= Decimal('1.0'): continue
-                
-                qty = ing.cantidad * (Decimal('1.0') - porcion_removida)
-                if qty > 0:
-                    insumos_orden[ing_id] = insumos_orden.get(ing_id, Decimal('0.0')) + (qty * det.cantidad)
 
-        for extra in det.extras_elegidos.all():
-            if extra.precio == Decimal('0.00') or extra.precio == 0:
-                cantidad_a_descontar = extra.porcion
-            else:
-                cantidad_a_descontar = extra.insumo.cantidad_porcion_extra 
-                precio_obj = PrecioExtra.objects.filter(insumo=extra.insumo, tamano=det.producto.tamano).first()
-                if precio_obj and precio_obj.cantidad > 0:
-                    cantidad_a_descontar = precio_obj.cantidad
-                cantidad_a_descontar = cantidad_a_descontar * extra.porcion
-            
-            cantidad_a_descontar = cantidad_a_descontar * det.cantidad
-            if cantidad_a_descontar > 0:
-                extra_ins_id = int(extra.insumo.id)
-                insumos_orden[extra_ins_id] = insumos_orden.get(extra_ins_id, Decimal('0.0')) + cantidad_a_descontar
-        
-        if det.es_para_llevar:
-            config_global = Configuracion.get_solo()
-            caja_insumo = None
-            if det.producto.tamano == 'IND': caja_insumo = config_global.caja_individual
-            elif det.producto.tamano == 'MED': caja_insumo = config_global.caja_mediana
-            elif det.producto.tamano == 'FAM': caja_insumo = config_global.caja_familiar
-            if caja_insumo:
-                caja_id = int(caja_insumo.id)
-                insumos_orden[caja_id] = insumos_orden.get(caja_id, Decimal('0.0')) + det.cantidad
+    # Reutilizamos el mismo cálculo del descuento real para que la validación nunca difiera
+    for mov in calcular_movimientos_orden(orden, None, '', 'SALIDA'):
+        insumos_orden[mov.insumo_id] = insumos_orden.get(mov.insumo_id, Decimal('0.0')) + mov.cantidad
 
     return insumos_orden
 
+@reintentar_si_bd_bloqueada
 def grabar_mesa_ajax(request, table_id):
     if request.method == 'POST':
         try:
@@ -939,115 +806,67 @@ def grabar_mesa_ajax(request, table_id):
 
             with transaction.atomic():
                 orden, created = Orden.objects.get_or_create(mesa=table)
-                
-                # 1. Reponer inventario si estamos editando una orden existente
-                if not created and orden.detalles.exists():
-                    procesar_inventario_orden(orden, request.user, f"Rep. edición Mesa {table.number}", 'ENTRADA')
-
-                # Borrar items viejos y aplicar nuevos
-                orden.detalles.all().delete()
                 orden.mesero = mesero_obj
                 orden.save()
 
+                # 1. Comparar el carrito con lo ya grabado: las líneas iguales no se tocan
+                existentes = {det.id: det for det in preparar_detalles(orden.detalles.all())}
+                libres = {det_id: firma_detalle(det) for det_id, det in existentes.items()} # grabadas aún sin emparejar
+                nuevos_items = []     # ítems que no existían
+                editados = []         # (detalle, ítem) con cambios
+
+                def emparejar(det_id, leido, firma):
+                    det = existentes[det_id]
+                    if libres.pop(det_id) == firma:
+                        impreso = not leido['es_nuevo']
+                        if det.impreso != impreso:
+                            DetalleOrden.objects.filter(id=det_id).update(impreso=impreso)
+                    else:
+                        editados.append((det, leido))
+
+                # Primero los ítems que traen el id de su línea, luego el resto.
+                # Cada ítem se interpreta una sola vez (leer_item) para la firma y para grabar.
+                sin_id = []
                 for item in items:
-                    prod_id = item.get('id')
-                    cant = item.get('cantidad')
-                    precio = item.get('precio')
-                    
-                    prod_obj = Producto.objects.get(id=prod_id)
-                    
-                    # A) Detalle Principal
-                    nuevo_detalle = DetalleOrden.objects.create(
-                        orden=orden,
-                        producto=prod_obj,
-                        cantidad=cant,
-                        precio_unitario=precio,
-                        es_para_llevar=item.get('para_llevar', False),
-                        impreso=not item.get('es_nuevo', False)
-                    )
-                    
-                    mitad_id = item.get('mitad_id')
-                    cuarto_2_id = item.get('cuarto_2_id')
-                    cuarto_3_id = item.get('cuarto_3_id')
-                    cuarto_4_id = item.get('cuarto_4_id')
-                    
-                    if cuarto_2_id and cuarto_3_id and cuarto_4_id:
-                        nuevo_detalle.cuarto_2_producto = Producto.objects.get(id=cuarto_2_id)
-                        nuevo_detalle.cuarto_3_producto = Producto.objects.get(id=cuarto_3_id)
-                        nuevo_detalle.cuarto_4_producto = Producto.objects.get(id=cuarto_4_id)
-                        nuevo_detalle.save()
-                    elif mitad_id:
-                        mitad_obj = Producto.objects.get(id=mitad_id)
-                        nuevo_detalle.mitad_producto = mitad_obj
-                        nuevo_detalle.save()
-                        
-                    removidos = item.get('removidos', [])
-                    if removidos:
-                        for rem_data in removidos:
-                            try:
-                                if isinstance(rem_data, dict):
-                                    rem_id = int(rem_data.get('id', 0))
-                                    porcion = Decimal(str(rem_data.get('porcion', 1.0)))
-                                else:
-                                    rem_id = int(rem_data)
-                                    porcion = Decimal('1.0')
-                                    
-                                if rem_id > 0:
-                                    if porcion == Decimal('1.0'):
-                                        nuevo_detalle.ingredientes_removidos.add(rem_id)
-                                    else:
-                                        ins_rem = Insumo.objects.get(id=rem_id)
-                                        DetalleOrdenRemovido.objects.create(
-                                            detalle_orden=nuevo_detalle,
-                                            insumo=ins_rem,
-                                            porcion=porcion
-                                        )
-                            except Exception as e_rem:
-                                print(f"Error procesando removido: {e_rem}")
-
-                    # B) GUARDAR EXTRAS
-                    ids_extras = item.get('extras', [])
-                    if ids_extras:
-                        for extra_data in ids_extras:
-                            try:
-                                if isinstance(extra_data, dict):
-                                    extra_id = extra_data.get('id')
-                                    porcion = Decimal(str(extra_data.get('porcion', 1.0)))
-                                    es_sustituto = extra_data.get('es_sustituto', False)
-                                else:
-                                    extra_id = extra_data
-                                    porcion = Decimal('1.0')
-                                    es_sustituto = False
-                                    
-                                insumo = Insumo.objects.get(id=extra_id)
-                                
-                                # LÓGICA CORREGIDA: Buscar precio según tamaño del producto
-                                precio_final = insumo.precio_venta_extra # Valor por defecto
-                                
-                                # Buscamos si existe un precio configurado para este tamaño
-                                precio_obj = PrecioExtra.objects.filter(
-                                    insumo=insumo, 
-                                    tamano=prod_obj.tamano
-                                ).first()
-                                
-                                if precio_obj:
-                                    precio_final = precio_obj.precio
-                                    
-                                precio_cobrado = Decimal('0.00') if es_sustituto else (precio_final * porcion)
-
-                                DetalleOrdenExtra.objects.create(
-                                    detalle_orden=nuevo_detalle,
-                                    insumo=insumo,
-                                    precio=precio_cobrado,
-                                    porcion=porcion
-                                )
-                            except Insumo.DoesNotExist:
-                                print(f"Error: Insumo ID {extra_id} no existe.")
-                            except Exception as e_extra:
-                                print(f"Error guardando extra: {e_extra}")
-                                
-                # 4. Descontar el inventario de la nueva orden recién grabada
-                procesar_inventario_orden(orden, request.user, f"Orden Mesa {table.number}", 'SALIDA')
+                    leido = leer_item(item)
+                    firma = firma_item(leido)
+                    det_id = str(item.get('detalle_id') or '')
+                    if det_id.isdigit() and int(det_id) in libres:
+                        emparejar(int(det_id), leido, firma)
+                    else:
+                        sin_id.append((leido, firma))
+                for leido, firma in sin_id:
+                    # Sin id (línea nueva o carrito sin recargar): buscamos una grabada idéntica
+                    det_id = next((i for i, f in libres.items() if f == firma), None)
+                    if det_id is None:
+                        nuevos_items.append(leido)
+                    else:
+                        emparejar(det_id, leido, firma)
+
+                eliminados = [existentes[det_id] for det_id in libres]
+
+                # 2. Reponer inventario solo de lo que se quitó o se cambió
+                movimientos = calcular_movimientos_detalles(
+                    eliminados + [det for det, _ in editados], request.user, f"Rep. edición Mesa {table.number}", 'ENTRADA',
+                    'ORDEN', orden.id
+                )
+                if eliminados:
+                    orden.detalles.filter(id__in=[det.id for det in eliminados]).delete()
+
+                # 3. Grabar lo nuevo y lo editado (la línea editada conserva su id y su lugar)
+                ids_a_descontar = []
+                for det, leido in editados:
+                    aplicar_item_a_detalle(det, leido)
+                    ids_a_descontar.append(det.id)
+                for leido in nuevos_items:
+                    ids_a_descontar.append(aplicar_item_a_detalle(DetalleOrden(orden=orden), leido).id)
+
+                # 4. Descontar el inventario solo de las líneas nuevas o editadas
+                movimientos += calcular_movimientos_detalles(
+                    preparar_detalles(DetalleOrden.objects.filter(id__in=ids_a_descontar)), request.user, f"Orden Mesa {table.number}", 'SALIDA',
+                    'ORDEN', orden.id
+                )
+                registrar_movimientos(movimientos)
 
             # 4. Actualizar Mesa
             table.is_occupied = True
@@ -1059,6 +878,7 @@ def grabar_mesa_ajax(request, table_id):
             return JsonResponse({'status': 'ok', 'orden_id': orden.id, 'imprimir': imprimir_ticket})
             
         except Exception as e:
+            if es_bd_bloqueada(e): raise # Lo reintenta el decorador
             print(f"ERROR GRABAR MESA: {e}")
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
             
@@ -1135,8 +955,7 @@ def generar_cuenta_pdf(request, table_id):
     if not orden:
         return HttpResponse("No hay orden activa para esta mesa", status=404)
 
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
+    tasa_valor = float(obtener_tasas(request).bcv or 0)
 
     # Marcamos solicitud de pago
     table.solicitud_pago = True
@@ -1207,18 +1026,11 @@ def generar_cuenta_pdf(request, table_id):
     template = get_template(template_path)
     html = template.render(context)
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename="cuenta_mesa_{table.number}.pdf"'
-    
-    # Corrección para evitar error de tamaño
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    
-    if pisa_status.err:
-        return HttpResponse('Error al generar PDF', status=500)
-    return response
-    return HttpResponse(html)
+    # El PDF se genera fuera de la petición; el navegador espera y lo abre al terminar
+    return respuesta_pdf_en_cola(request, html, f"cuenta_mesa_{table.number}.pdf")
 
 @staff_member_required
+@reintentar_si_bd_bloqueada
 def facturar_mesa_ajax(request, table_id):
     if request.method == 'POST':
         try:
@@ -1253,29 +1065,14 @@ def facturar_mesa_ajax(request, table_id):
 
             # --- 3. TRANSACCIÓN DE GUARDADO ---
             with transaction.atomic():
-                # Numeración
-                ultima = Venta.objects.last()
-                nuevo_num = (int(ultima.codigo_factura) + 1) if (ultima and ultima.codigo_factura.isdigit()) else 1
-                codigo = f"{nuevo_num:06d}"
+                # Numeración (contador atómico, sin duplicados ni huecos)
+                codigo = ContadorFactura.siguiente_codigo()
 
                 metodo_general = 'MIXTO' if len(lista_pagos) > 1 else lista_pagos[0]['metodo']
                 
-                config_solo = Configuracion.get_solo()
-                tasa_usar = config_solo.tasa_dolar
-                
-                tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-                tasa_bcv_real = tasa_obj.precio if tasa_obj else config_solo.tasa_dolar
-                
-                if config_solo.usar_scraping_bcv:
-                    tasa_usar = tasa_bcv_real
-                    
+                tasas = obtener_tasas(request)
                 tiene_cashea = any(p.get('metodo') == 'CASHEA' for p in lista_pagos)
-                if tiene_cashea:
-                    if config_solo.usar_tasa_bcv_para_cashea:
-                        tasa_usar = tasa_bcv_real
-                    else:
-                        if config_solo.tasa_cashea > 0:
-                            tasa_usar = config_solo.tasa_cashea
+                tasa_usar = tasas.cashea if tiene_cashea else tasas.general
 
                 # Crear Venta con el TOTAL REAL RECALCULADO
                 venta = Venta.objects.create(
@@ -1294,6 +1091,9 @@ def facturar_mesa_ajax(request, table_id):
                     ref = p.get('referencia', '').strip() if p.get('referencia') else None
                     Pago.objects.create(venta=venta, metodo=p['metodo'], monto=p['monto'], referencia=ref)
 
+                # Totales del día para el cuadre y los reportes
+                sumar_venta(venta)
+
                 # Procesar Detalles
                 for det in orden.detalles.all():
                     precio_base = float(det.precio_unitario)
@@ -1334,6 +1134,9 @@ def facturar_mesa_ajax(request, table_id):
                             porcion=extra_orden.porcion
                         )
 
+                # El inventario descontado por la orden queda a nombre de la venta (para anularla)
+                MovimientoInventario.objects.filter(origen_tipo='ORDEN', origen_id=orden.id).update(origen_tipo='VENTA', origen_id=venta.id)
+
                 orden.delete()
                 table.is_occupied = False
                 table.solicitud_pago = False
@@ -1345,6 +1148,7 @@ def facturar_mesa_ajax(request, table_id):
             # IMPRESIÓN FÍSICA DIRECTA A LA TICKERA
             # =========================================================
             impreso_ok, mensaje_print = mandar_a_tickera(venta)
+            prerenderizar_factura(venta.id)
 
             return JsonResponse({
                 'status': 'ok', 
@@ -1354,37 +1158,30 @@ def facturar_mesa_ajax(request, table_id):
             })
 
         except Exception as e:
+            if es_bd_bloqueada(e): raise # Lo reintenta el decorador
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
     return JsonResponse({'status': 'error'}, status=400)
 @staff_member_required
 
 def generar_factura_pdf(request, venta_id):
-    venta = get_object_or_404(Venta, id=venta_id)
-    tasa_obj = TasaBCV.objects.order_by('-fecha_actualizacion').first()
-    tasa_valor = float(tasa_obj.precio) if tasa_obj else 0
-    tasa_uso = float(venta.tasa_aplicada) if venta.tasa_aplicada else tasa_valor
-    total_bs = float(venta.total) * tasa_uso
-    config_negocio = Configuracion.get_solo()
+    venta = get_object_or_404(Venta.objects.select_related('mesero'), id=venta_id)
 
-    context = {
-        'venta': venta,
-        'detalles': venta.detalles.all(),
-        'tasa': tasa_uso,
-        'total_bs': total_bs,
-        'vuelto': float(venta.monto_recibido) - float(venta.total) - float(venta.propina),
-        'config': config_negocio
-    }
-    
-    template_path = 'tables/factura_final_pdf.html'
-    template = get_template(template_path)
-    html = template.render(context)
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename="Factura_{venta.codigo_factura}.pdf"'
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    if pisa_status.err:
+    # Si el navegador ya tiene esta misma versión, no se genera ni se reenvía nada
+    huella = huella_factura(venta, request)
+    no_modificado = get_conditional_response(request, etag=quote_etag(huella))
+    if no_modificado is not None:
+        return no_modificado
+
+    try:
+        ruta, huella = obtener_pdf_factura(venta, request, huella=huella)
+    except RuntimeError:
         return HttpResponse('Error al generar PDF', status=500)
+
+    response = FileResponse(open(ruta, 'rb'), content_type='application/pdf', filename=f"Factura_{venta.codigo_factura}.pdf")
+    response['ETag'] = quote_etag(huella)
+    response['Last-Modified'] = http_date(int(os.path.getmtime(ruta)))
+    response['Cache-Control'] = 'private, no-cache'
     return response
-    return HttpResponse(html)
 
 def anular_venta(request, venta_id):
     if request.method == 'POST':
@@ -1396,102 +1193,45 @@ def anular_venta(request, venta_id):
 
         try:
             with transaction.atomic():
-                for detalle in venta.detalles.all():
-                    producto = detalle.producto
-                    cantidad_vendida = detalle.cantidad
-                    
-                    removidos_dict = {}
-                    for r in detalle.ingredientes_removidos.all():
-                        removidos_dict[r.id] = Decimal('1.0')
-                    if hasattr(detalle, 'removidos_detalles'):
-                        for r in detalle.removidos_detalles.all():
-                            if r.insumo: removidos_dict[r.insumo.id] = r.porcion
-                            
-                    if getattr(detalle, 'cuarto_2_producto', None) and getattr(detalle, 'cuarto_3_producto', None) and getattr(detalle, 'cuarto_4_producto', None):
-                        ings_prod1 = {ing.insumo.id: ing for ing in producto.ingredientes.all()} if producto else {}
-                        ings_prod2 = {ing.insumo.id: ing for ing in detalle.cuarto_2_producto.ingredientes.all()} if detalle.cuarto_2_producto else {}
-                        ings_prod3 = {ing.insumo.id: ing for ing in detalle.cuarto_3_producto.ingredientes.all()} if detalle.cuarto_3_producto else {}
-                        ings_prod4 = {ing.insumo.id: ing for ing in detalle.cuarto_4_producto.ingredientes.all()} if detalle.cuarto_4_producto else {}
-                        
-                        all_i_ids = set(ings_prod1.keys()) | set(ings_prod2.keys()) | set(ings_prod3.keys()) | set(ings_prod4.keys())
-                        for i_id in all_i_ids:
-                            porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                            if porcion_removida >= Decimal('1.0'): continue
-                            
-                            cantidades = []
-                            ins = None
-                            if i_id in ings_prod1: 
-                                cantidades.append(ings_prod1[i_id].cantidad)
-                                ins = ings_prod1[i_id].insumo
-                            if i_id in ings_prod2: 
-                                cantidades.append(ings_prod2[i_id].cantidad)
-                                if not ins: ins = ings_prod2[i_id].insumo
-                            if i_id in ings_prod3: 
-                                cantidades.append(ings_prod3[i_id].cantidad)
-                                if not ins: ins = ings_prod3[i_id].insumo
-                            if i_id in ings_prod4: 
-                                cantidades.append(ings_prod4[i_id].cantidad)
-                                if not ins: ins = ings_prod4[i_id].insumo
-                            
-                            qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('4.0'))
-                            qty = qty * (Decimal('1.0') - porcion_removida)
-                            if qty > 0 and ins:
-                                nota_mov = f"ANULACIÓN Venta #{venta.codigo_factura}: 4 Cuartos {producto.nombre[:10]}..."
-                                MovimientoInventario.objects.create(insumo=ins, tipo='ENTRADA', cantidad=qty * cantidad_vendida, unidad_movimiento=ins.unidad, usuario=request.user, nota=nota_mov, costo_unitario_movimiento=ins.costo_unitario)
-                    elif detalle.mitad_producto:
-                        if producto:
-                            ings_prod1 = {ing.insumo.id: ing for ing in producto.ingredientes.all()}
-                            ings_prod2 = {ing.insumo.id: ing for ing in detalle.mitad_producto.ingredientes.all()}
-                            
-                            for i_id in set(ings_prod1.keys()).union(set(ings_prod2.keys())):
-                                porcion_removida = removidos_dict.get(i_id, Decimal('0.0'))
-                                if porcion_removida >= Decimal('1.0'): continue
-                                
-                                cantidades = []
-                                insumo_usado = None
-                                if i_id in ings_prod1:
-                                    cantidades.append(ings_prod1[i_id].cantidad)
-                                    insumo_usado = ings_prod1[i_id].insumo
-                                if i_id in ings_prod2:
-                                    cantidades.append(ings_prod2[i_id].cantidad)
-                                    if not insumo_usado: insumo_usado = ings_prod2[i_id].insumo
-                                    
-                                qty = min(cantidades) * (Decimal(len(cantidades)) / Decimal('2.0'))
-                                nota_mov = f"ANULACIÓN Venta #{venta.codigo_factura}: Mitad/Mitad"
-
-                                qty = qty * (Decimal('1.0') - porcion_removida)
-                                if qty > 0:
-                                    MovimientoInventario.objects.create(
-                                        insumo=insumo_usado, tipo='ENTRADA',
-                                        cantidad=qty * cantidad_vendida,
-                                        unidad_movimiento=insumo_usado.unidad,
-                                        usuario=request.user,
-                                        nota=nota_mov,
-                                        costo_unitario_movimiento=insumo_usado.costo_unitario 
-                                    )
-                    else:
-                        if producto:
-                            for ingrediente in producto.ingredientes.all():
-                                porcion_removida = removidos_dict.get(ingrediente.insumo.id, Decimal('0.0'))
-                                if porcion_removida >= Decimal('1.0'): continue
-                                
-                                qty = ingrediente.cantidad * (Decimal('1.0') - porcion_removida)
-                                if qty > 0:
-                                    MovimientoInventario.objects.create(
-                                        insumo=ingrediente.insumo, tipo='ENTRADA',
-                                        cantidad=qty * cantidad_vendida,
-                                        unidad_movimiento=ingrediente.insumo.unidad,
-                                        usuario=request.user,
-                                        nota=f"ANULACIÓN Venta #{venta.codigo_factura}: {producto.nombre}",
-                                        costo_unitario_movimiento=ingrediente.insumo.costo_unitario 
-                                    )
-                        # Nota: Reponer extras sería ideal si los guardaras en historial
-                        
-                venta.anulada = True
-                venta.motivo_anulacion = motivo
-                venta.fecha_anulacion = timezone.now()
-                venta.usuario_anulacion = request.user
-                venta.save()
+                # Se marca como anulada solo si nadie la anuló antes: dos anulaciones
+                # simultáneas no pueden devolver el inventario dos veces
+                ahora = timezone.now()
+                if not Venta.objects.filter(pk=venta.pk, anulada=False).update(
+                    anulada=True, motivo_anulacion=motivo, fecha_anulacion=ahora, usuario_anulacion=request.user
+                ):
+                    messages.error(request, "Esta venta ya estaba anulada.")
+                    return redirect('reporte_ventas')
+                venta.anulada, venta.motivo_anulacion, venta.fecha_anulacion, venta.usuario_anulacion = True, motivo, ahora, request.user
+
+                # Se devuelve exactamente lo que se descontó: los movimientos de la
+                # orden pasan a la venta al facturar y aquí se invierten uno por uno
+                inverso = {'SALIDA': 'ENTRADA', 'ENTRADA': 'SALIDA'}
+                del_documento = list(MovimientoInventario.objects.filter(
+                    origen_tipo='VENTA', origen_id=venta.id, tipo__in=list(inverso)
+                ).select_related('unidad_movimiento').order_by('id'))
+                if any(mov.tipo == 'SALIDA' for mov in del_documento):
+                    movimientos = [
+                        MovimientoInventario(
+                            insumo_id=mov.insumo_id, tipo=inverso[mov.tipo], cantidad=mov.cantidad,
+                            unidad_movimiento=mov.unidad_movimiento, usuario=request.user,
+                            nota=f"ANULACIÓN Venta #{venta.codigo_factura}: {mov.nota or ''}"[:255],
+                            costo_unitario_movimiento=mov.costo_unitario_movimiento,
+                            origen_tipo='VENTA', origen_id=venta.id
+                        )
+                        for mov in del_documento
+                    ]
+                else:
+                    # Venta facturada antes de que los movimientos pasaran a la venta (o cuya
+                    # orden estaba abierta entonces): se calcula con las recetas, como antes
+                    movimientos = movimientos_anulacion_por_receta(venta, request.user)
+
+                # Devolvemos todo el inventario de la venta en bloque
+                registrar_movimientos(movimientos)
+                # Se descuenta de los totales del día
+                sumar_venta(venta, signo=-1)
+
+                # El PDF guardado ya no corresponde: se borra al confirmar
+                transaction.on_commit(lambda: borrar_pdf_factura(venta.id))
                 messages.success(request, f"Venta #{venta.codigo_factura} anulada.")
 
         except Exception as e:
@@ -1506,40 +1246,8 @@ def gestion_precios_extras(request):
 
     if request.method == 'POST':
         try:
-            # Iteramos sobre los datos recibidos
-            for key, value in request.POST.items():
-                
-                # CASO 1: Guardar PRECIO (name="precio_ID_TAM")
-                if key.startswith('precio_'):
-                    parts = key.split('_')
-                    insumo_id = parts[1]
-                    tamano_code = parts[2]
-                    
-                    # Convertimos vacío a 0
-                    val_precio = value if value else 0
-                    
-                    # Buscamos o creamos el registro y actualizamos SOLO el precio
-                    obj, created = PrecioExtra.objects.get_or_create(
-                        insumo_id=insumo_id,
-                        tamano=tamano_code
-                    )
-                    obj.precio = val_precio
-                    obj.save()
-
-                # CASO 2: Guardar CANTIDAD/PESO (name="cantidad_ID_TAM")
-                elif key.startswith('cantidad_'):
-                    parts = key.split('_')
-                    insumo_id = parts[1]
-                    tamano_code = parts[2]
-                    
-                    val_cantidad = value if value else 0
-                    
-                    obj, created = PrecioExtra.objects.get_or_create(
-                        insumo_id=insumo_id,
-                        tamano=tamano_code
-                    )
-                    obj.cantidad = val_cantidad
-                    obj.save()
+            # name="precio_ID_TAM" / "cantidad_ID_TAM" (vacío = 0), todos de una vez
+            guardar_precios_extras(request.POST, insumos_list.values_list('id', flat=True))
 
             messages.success(request, "Precios y porciones actualizados correctamente.")
             return redirect('manage_extras')